@@ -8,7 +8,7 @@ import os
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 import hashlib
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
 from database import SessionLocal
 import models
@@ -60,3 +60,10 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return user
+
+def get_current_user_ws(token: str = Query(..., description="Access token (WebSocket không gửi được header Authorization)")):
+    """Xác thực WebSocket bằng token trên query string; sai token -> đóng kết nối (1008)"""
+    try:
+        return get_current_user(token)
+    except HTTPException as e:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
@@ -0,0 +1,110 @@
+"""
+bench_result_encoding.py - So sánh format "rows" (string) và "columnar" của /db/{db_id}/query
+- Không cần MySQL: dùng rows giả lập giống dữ liệu PyMySQL trả về
+- Đo thời gian encode + serialize JSON và kích thước payload
+
+Chạy: python benchmarks/bench_result_encoding.py [rows] [repeat]
+"""
+
+import sys
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from pymysql.constants import FIELD_TYPE
+from schemas import SQLQueryResponse
+from services.sql_executor_service import SQLExecutorService
+
+DESCRIPTION = [
+    ("id", FIELD_TYPE.LONGLONG),
+    ("user_id", FIELD_TYPE.LONG),
+    ("amount", FIELD_TYPE.NEWDECIMAL),
+    ("ratio", FIELD_TYPE.DOUBLE),
+    ("status", FIELD_TYPE.VAR_STRING),
+    ("note", FIELD_TYPE.VAR_STRING),
+    ("created_at", FIELD_TYPE.DATETIME),
+    ("quantity", FIELD_TYPE.LONG),
+]
+
+
+def make_rows(count):
+    base = datetime(2024, 1, 1)
+    return [
+        (
+            i,
+            i % 977,
+            Decimal(f"{i % 100000}.{i % 100:02d}"),
+            (i % 1000) / 7.0,
+            "COMPLETED" if i % 3 else "PENDING",
+            None if i % 5 == 0 else f"order note {i}",
+            base + timedelta(seconds=i),
+            i % 50,
+        )
+        for i in range(count)
+    ]
+
+
+def encode_rows_format(rows):
+    """Format hiện tại: str() từng ô + validate qua SQLQueryResponse"""
+    rows_list = [[str(val) if val is not None else None for val in row] for row in rows]
+    response = SQLQueryResponse(
+        success=True,
+        columns=[d[0] for d in DESCRIPTION],
+        rows=rows_list,
+        row_count=len(rows_list),
+        affected_rows=len(rows_list),
+        execution_time_ms=0.0,
+        query_type="SELECT",
+        message="ok",
+    )
+    return json.dumps(response.model_dump(), ensure_ascii=False).encode("utf-8")
+
+
+def encode_columnar_format(executor, rows):
+    """Format columnar: encode theo cột, serialize thẳng (không qua Pydantic)"""
+    result = {
+        "success": True,
+        "format": "columnar",
+        "row_count": len(rows),
+        "affected_rows": len(rows),
+        "execution_time_ms": 0.0,
+        "query_type": "SELECT",
+        "message": "ok",
+    }
+    result.update(executor._encode_columnar(DESCRIPTION, rows))
+    return json.dumps(result, ensure_ascii=False).encode("utf-8")
+
+
+def bench(fn, repeat):
+    best = float("inf")
+    payload = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, len(payload)
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rows = make_rows(row_count)
+    executor = SQLExecutorService()
+
+    rows_ms, rows_size = bench(lambda: encode_rows_format(rows), repeat)
+    col_ms, col_size = bench(lambda: encode_columnar_format(executor, rows), repeat)
+
+    print(f"{row_count} rows x {len(DESCRIPTION)} columns, best of {repeat}")
+    print(f"  rows     : {rows_ms:8.2f} ms  {rows_size / 1024:8.1f} KiB")
+    print(f"  columnar : {col_ms:8.2f} ms  {col_size / 1024:8.1f} KiB")
+    print(f"  speedup  : {rows_ms / col_ms:8.2f}x  size ratio {col_size / rows_size:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,22 @@ main.py - Entry point for Cloud DB MVP backend
 """
 
 import os
+import json
+import asyncio
+import anyio
+import pymysql
 from pathlib import Path
 from datetime import datetime
-from fastapi import FastAPI, Depends, HTTPException, status, Query, Request, UploadFile, File, Body
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request, UploadFile, File, Body, WebSocket, WebSocketDisconnect
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import RedirectResponse, JSONResponse, FileResponse
+from fastapi.responses import RedirectResponse, JSONResponse, FileResponse, StreamingResponse, Response
 from sqlalchemy.orm import Session
 from database import Base, engine, get_db
 import models, schemas
 from auth import get_password_hash, authenticate_user, create_access_token
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from sqlalchemy import text
 import database as _database
 import httpx
@@ -25,12 +31,26 @@ from services.backup_service import BackupService
 from services.monitoring_service import MonitoringService
 from services.clone_service import CloneService
 from services.export_import_service import ExportImportService
-from services.sql_executor_service import SQLExecutorService
-from typing import Optional
+from services.sql_executor_service import SQLExecutorService, QueryTimeoutError, QueryCancelledError, QueryConflictError
+from services.query_watchdog import QueryControl
+from services.query_admission import AdmissionTicket, QueryAdmissionError, query_admission
+from services.mysql_service import MySQLService
+from services.bulk_ingest_service import BulkIngestService
+from services.query_job_service import QueryJobService, QueryJobLimitError
+from services.schema_cache import serialize_schema
+from services.table_browser_service import TableBrowserService
+from services.sql_session_service import SQLSessionService
+from services.query_stats import query_stats
+from services.slow_query_log import slow_query_log
+from services.metrics_collector import metrics_collector
+from typing import Optional, List
 
 # Create all tables
 Base.metadata.create_all(bind=engine)
 
+# Chu kỳ kiểm tra client còn kết nối khi đang chạy SQL (giây)
+DISCONNECT_POLL_SECONDS = float(os.getenv("SQL_DISCONNECT_POLL_SECONDS", "0.5"))
+
 
 def _ensure_sqlite_columns():
     """If using SQLite, try to add missing columns to existing tables safely.
@@ -76,6 +96,20 @@ def _ensure_sqlite_columns():
             conn.execute(text("ALTER TABLE users MODIFY COLUMN hashed_password VARCHAR(255) NULL;"))
         except Exception:
             pass
+        # EXPLAIN plan của slow query
+        try:
+            conn.execute(text("ALTER TABLE slow_queries ADD COLUMN explain_plan TEXT;"))
+        except Exception:
+            pass
+        # Worker sở hữu query job + heartbeat
+        try:
+            conn.execute(text("ALTER TABLE query_jobs ADD COLUMN worker_id VARCHAR(100);"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE query_jobs ADD COLUMN heartbeat_at DATETIME;"))
+        except Exception:
+            pass
 
 
 def _ensure_mysql_columns():
@@ -106,6 +140,32 @@ def _ensure_mysql_columns():
         except Exception as e:
             print(f"Warning: Could not modify hashed_password: {e}")
             pass
+        # Check and add explain_plan column (EXPLAIN plan của slow query)
+        try:
+            result = conn.execute(text("""
+                SELECT COUNT(*) FROM information_schema.COLUMNS 
+                WHERE TABLE_SCHEMA = DATABASE() 
+                AND TABLE_NAME = 'slow_queries' 
+                AND COLUMN_NAME = 'explain_plan'
+            """))
+            if result.scalar() == 0:
+                conn.execute(text("ALTER TABLE slow_queries ADD COLUMN explain_plan TEXT NULL;"))
+        except Exception as e:
+            print(f"Warning: Could not add explain_plan column: {e}")
+            pass
+        # Check and add worker_id / heartbeat_at columns (worker sở hữu query job)
+        for column, ddl in (("worker_id", "VARCHAR(100) NULL"), ("heartbeat_at", "DATETIME NULL")):
+            try:
+                result = conn.execute(text(f"""
+                    SELECT COUNT(*) FROM information_schema.COLUMNS 
+                    WHERE TABLE_SCHEMA = DATABASE() 
+                    AND TABLE_NAME = 'query_jobs' 
+                    AND COLUMN_NAME = '{column}'
+                """))
+                if result.scalar() == 0:
+                    conn.execute(text(f"ALTER TABLE query_jobs ADD COLUMN {column} {ddl};"))
+            except Exception as e:
+                print(f"Warning: Could not add {column} column: {e}")
 
 
 _ensure_sqlite_columns()
@@ -273,7 +333,7 @@ async def google_callback(request: schemas.GoogleCallbackRequest, db: Session =
         return {"access_token": access_token_jwt, "token_type": "bearer"}
 
 # --- DATABASE CLOUD APIs ---
-from auth import get_current_user
+from auth import get_current_user, get_current_user_ws
 from provisioner import Provisioner
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -331,6 +391,45 @@ def seed_promotions():
         db.close()
 
 
+@app.on_event("startup")
+def fail_orphaned_query_jobs():
+    # Query job đang chạy khi server restart không còn worker -> đánh dấu FAILED
+    try:
+        QueryJobService().fail_orphaned_jobs()
+    except SQLAlchemyError as e:
+        print(f"Warning: Could not clean up query jobs: {e}")
+
+
+@app.on_event("startup")
+def start_metrics_collector():
+    # Lấy mẫu metrics của mọi database ACTIVE ở thread nền (tắt bằng METRICS_COLLECTOR_ENABLED=false)
+    if os.getenv("METRICS_COLLECTOR_ENABLED", "true").lower() in ("1", "true", "yes"):
+        metrics_collector.start()
+
+
+@app.on_event("shutdown")
+def stop_metrics_collector():
+    metrics_collector.stop()
+
+
+@app.on_event("shutdown")
+def flush_query_stats():
+    # Ghi nốt thống kê query chưa flush trước khi process dừng
+    try:
+        query_stats.flush()
+    except SQLAlchemyError as e:
+        print(f"Warning: Could not flush query stats: {e}")
+
+
+@app.on_event("shutdown")
+def flush_slow_queries():
+    # Slow query còn trong buffer: ghi nốt (EXPLAIN nếu kịp)
+    try:
+        slow_query_log.process_pending()
+    except SQLAlchemyError as e:
+        print(f"Warning: Could not write slow queries: {e}")
+
+
 @app.get("/promotions", response_model=list[schemas.PromotionOut])
 def list_promotions(db: Session = Depends(get_db)):
     items = db.query(models.Promotion).filter(models.Promotion.active == 1).order_by(models.Promotion.id.desc()).all()
@@ -490,15 +589,8 @@ def create_db(req: schemas.CreateDatabase, current_user: models.User = Depends(g
     db_obj.db_password_hash = req.db_password
     db.commit()
     
-    # Tạo initial metrics để monitoring có data ngay
-    try:
-        from services.monitoring_service import MonitoringService
-        monitoring_service = MonitoringService()
-        # Collect initial metrics
-        monitoring_service.collect_metrics(db, db_obj.id)
-    except Exception as e:
-        # Không block nếu không tạo được metrics
-        print(f"Warning: Could not create initial metrics for database {db_obj.id}: {e}")
+    # Collector nền lấy mẫu đầu tiên ngay để monitoring có data (không chạy trong request)
+    metrics_collector.request_sample(db_obj.id)
     
     return db_obj
 
@@ -704,6 +796,9 @@ def reset_db_password(db_id: int, req: schemas.ResetPasswordRequest, current_use
         # Cập nhật password trong metadata
         db_obj.db_password_hash = req.new_password
         db.commit()
+        # Bỏ các connection SQL console đã cache với password cũ
+        SQLExecutorService().invalidate_connections(db_id)
+        SQLExecutorService().invalidate_cache(db_id)
         return {"message": "Password reset successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to reset password: {e}")
@@ -730,6 +825,9 @@ def delete_db(db_id: int, current_user: models.User = Depends(get_current_user),
         # Vẫn đánh dấu là DELETED trong metadata dù có lỗi khi xóa vật lý
         # (có thể DB/user đã bị xóa trước đó)
     
+    # Bỏ các connection SQL console đã cache của database này
+    SQLExecutorService().invalidate_connections(db_id)
+    SQLExecutorService().invalidate_cache(db_id)
     db_obj.status = "DELETED"
     db.commit()
     return {"ok": True}
@@ -910,6 +1008,9 @@ def restore_backup(
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Restore failed: {str(e)}")
+    finally:
+        # Dữ liệu đã bị thay bằng bản backup -> bỏ kết quả SELECT đã cache
+        SQLExecutorService().invalidate_cache(db_id)
 
 @app.get("/db/{db_id}/restores/{restore_id}", response_model=schemas.RestoreOut)
 def get_restore_status(
@@ -1154,6 +1255,9 @@ def import_database(
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+    finally:
+        # Import ghi dữ liệu trực tiếp vào MySQL -> bỏ kết quả SELECT đã cache
+        SQLExecutorService().invalidate_cache(db_id)
 
 @app.get("/db/{db_id}/imports", response_model=list[schemas.ImportOut])
 def list_imports(
@@ -1212,13 +1316,7 @@ def get_metrics(
     
     monitoring_service = MonitoringService()
     try:
-        # Collect metrics trước khi lấy (để đảm bảo có data mới nhất)
-        try:
-            monitoring_service.collect_metrics(db, db_id)
-        except Exception as e:
-            # Không block nếu không collect được metrics
-            print(f"Warning: Could not collect metrics: {e}")
-        
+        # Chỉ đọc metrics đã lưu; MetricsCollector lấy mẫu ở thread nền
         metrics = monitoring_service.get_metrics(db=db, database_id=db_id, timeframe=timeframe)
         return metrics
     except Exception as e:
@@ -1312,14 +1410,55 @@ def get_performance_summary(
 
 # --- SQL QUERY EXECUTION APIs ---
 
+async def _run_cancellable(request: Request, control: QueryControl, fn, *args):
+    """
+    Chạy handler blocking trong threadpool, định kỳ kiểm tra client còn kết nối
+    Client ngắt kết nối -> KILL QUERY statement đang chạy (giải phóng connection tenant + thread)
+    """
+    task = asyncio.ensure_future(run_in_threadpool(fn, *args, control))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            await run_in_threadpool(control.cancel, MySQLService().kill_query)
+            return await task
+
+async def _admit_query(db_id: int, current_user: models.User, db: Session) -> AdmissionTicket:
+    """
+    Chờ slot admission của database trong event loop, trước khi chuyển handler sang threadpool
+    (request đang xếp hàng không giữ thread). Kiểm tra quyền trước: không xếp hàng vào database của người khác
+    Caller release() ticket khi xong (release nhiều lần không sao)
+    """
+    owned = await run_in_threadpool(
+        lambda: db.query(models.Database.id).filter(
+            models.Database.id == db_id,
+            models.Database.owner_id == current_user.id
+        ).first()
+    )
+    if not owned:
+        raise HTTPException(status_code=404, detail="Database not found")
+    try:
+        return await query_admission.acquire_async(db_id)
+    except QueryAdmissionError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 @app.post("/db/{db_id}/query", response_model=schemas.SQLQueryResponse)
-def execute_sql_query(
+async def execute_sql_query(
     db_id: int,
     req: schemas.SQLQueryRequest,
+    request: Request,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Execute SQL query trên database"""
+    ticket = await _admit_query(db_id, current_user, db)
+    try:
+        return await _run_cancellable(request, QueryControl(), _execute_sql_query, db_id, req, current_user, db, ticket)
+    finally:
+        ticket.release()
+
+def _execute_sql_query(db_id, req, current_user, db, ticket, control):
     # Kiểm tra database thuộc về user
     db_obj = db.query(models.Database).filter(
         models.Database.id == db_id,
@@ -1337,18 +1476,27 @@ def execute_sql_query(
             db=db,
             database_id=db_id,
             query=req.query,
-            user_id=current_user.id
+            user_id=current_user.id,
+            result_format=req.format,
+            use_cache=not req.no_cache,
+            params=req.params,
+            control=control,
+            retry_conflicts=req.retry_on_conflict,
+            ticket=ticket
         )
         
-        # Collect metrics sau khi execute query (để monitoring có data)
-        try:
-            monitoring_service = MonitoringService()
-            monitoring_service.collect_metrics(db, db_id)
-        except Exception as e:
-            # Không block nếu không collect được metrics
-            print(f"Warning: Could not collect metrics after query execution: {e}")
-        
+        if req.format == "columnar":
+            # Trả JSON trực tiếp, bỏ qua validate lại response_model cho payload lớn
+            return JSONResponse(content=result)
         return result
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=408, detail=str(e))
+    except QueryCancelledError as e:
+        raise HTTPException(status_code=499, detail=str(e))
+    except QueryAdmissionError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except QueryConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -1356,6 +1504,562 @@ def execute_sql_query(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Query execution failed: {str(e)}")
 
+@app.post("/db/{db_id}/query/batch", response_model=schemas.SQLBatchResponse)
+async def execute_sql_batch(
+    db_id: int,
+    req: schemas.SQLBatchRequest,
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Chạy nhiều statement (list hoặc script) trên một connection, tùy chọn trong một transaction"""
+    ticket = await _admit_query(db_id, current_user, db)
+    try:
+        return await _run_cancellable(request, QueryControl(), _execute_sql_batch, db_id, req, current_user, db, ticket)
+    finally:
+        ticket.release()
+
+def _execute_sql_batch(db_id, req, current_user, db, ticket, control):
+    # Kiểm tra database thuộc về user
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    if db_obj.status != "ACTIVE":
+        raise HTTPException(status_code=400, detail="Database must be ACTIVE")
+    
+    sql_executor = SQLExecutorService()
+    try:
+        result = sql_executor.execute_batch(
+            db=db,
+            database_id=db_id,
+            user_id=current_user.id,
+            statements=req.statements,
+            script=req.script,
+            transaction=req.transaction,
+            stop_on_error=req.stop_on_error,
+            control=control,
+            ticket=ticket
+        )
+        
+        return result
+    except QueryCancelledError as e:
+        raise HTTPException(status_code=499, detail=str(e))
+    except QueryAdmissionError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Batch execution failed: {str(e)}")
+
+@app.get("/db/{db_id}/query/stats")
+def get_sql_query_stats(
+    db_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Số statement bị timeout / bị hủy (client ngắt kết nối) của database, thống kê cost guard, admission và slow query log
+    Chỉ số của database này: bộ đếm toàn process (tenant khác) không trả cho tenant
+    """
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    sql_executor = SQLExecutorService()
+    return {
+        "database_id": db_id,
+        "max_execution_time_s": sql_executor.max_execution_time,
+        **sql_executor.interrupt_stats(db_id),
+        "cost_guard": sql_executor.cost_guard.stats(db_id),
+        # Hàng đợi admission: đang chạy, độ sâu hàng đợi, thời gian chờ
+        "admission": sql_executor.admission.stats(db_id),
+        # Retry vì deadlock / lock wait timeout
+        "retries": sql_executor.retry_stats(db_id),
+        "slow_query_log": sql_executor.slow_query_log.stats(db_id)
+    }
+
+@app.get("/db/{db_id}/query-stats", response_model=schemas.QueryFingerprintStatsResponse)
+def get_query_fingerprint_stats(
+    db_id: int,
+    sort: str = Query("total_time", description="total_time | calls | avg_time | p95 | rows"),
+    limit: int = Query(50, ge=1, le=500, description="Số fingerprint trả về"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Latency (p50/p95/p99) và rows theo fingerprint query (literal đã bỏ) của database"""
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    try:
+        return query_stats.snapshot(db, db_id, sort=sort, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/db/{db_id}/schema", response_model=schemas.DatabaseSchemaResponse)
+def get_db_schema(
+    db_id: int,
+    request: Request,
+    refresh: bool = Query(False, description="True: bỏ qua cache, đọc lại information_schema"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Schema browser: tables, columns, indexes, foreign keys, số rows/dung lượng ước lượng
+    Đọc từ schema cache (invalidate khi chạy DDL); hỗ trợ If-None-Match -> 304
+    """
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    sql_executor = SQLExecutorService()
+    try:
+        schema = sql_executor.get_schema(db, db_id, current_user.id, refresh=refresh)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load schema: {str(e)}")
+    
+    etag = f'"{schema["version"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    
+    return JSONResponse(content={"database_id": db_id, **serialize_schema(schema)}, headers=headers)
+
+@app.get("/db/{db_id}/tables/{table_name}/rows", response_model=schemas.TableBrowseResponse)
+async def browse_table_rows(
+    db_id: int,
+    table_name: str,
+    limit: Optional[int] = Query(None, description="Số rows mỗi trang"),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước"),
+    sort: Optional[str] = Query(None, description="Cột sort (phải có index)"),
+    order: str = Query("asc", description="asc hoặc desc"),
+    filter: Optional[List[str]] = Query(None, description="Lọc bằng: col=value (lặp lại cho nhiều cột), col không có '=' -> IS NULL"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Duyệt dữ liệu table theo trang bằng keyset pagination (seek theo primary key / unique index)
+    Độ trễ mỗi trang không tăng theo độ sâu như LIMIT/OFFSET
+    """
+    ticket = await _admit_query(db_id, current_user, db)
+    try:
+        return await run_in_threadpool(
+            _browse_table_rows, db_id, table_name, limit, cursor, sort, order, filter, current_user, db, ticket
+        )
+    finally:
+        ticket.release()
+
+
+def _browse_table_rows(db_id, table_name, limit, cursor, sort, order, filter, current_user, db, ticket):
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    filters = {}
+    for item in filter or []:
+        column, sep, value = item.partition("=")
+        filters[column.strip()] = value if sep else None
+    
+    browser = TableBrowserService()
+    try:
+        return browser.browse(
+            db=db,
+            database_id=db_id,
+            user_id=current_user.id,
+            table=table_name,
+            limit=limit,
+            cursor=cursor,
+            sort=sort,
+            order=order,
+            filters=filters,
+            ticket=ticket
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/db/{db_id}/tables/{table_name}/ingest", response_model=schemas.BulkIngestResponse)
+async def bulk_ingest_rows(
+    db_id: int,
+    table_name: str,
+    request: Request,
+    chunk_size: Optional[int] = Query(None, description="Số rows mỗi multi-row INSERT"),
+    atomic: bool = Query(False, description="True: toàn bộ trong một transaction"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Nạp nhiều rows vào table (body JSON hoặc CSV, chọn theo Content-Type)
+    Ghi theo chunk bằng multi-row INSERT, báo số rows/giây
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    ticket = await _admit_query(db_id, current_user, db)
+    try:
+        # Phần còn lại là I/O blocking (SQLAlchemy + PyMySQL) -> chạy trong threadpool
+        return await run_in_threadpool(
+            _bulk_ingest, db_id, table_name, body, content_type, chunk_size, atomic, current_user, db, ticket
+        )
+    finally:
+        ticket.release()
+
+
+def _bulk_ingest(db_id, table_name, body, content_type, chunk_size, atomic, current_user, db, ticket):
+    # Kiểm tra database thuộc về user
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    if db_obj.status != "ACTIVE":
+        raise HTTPException(status_code=400, detail="Database must be ACTIVE")
+    
+    ingest_service = BulkIngestService()
+    try:
+        columns, rows = ingest_service.parse_payload(body, content_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rows:
+        raise HTTPException(status_code=400, detail="No rows to ingest")
+    
+    # Storage quota: chặn nếu dữ liệu mới (ước lượng theo kích thước payload) vượt gói
+    quota_info = check_and_update_quota_status(current_user.id, db)
+    if quota_info:
+        payload_mb = len(body) / (1024 * 1024)
+        if quota_info["quota_status"] == "BLOCKED" or quota_info["total_used_mb"] + payload_mb > quota_info["plan_limit_mb"]:
+            raise HTTPException(
+                status_code=403,
+                detail=f"Storage quota exceeded: {quota_info['total_used_mb']}MB used of {quota_info['plan_limit_mb']}MB"
+            )
+    
+    try:
+        result = ingest_service.ingest(
+            db=db,
+            database_id=db_id,
+            user_id=current_user.id,
+            table=table_name,
+            columns=columns,
+            rows=rows,
+            chunk_size=chunk_size,
+            atomic=atomic,
+            from_csv=BulkIngestService.is_csv(content_type),
+            ticket=ticket
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Bulk ingest failed: {str(e)}")
+    
+    # Cập nhật lại quota_status sau khi ghi dữ liệu
+    if result["rows_inserted"]:
+        check_and_update_quota_status(current_user.id, db)
+    return result
+
+@app.post("/db/{db_id}/query/export")
+async def export_sql_query(
+    db_id: int,
+    req: schemas.SQLExportRequest,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stream toàn bộ kết quả SELECT dưới dạng CSV hoặc NDJSON (tùy chọn gzip)"""
+    # Slot admission giữ tới khi stream xong (generator nhả slot; background task phòng khi stream không chạy)
+    ticket = await _admit_query(db_id, current_user, db)
+    try:
+        stream = await run_in_threadpool(_start_export, db_id, req, current_user, db, ticket)
+    except BaseException:
+        ticket.release()
+        raise
+    
+    media_type = "text/csv" if req.format == "csv" else "application/x-ndjson"
+    filename = f"query_{db_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{req.format}"
+    if req.gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        background=BackgroundTask(ticket.release)
+    )
+
+def _start_export(db_id, req, current_user, db, ticket):
+    # Kiểm tra database thuộc về user
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    if db_obj.status != "ACTIVE":
+        raise HTTPException(status_code=400, detail="Database must be ACTIVE")
+    
+    sql_executor = SQLExecutorService()
+    try:
+        return sql_executor.export_query(
+            db=db,
+            database_id=db_id,
+            query=req.query,
+            user_id=current_user.id,
+            export_format=req.format,
+            compress=req.gzip,
+            ticket=ticket
+        )
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=408, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Query export failed: {str(e)}")
+
+def _get_owned_query_job(db_id: int, job_id: int, current_user: models.User, db: Session) -> models.QueryJob:
+    """Lấy query job thuộc database + user, không có -> 404"""
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    job = db.query(models.QueryJob).filter(
+        models.QueryJob.id == job_id,
+        models.QueryJob.database_id == db_id,
+        models.QueryJob.user_id == current_user.id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Query job not found")
+    return job
+
+@app.post("/db/{db_id}/query-jobs", response_model=schemas.QueryJobOut, status_code=202)
+def submit_query_job(
+    db_id: int,
+    req: schemas.QueryJobCreate,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Chạy SELECT dài ở background, trả về job id ngay"""
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    
+    if db_obj.status != "ACTIVE":
+        raise HTTPException(status_code=400, detail="Database must be ACTIVE")
+    
+    try:
+        return QueryJobService().submit(db, db_id, current_user.id, req.query)
+    except QueryJobLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/db/{db_id}/query-jobs", response_model=list[schemas.QueryJobOut])
+def list_query_jobs(
+    db_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Danh sách query jobs của database (mới nhất trước)"""
+    db_obj = db.query(models.Database).filter(
+        models.Database.id == db_id,
+        models.Database.owner_id == current_user.id
+    ).first()
+    if not db_obj:
+        raise HTTPException(status_code=404, detail="Database not found")
+    return QueryJobService().list_jobs(db, db_id, limit)
+
+@app.get("/db/{db_id}/query-jobs/{job_id}", response_model=schemas.QueryJobOut)
+def get_query_job(
+    db_id: int,
+    job_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Trạng thái + tiến độ (row_count) của query job"""
+    return _get_owned_query_job(db_id, job_id, current_user, db)
+
+@app.get("/db/{db_id}/query-jobs/{job_id}/results", response_model=schemas.QueryJobResultsPage)
+def get_query_job_results(
+    db_id: int,
+    job_id: int,
+    offset: int = Query(0, ge=0, description="next_offset của lần đọc trước"),
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Poll kết quả theo trang (đọc được cả khi job đang chạy)"""
+    job = _get_owned_query_job(db_id, job_id, current_user, db)
+    return QueryJobService().read_results(job, offset, limit)
+
+@app.get("/db/{db_id}/query-jobs/{job_id}/stream")
+def stream_query_job_results(
+    db_id: int,
+    job_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stream kết quả NDJSON (dòng đầu là columns), chờ rows mới nếu job đang chạy"""
+    job = _get_owned_query_job(db_id, job_id, current_user, db)
+    return StreamingResponse(QueryJobService().stream_results(job), media_type="application/x-ndjson")
+
+@app.post("/db/{db_id}/query-jobs/{job_id}/cancel", response_model=schemas.QueryJobOut)
+def cancel_query_job(
+    db_id: int,
+    job_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Hủy query job (KILL QUERY nếu đang chạy)"""
+    _get_owned_query_job(db_id, job_id, current_user, db)
+    try:
+        return QueryJobService().cancel(db, job_id, current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/db/{db_id}/query-jobs/{job_id}")
+def delete_query_job(
+    db_id: int,
+    job_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Xóa query job đã kết thúc và file kết quả"""
+    _get_owned_query_job(db_id, job_id, current_user, db)
+    try:
+        QueryJobService().delete_job(db, job_id, current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True}
+
+# WebSocket close code khi phiên bị đóng vì idle (dải 4000-4999 dành cho ứng dụng)
+WS_CLOSE_IDLE_TIMEOUT = 4408
+
+@app.websocket("/db/{db_id}/session")
+async def sql_session(
+    websocket: WebSocket,
+    db_id: int,
+    current_user: models.User = Depends(get_current_user_ws),
+    db: Session = Depends(get_db)
+):
+    """
+    Phiên SQL tương tác trên một connection tenant (token trên query string: ?token=...)
+    Client gửi {"id", "query", "params"}; server trả "columns", "rows" (từng chunk), "done" hoặc "error"
+    BEGIN / COMMIT / ROLLBACK giữ transaction qua nhiều message; idle quá lâu -> rollback + đóng
+    """
+    await websocket.accept()
+    service = SQLSessionService()
+    session = None
+    try:
+        session = await run_in_threadpool(service.open, db, db_id, current_user.id)
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    except Exception as e:
+        await websocket.send_json({"type": "error", "error": f"Could not open session: {str(e)}"})
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+    
+    try:
+        await websocket.send_json({
+            "type": "ready",
+            "session_id": session.id,
+            "database_id": db_id,
+            "idle_timeout": service.idle_timeout,
+            "transaction_idle_timeout": service.transaction_idle_timeout
+        })
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), timeout=service.idle_timeout_for(session))
+            except asyncio.TimeoutError:
+                rolled_back = await run_in_threadpool(service.close, session)
+                await websocket.send_json({"type": "closing", "reason": "idle_timeout", "rolled_back": rolled_back})
+                await websocket.close(code=WS_CLOSE_IDLE_TIMEOUT)
+                return
+            
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                await websocket.send_json({"type": "error", "error": "Message must be JSON"})
+                continue
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "error": "Message must be a JSON object"})
+                continue
+            msg_id = message.get("id")
+            if message.get("type") == "ping":
+                await websocket.send_json({"type": "pong", "id": msg_id, "in_transaction": session.in_transaction})
+                continue
+            query = message.get("query")
+            params = message.get("params")
+            if not isinstance(query, str) or (params is not None and not isinstance(params, list)):
+                await websocket.send_json({"type": "error", "id": msg_id, "error": "Expected {'query': str, 'params': list?}"})
+                continue
+            
+            # Chờ slot admission trong event loop; statement chạy blocking trong threadpool,
+            # mỗi chunk gửi ngay khi fetch xong
+            try:
+                ticket = await query_admission.acquire_async(db_id)
+            except QueryAdmissionError as e:
+                await websocket.send_json({"type": "error", "id": msg_id, "error": str(e),
+                                           "retry_after": e.retry_after, "in_transaction": session.in_transaction})
+                continue
+            results = session.run(query, params, ticket=ticket)
+            try:
+                while True:
+                    item = await run_in_threadpool(next, results, None)
+                    if item is None:
+                        break
+                    item["id"] = msg_id
+                    await websocket.send_json(item)
+            except (ValueError, pymysql.err.MySQLError, QueryTimeoutError, QueryAdmissionError) as e:
+                await websocket.send_json({"type": "error", "id": msg_id, "error": str(e),
+                                           "in_transaction": session.in_transaction})
+            finally:
+                # Đóng generator: nhả slot admission, bỏ rows chưa gửi (kể cả khi task bị cancel)
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(results.close)
+                ticket.release()
+            if session.broken:
+                await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+                return
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Client ngắt kết nối / lỗi / task bị cancel: rollback transaction dở dang, trả connection về pool
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(service.close, session)
+
 # --- SUBSCRIPTION APIs ---
 
 @app.get("/subscription/storage-info")
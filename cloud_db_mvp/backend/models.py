@@ -3,7 +3,7 @@ models.py - SQLAlchemy ORM models
 - User, Database, and other core tables
 """
 
-from sqlalchemy import Column, Integer, String, DateTime, func, Text, ForeignKey, DECIMAL, Enum
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, func, Text, ForeignKey, DECIMAL, Enum, UniqueConstraint
 from sqlalchemy.orm import relationship
 import enum
 from database import Base
@@ -169,6 +169,39 @@ class PerformanceMetric(Base):
     )
 
 
+class MetricCounter(Base):
+    """Counter tích lũy (monotonic) của database ở lần lấy mẫu gần nhất, từ events_statements_summary_by_account_by_event_name"""
+    __tablename__ = "metric_counters"
+    database_id = Column(Integer, ForeignKey("databases.id"), primary_key=True)
+    statements = Column(BigInteger, nullable=False, default=0)  # SUM(COUNT_STAR)
+    timer_wait_us = Column(BigInteger, nullable=False, default=0)  # SUM(SUM_TIMER_WAIT), picoseconds -> microseconds
+    rows = Column(BigInteger, nullable=False, default=0)  # SUM(SUM_ROWS_SENT + SUM_ROWS_AFFECTED)
+    sampled_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        {'mysql_engine': 'InnoDB'},
+    )
+
+
+class MetricRollup(Base):
+    """Metric gộp theo bucket thời gian (1m / 1h / 1d), collector cập nhật dần khi ghi mẫu mới"""
+    __tablename__ = "metric_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    database_id = Column(Integer, ForeignKey("databases.id"), nullable=False)
+    metric_type = Column(String(30), nullable=False)
+    resolution = Column(String(3), nullable=False)  # 1m, 1h, 1d (xem services/metric_rollups.py)
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    count = Column(Integer, nullable=False, default=0)
+    sum = Column(Float, nullable=False, default=0)  # avg = sum / count
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("database_id", "resolution", "metric_type", "bucket_start", name="uq_metric_rollups_bucket"),
+        {'mysql_engine': 'InnoDB'},
+    )
+
+
 class SlowQuery(Base):
     """Slow queries log"""
     __tablename__ = "slow_queries"
@@ -178,12 +211,38 @@ class SlowQuery(Base):
     duration_ms = Column(DECIMAL(10, 2), nullable=False)  # Thời gian thực thi (ms)
     rows_examined = Column(Integer, nullable=True)
     rows_sent = Column(Integer, nullable=True)
+    explain_plan = Column(Text, nullable=True)  # EXPLAIN FORMAT=JSON lấy ở thread nền (None nếu không EXPLAIN được)
     timestamp = Column(DateTime, server_default=func.now(), index=True)
     
     # Relationship
     database = relationship("Database", backref="slow_queries")
 
 
+class QueryStat(Base):
+    """Thống kê latency theo fingerprint query (histogram bucket cố định), gộp dần từ SQL console"""
+    __tablename__ = "query_stats"
+    id = Column(Integer, primary_key=True, index=True)
+    database_id = Column(Integer, ForeignKey("databases.id"), nullable=False, index=True)
+    fingerprint_id = Column(String(16), nullable=False)  # sha1(fingerprint)[:16]
+    fingerprint = Column(Text, nullable=False)  # SQL đã chuẩn hóa (literal -> ?)
+    query_type = Column(String(20), nullable=True)
+    calls = Column(BigInteger, nullable=False, default=0)
+    total_time_ms = Column(Float, nullable=False, default=0)
+    max_time_ms = Column(Float, nullable=False, default=0)
+    rows_total = Column(BigInteger, nullable=False, default=0)  # Rows trả về (SELECT) / bị ảnh hưởng (ghi)
+    histogram = Column(Text, nullable=False)  # JSON list số lần theo bucket latency (xem services/query_stats.py)
+    first_seen = Column(DateTime, nullable=True)
+    last_seen = Column(DateTime, nullable=True, index=True)
+    
+    # Relationship
+    database = relationship("Database", backref="query_stats")
+    
+    __table_args__ = (
+        UniqueConstraint("database_id", "fingerprint_id", name="uq_query_stats_fingerprint"),
+        {'mysql_engine': 'InnoDB'},
+    )
+
+
 class CloneStatus(str, enum.Enum):
     """Trạng thái clone operation"""
     PENDING = "PENDING"
@@ -232,4 +291,37 @@ class DatabaseImport(Base):
     error_message = Column(Text, nullable=True)
     
     # Relationship
-    database = relationship("Database", backref="imports")
\ No newline at end of file
+    database = relationship("Database", backref="imports")
+
+class QueryJobStatus(str, enum.Enum):
+    """Trạng thái query job (chạy query dài ở background)"""
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+
+class QueryJob(Base):
+    """Query chạy bất đồng bộ, kết quả được spool ra file NDJSON"""
+    __tablename__ = "query_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    database_id = Column(Integer, ForeignKey("databases.id"), nullable=False, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    query_text = Column(Text, nullable=False)
+    status = Column(String(30), nullable=False, default=QueryJobStatus.PENDING.value)
+    result_path = Column(String(500), nullable=True)  # File NDJSON: mỗi dòng là một row (JSON array)
+    columns = Column(Text, nullable=True)  # JSON list tên cột
+    row_count = Column(Integer, nullable=False, default=0)  # Số rows đã spool (cập nhật trong lúc chạy)
+    result_bytes = Column(Integer, nullable=False, default=0)
+    truncated = Column(Integer, nullable=False, default=0)  # 1 nếu dừng vì vượt giới hạn rows/bytes
+    mysql_thread_id = Column(Integer, nullable=True)  # CONNECTION_ID() lúc chạy (chỉ để theo dõi; KILL do worker đang giữ connection)
+    worker_id = Column(String(100), nullable=True)  # Process chạy job (hostname:pid:token)
+    heartbeat_at = Column(DateTime, nullable=True)  # Worker cập nhật định kỳ khi job còn chạy
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    error_message = Column(Text, nullable=True)
+    
+    # Relationship
+    database = relationship("Database", backref="query_jobs")
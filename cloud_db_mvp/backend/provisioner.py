@@ -69,18 +69,30 @@ class Provisioner:
             # Quota được enforce ở application level (khi tạo DB, check tổng quota)
             # Có thể thêm monitoring job để check và cảnh báo khi vượt quota
             
+            # Connection đã USE database của tenant: không trả về pool (reset không đổi database hiện tại)
+            conn.invalidate()
+            conn = None
+
             # Trả về tên database thực tế đã tạo (để lưu vào metadata)
             return safe_db_name
         except Exception as e:
-            # Đóng connection nếu có lỗi
+            # Connection lỗi giữa chừng: đóng hẳn thay vì trả về pool
             if conn:
                 try:
-                    conn.close()
+                    conn.invalidate()
                 except:
                     pass
+                conn = None
             # Reset connection trong service để lần sau tạo connection mới
             self.mysql_service.conn = None
             raise  # Re-raise để caller xử lý
+        finally:
+            # Trả connection về pool dùng chung
+            if conn:
+                try:
+                    conn.close()
+                except:
+                    pass
 
     def drop_database_and_user(self, db_name, db_user):
         """Xóa database và user. db_name nên là format db_{id}"""
@@ -3,8 +3,8 @@ schemas.py - Pydantic models for API
 - Input/output validation for endpoints
 """
 
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, StrictBool, StrictInt
+from typing import Optional, List, Dict, Any, Union
 from datetime import datetime
 
 class UserOut(BaseModel):
@@ -254,6 +254,7 @@ class MetricsResponse(BaseModel):
     """Response cho metrics endpoint"""
     database_id: int
     timeframe: str
+    resolution: Optional[str] = None  # raw, 1m, 1h, 1d
     metrics: dict  # { "CPU": [...], "MEMORY": [...], "CONNECTIONS": [...] }
     summary: Optional[dict] = None  # Summary stats
 
@@ -283,6 +284,7 @@ class SlowQueryOut(BaseModel):
     duration_ms: float
     rows_examined: Optional[int] = None
     rows_sent: Optional[int] = None
+    explain_plan: Optional[Dict[str, Any]] = None
     timestamp: Optional[datetime] = None
     class Config:
         from_attributes = True
@@ -341,6 +343,26 @@ class ImportOut(BaseModel):
 class SQLQueryRequest(BaseModel):
     """Yêu cầu execute SQL query"""
     query: str
+    # "rows": list-of-lists string (mặc định); "columnar": mảng theo cột, giữ đúng kiểu dữ liệu
+    format: str = "rows"
+    no_cache: bool = False  # True: bỏ qua result cache, luôn chạy query trên MySQL
+    # Giá trị cho các placeholder '?' trong query (bind an toàn phía server, không nối chuỗi)
+    params: Optional[List[Union[StrictBool, StrictInt, float, str, None]]] = None
+    # True: INSERT/UPDATE/DELETE bị deadlock / lock wait timeout được tự chạy lại (backoff có jitter)
+    retry_on_conflict: bool = False
+
+class SQLExportRequest(BaseModel):
+    """Yêu cầu export toàn bộ kết quả SELECT"""
+    query: str
+    format: str = "csv"  # csv | ndjson
+    gzip: bool = False
+
+class SQLBatchRequest(BaseModel):
+    """Yêu cầu chạy nhiều statement trên một connection"""
+    statements: Optional[List[str]] = None  # list statement theo thứ tự
+    script: Optional[str] = None  # hoặc một script, server tự tách statement
+    transaction: bool = False  # True: chạy trong một transaction, lỗi -> rollback toàn bộ
+    stop_on_error: bool = True  # False: chạy tiếp khi lỗi (chỉ khi transaction=False)
 
 class SQLQueryResponse(BaseModel):
     """Response cho SQL query execution"""
@@ -352,3 +374,165 @@ class SQLQueryResponse(BaseModel):
     execution_time_ms: float
     query_type: str
     message: str
+    truncated: bool = False  # True nếu SELECT bị cắt theo giới hạn rows/bytes
+    estimated_total_rows: Optional[int] = None  # Tổng rows (ước lượng nếu truncated)
+    cached: bool = False  # True nếu kết quả lấy từ result cache
+    # Parameterized query: {"prepared", "prepared_cache_hit", "prepare_ms", "execute_ms"}
+    timing: Optional[Dict[str, Any]] = None
+    # Cost guard (SELECT): {"action": none|warn|limit, "estimated_rows_examined", "plan_cached", ...}
+    cost_guard: Optional[Dict[str, Any]] = None
+    queue_wait_ms: float = 0.0  # Thời gian chờ slot admission trước khi chạy
+    retries: int = 0  # Số lần chạy lại vì deadlock / lock wait timeout
+
+class SQLBatchStatementResult(BaseModel):
+    """Kết quả một statement trong batch"""
+    index: int
+    query_type: str
+    success: bool
+    skipped: bool = False
+    columns: List[str] = []
+    rows: List[List[Optional[str]]] = []
+    row_count: int = 0
+    affected_rows: int = 0
+    truncated: bool = False
+    execution_time_ms: float = 0.0
+    message: Optional[str] = None
+    error: Optional[str] = None
+    cost_guard: Optional[Dict[str, Any]] = None
+
+class SQLBatchResponse(BaseModel):
+    """Response cho batch execution"""
+    success: bool
+    transaction: bool
+    committed: bool
+    statement_count: int
+    executed_count: int
+    failed_index: Optional[int] = None
+    execution_time_ms: float
+    results: List[SQLBatchStatementResult]
+
+class BulkIngestResponse(BaseModel):
+    """Kết quả bulk ingest"""
+    success: bool
+    table: str
+    columns: List[str]
+    rows_received: int
+    rows_inserted: int
+    chunk_size: int
+    chunks: int
+    atomic: bool
+    failed_chunk: Optional[int] = None  # chunk lỗi (0-based), các chunk trước đã commit nếu atomic=False
+    error: Optional[str] = None
+    execution_time_ms: float
+    rows_per_sec: float
+
+class QueryJobCreate(BaseModel):
+    """Yêu cầu chạy query dài ở background"""
+    query: str
+
+class QueryJobOut(BaseModel):
+    """Thông tin query job"""
+    id: int
+    database_id: int
+    query_text: str
+    status: str
+    row_count: int = 0
+    result_bytes: int = 0
+    truncated: bool = False
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    error_message: Optional[str] = None
+    class Config:
+        from_attributes = True
+
+class QueryJobResultsPage(BaseModel):
+    """Một trang kết quả của query job (poll theo next_offset)"""
+    job_id: int
+    status: str
+    columns: List[str]
+    rows: List[List[Any]]
+    offset: int
+    next_offset: int
+    complete: bool  # True khi job đã kết thúc và đã đọc hết rows
+
+class SchemaColumn(BaseModel):
+    name: str
+    data_type: str
+    column_type: Optional[str] = None
+    nullable: bool
+    default: Optional[str] = None
+    extra: str = ""
+    key: str = ""
+
+class SchemaIndex(BaseModel):
+    name: str
+    columns: List[str]
+    unique: bool
+
+class SchemaForeignKey(BaseModel):
+    name: str
+    columns: List[str]
+    referenced_table: str
+    referenced_columns: List[str]
+
+class SchemaTable(BaseModel):
+    name: str
+    type: Optional[str] = None
+    engine: Optional[str] = None
+    rows_estimate: Optional[int] = None  # TABLE_ROWS của InnoDB là ước lượng
+    data_bytes: int = 0
+    index_bytes: int = 0
+    columns: List[SchemaColumn]
+    primary_key: List[str]
+    indexes: List[SchemaIndex]
+    foreign_keys: List[SchemaForeignKey]
+
+class DatabaseSchemaResponse(BaseModel):
+    """Schema browser: tables, columns, indexes của database (version dùng làm ETag)"""
+    database_id: int
+    version: str
+    loaded_at: str
+    table_count: int
+    tables: List[SchemaTable]
+
+class TableBrowseResponse(BaseModel):
+    """Một trang dữ liệu table (keyset pagination); gửi next_cursor để lấy trang tiếp"""
+    table: str
+    columns: List[str]
+    rows: List[List[Any]]
+    row_count: int
+    key: List[str]
+    order_by: List[str]
+    order: str
+    limit: int
+    has_more: bool
+    next_cursor: Optional[str] = None
+    execution_time_ms: float
+
+class QueryFingerprintStat(BaseModel):
+    """Latency / rows của một dạng query (fingerprint); histogram: số lần theo bucket buckets_ms (+ bucket cuối)"""
+    fingerprint_id: str
+    fingerprint: str
+    query_type: Optional[str] = None
+    calls: int
+    total_time_ms: float
+    avg_time_ms: float
+    max_time_ms: float
+    p50_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+    p99_ms: Optional[float] = None
+    rows_total: int
+    avg_rows: float
+    histogram: List[int]
+    first_seen: Optional[datetime] = None
+    last_seen: Optional[datetime] = None
+
+class QueryFingerprintStatsResponse(BaseModel):
+    """Thống kê query theo fingerprint của database (đã flush + chưa flush)"""
+    database_id: int
+    buckets_ms: List[float]
+    sort: str
+    total_fingerprints: int
+    unflushed_calls: int
+    fingerprints: List[QueryFingerprintStat]
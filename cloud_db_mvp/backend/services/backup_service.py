@@ -240,7 +240,8 @@ class BackupService:
             
             conn.commit()
             cur.close()
-            conn.close()
+            # Đã USE database của tenant + chạy SQL từ backup (SET ...): đóng hẳn, không trả về pool
+            conn.invalidate()
             
             # Cập nhật restore record
             restore.status = RestoreStatus.COMPLETED.value
@@ -0,0 +1,255 @@
+"""
+bulk_ingest_service.py - Service để nạp nhiều rows vào một table của tenant
+- Nhận JSON (list object hoặc {"columns", "rows"}) hoặc CSV có header
+- Validate columns theo schema thật của table (schema cache dùng chung với executor)
+- Ghi bằng executemany (PyMySQL gộp thành multi-row INSERT) theo từng chunk trong transaction
+- Dùng connection tenant (user riêng của database) qua SQLExecutorService
+"""
+
+import os
+import io
+import csv
+import json
+import re
+import time
+import pymysql
+from typing import List, Dict, Optional, Any, Tuple
+from sqlalchemy.orm import Session
+from services.query_admission import AdmissionTicket
+from services.sql_executor_service import SQLExecutorService
+from services.query_result_cache import query_result_cache
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z0-9_$]{1,64}$")
+
+# Kiểu cột nhận text nguyên văn; kiểu khác coi "" là NULL khi nạp CSV
+_TEXT_TYPES = {"char", "varchar", "tinytext", "text", "mediumtext", "longtext", "enum", "set"}
+
+
+class BulkIngestService:
+    def __init__(self):
+        self.executor = SQLExecutorService()
+        self.default_chunk_rows = int(os.getenv("SQL_INGEST_CHUNK_ROWS", "1000"))
+        self.max_chunk_rows = int(os.getenv("SQL_INGEST_MAX_CHUNK_ROWS", "10000"))
+        self.max_payload_bytes = int(os.getenv("SQL_INGEST_MAX_BYTES", str(50 * 1024 * 1024)))
+
+    @staticmethod
+    def is_csv(content_type: str) -> bool:
+        return (content_type or "").split(";")[0].strip().lower() in ("text/csv", "application/csv")
+
+    def parse_payload(self, body: bytes, content_type: str) -> Tuple[List[str], List[List[Any]]]:
+        """
+        Parse body thành (columns, rows)
+        - application/json: [{"col": val, ...}, ...] hoặc {"columns": [...], "rows": [[...], ...]}
+        - text/csv: dòng đầu là header
+        """
+        if len(body) > self.max_payload_bytes:
+            raise ValueError(f"Payload too large: {len(body)} bytes (max {self.max_payload_bytes})")
+
+        if self.is_csv(content_type):
+            return self._parse_csv(body)
+        content_type = (content_type or "").split(";")[0].strip().lower()
+        if content_type in ("application/json", ""):
+            return self._parse_json(body)
+        raise ValueError(f"Unsupported content type '{content_type}'. Use application/json or text/csv")
+
+    def _parse_json(self, body: bytes) -> Tuple[List[str], List[List[Any]]]:
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+
+        if isinstance(payload, dict):
+            columns = payload.get("columns")
+            rows = payload.get("rows")
+            if not isinstance(columns, list) or not isinstance(rows, list):
+                raise ValueError("JSON object payload must have 'columns' and 'rows' lists")
+            for index, row in enumerate(rows):
+                if not isinstance(row, list) or len(row) != len(columns):
+                    raise ValueError(f"Row {index + 1} must be a list of {len(columns)} values")
+            return columns, rows
+
+        if not isinstance(payload, list):
+            raise ValueError("JSON payload must be a list of objects or {'columns', 'rows'}")
+        if not payload:
+            return [], []
+        if not isinstance(payload[0], dict):
+            raise ValueError("Row 1 must be a JSON object")
+        columns = list(payload[0].keys())
+        column_set = set(columns)
+        rows = []
+        for index, item in enumerate(payload):
+            if not isinstance(item, dict) or set(item.keys()) != column_set:
+                raise ValueError(f"Row {index + 1} must be an object with columns: {', '.join(columns)}")
+            rows.append([item[col] for col in columns])
+        return columns, rows
+
+    def _parse_csv(self, body: bytes) -> Tuple[List[str], List[List[Any]]]:
+        try:
+            text = body.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise ValueError("CSV must be UTF-8 encoded")
+        reader = csv.reader(io.StringIO(text))
+        header = next(reader, None)
+        if not header:
+            return [], []
+        columns = [col.strip() for col in header]
+        rows = []
+        for index, row in enumerate(reader):
+            if not row:
+                continue
+            if len(row) != len(columns):
+                raise ValueError(f"CSV line {index + 2} has {len(row)} fields, expected {len(columns)}")
+            rows.append(row)
+        return columns, rows
+
+    def ingest(
+        self,
+        db: Session,
+        database_id: int,
+        user_id: int,
+        table: str,
+        columns: List[str],
+        rows: List[List[Any]],
+        chunk_size: Optional[int] = None,
+        atomic: bool = False,
+        from_csv: bool = False,
+        ticket: Optional[AdmissionTicket] = None
+    ) -> Dict[str, Any]:
+        """
+        Insert rows vào table theo chunk
+        - atomic=False: mỗi chunk một transaction; lỗi -> dừng, các chunk trước đã commit
+        - atomic=True: toàn bộ trong một transaction; lỗi -> rollback hết
+        - ticket: slot admission đã được cấp trước; None -> chờ slot tại đây
+        Returns: {"rows_inserted", "chunks", "rows_per_sec", "failed_chunk", "error", ...}
+        """
+        if not _IDENTIFIER_RE.match(table or ""):
+            raise ValueError(f"Invalid table name '{table}'")
+        if not columns:
+            raise ValueError("No columns provided")
+        if len(set(columns)) != len(columns):
+            raise ValueError("Duplicate column names in payload")
+        for col in columns:
+            if not _IDENTIFIER_RE.match(col):
+                raise ValueError(f"Invalid column name '{col}'")
+
+        chunk_size = chunk_size or self.default_chunk_rows
+        if chunk_size < 1 or chunk_size > self.max_chunk_rows:
+            raise ValueError(f"chunk_size must be between 1 and {self.max_chunk_rows}")
+
+        target = self.executor._get_target(db, database_id, user_id)
+        ticket = self.executor._admit(database_id, ticket)
+
+        start_time = time.time()
+        rows_inserted = 0
+        chunks_done = 0
+        failed_chunk = None
+        error = None
+        conn = None
+        try:
+            conn = self.executor._connect(target)
+            schema = self._load_columns(target, conn, table)
+            self._validate_columns(table, columns, schema)
+            converters = [self._converter(schema[col], from_csv) for col in columns]
+
+            sql = "INSERT INTO `{}` ({}) VALUES ({})".format(
+                table,
+                ", ".join(f"`{col}`" for col in columns),
+                ", ".join(["%s"] * len(columns))
+            )
+            cur = conn.cursor()
+            for offset in range(0, len(rows), chunk_size):
+                chunk = [
+                    [convert(val) for convert, val in zip(converters, row)]
+                    for row in rows[offset:offset + chunk_size]
+                ]
+                try:
+                    # PyMySQL executemany gộp INSERT ... VALUES thành multi-row INSERT
+                    cur.executemany(sql, chunk)
+                except pymysql.err.MySQLError as e:
+                    failed_chunk = chunks_done
+                    error = str(e)
+                    conn.rollback()
+                    if atomic:
+                        rows_inserted = 0
+                    break
+                rows_inserted += len(chunk)
+                chunks_done += 1
+                if not atomic:
+                    conn.commit()
+            if atomic and failed_chunk is None:
+                conn.commit()
+            cur.close()
+            conn.close()
+            conn = None
+        except Exception as e:
+            self.executor._release_after_error(conn, e)
+            if isinstance(e, ValueError):
+                raise
+            raise Exception(f"Bulk ingest failed: {str(e)}")
+        finally:
+            ticket.release()
+            if rows_inserted or failed_chunk is not None:
+                query_result_cache.invalidate_database(database_id)
+
+        elapsed = time.time() - start_time
+        return {
+            "success": failed_chunk is None,
+            "table": table,
+            "columns": columns,
+            "rows_received": len(rows),
+            "rows_inserted": rows_inserted,
+            "chunk_size": chunk_size,
+            "chunks": chunks_done,
+            "atomic": atomic,
+            "failed_chunk": failed_chunk,
+            "error": error,
+            "execution_time_ms": round(elapsed * 1000, 2),
+            "rows_per_sec": round(rows_inserted / elapsed, 1) if elapsed > 0 else float(rows_inserted)
+        }
+
+    def _load_columns(self, target: Dict[str, Any], conn, table: str) -> Dict[str, Dict[str, Any]]:
+        """Schema table (từ schema cache dùng chung): tên cột -> {data_type, nullable, has_default, generated}"""
+        info = self.executor._table_schema(target, table, conn)
+        if info is None or not info["columns"]:
+            raise ValueError(f"Table '{table}' not found")
+        schema = {}
+        for column in info["columns"]:
+            extra = column["extra"]
+            schema[column["name"]] = {
+                "data_type": column["data_type"],
+                "nullable": column["nullable"],
+                "has_default": column["default"] is not None or "auto_increment" in extra,
+                "generated": "generated" in extra,
+            }
+        return schema
+
+    @staticmethod
+    def _validate_columns(table: str, columns: List[str], schema: Dict[str, Dict[str, Any]]) -> None:
+        """Cột phải tồn tại, không phải generated column; cột NOT NULL không default phải có mặt"""
+        unknown = [col for col in columns if col not in schema]
+        if unknown:
+            raise ValueError(f"Unknown column(s) for table '{table}': {', '.join(unknown)}")
+        generated = [col for col in columns if schema[col]["generated"]]
+        if generated:
+            raise ValueError(f"Cannot insert into generated column(s): {', '.join(generated)}")
+        missing = [
+            name for name, info in schema.items()
+            if name not in columns and not info["nullable"] and not info["has_default"] and not info["generated"]
+        ]
+        if missing:
+            raise ValueError(f"Missing required column(s) for table '{table}': {', '.join(missing)}")
+
+    @staticmethod
+    def _converter(column: Dict[str, Any], from_csv: bool):
+        """Chuẩn hóa giá trị trước khi bind: object/list -> JSON text, CSV \\N hoặc "" (cột không phải text) -> NULL"""
+        is_text = column["data_type"] in _TEXT_TYPES
+
+        def convert(val):
+            if from_csv:
+                if val == "\\N" or (val == "" and not is_text):
+                    return None
+                return val
+            if isinstance(val, (dict, list)):
+                return json.dumps(val, ensure_ascii=False)
+            return val
+        return convert
@@ -0,0 +1,167 @@
+"""
+fleet_sampler.py - Lấy mẫu metrics cho nhiều schema trên cùng MySQL host trong một lượt
+- PROCESSLIST đếm theo GROUP BY DB, dung lượng theo GROUP BY table_schema
+- Counter statement theo tài khoản MySQL riêng của từng database (lọc theo user, không theo nội dung statement):
+  events_statements_summary_by_account_by_event_name GROUP BY USER (COUNT_STAR, SUM_TIMER_WAIT, rows)
+  -> statement của admin / sampler / tài khoản khác không bao giờ tính cho tenant; không dùng Questions
+  vì đó là traffic của cả host
+- Chỉ tính statement SQL (statement/sql/*, không tính lệnh protocol: ping, reset connection, chọn database của pool),
+  bỏ PREPARE / DEALLOCATE / SET mà executor tự gửi (prepared statement ở mức SQL, SET biến @_pN,
+  SET NAMES khi reset session) -> query có params chỉ tính một lần (EXECUTE)
+  SET do tenant tự gửi cũng không được tính; COMMIT / ROLLBACK / EXPLAIN / information_schema vẫn tính
+- max_connections chỉ đọc một lần cho cả lượt
+- Schema được chia theo lô (chunk_size) để câu IN (...) không quá lớn
+- Số round-trip mỗi lượt = 1 (max_connections) + 3 x ceil(N / chunk_size)
+  (mỗi lô: PROCESSLIST, dung lượng, counter statement) thay vì ~4 x N; query counter lỗi vẫn tính một round-trip,
+  lô không có schema nào trong accounts thì không gửi query counter
+- Kết quả fan-out thành mẫu riêng của từng schema (schema không có dòng nào -> 0)
+- counter_rates(): tốc độ từ hai snapshot counter liên tiếp, phát hiện counter bị reset
+"""
+
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Các counter tích lũy lấy từ statement summary theo account (xem MetricCounter trong models.py)
+COUNTER_FIELDS = ("statements", "timer_wait_us", "rows")
+
+# Statement SQL (COM_QUERY); lệnh protocol là statement/com/*
+STATEMENT_EVENTS = "statement/sql/%"
+# Statement executor tự gửi trên connection tenant: PREPARE / DEALLOCATE PREPARE / SET (@_pN, SET NAMES)
+PLATFORM_EVENTS = ("statement/sql/prepare_sql", "statement/sql/dealloc_sql", "statement/sql/set_option")
+
+
+def _chunks(items: List[str], size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def counter_rates(previous: Dict[str, int], current: Dict[str, int], elapsed_s: float) -> Optional[Dict[str, float]]:
+    """
+    Tốc độ giữa hai snapshot counter
+    Returns: {"qps", "avg_response_ms", "rows_per_second"}; None nếu không tính được
+    (khoảng thời gian <= 0 hoặc counter giảm: MySQL restart / TRUNCATE bảng summary)
+    """
+    if elapsed_s <= 0:
+        return None
+    deltas = {field: current[field] - previous[field] for field in COUNTER_FIELDS}
+    if any(delta < 0 for delta in deltas.values()):
+        return None
+    statements = deltas["statements"]
+    return {
+        "qps": round(statements / elapsed_s, 2),
+        "avg_response_ms": round(deltas["timer_wait_us"] / statements / 1000, 2) if statements else 0.0,
+        "rows_per_second": round(deltas["rows"] / elapsed_s, 2),
+    }
+
+
+class FleetSampler:
+    def __init__(self, mysql_service=None, chunk_size: int = 500):
+        self.mysql_service = mysql_service
+        self.chunk_size = max(1, chunk_size)
+
+    def _mysql(self):
+        if self.mysql_service is None:
+            # Import muộn: mysql_service kéo theo config admin
+            from services.mysql_service import MySQLService
+            self.mysql_service = MySQLService()
+        return self.mysql_service
+
+    def sample(self, schemas: List[str], accounts: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Lấy mẫu mọi schema trong một connection admin
+        accounts: schema -> user MySQL riêng của database (user tenant kết nối bằng)
+        Returns: {"taken_at", "round_trips" (= 1 + 3 x số lô), "host": {max_connections},
+                  "schemas": {schema: {"connections", "storage_mb", "counters"}}}
+        counters = {statements, timer_wait_us, rows} hoặc None nếu không đọc được performance_schema
+        / schema không có trong accounts
+        """
+        schemas = list(dict.fromkeys(schemas))
+        accounts = accounts or {}
+        samples = {
+            schema: {"connections": 0, "storage_mb": 0.0,
+                     "counters": dict.fromkeys(COUNTER_FIELDS, 0) if schema in accounts else None}
+            for schema in schemas
+        }
+        round_trips = 0
+
+        conn = self._mysql().connect()
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT @@GLOBAL.max_connections")
+                row = cur.fetchone()
+                round_trips += 1
+                max_connections = int(row[0]) if row and row[0] is not None else 100
+
+                for chunk in _chunks(schemas, self.chunk_size):
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    cur.execute(f"""
+                        SELECT DB, COUNT(*)
+                        FROM information_schema.PROCESSLIST
+                        WHERE DB IN ({placeholders}) AND COMMAND != 'Sleep'
+                        GROUP BY DB
+                    """, tuple(chunk))
+                    round_trips += 1
+                    for schema, count in cur.fetchall():
+                        if schema in samples:
+                            samples[schema]["connections"] = int(count or 0)
+
+                    cur.execute(f"""
+                        SELECT table_schema, ROUND(SUM(data_length + index_length) / 1024 / 1024, 2)
+                        FROM information_schema.tables
+                        WHERE table_schema IN ({placeholders})
+                        GROUP BY table_schema
+                    """, tuple(chunk))
+                    round_trips += 1
+                    for schema, size_mb in cur.fetchall():
+                        if schema in samples:
+                            samples[schema]["storage_mb"] = float(size_mb or 0.0)
+
+                    schemas_by_user: Dict[str, List[str]] = {}
+                    for schema in chunk:
+                        if schema in accounts:
+                            schemas_by_user.setdefault(accounts[schema], []).append(schema)
+                    if not schemas_by_user:
+                        continue
+                    users = tuple(schemas_by_user)
+                    # Query counter đã gửi tới server dù thành công hay lỗi -> đếm trước
+                    round_trips += 1
+                    try:
+                        cur.execute(f"""
+                            SELECT USER, SUM(COUNT_STAR), SUM(SUM_TIMER_WAIT),
+                                   SUM(SUM_ROWS_SENT + SUM_ROWS_AFFECTED)
+                            FROM performance_schema.events_statements_summary_by_account_by_event_name
+                            WHERE USER IN ({", ".join(["%s"] * len(users))})
+                              AND EVENT_NAME LIKE %s
+                              AND EVENT_NAME NOT IN ({", ".join(["%s"] * len(PLATFORM_EVENTS))})
+                            GROUP BY USER
+                        """, users + (STATEMENT_EVENTS,) + PLATFORM_EVENTS)
+                    except Exception as e:
+                        # performance_schema tắt / thiếu quyền: vẫn giữ connections + storage
+                        print(f"Warning: could not read statement counters: {e}")
+                        for schema in chunk:
+                            samples[schema]["counters"] = None
+                        continue
+                    for user, statements, timer_wait_ps, rows in cur.fetchall():
+                        for schema in schemas_by_user.get(user, []):
+                            samples[schema]["counters"] = {
+                                "statements": int(statements or 0),
+                                "timer_wait_us": int(timer_wait_ps or 0) // 1_000_000,
+                                "rows": int(rows or 0),
+                            }
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+
+        return {
+            "taken_at": datetime.now(),
+            "round_trips": round_trips,
+            "host": {"max_connections": max_connections},
+            "schemas": samples,
+        }
+
+
+# Sampler dùng chung toàn process
+fleet_sampler = FleetSampler(chunk_size=int(os.getenv("METRICS_SAMPLE_CHUNK_SIZE", "500")))
@@ -0,0 +1,125 @@
+"""
+metric_rollups.py - Gộp performance metrics theo nhiều độ phân giải (1m / 1h / 1d)
+- Collector gọi apply() mỗi lần ghi mẫu: cộng dồn count / sum / min / max vào bucket hiện tại,
+  không phải quét lại dữ liệu thô
+- Timeframe dài đọc bảng rollup thô nhất còn đủ điểm (MIN_POINTS) thay vì load mọi mẫu thô
+- Mỗi độ phân giải có retention riêng (prune()), bucket cũ hơn retention bị xóa
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from models import MetricRollup
+
+# Thứ tự từ mịn tới thô
+RESOLUTIONS: Dict[str, timedelta] = {
+    "1m": timedelta(minutes=1),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+
+RETENTION: Dict[str, timedelta] = {
+    "1m": timedelta(hours=float(os.getenv("METRICS_ROLLUP_1M_RETENTION_HOURS", "48"))),
+    "1h": timedelta(days=float(os.getenv("METRICS_ROLLUP_1H_RETENTION_DAYS", "35"))),
+    "1d": timedelta(days=float(os.getenv("METRICS_ROLLUP_1D_RETENTION_DAYS", "400"))),
+}
+
+# Timeframe tới mức này đọc thẳng mẫu thô (~1 mẫu / interval của collector)
+RAW_WINDOW = timedelta(hours=1)
+# Số điểm tối thiểu trên biểu đồ khi chọn độ phân giải
+MIN_POINTS = 24
+
+
+def bucket_start(timestamp: datetime, resolution: str) -> datetime:
+    """Đầu bucket chứa timestamp"""
+    if resolution == "1m":
+        return timestamp.replace(second=0, microsecond=0)
+    if resolution == "1h":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def resolution_for(window: timedelta) -> Optional[str]:
+    """
+    Độ phân giải thô nhất vẫn cho >= MIN_POINTS điểm và còn giữ đủ dữ liệu cho window
+    None -> đọc mẫu thô
+    """
+    if window <= RAW_WINDOW:
+        return None
+    for resolution in reversed(list(RESOLUTIONS)):
+        if window / RESOLUTIONS[resolution] >= MIN_POINTS and RETENTION[resolution] >= window:
+            return resolution
+    return "1m"
+
+
+def apply(db: Session, samples: Iterable[Dict]) -> int:
+    """
+    Cộng dồn mẫu mới vào rollup của mọi độ phân giải (chưa commit - commit cùng mẫu thô)
+    samples: dict có database_id, metric_type, value, timestamp
+    Returns: số bucket đã cập nhật / tạo mới
+    """
+    deltas: Dict[Tuple[int, str, str, datetime], List[float]] = {}
+    for sample in samples:
+        value = float(sample["value"])
+        for resolution in RESOLUTIONS:
+            key = (sample["database_id"], resolution, sample["metric_type"], bucket_start(sample["timestamp"], resolution))
+            delta = deltas.get(key)
+            if delta is None:
+                deltas[key] = [1, value, value, value]
+            else:
+                delta[0] += 1
+                delta[1] += value
+                delta[2] = min(delta[2], value)
+                delta[3] = max(delta[3], value)
+    if not deltas:
+        return 0
+
+    # Một query lấy mọi bucket đang mở của các database trong lô
+    database_ids = {key[0] for key in deltas}
+    starts = {key[3] for key in deltas}
+    existing = {
+        (row.database_id, row.resolution, row.metric_type, row.bucket_start): row
+        for row in db.query(MetricRollup).filter(
+            MetricRollup.database_id.in_(database_ids),
+            MetricRollup.bucket_start.in_(starts)
+        )
+    }
+
+    for key, (count, total, low, high) in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            database_id, resolution, metric_type, start = key
+            db.add(MetricRollup(database_id=database_id, resolution=resolution, metric_type=metric_type,
+                                bucket_start=start, count=count, sum=total, min=low, max=high))
+        else:
+            row.count += count
+            row.sum += total
+            row.min = min(row.min, low)
+            row.max = max(row.max, high)
+    return len(deltas)
+
+
+def read(db: Session, database_id: int, resolution: str, since: datetime) -> List[Tuple]:
+    """(metric_type, bucket_start, count, sum, min, max) theo thời gian tăng dần"""
+    return db.query(
+        MetricRollup.metric_type, MetricRollup.bucket_start, MetricRollup.count,
+        MetricRollup.sum, MetricRollup.min, MetricRollup.max
+    ).filter(
+        MetricRollup.database_id == database_id,
+        MetricRollup.resolution == resolution,
+        MetricRollup.bucket_start >= bucket_start(since, resolution)
+    ).order_by(MetricRollup.bucket_start.asc()).all()
+
+
+def prune(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Xóa bucket cũ hơn retention của từng độ phân giải; Returns: số dòng đã xóa theo độ phân giải"""
+    now = now or datetime.now()
+    deleted = {}
+    for resolution, retention in RETENTION.items():
+        deleted[resolution] = db.query(MetricRollup).filter(
+            MetricRollup.resolution == resolution,
+            MetricRollup.bucket_start < now - retention
+        ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
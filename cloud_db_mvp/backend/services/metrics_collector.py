@@ -0,0 +1,226 @@
+"""
+metrics_collector.py - Thread nền lấy mẫu metrics cho mọi database ACTIVE theo chu kỳ cố định
+- Chạy ngoài request path: API monitoring chỉ đọc dữ liệu đã lưu
+- Chu kỳ cố định (fixed-rate) + jitter để nhiều process không lấy mẫu cùng lúc;
+  chu kỳ chạy quá lâu thì bỏ các tick đã lỡ thay vì chạy dồn
+- Mỗi lượt lấy mẫu theo lô (batch_size database / lô) qua FleetSampler: vài query GROUP BY cho cả lô
+  thay vì vài query cho từng database
+- Mẫu mới được cộng dồn vào rollup 1m / 1h / 1d; bucket quá retention bị xóa mỗi chu kỳ
+- Sau chu kỳ: MetricsRetentionJob dọn mẫu thô quá hạn (theo lô, tối đa một lần mỗi interval của job)
+- Database mới tạo: request_sample() đánh thức collector lấy mẫu ngay
+- Thống kê mỗi chu kỳ: thời gian chạy, độ trễ so với lịch (lag), số database, số lỗi
+  (stats() chỉ dùng nội bộ: là số liệu của cả fleet, không đưa ra API của tenant - app chưa có quyền admin)
+- Nhiều worker process: chỉ bật collector ở một process (METRICS_COLLECTOR_ENABLED)
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from database import SessionLocal
+from models import Database
+from services import metric_rollups
+from services.metrics_retention import metrics_retention
+
+
+class MetricsCollector:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        interval: float = 60.0,
+        jitter: float = 0.1,
+        service_factory: Optional[Callable[[], Any]] = None,
+        batch_size: int = 500,
+        retention=None
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.jitter = jitter  # Tỉ lệ của interval: lệch ngẫu nhiên trong [-jitter, +jitter] x interval
+        self.batch_size = max(1, batch_size)
+        self.retention = retention  # MetricsRetentionJob (services/metrics_retention.py), None -> không dọn mẫu thô
+        self.service_factory = service_factory
+        self._wake = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._requested: Set[int] = set()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "cycles": 0, "skipped_ticks": 0, "databases_sampled": 0, "errors": 0, "on_demand_samples": 0,
+            "last_cycle_at": None, "last_cycle_ms": None, "max_cycle_ms": 0.0, "avg_cycle_ms": 0.0,
+            "last_lag_ms": None, "max_lag_ms": 0.0, "last_cycle_databases": 0, "last_cycle_errors": 0,
+            "round_trips": 0, "last_cycle_round_trips": 0, "counter_resets": 0,
+            "rollups_pruned": 0,
+        }
+
+    def _service(self):
+        if self.service_factory is None:
+            # Import muộn: monitoring_service kéo theo MySQLService
+            from services.monitoring_service import MonitoringService
+            self.service_factory = MonitoringService
+        return self.service_factory()
+
+    def start(self) -> None:
+        with self._wake:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="metrics-collector", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._wake:
+            thread = self._thread
+            self._stopping = True
+            self._wake.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        with self._wake:
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def request_sample(self, database_id: int) -> None:
+        """Lấy mẫu database này sớm nhất có thể (không chờ tới chu kỳ sau)"""
+        with self._wake:
+            self._requested.add(database_id)
+            self._wake.notify_all()
+
+    def _initial_delay(self) -> float:
+        # Lệch pha ngẫu nhiên lần đầu: các process khởi động cùng lúc không lấy mẫu cùng lúc
+        return random.uniform(0, self.interval * self.jitter)
+
+    def _next_delay(self) -> float:
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _run(self) -> None:
+        scheduled = time.monotonic() + self._initial_delay()
+        while True:
+            with self._wake:
+                while not self._stopping and not self._requested and time.monotonic() < scheduled:
+                    self._wake.wait(scheduled - time.monotonic())
+                if self._stopping:
+                    return
+                requested, self._requested = self._requested, set()
+
+            now = time.monotonic()
+            try:
+                if now >= scheduled:
+                    self.run_cycle(lag_ms=(now - scheduled) * 1000)
+                    scheduled += self._next_delay()
+                    if scheduled <= time.monotonic():
+                        # Chu kỳ chạy lâu hơn interval: bỏ các tick đã lỡ
+                        missed = int((time.monotonic() - scheduled) // self.interval) + 1
+                        self._count("skipped_ticks", missed)
+                        scheduled = time.monotonic() + self._next_delay()
+                else:
+                    self.sample(sorted(requested))
+                    self._count("on_demand_samples", len(requested))
+            except Exception as e:
+                print(f"Warning: metrics collector cycle failed: {e}")
+
+    def run_cycle(self, lag_ms: float = 0.0) -> Dict[str, Any]:
+        """Lấy mẫu mọi database ACTIVE một lượt; Returns: thống kê của chu kỳ"""
+        start = time.monotonic()
+        db = self.session_factory()
+        try:
+            database_ids = [row[0] for row in db.query(Database.id).filter(Database.status == "ACTIVE").order_by(Database.id).all()]
+        finally:
+            db.close()
+        errors, round_trips = self._sample(database_ids)
+        self._prune_rollups()
+        self._run_retention()
+        cycle_ms = (time.monotonic() - start) * 1000
+
+        with self._lock:
+            stats = self._stats
+            stats["cycles"] += 1
+            stats["last_cycle_at"] = time.time()
+            stats["last_cycle_ms"] = round(cycle_ms, 2)
+            stats["max_cycle_ms"] = round(max(stats["max_cycle_ms"], cycle_ms), 2)
+            stats["avg_cycle_ms"] = round(stats["avg_cycle_ms"] + (cycle_ms - stats["avg_cycle_ms"]) / stats["cycles"], 2)
+            stats["last_lag_ms"] = round(lag_ms, 2)
+            stats["max_lag_ms"] = round(max(stats["max_lag_ms"], lag_ms), 2)
+            stats["last_cycle_databases"] = len(database_ids)
+            stats["last_cycle_errors"] = errors
+            stats["last_cycle_round_trips"] = round_trips
+        return {"databases": len(database_ids), "errors": errors, "round_trips": round_trips,
+                "cycle_ms": round(cycle_ms, 2), "lag_ms": round(lag_ms, 2)}
+
+    def sample(self, database_ids: List[int]) -> int:
+        """Collect metrics cho danh sách database; Returns: số database lỗi"""
+        return self._sample(database_ids)[0]
+
+    def _sample(self, database_ids: List[int]) -> Tuple[int, int]:
+        """Mỗi lô một session + một lượt FleetSampler; lô lỗi -> mọi database trong lô tính là lỗi"""
+        if not database_ids:
+            return 0, 0
+        service = self._service()
+        errors = 0
+        round_trips = 0
+        for i in range(0, len(database_ids), self.batch_size):
+            if self._stopping:
+                break
+            batch = database_ids[i:i + self.batch_size]
+            db = self.session_factory()
+            try:
+                result = service.collect_fleet_metrics(db, batch)
+                round_trips += result.get("round_trips", 0)
+                self._count("counter_resets", result.get("counter_resets", 0))
+            except Exception as e:
+                errors += len(batch)
+                db.rollback()
+                print(f"Warning: could not collect metrics for databases {batch[0]}..{batch[-1]}: {e}")
+            finally:
+                db.close()
+        self._count("databases_sampled", len(database_ids))
+        self._count("errors", errors)
+        self._count("round_trips", round_trips)
+        return errors, round_trips
+
+    def _prune_rollups(self) -> None:
+        """Xóa bucket rollup quá retention (mỗi chu kỳ, xóa theo index bucket_start)"""
+        db = self.session_factory()
+        try:
+            deleted = metric_rollups.prune(db)
+            self._count("rollups_pruned", sum(deleted.values()))
+        except Exception as e:
+            db.rollback()
+            print(f"Warning: could not prune metric rollups: {e}")
+        finally:
+            db.close()
+
+    def _run_retention(self) -> None:
+        """Dọn mẫu thô quá hạn (tối đa một lần mỗi interval của job, xóa theo lô)"""
+        if self.retention is None:
+            return
+        try:
+            report = self.retention.maybe_run()
+            if report and report["rows_reclaimed"]:
+                print(f"Metrics retention: reclaimed {report['rows_reclaimed']} rows in {report['batches']} batches")
+        except Exception as e:
+            print(f"Warning: metrics retention failed: {e}")
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["running"] = self.running
+        stats["interval_s"] = self.interval
+        if self.retention is not None:
+            stats["retention"] = self.retention.stats()
+        return stats
+
+
+# Collector dùng chung toàn process (start ở startup của app)
+metrics_collector = MetricsCollector(
+    interval=float(os.getenv("METRICS_COLLECT_INTERVAL", "60")),
+    jitter=float(os.getenv("METRICS_COLLECT_JITTER", "0.1")),
+    batch_size=int(os.getenv("METRICS_COLLECT_BATCH_SIZE", "500")),
+    retention=metrics_retention
+)
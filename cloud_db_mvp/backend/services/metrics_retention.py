@@ -0,0 +1,213 @@
+"""
+metrics_retention.py - Xóa mẫu thô performance_metrics quá hạn
+- Retention theo metric_type (METRICS_RAW_RETENTION_BY_TYPE="CONNECTIONS=24,QUERIES=72", đơn vị giờ),
+  type không cấu hình dùng METRICS_RAW_RETENTION_HOURS
+- Xóa theo lô nhỏ theo thứ tự id (primary key), commit từng lô + nghỉ giữa các lô:
+  không giữ lock lâu trên metadata DB; mỗi lần chạy có giới hạn số lô, phần còn lại để lần sau
+- Metadata DB là MySQL và bảng đã partition theo ngày: DROP PARTITION cho ngày đã quá retention
+  dài nhất (O(1), không quét dòng) + tạo trước partition cho vài ngày tới
+  Bảng cần được partition một lần thủ công (InnoDB partition không hỗ trợ foreign key):
+    ALTER TABLE performance_metrics DROP FOREIGN KEY <fk>, DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp),
+      PARTITION BY RANGE (TO_DAYS(timestamp)) (PARTITION pmax VALUES LESS THAN MAXVALUE);
+- Báo cáo mỗi lần chạy: số dòng đã xóa theo type, số lô, partition đã drop
+"""
+
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import MetricType, PerformanceMetric
+
+MAXVALUE = "MAXVALUE"
+
+
+def parse_retention_overrides(value: str) -> Dict[str, float]:
+    """"CONNECTIONS=24,QUERIES=72" -> {"CONNECTIONS": 24.0, "QUERIES": 72.0} (giờ)"""
+    overrides = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, _, hours = item.partition("=")
+        try:
+            overrides[name.strip().upper()] = float(hours)
+        except ValueError:
+            raise ValueError(f"Invalid metrics retention entry: {item.strip()!r}")
+    return overrides
+
+
+def to_days(day: date) -> int:
+    """Giống TO_DAYS() của MySQL"""
+    return day.toordinal() + 365
+
+
+def expired_partitions(partitions: List[Tuple[str, str]], cutoff: datetime) -> List[str]:
+    """
+    partitions: (PARTITION_NAME, PARTITION_DESCRIPTION) của RANGE (TO_DAYS(timestamp))
+    Partition drop được khi mọi dòng của nó cũ hơn cutoff (VALUES LESS THAN <= TO_DAYS(ngày cutoff))
+    Không bao giờ drop partition MAXVALUE
+    """
+    limit = to_days(cutoff.date())
+    return [name for name, bound in partitions if bound != MAXVALUE and int(bound) <= limit]
+
+
+def missing_partitions(partitions: List[Tuple[str, str]], today: date, days_ahead: int) -> List[Tuple[str, int]]:
+    """Partition theo ngày còn thiếu từ hôm nay tới days_ahead ngày tới: [(tên, VALUES LESS THAN)]"""
+    bounds = {int(bound) for _, bound in partitions if bound != MAXVALUE}
+    missing = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        bound = to_days(day + timedelta(days=1))
+        if bound not in bounds and (not bounds or bound > max(bounds)):
+            missing.append((f"p{day:%Y%m%d}", bound))
+    return missing
+
+
+class MetricsRetentionJob:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        default_hours: float = 168.0,
+        overrides: Optional[Dict[str, float]] = None,
+        batch_size: int = 1000,
+        max_batches: int = 200,
+        pause: float = 0.05,
+        interval: float = 3600.0,
+        partition_days_ahead: int = 3
+    ):
+        self.session_factory = session_factory
+        self.default_hours = default_hours
+        self.overrides = overrides or {}
+        self.batch_size = max(1, batch_size)
+        self.max_batches = max(1, max_batches)  # Giới hạn mỗi lần chạy
+        self.pause = pause  # Giây nghỉ giữa các lô: nhường lock cho collector / API
+        self.interval = interval  # maybe_run() chạy tối đa một lần mỗi interval giây
+        self.partition_days_ahead = partition_days_ahead
+        self._lock = threading.Lock()
+        self._last_run_at: Optional[float] = None
+        self._last_report: Optional[Dict[str, Any]] = None
+        self._total_deleted = 0
+
+    def retention_for(self, metric_type: str) -> timedelta:
+        return timedelta(hours=self.overrides.get(metric_type, self.default_hours))
+
+    def maybe_run(self) -> Optional[Dict[str, Any]]:
+        """Chạy nếu đã quá interval kể từ lần trước (collector gọi sau mỗi chu kỳ)"""
+        with self._lock:
+            if self._last_run_at is not None and time.monotonic() - self._last_run_at < self.interval:
+                return None
+            self._last_run_at = time.monotonic()
+        return self.run_once()
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Một lượt dọn dẹp; Returns: báo cáo (rows đã xóa theo type, số lô, partition đã drop)"""
+        now = now or datetime.now()
+        start = time.monotonic()
+        report: Dict[str, Any] = {"deleted": {}, "batches": 0, "partitions_dropped": [], "partitions_added": [], "finished": True}
+
+        db = self.session_factory()
+        try:
+            if db.get_bind().dialect.name == "mysql":
+                longest = max([self.default_hours, *self.overrides.values()])
+                dropped, added = self._manage_partitions(db, now - timedelta(hours=longest), now.date())
+                report["partitions_dropped"], report["partitions_added"] = dropped, added
+
+            known = list(dict.fromkeys([t.value for t in MetricType] + list(self.overrides)))
+            for metric_type in known + [None]:
+                # None: metric_type lạ không có trong enum / cấu hình -> retention mặc định
+                deleted, finished = self._delete_expired(db, metric_type, known, now, report)
+                if deleted:
+                    report["deleted"][metric_type or "OTHER"] = deleted
+                if not finished:
+                    report["finished"] = False
+                    break
+        finally:
+            db.close()
+
+        report["rows_reclaimed"] = sum(report["deleted"].values())
+        report["duration_ms"] = round((time.monotonic() - start) * 1000, 2)
+        report["ran_at"] = now.isoformat()
+        with self._lock:
+            self._last_report = report
+            self._total_deleted += report["rows_reclaimed"]
+        return report
+
+    def _delete_expired(self, db: Session, metric_type: Optional[str], known: List[str], now: datetime,
+                        report: Dict[str, Any]) -> Tuple[int, bool]:
+        """Xóa theo lô id tăng dần; Returns: (số dòng đã xóa, True nếu đã hết dòng quá hạn)"""
+        cutoff = now - self.retention_for(metric_type or "")
+        if metric_type is None:
+            type_filter = PerformanceMetric.metric_type.notin_(known)
+        else:
+            type_filter = PerformanceMetric.metric_type == metric_type
+        deleted = 0
+        while True:
+            if report["batches"] >= self.max_batches:
+                return deleted, False
+            ids = [row[0] for row in db.query(PerformanceMetric.id).filter(
+                type_filter,
+                PerformanceMetric.timestamp < cutoff
+            ).order_by(PerformanceMetric.id.asc()).limit(self.batch_size)]
+            if not ids:
+                return deleted, True
+            deleted += db.query(PerformanceMetric).filter(
+                PerformanceMetric.id.in_(ids)
+            ).delete(synchronize_session=False)
+            db.commit()
+            report["batches"] += 1
+            if len(ids) < self.batch_size:
+                return deleted, True
+            if self.pause:
+                time.sleep(self.pause)
+
+    def _manage_partitions(self, db: Session, cutoff: datetime, today: date) -> Tuple[List[str], List[str]]:
+        """DROP partition quá hạn + tạo trước partition ngày tới; bảng chưa partition -> không làm gì"""
+        partitions = [
+            (name, description) for name, description in db.execute(text("""
+                SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+                FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'performance_metrics'
+                  AND PARTITION_NAME IS NOT NULL
+                ORDER BY PARTITION_ORDINAL_POSITION
+            """)).all()
+        ]
+        if not partitions:
+            return [], []
+
+        dropped = expired_partitions(partitions, cutoff)
+        if dropped:
+            db.execute(text(f"ALTER TABLE performance_metrics DROP PARTITION {', '.join(dropped)}"))
+
+        added = missing_partitions(partitions, today, self.partition_days_ahead)
+        if added and partitions[-1][1] == MAXVALUE:
+            definitions = ", ".join(f"PARTITION {name} VALUES LESS THAN ({bound})" for name, bound in added)
+            db.execute(text(
+                f"ALTER TABLE performance_metrics REORGANIZE PARTITION {partitions[-1][0]} INTO "
+                f"({definitions}, PARTITION {partitions[-1][0]} VALUES LESS THAN MAXVALUE)"
+            ))
+        else:
+            added = []
+        return dropped, [name for name, _ in added]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "default_retention_hours": self.default_hours,
+                "retention_hours_by_type": dict(self.overrides),
+                "total_rows_reclaimed": self._total_deleted,
+                "last_run": self._last_report,
+            }
+
+
+# Job dùng chung toàn process (MetricsCollector gọi maybe_run sau mỗi chu kỳ)
+metrics_retention = MetricsRetentionJob(
+    default_hours=float(os.getenv("METRICS_RAW_RETENTION_HOURS", "168")),
+    overrides=parse_retention_overrides(os.getenv("METRICS_RAW_RETENTION_BY_TYPE", "")),
+    batch_size=int(os.getenv("METRICS_RETENTION_BATCH_SIZE", "1000")),
+    max_batches=int(os.getenv("METRICS_RETENTION_MAX_BATCHES", "200")),
+    pause=float(os.getenv("METRICS_RETENTION_PAUSE_MS", "50")) / 1000,
+    interval=float(os.getenv("METRICS_RETENTION_INTERVAL", "3600"))
+)
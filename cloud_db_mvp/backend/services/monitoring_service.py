@@ -11,18 +11,23 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
-from models import Database, PerformanceMetric, SlowQuery, MetricType
+from models import Database, PerformanceMetric, MetricCounter, SlowQuery, MetricType
 from services.mysql_service import MySQLService
+from services.fleet_sampler import fleet_sampler, counter_rates, COUNTER_FIELDS
+from services import metric_rollups
 import json
 
 class MonitoringService:
     def __init__(self):
         self.mysql_service = MySQLService()
+        self.fleet_sampler = fleet_sampler
     
     def get_metrics(self, db: Session, database_id: int, timeframe: str = "1h") -> Dict:
         """
         Lấy performance metrics theo timeframe
-        timeframe: "1h", "24h", "7d", "30d"
+        timeframe: "1h", "6h", "24h", "7d", "30d"
+        Chỉ đọc dữ liệu đã lưu (MetricsCollector ghi định kỳ); database chưa có mẫu -> các list rỗng
+        1h đọc mẫu thô, timeframe dài hơn đọc bảng rollup (services/metric_rollups.py)
         """
         # Parse timeframe
         timeframe_map = {
@@ -36,136 +41,52 @@ class MonitoringService:
         if timeframe not in timeframe_map:
             timeframe = "1h"
         
-        since = datetime.now() - timeframe_map[timeframe]
+        window = timeframe_map[timeframe]
+        since = datetime.now() - window
+        resolution = metric_rollups.resolution_for(window)
         
-        # Query metrics từ database
-        metrics_query = db.query(PerformanceMetric).filter(
-            and_(
-                PerformanceMetric.database_id == database_id,
-                PerformanceMetric.timestamp >= since
-            )
-        ).order_by(PerformanceMetric.timestamp.asc())
-        
-        # Group by metric_type
-        # QUERIES metric giờ lưu QPS (Queries Per Second) thay vì total queries
+        # QUERIES / RESPONSE_TIME / THROUGHPUT là tốc độ theo schema (xem collect_fleet_metrics)
         metrics_dict = {
             "CPU": [],
             "MEMORY": [],
             "CONNECTIONS": [],
-            "QUERIES": [],  # Giờ là QPS, không phải total queries
+            "QUERIES": [],
             "RESPONSE_TIME": [],
             "THROUGHPUT": []
         }
         
-        for metric in metrics_query.all():
-            metric_type = metric.metric_type
-            if metric_type in metrics_dict:
-                # QUERIES metric giờ là QPS (queries per second)
-                metrics_dict[metric_type].append({
-                    "value": float(metric.value),
-                    "timestamp": metric.timestamp.isoformat() if metric.timestamp else None
-                })
-        
-        # Nếu không có historical data, lấy real-time metrics và tạo sample data
-        has_data = any(len(v) > 0 for v in metrics_dict.values())
-        if not has_data:
-            # Luôn đảm bảo có data bằng cách lấy từ MySQL trực tiếp
-            database = db.query(Database).filter(Database.id == database_id).first()
-            if database and database.status == "ACTIVE":
-                physical_db_name = database.physical_db_name or f"db_{database.id}"
-                now = datetime.now()
-                try:
-                    conn = self.mysql_service.connect()
-                    cur = conn.cursor()
-                    
-                    # Get connections
-                    cur.execute("""
-                        SELECT COUNT(*) as active_connections
-                        FROM information_schema.PROCESSLIST
-                        WHERE DB = %s AND COMMAND != 'Sleep'
-                    """, (physical_db_name,))
-                    conn_result = cur.fetchone()
-                    active_conn = conn_result[0] if conn_result else 0
-                    
-                    # Get storage
-                    cur.execute("""
-                        SELECT 
-                            ROUND(SUM(data_length + index_length) / 1024 / 1024, 2) AS size_mb
-                        FROM information_schema.tables
-                        WHERE table_schema = %s
-                    """, (physical_db_name,))
-                    storage_result = cur.fetchone()
-                    storage_mb = float(storage_result[0]) if storage_result and storage_result[0] else 0.0
-                    
-                    # Tính QPS từ total queries (nếu có stored metrics trước đó)
-                    cur.execute("""
-                        SELECT VARIABLE_VALUE
-                        FROM performance_schema.global_status
-                        WHERE VARIABLE_NAME = 'Questions'
-                    """)
-                    query_result = cur.fetchone()
-                    current_total_queries = int(query_result[0]) if query_result else 0
-                    
-                    cur.close()
-                    conn.close()
-                    
-                    # Tính QPS từ stored metrics (nếu có)
-                    qps_value = 0.0
-                    since_5min = now - timedelta(minutes=5)
-                    last_query_metric = db.query(PerformanceMetric).filter(
-                        and_(
-                            PerformanceMetric.database_id == database_id,
-                            PerformanceMetric.metric_type == "QUERIES",
-                            PerformanceMetric.timestamp >= since_5min
-                        )
-                    ).order_by(PerformanceMetric.timestamp.desc()).first()
-                    
-                    if last_query_metric:
-                        # Tìm total queries metric gần nhất để tính QPS
-                        # Tạm thời dùng giá trị stored QUERIES (có thể là QPS hoặc total)
-                        # Nếu là QPS thì dùng luôn, nếu là total thì tính
-                        previous_value = float(last_query_metric.value)
-                        time_diff = (now - last_query_metric.timestamp).total_seconds()
-                        if time_diff > 0 and previous_value < 1000000:  # Nếu giá trị nhỏ, có thể là QPS
-                            # Giả sử đây là total queries, tính QPS
-                            qps_value = (current_total_queries - previous_value) / time_diff
-                        elif previous_value < 1000:  # Nếu giá trị nhỏ, có thể là QPS rồi
-                            qps_value = previous_value
-                    
-                    # Tạo data points (luôn có ít nhất 1 data point)
-                    metrics_dict["CONNECTIONS"].append({
-                        "value": float(active_conn),
-                        "timestamp": now.isoformat()
-                    })
-                    metrics_dict["MEMORY"].append({
-                        "value": storage_mb,
-                        "timestamp": now.isoformat()
-                    })
-                    metrics_dict["QUERIES"].append({
-                        "value": qps_value,  # Giờ là QPS, không phải total queries
-                        "timestamp": now.isoformat()
-                    })
-                    
-                    print(f"Created real-time metrics for database {database_id}: CONNECTIONS={active_conn}, MEMORY={storage_mb}MB, QPS={qps_value:.2f}")
-                except Exception as e:
-                    print(f"Warning: Could not get real-time values from MySQL for database {database_id}: {e}")
-                    # Nếu không lấy được, vẫn tạo default data points
-                    metrics_dict["CONNECTIONS"].append({
-                        "value": 0.0,
-                        "timestamp": now.isoformat()
-                    })
-                    metrics_dict["MEMORY"].append({
-                        "value": 0.0,
-                        "timestamp": now.isoformat()
+        if resolution is None:
+            # Timeframe ngắn: mẫu thô (chỉ lấy cột cần thiết, không load ORM object)
+            rows = db.query(
+                PerformanceMetric.metric_type, PerformanceMetric.value, PerformanceMetric.timestamp
+            ).filter(
+                and_(
+                    PerformanceMetric.database_id == database_id,
+                    PerformanceMetric.timestamp >= since
+                )
+            ).order_by(PerformanceMetric.timestamp.asc())
+            for metric_type, value, timestamp in rows:
+                if metric_type in metrics_dict:
+                    metrics_dict[metric_type].append({
+                        "value": float(value),
+                        "timestamp": timestamp.isoformat() if timestamp else None
                     })
-                    metrics_dict["QUERIES"].append({
-                        "value": 0.0,  # QPS = 0 nếu không có data
-                        "timestamp": now.isoformat()
+        else:
+            # Timeframe dài: mỗi điểm là một bucket rollup (avg, kèm min / max / count)
+            for metric_type, start, count, total, low, high in metric_rollups.read(db, database_id, resolution, since):
+                if metric_type in metrics_dict:
+                    metrics_dict[metric_type].append({
+                        "value": round(total / count, 2) if count else 0.0,
+                        "min": low,
+                        "max": high,
+                        "count": count,
+                        "timestamp": start.isoformat()
                     })
         
         return {
             "database_id": database_id,
             "timeframe": timeframe,
+            "resolution": resolution or "raw",
             "metrics": metrics_dict
         }
     
@@ -183,67 +104,40 @@ class MonitoringService:
         physical_db_name = database.physical_db_name or f"db_{database.id}"
         
         try:
-            conn = self.mysql_service.connect()
-            cur = conn.cursor()
-            
-            metrics = {}
-            
-            # 1. Active Connections
-            cur.execute("""
-                SELECT COUNT(*) as active_connections
-                FROM information_schema.PROCESSLIST
-                WHERE DB = %s AND COMMAND != 'Sleep'
-            """, (physical_db_name,))
-            result = cur.fetchone()
-            metrics["connections"] = {
-                "active": result[0] if result else 0,
-                "max": self._get_max_connections(cur)
-            }
-            
-            # 2. Queries per second (from last minute)
-            cur.execute("""
-                SELECT 
-                    VARIABLE_VALUE as qps
-                FROM performance_schema.global_status
-                WHERE VARIABLE_NAME = 'Questions'
-            """)
-            result = cur.fetchone()
-            # Questions là tổng số queries từ khi MySQL start
-            # Để tính QPS, cần lưu giá trị trước đó và so sánh
-            # Tạm thời return giá trị hiện tại
-            metrics["queries"] = {
-                "total": int(result[0]) if result else 0,
-                "per_second": 0  # Sẽ tính từ stored metrics
-            }
+            # Cùng bộ query với lượt lấy mẫu của collector, chỉ cho một schema
+            fleet = self.fleet_sampler.sample(
+                [physical_db_name], {physical_db_name: database.db_username or f"user_{database.id}"}
+            )
+            sample = fleet["schemas"][physical_db_name]
             
-            # 3. Average response time (từ performance_schema)
-            # MySQL không có built-in avg response time, cần tính từ slow query log hoặc events_statements_summary
-            metrics["response_time"] = {
-                "avg_ms": 0,  # Sẽ tính từ stored metrics
-                "min_ms": 0,
-                "max_ms": 0
-            }
+            # Tốc độ cần hai snapshot counter -> lấy mẫu gần nhất collector đã lưu
+            latest = self._latest_values(db, database_id, [MetricType.QUERIES.value, MetricType.RESPONSE_TIME.value])
             
-            # 4. Database size
-            cur.execute("""
-                SELECT 
-                    ROUND(SUM(data_length + index_length) / 1024 / 1024, 2) AS size_mb
-                FROM information_schema.tables
-                WHERE table_schema = %s
-            """, (physical_db_name,))
-            result = cur.fetchone()
-            metrics["storage"] = {
-                "size_mb": float(result[0]) if result and result[0] else 0.0
+            metrics = {
+                "connections": {
+                    "active": sample["connections"],
+                    "max": fleet["host"]["max_connections"]
+                },
+                # total: số statement SQL của user database từ khi MySQL start (không tính PREPARE / SET của platform)
+                "queries": {
+                    "total": sample["counters"]["statements"] if sample["counters"] else 0,
+                    "per_second": latest.get(MetricType.QUERIES.value, 0.0)
+                },
+                "response_time": {
+                    "avg_ms": latest.get(MetricType.RESPONSE_TIME.value, 0.0),
+                    "min_ms": 0,
+                    "max_ms": 0
+                },
+                "storage": {
+                    "size_mb": sample["storage_mb"]
+                }
             }
             
-            cur.close()
-            conn.close()
-            
             # Format theo MetricsResponse schema + format cho frontend
             now = datetime.now()
             storage_size = metrics.get("storage", {}).get("size_mb", 0.0)
             active_conn = metrics.get("connections", {}).get("active", 0)
-            total_queries = metrics.get("queries", {}).get("total", 0)
+            qps = metrics.get("queries", {}).get("per_second", 0.0)
             
             return {
                 "database_id": database_id,
@@ -252,7 +146,7 @@ class MonitoringService:
                     "CPU": [],
                     "MEMORY": [{"value": storage_size, "timestamp": now.isoformat()}] if storage_size is not None else [],
                     "CONNECTIONS": [{"value": float(active_conn), "timestamp": now.isoformat()}] if active_conn is not None else [],
-                    "QUERIES": [{"value": float(total_queries), "timestamp": now.isoformat()}] if total_queries is not None else [],
+                    "QUERIES": [{"value": float(qps), "timestamp": now.isoformat()}],
                     "RESPONSE_TIME": [],
                     "THROUGHPUT": []
                 },
@@ -350,6 +244,7 @@ class MonitoringService:
                 "duration_ms": float(sq.duration_ms),
                 "rows_examined": sq.rows_examined,
                 "rows_sent": sq.rows_sent,
+                "explain_plan": json.loads(sq.explain_plan) if sq.explain_plan else None,
                 "timestamp": sq.timestamp.isoformat() if sq.timestamp else None
             })
         
@@ -382,51 +277,20 @@ class MonitoringService:
                 "slow_queries_count": 0
             }
         
-        # Calculate QPS từ stored metrics (last 1 minute)
+        # QPS / response time: trung bình các mẫu collector đã lưu trong 1 phút gần nhất
+        # (giá trị lưu đã là tốc độ theo schema, không phải counter tích lũy)
         since = datetime.now() - timedelta(minutes=1)
-        query_metrics = db.query(PerformanceMetric).filter(
-            and_(
-                PerformanceMetric.database_id == database_id,
-                PerformanceMetric.metric_type == "QUERIES",
-                PerformanceMetric.timestamp >= since
-            )
-        ).all()
-        
-        qps = 0.0
-        if query_metrics and len(query_metrics) > 1:
-            # Tính QPS từ sự khác biệt giữa metrics
-            values = [float(m.value) for m in query_metrics]
-            if len(values) >= 2:
-                diff = values[-1] - values[0]
-                time_diff = (query_metrics[-1].timestamp - query_metrics[0].timestamp).total_seconds()
-                if time_diff > 0:
-                    qps = diff / time_diff
-        elif query_metrics:
-            # Nếu chỉ có 1 metric, dùng giá trị hiện tại
-            qps = float(query_metrics[0].value) / 60.0
-        
-        # Nếu không có stored metrics, tính từ real-time
-        if qps == 0.0:
-            # Thử lấy từ format mới trước (queries ở top level)
-            if "queries" in real_time:
-                qps = real_time["queries"].get("per_second", 0.0)
-            elif "metrics" in real_time:
-                queries_info = real_time["metrics"].get("queries", {})
-                # Estimate QPS từ total queries (rất rough estimate)
-                qps = queries_info.get("per_second", 0.0)
-        
-        # Calculate avg response time từ stored metrics
-        response_time_metrics = db.query(PerformanceMetric).filter(
-            and_(
-                PerformanceMetric.database_id == database_id,
-                PerformanceMetric.metric_type == "RESPONSE_TIME",
-                PerformanceMetric.timestamp >= since
-            )
-        ).all()
-        
-        avg_response_time_ms = 0.0
-        if response_time_metrics:
-            avg_response_time_ms = sum(float(m.value) for m in response_time_metrics) / len(response_time_metrics)
+        averages = dict(
+            db.query(PerformanceMetric.metric_type, func.avg(PerformanceMetric.value)).filter(
+                and_(
+                    PerformanceMetric.database_id == database_id,
+                    PerformanceMetric.metric_type.in_([MetricType.QUERIES.value, MetricType.RESPONSE_TIME.value]),
+                    PerformanceMetric.timestamp >= since
+                )
+            ).group_by(PerformanceMetric.metric_type).all()
+        )
+        qps = float(averages.get(MetricType.QUERIES.value) or real_time["queries"].get("per_second", 0.0))
+        avg_response_time_ms = float(averages.get(MetricType.RESPONSE_TIME.value) or 0.0)
         
         # Count slow queries (last 24h)
         since_24h = datetime.now() - timedelta(hours=24)
@@ -479,140 +343,15 @@ class MonitoringService:
             "slow_queries_count": slow_queries_count
         }
     
-    def collect_metrics(self, db: Session, database_id: int) -> None:
+    def collect_metrics(self, db: Session, database_id: int) -> bool:
         """
         Collect và lưu metrics vào database
-        Chạy định kỳ (mỗi 1 phút) để collect metrics
         Luôn đảm bảo có ít nhất 1 metric được lưu để hiển thị
+        Returns: False nếu không lấy được metrics từ MySQL (đã lưu giá trị mặc định)
         """
         try:
-            real_time = self.get_real_time_metrics(db, database_id)
-            now = datetime.now()
-            metrics_added = 0
-            
-            # Lưu connections metric (luôn có, ít nhất là 0)
-            connections_data = real_time["metrics"].get("CONNECTIONS", [])
-            if connections_data and len(connections_data) > 0:
-                conn_value = connections_data[-1].get("value", 0)
-            else:
-                conn_value = 0
-            
-            metric = PerformanceMetric(
-                database_id=database_id,
-                metric_type=MetricType.CONNECTIONS.value,
-                value=conn_value,
-                timestamp=now
-            )
-            db.add(metric)
-            metrics_added += 1
-            
-            # Tính QPS (Queries Per Second) từ total queries
-            # Lấy total queries hiện tại từ MySQL
-            try:
-                conn = self.mysql_service.connect()
-                cur = conn.cursor()
-                cur.execute("""
-                    SELECT VARIABLE_VALUE
-                    FROM performance_schema.global_status
-                    WHERE VARIABLE_NAME = 'Questions'
-                """)
-                result = cur.fetchone()
-                current_total_queries = int(result[0]) if result else 0
-                cur.close()
-                conn.close()
-            except Exception as e:
-                print(f"Warning: Could not get total queries from MySQL: {e}")
-                current_total_queries = 0
-            
-            # Tìm stored QUERIES metric gần nhất để lấy total queries trước đó
-            # Lưu ý: Stored QUERIES metrics giờ là QPS, nhưng để tính QPS lần đầu,
-            # ta cần lưu total queries vào một nơi khác hoặc tính từ MySQL
-            # Tạm thời: Lấy total queries từ real-time metrics (nếu có)
-            qps_value = 0.0
-            
-            # Tìm metric QUERIES gần nhất (trong 5 phút) để tính QPS
-            since_5min = now - timedelta(minutes=5)
-            last_query_metric = db.query(PerformanceMetric).filter(
-                and_(
-                    PerformanceMetric.database_id == database_id,
-                    PerformanceMetric.metric_type == "QUERIES",
-                    PerformanceMetric.timestamp >= since_5min
-                )
-            ).order_by(PerformanceMetric.timestamp.desc()).first()
-            
-            if last_query_metric:
-                # Nếu stored metric là QPS (giá trị nhỏ < 10000), không thể tính từ đó
-                # Cần lưu total queries riêng hoặc lấy từ MySQL mỗi lần
-                # Tạm thời: Tính QPS từ total queries hiện tại và stored total queries
-                # Nhưng stored metric giờ là QPS rồi, nên không thể dùng
-                # Giải pháp: Lấy total queries từ MySQL và tính QPS từ stored total queries
-                # Nhưng không có stored total queries, nên tính QPS từ stored QPS (smooth average)
-                stored_qps = float(last_query_metric.value)
-                if stored_qps < 10000:  # Nếu là QPS (giá trị nhỏ)
-                    # Dùng stored QPS làm giá trị hiện tại (smooth)
-                    qps_value = stored_qps
-                else:  # Nếu là total queries (giá trị lớn) - backward compatibility
-                    previous_total = stored_qps
-                    time_diff = (now - last_query_metric.timestamp).total_seconds()
-                    if time_diff > 0:
-                        qps_value = (current_total_queries - previous_total) / time_diff
-            
-            # Nếu không có stored metrics hoặc không tính được, tính QPS từ total queries
-            if qps_value == 0.0 and current_total_queries > 0:
-                # Tìm metric QUERIES đầu tiên (có thể là total queries) trong 10 phút
-                since_10min = now - timedelta(minutes=10)
-                first_query_metric = db.query(PerformanceMetric).filter(
-                    and_(
-                        PerformanceMetric.database_id == database_id,
-                        PerformanceMetric.metric_type == "QUERIES",
-                        PerformanceMetric.timestamp >= since_10min
-                    )
-                ).order_by(PerformanceMetric.timestamp.asc()).first()
-                
-                if first_query_metric:
-                    first_value = float(first_query_metric.value)
-                    time_diff = (now - first_query_metric.timestamp).total_seconds()
-                    if time_diff > 0 and first_value > 1000:  # Nếu là total queries
-                        qps_value = (current_total_queries - first_value) / time_diff
-                    elif first_value < 1000:  # Nếu là QPS, dùng luôn
-                        qps_value = first_value
-            
-            # Lưu QPS metric (thay vì QUERIES total)
-            metric = PerformanceMetric(
-                database_id=database_id,
-                metric_type="QUERIES",  # Giữ tên QUERIES nhưng lưu giá trị QPS
-                value=qps_value,
-                timestamp=now
-            )
-            db.add(metric)
-            metrics_added += 1
-            
-            # Vẫn lưu total queries để tính QPS lần sau (backward compatibility)
-            queries_data = real_time["metrics"].get("QUERIES", [])
-            if queries_data and len(queries_data) > 0:
-                total_queries_value = queries_data[-1].get("value", 0)
-                # Lưu total queries với metric_type riêng để tính QPS
-                # Nhưng không hiển thị trong frontend, chỉ dùng để tính QPS
-                # Có thể tạo metric_type mới "TOTAL_QUERIES" nếu cần
-            
-            # Lưu storage/memory metric (luôn có, ít nhất là 0)
-            memory_data = real_time["metrics"].get("MEMORY", [])
-            if memory_data and len(memory_data) > 0:
-                storage_value = memory_data[-1].get("value", 0)
-            else:
-                storage_value = 0.0
-            
-            metric = PerformanceMetric(
-                database_id=database_id,
-                metric_type=MetricType.MEMORY.value,
-                value=storage_value,
-                timestamp=now
-            )
-            db.add(metric)
-            metrics_added += 1
-            
-            db.commit()
-            print(f"Successfully collected {metrics_added} metrics for database {database_id} at {now.isoformat()}")
+            self.collect_fleet_metrics(db, [database_id])
+            return True
             
         except Exception as e:
             import traceback
@@ -635,6 +374,87 @@ class MonitoringService:
             except Exception as e2:
                 print(f"Failed to create default metrics: {e2}")
                 db.rollback()
+            return False
+    
+    def collect_fleet_metrics(self, db: Session, database_ids: List[int]) -> Dict:
+        """
+        Collect và lưu metrics cho nhiều database trong một lượt lấy mẫu (FleetSampler)
+        Được gọi định kỳ bởi MetricsCollector (services/metrics_collector.py), không chạy trong request
+        - CONNECTIONS / MEMORY: giá trị tức thời
+        - QUERIES (QPS), RESPONSE_TIME (ms / statement), THROUGHPUT (rows/s): tính từ counter của lần
+          lấy mẫu trước (MetricCounter); lần đầu hoặc counter bị reset -> chỉ lưu counter, chưa có tốc độ
+        Database không còn ACTIVE bị bỏ qua; lỗi MySQL -> raise, không lưu gì
+        Returns: {"databases", "round_trips", "counter_resets"}
+        """
+        databases = db.query(Database.id, Database.physical_db_name, Database.db_username).filter(
+            Database.id.in_(database_ids),
+            Database.status == "ACTIVE"
+        ).all()
+        if not databases:
+            return {"databases": 0, "round_trips": 0, "counter_resets": 0}
+        
+        schema_by_id = {row.id: row.physical_db_name or f"db_{row.id}" for row in databases}
+        # Counter statement theo user MySQL riêng của database (cùng fallback với executor)
+        accounts = {schema_by_id[row.id]: row.db_username or f"user_{row.id}" for row in databases}
+        fleet = self.fleet_sampler.sample(list(schema_by_id.values()), accounts)
+        now = fleet["taken_at"]
+        previous_counters = {
+            counter.database_id: counter
+            for counter in db.query(MetricCounter).filter(MetricCounter.database_id.in_(list(schema_by_id))).all()
+        }
+        
+        rows = []
+        counter_resets = 0
+        for database_id, schema in schema_by_id.items():
+            sample = fleet["schemas"][schema]
+            values = [
+                (MetricType.CONNECTIONS.value, sample["connections"]),
+                (MetricType.MEMORY.value, sample["storage_mb"]),
+            ]
+            
+            counters = sample["counters"]
+            if counters is not None:
+                previous = previous_counters.get(database_id)
+                if previous is None:
+                    db.add(MetricCounter(database_id=database_id, sampled_at=now, **counters))
+                else:
+                    rates = counter_rates(
+                        {field: getattr(previous, field) for field in COUNTER_FIELDS},
+                        counters,
+                        (now - previous.sampled_at).total_seconds()
+                    )
+                    if rates is None:
+                        counter_resets += 1
+                    else:
+                        values += [
+                            (MetricType.QUERIES.value, rates["qps"]),
+                            (MetricType.RESPONSE_TIME.value, rates["avg_response_ms"]),
+                            (MetricType.THROUGHPUT.value, rates["rows_per_second"]),
+                        ]
+                    for field in COUNTER_FIELDS:
+                        setattr(previous, field, counters[field])
+                    previous.sampled_at = now
+            
+            for metric_type, value in values:
+                rows.append({"database_id": database_id, "metric_type": metric_type, "value": value, "timestamp": now})
+        db.bulk_insert_mappings(PerformanceMetric, rows)
+        metric_rollups.apply(db, rows)
+        db.commit()
+        return {"databases": len(schema_by_id), "round_trips": fleet["round_trips"], "counter_resets": counter_resets}
+    
+    def _latest_values(self, db: Session, database_id: int, metric_types: List[str]) -> Dict[str, float]:
+        """Giá trị mới nhất đã lưu (trong 5 phút) của từng metric_type"""
+        since = datetime.now() - timedelta(minutes=5)
+        latest = {}
+        for metric in db.query(PerformanceMetric).filter(
+            and_(
+                PerformanceMetric.database_id == database_id,
+                PerformanceMetric.metric_type.in_(metric_types),
+                PerformanceMetric.timestamp >= since
+            )
+        ).order_by(PerformanceMetric.timestamp.asc()):
+            latest[metric.metric_type] = float(metric.value)
+        return latest
     
     def _get_max_connections(self, cursor) -> int:
         """Lấy max_connections từ MySQL"""
@@ -2,12 +2,427 @@
 mysql_service.py - Quản lý kết nối MySQL vật lý
 - Tách biệt logic kết nối MySQL khỏi provisioner
 - Dễ mở rộng cho các thao tác DB vật lý khác
+- Connection pool dùng chung toàn process cho admin connections
 """
 
 import os
+import hashlib
+import threading
+import time
+from collections import deque, OrderedDict
 import pymysql
 from pymysql.constants import CLIENT
 
+
+class PoolTimeoutError(Exception):
+    """Hết thời gian chờ lấy connection từ pool"""
+    pass
+
+
+class PooledConnection:
+    """
+    Wrapper quanh một PyMySQL connection được mượn từ pool
+    - close() trả connection về pool thay vì đóng socket
+    - Các attribute/method khác được chuyển tiếp sang connection gốc
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        """Trả connection về pool (gọi nhiều lần vẫn an toàn)"""
+        if self._released:
+            return
+        self._released = True
+        self._pool._checkin(self._raw, self._created_at)
+
+    def invalidate(self):
+        """Đóng hẳn connection (ví dụ khi connection bị lỗi) và giải phóng slot trong pool"""
+        if self._released:
+            return
+        self._released = True
+        self._pool._discard(self._raw)
+
+    def __del__(self):
+        # Caller quên close() (ví dụ exception giữa chừng) -> không trả về pool
+        # vì trạng thái connection không rõ, đóng hẳn để giải phóng slot
+        if self.__dict__.get("_released", True):
+            return
+        try:
+            self.invalidate()
+        except Exception:
+            pass
+
+
+class MySQLConnectionPool:
+    """
+    Bounded, thread-safe pool cho PyMySQL connections
+    - checkout/checkin với giới hạn max_size
+    - pre-ping connection đã idle trước khi trả cho caller
+    - recycle connection quá max_lifetime
+    - thống kê thời gian chờ và số lần timeout
+    """
+
+    def __init__(self, connect_fn, max_size=10, wait_timeout=10.0,
+                 max_lifetime=1800.0, pre_ping_after=5.0, reset_fn=None):
+        self._connect_fn = connect_fn
+        self._reset_fn = reset_fn
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping_after = pre_ping_after
+        self.closed = False
+        self._idle = deque()  # (raw, created_at, last_used_at)
+        self._open = 0  # tổng số connection đang mở (idle + đang mượn)
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+            "discarded": 0,
+            "waits": 0,
+            "wait_time_ms_total": 0.0,
+            "wait_time_ms_max": 0.0,
+            "timeouts": 0,
+        }
+
+    def checkout(self, timeout=None):
+        """Mượn một connection; chờ tối đa `timeout` giây nếu pool đã đầy"""
+        timeout = self.wait_timeout if timeout is None else timeout
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, created_at, last_used = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    # Giữ chỗ trước, tạo connection ngoài lock
+                    self._open += 1
+                    raw = None
+                    break
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {timeout}s waiting for a MySQL connection (pool size {self.max_size})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            self._stats["checkouts"] += 1
+            if waited:
+                wait_ms = (time.monotonic() - start) * 1000
+                self._stats["waits"] += 1
+                self._stats["wait_time_ms_total"] += wait_ms
+                self._stats["wait_time_ms_max"] = max(self._stats["wait_time_ms_max"], wait_ms)
+
+        if raw is not None:
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime:
+                self._close_quietly(raw)
+                self._count("recycled")
+                raw = None
+            elif now - last_used > self.pre_ping_after:
+                try:
+                    raw.ping(reconnect=False)
+                except Exception:
+                    self._close_quietly(raw)
+                    self._count("ping_failures")
+                    raw = None
+            if raw is not None:
+                return PooledConnection(self, raw, created_at)
+
+        # Slot đã được giữ (_open đã tính), tạo connection mới
+        try:
+            raw = self._connect_fn()
+        except Exception:
+            self._release_slot()
+            raise
+        self._count("created")
+        return PooledConnection(self, raw, time.monotonic())
+
+    def _checkin(self, raw, created_at):
+        if not raw.open:
+            self._release_slot()
+            return
+        if self.closed:
+            self._discard(raw)
+            return
+        if self._reset_fn is not None:
+            try:
+                self._reset_fn(raw)
+            except Exception:
+                self._close_quietly(raw)
+                self._count("discarded")
+                self._release_slot()
+                return
+        with self._cond:
+            self._idle.append((raw, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, raw):
+        self._close_quietly(raw)
+        self._count("discarded")
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def _count(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def evict_idle(self, max_idle=None, limit=None):
+        """
+        Đóng connection idle lâu hơn max_idle giây (None = mọi connection idle)
+        limit: số connection tối đa được đóng (ưu tiên connection idle lâu nhất)
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._cond:
+            # deque: đầu trái là connection idle lâu nhất
+            while self._idle and (limit is None or len(evicted) < limit):
+                raw, created_at, last_used = self._idle[0]
+                if max_idle is not None and now - last_used < max_idle:
+                    break
+                self._idle.popleft()
+                evicted.append(raw)
+            self._open -= len(evicted)
+            if evicted:
+                self._cond.notify_all()
+        for raw in evicted:
+            self._close_quietly(raw)
+        return len(evicted)
+
+    def dispose(self):
+        """
+        Đóng pool: đóng tất cả connection idle, connection đang mượn
+        sẽ bị đóng khi được trả về
+        """
+        self.closed = True
+        return self.evict_idle()
+
+    @property
+    def size(self):
+        with self._cond:
+            return self._open
+
+    @property
+    def idle_count(self):
+        with self._cond:
+            return len(self._idle)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._open
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open - len(self._idle)
+            stats["max_size"] = self.max_size
+        checkouts = stats["checkouts"]
+        stats["wait_time_ms_avg"] = round(stats["wait_time_ms_total"] / stats["waits"], 2) if stats["waits"] else 0.0
+        stats["wait_time_ms_total"] = round(stats["wait_time_ms_total"], 2)
+        stats["wait_time_ms_max"] = round(stats["wait_time_ms_max"], 2)
+        stats["reuse_ratio"] = round(1 - stats["created"] / checkouts, 4) if checkouts else 0.0
+        return stats
+
+
+class TenantPoolRegistry:
+    """
+    Cache các pool connection của tenant (user riêng của từng database)
+    - Key: database_id + username + hash(password) -> đổi password sẽ ra pool mới
+    - Đóng connection idle quá idle_timeout
+    - Giới hạn tổng số connection tenant đang mở (LRU: đóng connection idle
+      của pool ít dùng gần đây nhất trước)
+    """
+
+    def __init__(self, connect_fn, max_total=50, max_per_pool=5, idle_timeout=300.0,
+                 wait_timeout=10.0, max_lifetime=1800.0, pre_ping_after=5.0, reset_fn=None):
+        self._connect_fn = connect_fn
+        self._reset_fn = reset_fn
+        self.max_total = max_total
+        self.max_per_pool = max_per_pool
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping_after = pre_ping_after
+        self._pools = OrderedDict()  # key -> MySQLConnectionPool, thứ tự LRU
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+        self._stats = {
+            "pools_created": 0,
+            "idle_evictions": 0,
+            "lru_evictions": 0,
+            "invalidations": 0,
+        }
+        # Counters của các pool đã bị bỏ (để hit rate không bị reset khi invalidate)
+        self._retired = {"checkouts": 0, "created": 0}
+
+    @staticmethod
+    def make_key(database_id, username, password):
+        digest = hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+        return (database_id, username, digest)
+
+    def checkout(self, database_id, username, password, database_name):
+        """Mượn connection của tenant, tạo pool mới nếu chưa có"""
+        key = self.make_key(database_id, username, password)
+        with self._lock:
+            self._sweep_idle()
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = MySQLConnectionPool(
+                    connect_fn=lambda: self._open_tenant_connection(key, username, password, database_name),
+                    max_size=self.max_per_pool,
+                    wait_timeout=self.wait_timeout,
+                    max_lifetime=self.max_lifetime,
+                    pre_ping_after=self.pre_ping_after,
+                    reset_fn=self._reset_fn,
+                )
+                self._pools[key] = pool
+                self._stats["pools_created"] += 1
+            self._pools.move_to_end(key)
+        return pool.checkout()
+
+    def _open_tenant_connection(self, key, username, password, database_name):
+        with self._lock:
+            # pool của key hiện tại đã giữ slot trước khi gọi connect_fn
+            if self._total_open() > self.max_total:
+                self._evict_lru(exclude=key)
+            if self._total_open() > self.max_total:
+                # Trả slot bằng exception - pool sẽ release
+                raise PoolTimeoutError(
+                    f"Too many open tenant connections (limit {self.max_total}). Please retry later."
+                )
+        return self._connect_fn(username, password, database_name)
+
+    def _total_open(self):
+        return sum(pool.size for pool in self._pools.values())
+
+    def _evict_lru(self, exclude=None):
+        """Đóng connection idle từ pool ít dùng gần đây nhất cho tới khi dưới giới hạn"""
+        for key, pool in list(self._pools.items()):
+            if self._total_open() <= self.max_total:
+                break
+            if key == exclude:
+                continue
+            overflow = self._total_open() - self.max_total
+            evicted = pool.evict_idle(limit=overflow)
+            self._stats["lru_evictions"] += evicted
+            if pool.size == 0:
+                self._retire(key)
+
+    def _sweep_idle(self):
+        """Đóng connection idle quá lâu và bỏ các pool rỗng (tối đa 1 lần / giây)"""
+        now = time.monotonic()
+        if now - self._last_sweep < 1.0:
+            return
+        self._last_sweep = now
+        for key, pool in list(self._pools.items()):
+            self._stats["idle_evictions"] += pool.evict_idle(max_idle=self.idle_timeout)
+            if pool.size == 0:
+                self._retire(key)
+
+    def _retire(self, key):
+        pool = self._pools.pop(key, None)
+        if pool is None:
+            return
+        pool_stats = pool.stats()
+        self._retired["checkouts"] += pool_stats["checkouts"]
+        self._retired["created"] += pool_stats["created"]
+        pool.dispose()
+
+    def invalidate(self, database_id):
+        """Bỏ mọi pool của database (gọi khi đổi password / xóa database)"""
+        with self._lock:
+            keys = [key for key in self._pools if key[0] == database_id]
+            for key in keys:
+                self._retire(key)
+            if keys:
+                self._stats["invalidations"] += 1
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._pools):
+                self._retire(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            checkouts = self._retired["checkouts"]
+            created = self._retired["created"]
+            open_conns = idle = 0
+            for pool in self._pools.values():
+                pool_stats = pool.stats()
+                checkouts += pool_stats["checkouts"]
+                created += pool_stats["created"]
+                open_conns += pool_stats["size"]
+                idle += pool_stats["idle"]
+            stats["pools"] = len(self._pools)
+        stats["open_connections"] = open_conns
+        stats["idle_connections"] = idle
+        stats["max_total"] = self.max_total
+        stats["checkouts"] = checkouts
+        stats["hits"] = checkouts - created
+        stats["misses"] = created
+        stats["hit_rate"] = round((checkouts - created) / checkouts, 4) if checkouts else 0.0
+        return stats
+
+
+# Pool admin dùng chung cho mọi MySQLService trong process (Provisioner, MonitoringService, ...)
+_admin_pool = None
+_admin_pool_lock = threading.Lock()
+# Pool connection của tenant (user riêng của từng database), dùng bởi SQLExecutorService
+_tenant_pools = None
+
+
+# COM_RESET_CONNECTION (MySQL >= 5.7.3): PyMySQL chưa có constant / API cho lệnh này
+COM_RESET_CONNECTION = 0x1F
+
+
+def _reset_session(raw):
+    """
+    Reset session trước khi trả connection về pool (không cần reconnect / xác thực lại)
+    - COM_RESET_CONNECTION: rollback, xóa biến session / @vars, TEMPORARY table, LOCK TABLES, GET_LOCK,
+      prepared statement (cả cache tên statement của executor); biến session (sql_mode, charset, autocommit...)
+      về giá trị global
+    - Đặt lại charset + autocommit của connection bằng một statement
+    - Reset không đổi database hiện tại: connection tenant chọn lại database lúc connect (SQL của
+      tenant có thể đã USE schema khác); admin connection không có database mặc định -> caller đã
+      USE database khác phải invalidate() thay vì close()
+    """
+    raw._execute_command(COM_RESET_CONNECTION, b"")
+    raw._read_ok_packet()
+    # Server đã xóa mọi prepared statement -> bỏ cache tên statement của executor gắn trên connection
+    if getattr(raw, "_prepared_statements", None) is not None:
+        raw._prepared_statements.clear()
+        raw._prepared_seq = 0
+    names = f"SET NAMES {raw.charset}" + (f" COLLATE {raw.collation}" if raw.collation else "")
+    raw.query(f"{names}, autocommit={int(raw.autocommit_mode)}")
+    if raw.db:
+        raw.select_db(raw.db)
+
+
 class MySQLService:
     def __init__(self):
         self.host = os.getenv('MYSQL_HOST', 'localhost')
@@ -16,20 +431,85 @@ class MySQLService:
         self.password = os.getenv('MYSQL_ADMIN_PASSWORD', 'admin@123')
         self.conn = None
 
+    @property
+    def pool(self) -> MySQLConnectionPool:
+        """Pool admin dùng chung toàn process (khởi tạo lazy lần đầu)"""
+        global _admin_pool
+        if _admin_pool is None:
+            with _admin_pool_lock:
+                if _admin_pool is None:
+                    _admin_pool = MySQLConnectionPool(
+                        connect_fn=self._open_connection,
+                        max_size=int(os.getenv('MYSQL_ADMIN_POOL_SIZE', '10')),
+                        wait_timeout=float(os.getenv('MYSQL_ADMIN_POOL_TIMEOUT', '10')),
+                        max_lifetime=float(os.getenv('MYSQL_ADMIN_POOL_RECYCLE', '1800')),
+                        pre_ping_after=float(os.getenv('MYSQL_ADMIN_POOL_PRE_PING_AFTER', '5')),
+                        reset_fn=_reset_session,
+                    )
+        return _admin_pool
+
+    @property
+    def tenant_pools(self) -> TenantPoolRegistry:
+        """Registry pool connection tenant dùng chung toàn process"""
+        global _tenant_pools
+        if _tenant_pools is None:
+            with _admin_pool_lock:
+                if _tenant_pools is None:
+                    _tenant_pools = TenantPoolRegistry(
+                        connect_fn=self._open_tenant_connection,
+                        max_total=int(os.getenv('MYSQL_TENANT_POOL_MAX_TOTAL', '50')),
+                        max_per_pool=int(os.getenv('MYSQL_TENANT_POOL_SIZE', '5')),
+                        idle_timeout=float(os.getenv('MYSQL_TENANT_POOL_IDLE_TIMEOUT', '300')),
+                        wait_timeout=float(os.getenv('MYSQL_TENANT_POOL_TIMEOUT', '10')),
+                        max_lifetime=float(os.getenv('MYSQL_TENANT_POOL_RECYCLE', '1800')),
+                        reset_fn=_reset_session,
+                    )
+        return _tenant_pools
+
+    def connect_tenant(self, database_id, username, password, database_name):
+        """
+        Mượn connection bằng user riêng của database (không dùng root/admin)
+        Connection được cache theo database + credentials, conn.close() trả về pool
+        """
+        return self.tenant_pools.checkout(database_id, username, password, database_name)
+
+    def _open_tenant_connection(self, username, password, database_name):
+        """Mở connection mới bằng user của tenant (chỉ TenantPoolRegistry gọi)"""
+        return pymysql.connect(
+            host=self.host,
+            port=self.port,
+            user=username,
+            password=password,
+            database=database_name,
+            client_flag=CLIENT.MULTI_STATEMENTS,
+            autocommit=False,  # Không autocommit để có thể rollback nếu cần
+            connect_timeout=10,
+            ssl={'check_hostname': False} if self.host != 'localhost' else None
+        )
+
     def connect(self):
-        # Đóng connection cũ nếu có (tránh connection stale)
+        """
+        Mượn admin connection từ pool dùng chung
+        Caller vẫn gọi conn.close() như cũ - connection sẽ được trả về pool
+        """
+        # Trả connection cũ về pool nếu caller chưa close
         if self.conn:
             try:
                 self.conn.close()
             except:
                 pass
             self.conn = None
-        
+
+        self.conn = self.pool.checkout()
+        return self.conn
+
+    def _open_connection(self):
+        """Mở một admin connection mới tới MySQL (chỉ pool gọi)"""
         try:
             # PyMySQL không hỗ trợ allow_public_key_retrieval trực tiếp
             # Thay vào đó, thử kết nối với ssl disabled hoặc dùng connection string
             # Hoặc có thể cần thay đổi authentication plugin của MySQL user
-            self.conn = pymysql.connect(
+            return pymysql.connect(
                 host=self.host,
                 port=self.port,
                 user=self.user,
@@ -39,7 +519,6 @@ class MySQLService:
                 connect_timeout=10,  # Timeout 10 giây
                 ssl={'check_hostname': False} if self.host != 'localhost' else None
             )
-            return self.conn
         except Exception as e:
             error_msg = str(e)
             # Nếu vẫn gặp lỗi Public Key Retrieval, thử giải pháp thay thế
@@ -48,7 +527,7 @@ class MySQLService:
                 print("Attempting to fix by changing user authentication method...")
                 # Thử kết nối lại với ssl disabled hoàn toàn
                 try:
-                    self.conn = pymysql.connect(
+                    return pymysql.connect(
                         host=self.host,
                         port=self.port,
                         user=self.user,
@@ -58,7 +537,6 @@ class MySQLService:
                         connect_timeout=10,
                         ssl=None  # Disable SSL completely
                     )
-                    return self.conn
                 except Exception as e2:
                     print(f"ERROR connecting to MySQL (retry failed): {e2}")
                     print(f"Host: {self.host}, Port: {self.port}, User: {self.user}")
@@ -71,6 +549,27 @@ class MySQLService:
                 print(f"Host: {self.host}, Port: {self.port}, User: {self.user}")
                 raise
 
+    def kill_query(self, thread_id: int) -> bool:
+        """
+        KILL QUERY bằng admin connection: chỉ dừng statement đang chạy, connection vẫn dùng được
+        Returns: False nếu KILL lỗi (thường là statement đã xong / connection đã đóng)
+        """
+        conn = self.pool.checkout()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"KILL QUERY {int(thread_id)}")
+            cur.close()
+            return True
+        except pymysql.err.MySQLError as e:
+            print(f"Warning: KILL QUERY {thread_id} failed: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def pool_stats(self):
+        """Thống kê admin pool (checkouts, wait time, timeouts, ...)"""
+        return self.pool.stats()
+
     def close(self):
         if self.conn:
             self.conn.close()
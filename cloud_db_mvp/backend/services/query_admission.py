@@ -0,0 +1,243 @@
+"""
+query_admission.py - Admission control cho query của tenant
+- Mỗi database tối đa N statement chạy đồng thời, toàn process tối đa M
+- Vượt giới hạn -> xếp hàng FIFO (có timeout); hàng đợi đầy / hết timeout -> QueryAdmissionError (429 + Retry-After)
+- Slot trống được trao cho request chờ lâu nhất mà database của nó còn slot
+  -> một tenant bắn nhiều request song song không chặn được tenant khác
+- API HTTP / WebSocket chờ slot trong event loop (acquire_async) rồi mới chuyển sang threadpool:
+  request đang xếp hàng không giữ thread của AnyIO (mặc định 40) -> login và các API khác không bị nghẽn
+- acquire() (chờ blocking) chỉ dùng cho thread nền (query job) và caller không có event loop
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+
+class QueryAdmissionError(Exception):
+    """Không được nhận vào chạy (hàng đợi đầy hoặc chờ quá lâu); retry_after: số giây nên thử lại"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Một slot đã được cấp; release() đúng một lần khi statement xong"""
+
+    def __init__(self, controller: "QueryAdmission", database_id: int):
+        self.controller = controller
+        self.database_id = database_id
+        self.wait_ms = 0.0
+        self.admitted_at = 0.0
+        self.released = False
+
+    def release(self) -> None:
+        self.controller._release(self)
+
+
+class _Waiter:
+    """Request đang xếp hàng; admitted đổi dưới lock, event / future chỉ để đánh thức"""
+
+    def __init__(self, ticket: AdmissionTicket, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.ticket = ticket
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self.admitted = False
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            # _dispatch có thể chạy trên thread của threadpool (release) -> báo về event loop
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class QueryAdmission:
+    def __init__(
+        self,
+        per_database: int = 4,
+        global_limit: int = 16,
+        queue_per_database: int = 8,
+        queue_global: int = 16,
+        queue_timeout: float = 10.0
+    ):
+        self.per_database = per_database
+        self.global_limit = global_limit
+        self.queue_per_database = queue_per_database
+        self.queue_global = queue_global
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._waiters: Deque[_Waiter] = deque()
+        self._active: Dict[int, int] = {}
+        self._active_total = 0
+        self._stats: Dict[int, Dict[str, float]] = {}
+        # Thời gian giữ slot trung bình (EWMA, giây) theo database -> ước lượng Retry-After
+        self._hold_ewma: Dict[int, float] = {}
+
+    def acquire(self, database_id: int, timeout: Optional[float] = None) -> AdmissionTicket:
+        """Chờ tới khi có slot (tối đa timeout giây, blocking thread hiện tại); raise QueryAdmissionError nếu không được nhận"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+        waiter = self._enqueue(database_id, None)
+        if not waiter.admitted:
+            waiter.event.wait(timeout)
+            self._give_up_if_waiting(waiter, timeout)
+        return self._admitted(waiter.ticket, start)
+
+    async def acquire_async(self, database_id: int, timeout: Optional[float] = None) -> AdmissionTicket:
+        """Như acquire() nhưng chờ trong event loop, không chiếm thread nào khi xếp hàng"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.monotonic()
+        waiter = self._enqueue(database_id, asyncio.get_running_loop())
+        if not waiter.admitted:
+            try:
+                await asyncio.wait_for(waiter.future, timeout)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                # Task bị cancel khi đang chờ: rời hàng đợi hoặc trả slot vừa được cấp
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                if waiter.admitted:
+                    waiter.ticket.release()
+                raise
+            self._give_up_if_waiting(waiter, timeout)
+        return self._admitted(waiter.ticket, start)
+
+    def _enqueue(self, database_id: int, loop: Optional[asyncio.AbstractEventLoop]) -> _Waiter:
+        """Vào hàng đợi và thử cấp slot ngay; hàng đợi đầy -> QueryAdmissionError"""
+        waiter = _Waiter(AdmissionTicket(self, database_id), loop)
+        with self._lock:
+            stats = self._db_stats(database_id)
+            queued = self._queued(database_id)
+            total_queued = len(self._waiters)
+            self._waiters.append(waiter)
+            self._dispatch()
+            if not waiter.admitted:
+                if queued >= self.queue_per_database or total_queued >= self.queue_global:
+                    self._waiters.remove(waiter)
+                    stats["rejected"] += 1
+                    raise QueryAdmissionError(
+                        f"Too many concurrent queries for database {database_id} "
+                        f"({self._active.get(database_id, 0)} running, {queued} queued)",
+                        self._retry_after(database_id, queued)
+                    )
+                stats["queued_total"] += 1
+        return waiter
+
+    def _give_up_if_waiting(self, waiter: _Waiter, timeout: float) -> None:
+        """Hết thời gian chờ: rời hàng đợi (release có thể vừa cấp slot -> kiểm tra dưới lock)"""
+        database_id = waiter.ticket.database_id
+        with self._lock:
+            if not waiter.admitted:
+                self._waiters.remove(waiter)
+                stats = self._db_stats(database_id)
+                stats["timeouts"] += 1
+                stats["rejected"] += 1
+                raise QueryAdmissionError(
+                    f"Timed out after {timeout:g}s waiting for a query slot on database {database_id}",
+                    self._retry_after(database_id, self._queued(database_id))
+                )
+
+    def _admitted(self, ticket: AdmissionTicket, start: float) -> AdmissionTicket:
+        ticket.wait_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            stats = self._db_stats(ticket.database_id)
+            stats["wait_ms_total"] += ticket.wait_ms
+            stats["max_wait_ms"] = max(stats["max_wait_ms"], ticket.wait_ms)
+        return ticket
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._active[ticket.database_id] -= 1
+            self._active_total -= 1
+            held = time.monotonic() - ticket.admitted_at
+            previous = self._hold_ewma.get(ticket.database_id)
+            self._hold_ewma[ticket.database_id] = held if previous is None else 0.8 * previous + 0.2 * held
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """
+        (Giữ lock) Cấp slot theo thứ tự đến: waiter cũ nhất mà database còn slot
+        Waiter của database đã hết slot không chặn database khác; trong một database giữ FIFO
+        """
+        blocked = set()
+        for waiter in list(self._waiters):
+            if self._active_total >= self.global_limit:
+                return
+            database_id = waiter.ticket.database_id
+            if database_id in blocked:
+                continue
+            if self._active.get(database_id, 0) >= self.per_database:
+                blocked.add(database_id)
+                continue
+            self._waiters.remove(waiter)
+            self._active[database_id] = self._active.get(database_id, 0) + 1
+            self._active_total += 1
+            self._db_stats(database_id)["admitted"] += 1
+            waiter.ticket.admitted_at = time.monotonic()
+            waiter.admitted = True
+            waiter.wake()
+
+    def _queued(self, database_id: int) -> int:
+        return sum(1 for waiter in self._waiters if waiter.ticket.database_id == database_id)
+
+    def _retry_after(self, database_id: int, queued: int) -> int:
+        """Số giây ước lượng tới khi hàng đợi của database rút bớt (1..60)"""
+        hold = self._hold_ewma.get(database_id, 1.0)
+        return max(1, min(60, math.ceil(hold * (queued + 1) / max(self.per_database, 1))))
+
+    def _db_stats(self, database_id: int) -> Dict[str, float]:
+        stats = self._stats.get(database_id)
+        if stats is None:
+            stats = {"admitted": 0, "queued_total": 0, "rejected": 0, "timeouts": 0,
+                     "wait_ms_total": 0.0, "max_wait_ms": 0.0}
+            self._stats[database_id] = stats
+        return stats
+
+    def stats(self, database_id: Optional[int] = None) -> Dict[str, Any]:
+        """Độ sâu hàng đợi, số đang chạy, thời gian chờ (theo database hoặc toàn process)"""
+        with self._lock:
+            if database_id is not None:
+                raw = dict(self._db_stats(database_id))
+                raw["running"] = self._active.get(database_id, 0)
+                raw["queue_depth"] = self._queued(database_id)
+                raw["limit"] = self.per_database
+            else:
+                raw = {"admitted": 0, "queued_total": 0, "rejected": 0, "timeouts": 0,
+                       "wait_ms_total": 0.0, "max_wait_ms": 0.0}
+                for stats in self._stats.values():
+                    for key in ("admitted", "queued_total", "rejected", "timeouts", "wait_ms_total"):
+                        raw[key] += stats[key]
+                    raw["max_wait_ms"] = max(raw["max_wait_ms"], stats["max_wait_ms"])
+                raw["running"] = self._active_total
+                raw["queue_depth"] = len(self._waiters)
+                raw["limit"] = self.global_limit
+        admitted = raw["admitted"]
+        raw["avg_wait_ms"] = round(raw.pop("wait_ms_total") / admitted, 2) if admitted else 0.0
+        raw["max_wait_ms"] = round(raw["max_wait_ms"], 2)
+        return raw
+
+
+# Admission controller dùng chung toàn process
+query_admission = QueryAdmission(
+    per_database=int(os.getenv("SQL_ADMISSION_PER_DB", "4")),
+    global_limit=int(os.getenv("SQL_ADMISSION_GLOBAL", "16")),
+    queue_per_database=int(os.getenv("SQL_ADMISSION_QUEUE_PER_DB", "8")),
+    queue_global=int(os.getenv("SQL_ADMISSION_QUEUE_GLOBAL", "16")),
+    queue_timeout=float(os.getenv("SQL_ADMISSION_QUEUE_TIMEOUT", "10"))
+)
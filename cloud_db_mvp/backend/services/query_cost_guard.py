@@ -0,0 +1,272 @@
+"""
+query_cost_guard.py - Kiểm tra chi phí SELECT bằng EXPLAIN FORMAT=JSON trước khi chạy
+- Ước lượng số rows MySQL phải đọc (rows examined) từ plan
+- Theo ngưỡng của gói (pricing plan): cảnh báo / tự thêm LIMIT / từ chối
+- Cache plan theo (database, fingerprint): query lặp lại chỉ khác literal không EXPLAIN lại
+"""
+
+import os
+import json
+import hashlib
+import re
+import threading
+import time
+import pymysql
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from models import Subscription, PricingPlan
+from services.query_fingerprint import fingerprint
+from services.sql_tokenizer import to_pyformat
+
+# Ngưỡng rows examined theo tên gói: (warn, inject LIMIT, reject)
+DEFAULT_PLAN_LIMITS: Dict[str, Tuple[int, int, int]] = {
+    "Gói Cơ bản": (100_000, 500_000, 2_000_000),
+    "Gói Personal": (200_000, 1_000_000, 5_000_000),
+    "Gói Starter": (500_000, 2_000_000, 10_000_000),
+    "Gói Pro": (1_000_000, 5_000_000, 25_000_000),
+    "Gói Team": (2_000_000, 10_000_000, 50_000_000),
+    "Gói Business": (5_000_000, 20_000_000, 100_000_000),
+    "Gói Enterprise": (10_000_000, 50_000_000, 250_000_000),
+    "Gói Unlimited-1": (20_000_000, 100_000_000, 500_000_000),
+    "Gói Unlimited-2": (50_000_000, 250_000_000, 1_000_000_000),
+}
+# User chưa có subscription / gói không có trong bảng
+FALLBACK_LIMITS = (100_000, 500_000, 2_000_000)
+
+# Mệnh đề phải đứng sau LIMIT -> không tự thêm LIMIT vào cuối query
+_NO_APPEND_RE = re.compile(r"\b(?:for update|for share|lock in share mode|into outfile|into dumpfile|into @|procedure)\b")
+
+
+class QueryRejectedError(ValueError):
+    """SELECT bị cost guard từ chối (ước lượng rows examined vượt ngưỡng của gói)"""
+
+
+def estimate_rows_examined(plan: Dict[str, Any]) -> Tuple[int, List[str]]:
+    """
+    Ước lượng tổng rows examined từ EXPLAIN FORMAT=JSON
+    nested_loop: table thứ i được scan (rows_produced_per_join của table trước) lần
+    Returns: (rows, các table bị full scan)
+    """
+    full_scans: List[str] = []
+
+    def table_rows(table: Dict[str, Any]) -> Tuple[float, float]:
+        if table.get("access_type") == "ALL":
+            full_scans.append(table.get("table_name", "?"))
+        examined = float(table.get("rows_examined_per_scan") or 0)
+        produced = float(table.get("rows_produced_per_join") or examined)
+        nested = walk(table.get("materialized_from_subquery", {})) + walk(table.get("attached_subqueries", []))
+        return examined + nested, produced
+
+    def walk(node: Any) -> float:
+        if isinstance(node, list):
+            return sum(walk(item) for item in node)
+        if not isinstance(node, dict):
+            return 0.0
+        total = 0.0
+        for key, value in node.items():
+            if key == "nested_loop":
+                prefix = 1.0
+                for item in value:
+                    table = item.get("table", {})
+                    examined, produced = table_rows(table)
+                    total += examined * prefix
+                    prefix = max(produced, 1.0)
+            elif key == "table":
+                total += table_rows(value)[0]
+            elif isinstance(value, (dict, list)):
+                total += walk(value)
+        return total
+
+    return int(walk(plan)), full_scans
+
+
+def has_top_level_limit(normalized: str) -> bool:
+    """Fingerprint có LIMIT ở ngoài mọi dấu ngoặc (LIMIT của subquery không tính)"""
+    depth = 0
+    for match in re.finditer(r"[()]|\blimit\b", normalized):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            return True
+    return False
+
+
+class QueryCostGuard:
+    """Plan cache + quyết định warn/limit/reject cho SELECT"""
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 300.0, limits_ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.limits_ttl = limits_ttl
+        self._plans: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+        self._limits: Dict[int, Tuple[float, Tuple[int, int, int], Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"explains": 0, "plan_hits": 0, "warned": 0, "limited": 0, "rejected": 0, "explain_errors": 0}
+        # Cùng bộ đếm theo database -> API của tenant chỉ thấy số của database mình
+        self._db_stats: Dict[int, Dict[str, int]] = {}
+        self.plan_limits = dict(DEFAULT_PLAN_LIMITS)
+        override = os.getenv("SQL_COST_GUARD_PLAN_LIMITS")
+        if override:
+            # JSON: {"Tên gói": [warn, limit, reject], ...}
+            self.plan_limits.update({name: tuple(values) for name, values in json.loads(override).items()})
+
+    def limits_for(self, db: Session, user_id: int) -> Tuple[Tuple[int, int, int], Optional[str]]:
+        """Ngưỡng theo gói đang ACTIVE của user (cache ngắn để không query metadata DB mỗi lần)"""
+        now = time.time()
+        with self._lock:
+            cached = self._limits.get(user_id)
+            if cached is not None and now - cached[0] < self.limits_ttl:
+                return cached[1], cached[2]
+
+        plan_name = None
+        active_sub = db.query(Subscription).filter(
+            Subscription.user_id == user_id,
+            Subscription.status == "ACTIVE"
+        ).first()
+        if active_sub:
+            plan = db.query(PricingPlan).filter(PricingPlan.id == active_sub.plan_id).first()
+            plan_name = plan.name if plan else None
+        limits = self.plan_limits.get(plan_name, FALLBACK_LIMITS)
+        with self._lock:
+            self._limits[user_id] = (now, limits, plan_name)
+        return limits, plan_name
+
+    def check(
+        self,
+        conn,
+        database_id: int,
+        query: str,
+        params: Optional[List[Any]],
+        limits: Tuple[int, int, int],
+        row_cap: int
+    ) -> Dict[str, Any]:
+        """
+        EXPLAIN (hoặc lấy từ plan cache) rồi quyết định
+        row_cap: số rows LIMIT được thêm vào khi vượt ngưỡng limit
+        Returns: {"query": query sẽ chạy, "action": "none"|"warn"|"limit", "estimated_rows_examined", ...}
+        Raise QueryRejectedError khi vượt ngưỡng reject
+        """
+        warn_rows, limit_rows, reject_rows = limits
+        normalized = fingerprint(query)
+        key = (database_id, hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16])
+        estimate = self._cached_plan(key)
+        plan_cached = estimate is not None
+        if estimate is None:
+            estimate = self._explain(conn, database_id, query, params)
+            if estimate is None:
+                # EXPLAIN lỗi (cú pháp, quyền...) -> không chặn, để query thật báo lỗi
+                return {"query": query, "action": "none", "estimated_rows_examined": None, "plan_cached": False}
+            self._store_plan(key, estimate)
+
+        rows = estimate["rows_examined"]
+        info = {
+            "query": query,
+            "action": "none",
+            "estimated_rows_examined": rows,
+            "full_scan_tables": estimate["full_scans"],
+            "plan_cached": plan_cached,
+            "thresholds": {"warn": warn_rows, "limit": limit_rows, "reject": reject_rows},
+        }
+        if rows > reject_rows:
+            self._count("rejected", database_id)
+            raise QueryRejectedError(
+                f"Query rejected: estimated {rows} rows examined exceeds the limit of {reject_rows} for your plan. "
+                f"Add a selective WHERE condition on an indexed column or a LIMIT."
+            )
+        if rows > limit_rows and not has_top_level_limit(normalized) and not _NO_APPEND_RE.search(normalized):
+            self._count("limited", database_id)
+            info["action"] = "limit"
+            # Xuống dòng trước LIMIT: query có thể kết thúc bằng comment "-- ..."
+            info["query"] = f"{query.rstrip().rstrip(';').rstrip()}\nLIMIT {int(row_cap)}"
+            info["warning"] = f"Estimated {rows} rows examined; LIMIT {int(row_cap)} was added automatically."
+        elif rows > warn_rows:
+            self._count("warned", database_id)
+            info["action"] = "warn"
+            info["warning"] = f"Estimated {rows} rows examined; consider adding an index or a more selective WHERE."
+        return info
+
+    def _explain(self, conn, database_id: int, query: str, params: Optional[List[Any]]) -> Optional[Dict[str, Any]]:
+        self._count("explains", database_id)
+        cur = conn.cursor()
+        try:
+            if params is not None:
+                cur.execute("EXPLAIN FORMAT=JSON " + to_pyformat(query), params)
+            else:
+                cur.execute("EXPLAIN FORMAT=JSON " + query)
+            row = cur.fetchone()
+            plan = json.loads(row[0])
+        except (pymysql.err.MySQLError, ValueError, TypeError) as e:
+            if isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError)) and not getattr(conn, "open", True):
+                raise
+            self._count("explain_errors", database_id)
+            return None
+        finally:
+            cur.close()
+        rows, full_scans = estimate_rows_examined(plan)
+        cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost")
+        return {"rows_examined": rows, "full_scans": full_scans,
+                "query_cost": float(cost) if cost is not None else None, "explained_at": time.time()}
+
+    def _cached_plan(self, key: Tuple[int, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._plans.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry["explained_at"] >= self.ttl:
+                del self._plans[key]
+                return None
+            self._plans.move_to_end(key)
+            self._increment("plan_hits", key[0])
+            return entry
+
+    def _store_plan(self, key: Tuple[int, str], estimate: Dict[str, Any]) -> None:
+        with self._lock:
+            self._plans[key] = estimate
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+    def invalidate(self, database_id: int) -> int:
+        """Bỏ plan đã cache của database (schema đổi -> plan cũ không còn đúng)"""
+        with self._lock:
+            keys = [key for key in self._plans if key[0] == database_id]
+            for key in keys:
+                del self._plans[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self._limits.clear()
+
+    def _count(self, name: str, database_id: int) -> None:
+        with self._lock:
+            self._increment(name, database_id)
+
+    def _increment(self, name: str, database_id: int) -> None:
+        """(Giữ lock) Tăng bộ đếm toàn process và của database"""
+        self._stats[name] += 1
+        db_stats = self._db_stats.setdefault(database_id, dict.fromkeys(self._stats, 0))
+        db_stats[name] += 1
+
+    def stats(self, database_id: Optional[int] = None) -> Dict[str, Any]:
+        """Bộ đếm của một database, hoặc toàn process khi database_id là None"""
+        with self._lock:
+            if database_id is None:
+                stats = dict(self._stats)
+                stats["cached_plans"] = len(self._plans)
+            else:
+                stats = dict(self._db_stats.get(database_id) or dict.fromkeys(self._stats, 0))
+                stats["cached_plans"] = sum(1 for key in self._plans if key[0] == database_id)
+        return stats
+
+
+# Guard dùng chung toàn process
+query_cost_guard = QueryCostGuard(
+    max_entries=int(os.getenv("SQL_COST_GUARD_PLAN_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("SQL_COST_GUARD_PLAN_TTL", "300"))
+)
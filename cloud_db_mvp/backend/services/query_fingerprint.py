@@ -0,0 +1,85 @@
+"""
+query_fingerprint.py - Chuẩn hóa SQL thành fingerprint (bỏ literal) để gom các query cùng dạng
+- 'abc', "abc", 123, 1.5e3, 0xFF, '?' placeholder -> ?
+- IN (?, ?, ?) -> IN (?+), VALUES (...), (...) -> VALUES (...)
+- Bỏ comment / optimizer hint, gộp khoảng trắng, chữ thường (giữ nguyên `identifier`)
+- Dùng cho plan cache của cost guard và thống kê latency theo fingerprint
+"""
+
+import hashlib
+import re
+from typing import List
+
+_NUMBER_RE = re.compile(r"(?<![\w$])(?:0x[0-9a-f]+|x'[0-9a-f]*'|[+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?)(?![\w$])")
+_IN_LIST_RE = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES_RE = re.compile(r"\b(values?)\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint(query: str) -> str:
+    """SQL -> dạng chuẩn hóa (literal thay bằng ?); query giống nhau chỉ khác giá trị cho cùng kết quả"""
+    parts: List[str] = []
+    segment: List[str] = []
+    i = 0
+    n = len(query)
+
+    def flush():
+        if segment:
+            parts.append(_NUMBER_RE.sub("?", "".join(segment).lower()))
+            segment.clear()
+
+    while i < n:
+        ch = query[i]
+        if ch in ("'", '"'):
+            flush()
+            i = _skip_quoted(query, i)
+            parts.append("?")
+            continue
+        if ch == "`":
+            flush()
+            end = _skip_quoted(query, i)
+            parts.append(query[i:end])
+            i = end
+            continue
+        if ch == "#" or (query.startswith("--", i) and (i + 2 == n or query[i + 2] in " \t\r\n")):
+            end = query.find("\n", i)
+            i = n if end == -1 else end
+            segment.append(" ")
+            continue
+        if query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            segment.append(" ")
+            continue
+        segment.append(ch)
+        i += 1
+    flush()
+
+    text = _SPACE_RE.sub(" ", "".join(parts)).strip().rstrip(";").strip()
+    text = _IN_LIST_RE.sub("in (?+)", text)
+    text = _VALUES_RE.sub(r"\1 \2", text)
+    return text
+
+
+def fingerprint_id(query: str) -> str:
+    """Id ngắn (16 hex) của fingerprint, dùng làm key cache / thống kê"""
+    return hashlib.sha1(fingerprint(query).encode("utf-8")).hexdigest()[:16]
+
+
+def _skip_quoted(query: str, i: int) -> int:
+    """Vị trí ngay sau chuỗi/identifier bắt đầu tại i; chuỗi chưa đóng -> hết query"""
+    quote = query[i]
+    i += 1
+    n = len(query)
+    while i < n:
+        ch = query[i]
+        if ch == "\\" and quote != "`":
+            i += 2
+            continue
+        if ch == quote:
+            if i + 1 < n and query[i + 1] == quote:
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    return n
@@ -0,0 +1,489 @@
+"""
+query_job_service.py - Service chạy query dài ở background (query job)
+- Submit trả về job id ngay, query chạy trên worker thread riêng
+- Kết quả spool ra file NDJSON theo chunk (mỗi dòng một row), client poll theo offset hoặc stream
+- Cancel: KILL QUERY qua connection admin, chỉ do process đang chạy job gửi (khi còn giữ connection)
+  -> connection đã trả về pool / đưa cho request khác không bao giờ bị KILL nhầm
+- Cancel job của worker process khác: chỉ ghi CANCELLED vào DB; worker đó thấy khi poll (cancel_poll_interval)
+  rồi tự KILL connection của mình
+- Giới hạn số job đang chạy đồng thời của mỗi tenant (user)
+- Job đang chạy chiếm một slot admission của database như query thường (worker chờ slot, không phải request)
+- Job ghi worker_id (hostname:pid:token) + heartbeat định kỳ: startup chỉ đánh FAILED job
+  có heartbeat quá hạn, không đụng job của worker process khác còn sống
+"""
+
+import os
+import json
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+import pymysql
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import QueryJob, QueryJobStatus
+from services.mysql_service import MySQLService
+from services.sql_executor_service import SQLExecutorService
+
+# MySQL error: "Query execution was interrupted" (sau KILL QUERY)
+ER_QUERY_INTERRUPTED = 1317
+
+ACTIVE_STATUSES = (QueryJobStatus.PENDING.value, QueryJobStatus.RUNNING.value)
+
+
+class QueryJobLimitError(Exception):
+    """Tenant đã có đủ số job đang chạy"""
+
+
+class _JobState:
+    """Trạng thái in-memory của job đang chạy trong process này"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.cancel_requested = threading.Event()
+        self.finished = threading.Event()
+        # Connection MySQL đang chạy job; đổi / KILL dưới lock -> không KILL sau khi connection đã trả về pool
+        self.lock = threading.Lock()
+        self.thread_id = None
+
+
+# Dùng chung toàn process: worker pool + job đang chạy + thread heartbeat
+_worker_pool = None
+_heartbeat_thread = None
+_jobs: Dict[int, _JobState] = {}
+_jobs_lock = threading.Lock()
+
+# Định danh process này (token phân biệt process mới trùng pid sau restart)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class QueryJobService:
+    def __init__(self, session_factory=SessionLocal):
+        self.executor = SQLExecutorService()
+        self.mysql_service = MySQLService()
+        self.session_factory = session_factory
+        self.job_dir = Path(os.getenv("SQL_JOB_DIR", "/tmp/query_jobs"))
+        self.max_workers = int(os.getenv("SQL_JOB_WORKERS", "4"))
+        self.max_jobs_per_tenant = int(os.getenv("SQL_JOB_MAX_PER_TENANT", "2"))
+        self.max_rows = int(os.getenv("SQL_JOB_MAX_ROWS", "1000000"))
+        self.max_bytes = int(os.getenv("SQL_JOB_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.progress_interval = float(os.getenv("SQL_JOB_PROGRESS_INTERVAL", "1.0"))  # seconds
+        self.heartbeat_interval = float(os.getenv("SQL_JOB_HEARTBEAT_INTERVAL", "15"))  # seconds
+        # Chu kỳ kiểm tra job của process này bị cancel từ process khác (qua DB)
+        self.cancel_poll_interval = float(os.getenv("SQL_JOB_CANCEL_POLL_INTERVAL", "2"))  # seconds
+        # Heartbeat cũ hơn mức này -> worker coi như đã chết
+        self.heartbeat_timeout = float(os.getenv("SQL_JOB_HEARTBEAT_TIMEOUT", "60"))  # seconds
+        # Worker chờ slot admission lâu hơn request HTTP (job đã được nhận, chỉ xếp hàng)
+        self.admission_timeout = float(os.getenv("SQL_JOB_ADMISSION_TIMEOUT", "300"))  # seconds
+
+    def _pool(self) -> ThreadPoolExecutor:
+        global _worker_pool, _heartbeat_thread
+        with _jobs_lock:
+            if _worker_pool is None:
+                _worker_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="query-job")
+            if _heartbeat_thread is None:
+                _heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="query-job-heartbeat", daemon=True)
+                _heartbeat_thread.start()
+            return _worker_pool
+
+    def _heartbeat_loop(self) -> None:
+        last_heartbeat = time.monotonic()
+        while True:
+            time.sleep(min(self.cancel_poll_interval, self.heartbeat_interval))
+            self.poll_cancellations()
+            if time.monotonic() - last_heartbeat >= self.heartbeat_interval:
+                self.heartbeat()
+                last_heartbeat = time.monotonic()
+
+    def poll_cancellations(self) -> int:
+        """Job của process này đã bị cancel qua DB (từ process khác) -> dừng + KILL connection của job; Returns: số job"""
+        with _jobs_lock:
+            states = dict(_jobs)
+        if not states:
+            return 0
+        db = self.session_factory()
+        try:
+            cancelled = [job_id for (job_id,) in db.query(QueryJob.id).filter(
+                QueryJob.id.in_(list(states)),
+                QueryJob.status == QueryJobStatus.CANCELLED.value
+            ).all()]
+        except Exception as e:
+            print(f"Warning: Could not poll query job cancellations: {e}")
+            return 0
+        finally:
+            db.close()
+        for job_id in cancelled:
+            state = states[job_id]
+            state.cancel_requested.set()
+            self._kill_job_query(state)
+        return len(cancelled)
+
+    def _kill_job_query(self, state: _JobState) -> None:
+        """KILL QUERY connection của job nếu worker còn giữ nó (giữ lock: worker chưa thể trả connection về pool)"""
+        with state.lock:
+            if state.thread_id is not None:
+                self.mysql_service.kill_query(state.thread_id)
+
+    @staticmethod
+    def _disown(state: _JobState) -> None:
+        """Worker gọi trước khi close / invalidate connection: từ đây không KILL nào nhắm vào connection này"""
+        with state.lock:
+            state.thread_id = None
+
+    def heartbeat(self) -> int:
+        """Cập nhật heartbeat_at cho job đang chạy trong process này; Returns: số job đã cập nhật"""
+        with _jobs_lock:
+            job_ids = list(_jobs)
+        if not job_ids:
+            return 0
+        db = self.session_factory()
+        try:
+            updated = db.query(QueryJob).filter(
+                QueryJob.id.in_(job_ids),
+                QueryJob.status.in_(ACTIVE_STATUSES)
+            ).update({QueryJob.worker_id: WORKER_ID, QueryJob.heartbeat_at: datetime.now()}, synchronize_session=False)
+            db.commit()
+            return updated
+        except Exception as e:
+            db.rollback()
+            print(f"Warning: Could not update query job heartbeat: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def submit(self, db: Session, database_id: int, user_id: int, query: str) -> QueryJob:
+        """
+        Tạo job và đưa vào worker pool
+        Raise ValueError nếu query không hợp lệ, QueryJobLimitError nếu tenant đã đủ job đang chạy
+        """
+        target = self.executor._get_target(db, database_id, user_id)
+        self.executor._validate_query(query)
+        query = query.strip()
+        if not query:
+            raise ValueError("Query cannot be empty")
+        if self.executor._get_query_type(query) != "SELECT":
+            raise ValueError("Only SELECT queries can run as jobs")
+
+        with _jobs_lock:
+            running = sum(1 for state in _jobs.values() if state.user_id == user_id and not state.finished.is_set())
+            if running >= self.max_jobs_per_tenant:
+                raise QueryJobLimitError(
+                    f"Too many running query jobs ({running}/{self.max_jobs_per_tenant}). Wait for a job to finish or cancel one."
+                )
+            job = QueryJob(
+                database_id=database_id,
+                user_id=user_id,
+                query_text=query,
+                status=QueryJobStatus.PENDING.value,
+                worker_id=WORKER_ID,
+                heartbeat_at=datetime.now()
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            _jobs[job.id] = _JobState(user_id)
+
+        self._pool().submit(self._run_job, job.id, target, query)
+        return job
+
+    def get_job(self, db: Session, job_id: int, user_id: int) -> QueryJob:
+        job = db.query(QueryJob).filter(QueryJob.id == job_id).first()
+        if not job or job.user_id != user_id:
+            raise ValueError(f"Query job {job_id} not found")
+        return job
+
+    def list_jobs(self, db: Session, database_id: int, limit: int = 50) -> List[QueryJob]:
+        return db.query(QueryJob).filter(
+            QueryJob.database_id == database_id
+        ).order_by(QueryJob.created_at.desc(), QueryJob.id.desc()).limit(limit).all()
+
+    def cancel(self, db: Session, job_id: int, user_id: int) -> QueryJob:
+        """
+        Hủy job: đặt cờ cancel (job chưa chạy sẽ bị bỏ qua); query đang chạy -> KILL QUERY trên MySQL,
+        worker thấy lỗi interrupted/cờ cancel thì đánh dấu CANCELLED
+        Job của worker process khác: chỉ ghi CANCELLED vào DB (không KILL theo mysql_thread_id đã lưu:
+        job có thể vừa xong và connection đã sang request khác); worker đó thấy qua poll_cancellations()
+        rồi tự KILL connection của mình, và không ghi đè CANCELLED
+        """
+        job = self.get_job(db, job_id, user_id)
+        if job.status not in ACTIVE_STATUSES:
+            raise ValueError(f"Query job {job_id} is already {job.status}")
+
+        with _jobs_lock:
+            state = _jobs.get(job_id)
+        if state is None:
+            if not self._finish_if_active(db, job_id, QueryJobStatus.CANCELLED.value):
+                db.refresh(job)
+                raise ValueError(f"Query job {job_id} is already {job.status}")
+            # Worker chưa ghi RUNNING -> update có điều kiện của nó thất bại và worker tự dừng
+            db.refresh(job)
+            return job
+
+        state.cancel_requested.set()
+        self._kill_job_query(state)
+        # Chờ worker ghi trạng thái cuối cùng (ngắn, không block lâu request)
+        state.finished.wait(timeout=5)
+        db.refresh(job)
+        return job
+
+    @staticmethod
+    def _update_if_active(db: Session, job_id: int, values: Dict[str, Any]) -> bool:
+        """UPDATE chỉ khi job còn PENDING/RUNNING; False nếu job đã bị cancel / kết thúc ở nơi khác"""
+        updated = db.query(QueryJob).filter(
+            QueryJob.id == job_id,
+            QueryJob.status.in_(ACTIVE_STATUSES)
+        ).update(values, synchronize_session=False)
+        db.commit()
+        return updated > 0
+
+    def _finish_if_active(self, db: Session, job_id: int, status: str, error: Optional[str] = None) -> bool:
+        return self._update_if_active(db, job_id, {
+            QueryJob.status: status,
+            QueryJob.error_message: error,
+            QueryJob.completed_at: datetime.now()
+        })
+
+    def _cancelled_elsewhere(self, db: Session, job_id: int) -> bool:
+        status = db.query(QueryJob.status).filter(QueryJob.id == job_id).scalar()
+        return status not in ACTIVE_STATUSES
+
+    def _run_job(self, job_id: int, target: Dict[str, Any], query: str) -> None:
+        """Worker: chạy query bằng unbuffered cursor, ghi từng chunk rows ra file"""
+        with _jobs_lock:
+            state = _jobs.setdefault(job_id, _JobState(None))
+        db = self.session_factory()
+        conn = None
+        ticket = None
+        status = QueryJobStatus.FAILED.value
+        error = None
+        try:
+            job = db.query(QueryJob).filter(QueryJob.id == job_id).first()
+            if job is None or state.cancel_requested.is_set() or job.status not in ACTIVE_STATUSES:
+                status = QueryJobStatus.CANCELLED.value
+                return
+            ticket = self.executor.admission.acquire(job.database_id, timeout=self.admission_timeout)
+
+            self.job_dir.mkdir(parents=True, exist_ok=True)
+            result_path = self.job_dir / f"job_{job_id}.ndjson"
+            conn = self.executor._connect(target)
+            with state.lock:
+                state.thread_id = conn.thread_id()
+            # cancel() đặt cờ rồi mới đọc thread_id: kiểm tra lại cờ sau khi ghi thread_id
+            # để không bỏ lỡ cancel tới đúng lúc đang kết nối
+            if state.cancel_requested.is_set():
+                self._disown(state)
+                conn.close()
+                conn = None
+                status = QueryJobStatus.CANCELLED.value
+                return
+            # Ghi RUNNING có điều kiện: job đã bị cancel từ worker khác -> không chạy
+            if not self._update_if_active(db, job_id, {
+                QueryJob.mysql_thread_id: state.thread_id,
+                QueryJob.worker_id: WORKER_ID,
+                QueryJob.heartbeat_at: datetime.now(),
+                QueryJob.status: QueryJobStatus.RUNNING.value,
+                QueryJob.started_at: datetime.now(),
+                QueryJob.result_path: str(result_path)
+            }):
+                state.cancel_requested.set()
+                self._disown(state)
+                conn.close()
+                conn = None
+                status = QueryJobStatus.CANCELLED.value
+                return
+            db.refresh(job)
+
+            cur = conn.cursor(pymysql.cursors.SSCursor)
+            cur.execute(query)
+            job.columns = json.dumps([desc[0] for desc in cur.description] if cur.description else [])
+            db.commit()
+
+            finished = self._spool(db, job, cur, result_path, state)
+            self._disown(state)
+            if finished:
+                cur.close()
+                conn.close()
+            else:
+                # Dừng giữa chừng (cancel/giới hạn): còn rows trên server -> đóng hẳn connection
+                conn.invalidate()
+            conn = None
+            status = QueryJobStatus.CANCELLED.value if state.cancel_requested.is_set() else QueryJobStatus.COMPLETED.value
+        except pymysql.err.MySQLError as e:
+            if state.cancel_requested.is_set() or (e.args and e.args[0] == ER_QUERY_INTERRUPTED):
+                status = QueryJobStatus.CANCELLED.value
+            else:
+                error = str(e)
+        except Exception as e:
+            error = str(e)
+        finally:
+            if conn is not None:
+                self._disown(state)
+                conn.invalidate()
+            if ticket is not None:
+                ticket.release()
+            try:
+                # Không ghi đè trạng thái do worker khác đặt (cancel qua DB)
+                db.rollback()
+                self._finish_if_active(db, job_id, status, error)
+            except Exception as e:
+                print(f"Warning: Could not update query job {job_id}: {e}")
+            finally:
+                db.close()
+                state.finished.set()
+                with _jobs_lock:
+                    _jobs.pop(job_id, None)
+
+    def _spool(self, db: Session, job: QueryJob, cur, result_path: Path, state: _JobState) -> bool:
+        """
+        Ghi rows ra file theo chunk; cập nhật row_count định kỳ để client poll thấy tiến độ
+        Returns: True nếu đọc hết result, False nếu dừng vì cancel hoặc vượt giới hạn
+        """
+        row_count = 0
+        written = 0
+        last_progress = time.time()
+        with open(result_path, "w", encoding="utf-8") as f:
+            while True:
+                if state.cancel_requested.is_set():
+                    return False
+                rows = cur.fetchmany(self.executor.fetch_chunk_rows)
+                if not rows:
+                    break
+                data = "".join(
+                    json.dumps([self._json_value(val) for val in row], ensure_ascii=False) + "\n"
+                    for row in rows
+                )
+                f.write(data)
+                f.flush()
+                row_count += len(rows)
+                written += len(data.encode("utf-8"))
+                if row_count >= self.max_rows or written >= self.max_bytes:
+                    job.truncated = 1
+                    break
+                if time.time() - last_progress >= self.progress_interval:
+                    job.row_count = row_count
+                    job.result_bytes = written
+                    db.commit()
+                    last_progress = time.time()
+                    # Cancel từ worker process khác chỉ thấy được qua DB
+                    if self._cancelled_elsewhere(db, job.id):
+                        state.cancel_requested.set()
+                        return False
+        job.row_count = row_count
+        job.result_bytes = written
+        db.commit()
+        return not job.truncated
+
+    @staticmethod
+    def _json_value(val: Any) -> Any:
+        if val is None or isinstance(val, (int, float, str, bool)):
+            return val
+        return SQLExecutorService._export_text(val)
+
+    def read_results(self, job: QueryJob, offset: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        """
+        Đọc một trang rows từ file spool (poll)
+        offset là byte offset trả về từ lần đọc trước (next_offset), chỉ trả về dòng hoàn chỉnh
+        """
+        columns = json.loads(job.columns) if job.columns else []
+        rows = []
+        next_offset = offset
+        if job.result_path and os.path.exists(job.result_path):
+            with open(job.result_path, "rb") as f:
+                f.seek(offset)
+                while len(rows) < limit:
+                    line = f.readline()
+                    if not line or not line.endswith(b"\n"):
+                        break
+                    rows.append(json.loads(line))
+                    next_offset += len(line)
+        done = job.status not in ACTIVE_STATUSES
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "columns": columns,
+            "rows": rows,
+            "offset": offset,
+            "next_offset": next_offset,
+            "complete": done and len(rows) < limit
+        }
+
+    def stream_results(self, job: QueryJob, poll_interval: float = 0.2) -> Iterator[bytes]:
+        """
+        Stream file spool dưới dạng NDJSON; job còn chạy thì chờ rows mới tới khi job kết thúc
+        Dòng đầu là {"columns": [...]} (có khi job đã bắt đầu chạy query)
+        """
+        job_id = job.id
+        result_path = job.result_path
+        columns = job.columns
+        with _jobs_lock:
+            state = _jobs.get(job_id)
+
+        while state is not None and not state.finished.is_set() and (result_path is None or columns is None):
+            time.sleep(poll_interval)
+            db = self.session_factory()
+            try:
+                fresh = db.query(QueryJob).filter(QueryJob.id == job_id).first()
+                result_path, columns = fresh.result_path, fresh.columns
+            finally:
+                db.close()
+
+        yield (json.dumps({"columns": json.loads(columns) if columns else []}) + "\n").encode("utf-8")
+        if not result_path or not os.path.exists(result_path):
+            return
+        with open(result_path, "rb") as f:
+            pending = b""
+            while True:
+                chunk = f.read(64 * 1024)
+                if chunk:
+                    pending += chunk
+                    cut = pending.rfind(b"\n") + 1
+                    if cut:
+                        yield pending[:cut]
+                        pending = pending[cut:]
+                    continue
+                if state is None or state.finished.is_set():
+                    # Đọc nốt phần worker ghi trước khi kết thúc
+                    rest = f.read()
+                    if rest or pending:
+                        yield pending + rest
+                    return
+                time.sleep(poll_interval)
+
+    def delete_job(self, db: Session, job_id: int, user_id: int) -> None:
+        """Xóa job đã kết thúc và file kết quả"""
+        job = self.get_job(db, job_id, user_id)
+        if job.status in ACTIVE_STATUSES:
+            raise ValueError("Cancel the query job before deleting it")
+        if job.result_path and os.path.exists(job.result_path):
+            os.remove(job.result_path)
+        db.delete(job)
+        db.commit()
+
+    def fail_orphaned_jobs(self) -> int:
+        """
+        Startup: job PENDING/RUNNING không còn worker -> FAILED
+        Chỉ job có heartbeat quá hạn (hoặc chưa từng có): job của worker process khác còn sống được giữ nguyên
+        """
+        stale_before = datetime.now() - timedelta(seconds=self.heartbeat_timeout)
+        db = self.session_factory()
+        try:
+            jobs = db.query(QueryJob).filter(
+                QueryJob.status.in_(ACTIVE_STATUSES),
+                (QueryJob.heartbeat_at.is_(None)) | (QueryJob.heartbeat_at < stale_before)
+            ).all()
+            failed = 0
+            for job in jobs:
+                if job.id in _jobs:
+                    continue
+                job.status = QueryJobStatus.FAILED.value
+                job.error_message = f"Worker {job.worker_id or 'unknown'} stopped while the query job was running"
+                job.completed_at = datetime.now()
+                failed += 1
+            db.commit()
+            return failed
+        finally:
+            db.close()
@@ -0,0 +1,177 @@
+"""
+query_result_cache.py - Cache kết quả SELECT của SQL console
+- Key: database_id + SQL đã normalize + format kết quả (+ params của parameterized query)
+- LRU giới hạn theo số entry và tổng bytes, mỗi entry có TTL
+- Invalidate toàn bộ entry của database khi có lệnh ghi (INSERT/UPDATE/DELETE/DDL)
+"""
+
+import os
+import re
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Các hàm/clauses cho kết quả thay đổi giữa các lần chạy -> không cache
+_NON_DETERMINISTIC = re.compile(
+    r"\b(NOW|SYSDATE|CURDATE|CURTIME|UTC_DATE|UTC_TIME|UTC_TIMESTAMP|UNIX_TIMESTAMP|RAND|UUID|"
+    r"UUID_SHORT|CONNECTION_ID|LAST_INSERT_ID|FOUND_ROWS|ROW_COUNT|SLEEP|GET_LOCK|RELEASE_LOCK|"
+    r"USER|SESSION_USER|SYSTEM_USER)\s*\("
+    r"|\b(CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|CURRENT_USER|LOCALTIME|LOCALTIMESTAMP)\b"
+    r"|\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bFOR\s+SHARE\b|@",
+    re.IGNORECASE
+)
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Chuẩn hóa SQL để làm cache key: gộp whitespace, bỏ ';' cuối
+    Giữ nguyên nội dung trong chuỗi/identifier có quote (phân biệt hoa thường)
+    """
+    out = []
+    quote = None
+    pending_space = False
+    i = 0
+    while i < len(query):
+        ch = query[i]
+        if quote:
+            out.append(ch)
+            if ch == "\\" and quote != "`" and i + 1 < len(query):
+                out.append(query[i + 1])
+                i += 2
+                continue
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"', "`"):
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            quote = ch
+            out.append(ch)
+        elif ch.isspace():
+            pending_space = True
+        else:
+            if pending_space and out:
+                out.append(" ")
+            pending_space = False
+            out.append(ch)
+        i += 1
+    return "".join(out).rstrip(";").rstrip()
+
+
+def is_cacheable(query: str) -> bool:
+    """SELECT có hàm non-deterministic, lock hoặc biến session thì không cache"""
+    return _NON_DETERMINISTIC.search(query) is None
+
+
+def estimate_result_size(result: Dict[str, Any]) -> int:
+    """Ước lượng bytes của result (string theo độ dài, giá trị khác ~8 bytes)"""
+    size = 256
+    for key in ("rows", "data"):
+        for seq in result.get(key) or []:
+            for val in seq:
+                size += len(val) if isinstance(val, str) else 8
+    return size
+
+
+class QueryResultCache:
+    """LRU cache (thread-safe) cho kết quả SELECT, dùng chung toàn process"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, result)
+        self._bytes = 0
+        # Tăng mỗi lần invalidate: SELECT bắt đầu trước lệnh ghi không được lưu kết quả cũ
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(database_id: int, query: str, result_format: str = "rows", params: Optional[List[Any]] = None):
+        # params dạng JSON để 1 và True (hash bằng nhau trong Python) là hai key khác nhau
+        param_key = None if params is None else json.dumps(params, default=str)
+        return (database_id, result_format, normalize_sql(query), param_key)
+
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, size, result = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return result
+
+    def generation(self, database_id: int) -> int:
+        """Lấy generation hiện tại của database (đọc trước khi chạy SELECT)"""
+        with self._lock:
+            return self._generations.get(database_id, 0)
+
+    def put(self, key, result: Dict[str, Any], generation: Optional[int] = None, ttl: Optional[float] = None) -> bool:
+        """
+        Lưu result; generation là giá trị đọc trước khi chạy query -
+        nếu database đã bị invalidate trong lúc query chạy thì bỏ qua
+        """
+        size = estimate_result_size(result)
+        if size > self.max_bytes:
+            return False
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and self._generations.get(key[0], 0) != generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, result)
+            self._bytes += size
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+        return True
+
+    def invalidate_database(self, database_id: int) -> int:
+        """Xóa mọi entry của database (gọi sau lệnh ghi/DDL, restore, import)"""
+        with self._lock:
+            self._generations[database_id] = self._generations.get(database_id, 0) + 1
+            keys = [key for key in self._entries if key[0] == database_id]
+            for key in keys:
+                self._remove(key)
+            if keys:
+                self._stats["invalidations"] += 1
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+# Cache dùng chung cho mọi SQLExecutorService trong process
+query_result_cache = QueryResultCache(
+    max_entries=int(os.getenv("SQL_RESULT_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(os.getenv("SQL_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("SQL_RESULT_CACHE_TTL", "30")),
+)
@@ -0,0 +1,110 @@
+"""
+query_retry.py - Retry statement ghi khi InnoDB báo deadlock (1213) / lock wait timeout (1205)
+- Chỉ áp dụng cho statement ghi đơn lẻ (autocommit từng statement): InnoDB đã rollback nên chạy lại an toàn
+- Backoff lũy thừa có jitter (full jitter) -> các transaction tranh chấp không retry cùng lúc
+- Retry budget theo database (token bucket): số retry tối đa ~ ratio x số statement,
+  tranh chấp kéo dài không bị retry khuếch đại thêm tải
+- Đếm số retry / thành công sau retry / bỏ cuộc / hết budget theo database
+"""
+
+import os
+import random
+import threading
+from typing import Any, Dict, Optional
+import pymysql
+
+# MySQL error: "Lock wait timeout exceeded; try restarting transaction"
+ER_LOCK_WAIT_TIMEOUT = 1205
+# MySQL error: "Deadlock found when trying to get lock; try restarting transaction"
+ER_LOCK_DEADLOCK = 1213
+RETRYABLE_ERRORS = (ER_LOCK_WAIT_TIMEOUT, ER_LOCK_DEADLOCK)
+# Loại statement được retry (DDL tự commit, SELECT không tranh chấp lock ghi)
+RETRYABLE_TYPES = ("INSERT", "UPDATE", "DELETE")
+
+
+def conflict_errno(error: Exception) -> Optional[int]:
+    """Mã lỗi nếu là deadlock / lock wait timeout, ngược lại None"""
+    if isinstance(error, pymysql.err.MySQLError) and error.args and error.args[0] in RETRYABLE_ERRORS:
+        return error.args[0]
+    return None
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.05,
+        max_delay: float = 1.0,
+        budget_ratio: float = 0.2,
+        budget_max: float = 10.0
+    ):
+        self.max_attempts = max_attempts  # Tổng số lần chạy (lần đầu + retry)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio  # Mỗi statement nạp thêm bấy nhiêu token, mỗi retry tốn 1
+        self.budget_max = budget_max
+        self._lock = threading.Lock()
+        self._tokens: Dict[int, float] = {}
+        self._stats: Dict[int, Dict[str, int]] = {}
+
+    def deposit(self, database_id: int) -> None:
+        """Gọi một lần cho mỗi statement được bật retry"""
+        with self._lock:
+            tokens = self._tokens.get(database_id, self.budget_max)
+            self._tokens[database_id] = min(self.budget_max, tokens + self.budget_ratio)
+
+    def allow_retry(self, database_id: int, error: Exception, attempt: int) -> bool:
+        """
+        attempt: số lần đã chạy (1 = vừa lỗi ở lần đầu)
+        True nếu lỗi retry được, còn lượt và còn budget (đã trừ 1 token)
+        """
+        errno = conflict_errno(error)
+        if errno is None:
+            return False
+        with self._lock:
+            stats = self._db_stats(database_id)
+            if attempt >= self.max_attempts:
+                return False
+            tokens = self._tokens.get(database_id, self.budget_max)
+            if tokens < 1.0:
+                stats["budget_exhausted"] += 1
+                return False
+            self._tokens[database_id] = tokens - 1.0
+            stats["retries"] += 1
+            stats["deadlock_retries" if errno == ER_LOCK_DEADLOCK else "lock_timeout_retries"] += 1
+            return True
+
+    def backoff(self, attempt: int) -> float:
+        """Thời gian chờ (giây) trước lần chạy thứ attempt + 1: ngẫu nhiên trong [0, base * 2^(attempt-1)]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def record_outcome(self, database_id: int, retries: int, succeeded: bool) -> None:
+        if retries == 0:
+            return
+        with self._lock:
+            self._db_stats(database_id)["succeeded_after_retry" if succeeded else "gave_up"] += 1
+
+    def _db_stats(self, database_id: int) -> Dict[str, int]:
+        stats = self._stats.get(database_id)
+        if stats is None:
+            stats = {"retries": 0, "deadlock_retries": 0, "lock_timeout_retries": 0,
+                     "succeeded_after_retry": 0, "gave_up": 0, "budget_exhausted": 0}
+            self._stats[database_id] = stats
+        return stats
+
+    def stats(self, database_id: int) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._db_stats(database_id))
+            stats["budget_tokens"] = round(self._tokens.get(database_id, self.budget_max), 2)
+        stats["max_attempts"] = self.max_attempts
+        return stats
+
+
+# Policy dùng chung toàn process
+query_retry_policy = RetryPolicy(
+    max_attempts=int(os.getenv("SQL_RETRY_MAX_ATTEMPTS", "3")),
+    base_delay=float(os.getenv("SQL_RETRY_BASE_DELAY", "0.05")),
+    max_delay=float(os.getenv("SQL_RETRY_MAX_DELAY", "1.0")),
+    budget_ratio=float(os.getenv("SQL_RETRY_BUDGET_RATIO", "0.2")),
+    budget_max=float(os.getenv("SQL_RETRY_BUDGET_MAX", "10"))
+)
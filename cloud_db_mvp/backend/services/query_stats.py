@@ -0,0 +1,337 @@
+"""
+query_stats.py - Thống kê latency theo fingerprint query của SQL console
+- Mỗi (database, fingerprint) giữ histogram bucket cố định (array số đếm) + số lần, tổng/max thời gian, tổng rows
+- Executor chỉ đẩy (database, query, ms, rows) vào hàng đợi; fingerprint + gộp chạy ở thread nền
+  -> không thêm độ trễ vào request
+- Thread nền flush định kỳ phần tăng thêm vào bảng query_stats (metadata DB)
+- p50/p95/p99 nội suy tuyến tính trong bucket (sai số tối đa bằng độ rộng bucket)
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Database, QueryStat
+from services.query_fingerprint import fingerprint
+
+# Cận trên (ms) của các bucket latency; thêm một bucket cuối cho > 30s
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+# Query rất dài (INSERT nhiều VALUES...) chỉ fingerprint phần đầu
+MAX_FINGERPRINT_CHARS = 16384
+
+SORT_KEYS = ("total_time", "calls", "avg_time", "p95", "rows")
+
+
+class LatencyHistogram:
+    """Số đếm theo bucket latency cố định + các tổng (gộp được bằng phép cộng)"""
+
+    __slots__ = ("counts", "calls", "total_ms", "max_ms", "rows")
+
+    def __init__(self):
+        self.counts = array("L", [0] * (len(LATENCY_BUCKETS_MS) + 1))
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+    def add(self, elapsed_ms: float, rows: int) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += max(rows, 0)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.calls += other.calls
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.rows += other.rows
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Giá trị ước lượng tại phân vị q (0..1): nội suy trong bucket chứa rank, không vượt max"""
+        if self.calls == 0:
+            return None
+        rank = q * self.calls
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0.0
+                upper = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+                value = lower + (upper - lower) * (rank - cumulative) / count
+                return round(min(value, self.max_ms), 2)
+            cumulative += count
+        return round(self.max_ms, 2)
+
+
+class _FingerprintStats:
+    __slots__ = ("fingerprint", "query_type", "histogram", "first_seen", "last_seen")
+
+    def __init__(self, text: str, query_type: Optional[str], seen: float):
+        self.fingerprint = text
+        self.query_type = query_type
+        self.histogram = LatencyHistogram()
+        self.first_seen = seen
+        self.last_seen = seen
+
+    def merge(self, other: "_FingerprintStats") -> None:
+        self.histogram.merge(other.histogram)
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_seen = max(self.last_seen, other.last_seen)
+
+    @classmethod
+    def from_row(cls, row: QueryStat) -> "_FingerprintStats":
+        entry = cls(row.fingerprint, row.query_type, row.first_seen.timestamp() if row.first_seen else 0.0)
+        entry.last_seen = row.last_seen.timestamp() if row.last_seen else entry.first_seen
+        hist = entry.histogram
+        counts = json.loads(row.histogram or "[]")
+        for i, count in enumerate(counts[:len(hist.counts)]):
+            hist.counts[i] = count
+        hist.calls = row.calls or 0
+        hist.total_ms = row.total_time_ms or 0.0
+        hist.max_ms = row.max_time_ms or 0.0
+        hist.rows = row.rows_total or 0
+        return entry
+
+    def to_dict(self, fingerprint_id: str) -> Dict[str, Any]:
+        hist = self.histogram
+        return {
+            "fingerprint_id": fingerprint_id,
+            "fingerprint": self.fingerprint,
+            "query_type": self.query_type,
+            "calls": hist.calls,
+            "total_time_ms": round(hist.total_ms, 2),
+            "avg_time_ms": round(hist.total_ms / hist.calls, 2) if hist.calls else 0.0,
+            "max_time_ms": round(hist.max_ms, 2),
+            "p50_ms": hist.percentile(0.50),
+            "p95_ms": hist.percentile(0.95),
+            "p99_ms": hist.percentile(0.99),
+            "rows_total": hist.rows,
+            "avg_rows": round(hist.rows / hist.calls, 2) if hist.calls else 0.0,
+            "histogram": list(hist.counts),
+            "first_seen": datetime.fromtimestamp(self.first_seen) if self.first_seen else None,
+            "last_seen": datetime.fromtimestamp(self.last_seen) if self.last_seen else None,
+        }
+
+
+class QueryStatsCollector:
+    """
+    Hàng đợi mẫu (không chặn request) -> histogram theo fingerprint trong memory -> flush vào metadata DB
+    Flush chỉ ghi phần tăng thêm (delta) từ lần flush trước: nhiều worker process cùng cộng dồn vào một row
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_interval: float = 60.0,
+        max_queued: int = 10000,
+        max_fingerprints: int = 5000,
+        drain_batch: int = 256
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval  # giây, 0 = không chạy thread nền (chỉ flush khi gọi)
+        self.max_queued = max_queued
+        self.max_fingerprints = max_fingerprints  # số (database, fingerprint) chưa flush tối đa
+        self.drain_batch = drain_batch
+        self._queue: Deque[Tuple[int, str, Optional[str], float, int, float]] = deque()
+        self._cond = threading.Condition()
+        self._pending: Dict[Tuple[int, str], _FingerprintStats] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_flush = time.monotonic()
+        self._stats = {"recorded": 0, "dropped": 0, "flushes": 0, "flush_errors": 0, "rows_written": 0}
+
+    def record(self, database_id: int, query: str, query_type: Optional[str], elapsed_ms: float, rows: int) -> None:
+        """Gọi trên request path: chỉ append vào hàng đợi (hàng đợi đầy -> bỏ mẫu, đếm dropped)"""
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                self._stats["dropped"] += 1
+                return
+            self._queue.append((database_id, query, query_type, float(elapsed_ms), int(rows or 0), time.time()))
+            self._stats["recorded"] += 1
+            if self._thread is None and self.flush_interval > 0:
+                self._thread = threading.Thread(target=self._run, name="query-stats", daemon=True)
+                self._thread.start()
+            if len(self._queue) >= self.drain_batch:
+                self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                remaining = self.flush_interval - (time.monotonic() - self._last_flush)
+                if remaining > 0 and len(self._queue) < self.drain_batch:
+                    self._cond.wait(remaining)
+            try:
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    self.flush()
+                else:
+                    self._drain()
+            except Exception as e:
+                print(f"Warning: could not flush query stats: {e}")
+
+    def _drain(self) -> None:
+        """Fingerprint các mẫu đang chờ và cộng vào histogram chưa flush"""
+        with self._cond:
+            items = list(self._queue)
+            self._queue.clear()
+        if not items:
+            return
+
+        folded: Dict[Tuple[int, str], _FingerprintStats] = {}
+        for database_id, query, query_type, elapsed_ms, rows, seen in items:
+            text = fingerprint(query[:MAX_FINGERPRINT_CHARS])
+            key = (database_id, hashlib.sha1(text.encode("utf-8")).hexdigest()[:16])
+            entry = folded.get(key)
+            if entry is None:
+                entry = folded[key] = _FingerprintStats(text, query_type, seen)
+            entry.histogram.add(elapsed_ms, rows)
+            entry.last_seen = max(entry.last_seen, seen)
+
+        dropped = 0
+        with self._lock:
+            for key, entry in folded.items():
+                current = self._pending.get(key)
+                if current is not None:
+                    current.merge(entry)
+                elif len(self._pending) < self.max_fingerprints:
+                    self._pending[key] = entry
+                else:
+                    dropped += entry.histogram.calls
+        if dropped:
+            self._count("dropped", dropped)
+
+    def flush(self) -> int:
+        """Cộng phần tăng thêm vào bảng query_stats; Returns: số row được ghi"""
+        self._drain()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        db = self.session_factory()
+        written = 0
+        try:
+            by_database: Dict[int, Dict[str, _FingerprintStats]] = {}
+            for (database_id, fingerprint_id), entry in pending.items():
+                by_database.setdefault(database_id, {})[fingerprint_id] = entry
+            # Database đã bị xóa khỏi metadata -> bỏ mẫu (không vi phạm foreign key)
+            known = {row[0] for row in db.query(Database.id).filter(Database.id.in_(list(by_database))).all()}
+
+            for database_id, entries in by_database.items():
+                if database_id not in known:
+                    continue
+                existing = {
+                    row.fingerprint_id: row
+                    for row in db.query(QueryStat).filter(
+                        QueryStat.database_id == database_id,
+                        QueryStat.fingerprint_id.in_(list(entries))
+                    ).with_for_update().all()
+                }
+                for fingerprint_id, entry in entries.items():
+                    row = existing.get(fingerprint_id)
+                    if row is None:
+                        merged = entry
+                        row = QueryStat(database_id=database_id, fingerprint_id=fingerprint_id,
+                                        fingerprint=entry.fingerprint, query_type=entry.query_type)
+                        db.add(row)
+                    else:
+                        merged = _FingerprintStats.from_row(row)
+                        merged.merge(entry)
+                    hist = merged.histogram
+                    row.calls = hist.calls
+                    row.total_time_ms = hist.total_ms
+                    row.max_time_ms = hist.max_ms
+                    row.rows_total = hist.rows
+                    row.histogram = json.dumps(list(hist.counts))
+                    row.first_seen = datetime.fromtimestamp(merged.first_seen)
+                    row.last_seen = datetime.fromtimestamp(merged.last_seen)
+                    written += 1
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Giữ lại delta cho lần flush sau
+            with self._lock:
+                for key, entry in pending.items():
+                    current = self._pending.get(key)
+                    if current is None:
+                        self._pending[key] = entry
+                    else:
+                        current.merge(entry)
+            self._count("flush_errors")
+            raise
+        finally:
+            db.close()
+
+        self._count("flushes")
+        self._count("rows_written", written)
+        return written
+
+    def snapshot(self, db: Session, database_id: int, sort: str = "total_time", limit: int = 50) -> Dict[str, Any]:
+        """Thống kê đã flush + phần chưa flush của database, sắp xếp theo sort (giảm dần)"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unsupported sort '{sort}'. Use one of: {', '.join(SORT_KEYS)}")
+        self._drain()
+
+        merged: Dict[str, _FingerprintStats] = {
+            row.fingerprint_id: _FingerprintStats.from_row(row)
+            for row in db.query(QueryStat).filter(QueryStat.database_id == database_id).all()
+        }
+        pending_calls = 0
+        with self._lock:
+            for (entry_db, fingerprint_id), entry in self._pending.items():
+                if entry_db != database_id:
+                    continue
+                pending_calls += entry.histogram.calls
+                current = merged.get(fingerprint_id)
+                if current is None:
+                    current = merged[fingerprint_id] = _FingerprintStats(entry.fingerprint, entry.query_type, entry.first_seen)
+                current.merge(entry)
+
+        items = [entry.to_dict(fingerprint_id) for fingerprint_id, entry in merged.items()]
+        sort_field = {"total_time": "total_time_ms", "calls": "calls", "avg_time": "avg_time_ms",
+                      "p95": "p95_ms", "rows": "rows_total"}[sort]
+        items.sort(key=lambda item: item[sort_field] or 0, reverse=True)
+        return {
+            "database_id": database_id,
+            "buckets_ms": list(LATENCY_BUCKETS_MS),
+            "sort": sort,
+            "total_fingerprints": len(items),
+            "unflushed_calls": pending_calls,
+            "fingerprints": items[:limit],
+        }
+
+    def clear(self) -> None:
+        with self._cond:
+            self._queue.clear()
+        with self._lock:
+            self._pending.clear()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._cond:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._queue)
+        with self._lock:
+            stats["pending_fingerprints"] = len(self._pending)
+        return stats
+
+
+# Collector dùng chung toàn process
+query_stats = QueryStatsCollector(
+    flush_interval=float(os.getenv("SQL_QUERY_STATS_FLUSH_SECONDS", "60")),
+    max_queued=int(os.getenv("SQL_QUERY_STATS_MAX_QUEUED", "10000")),
+    max_fingerprints=int(os.getenv("SQL_QUERY_STATS_MAX_FINGERPRINTS", "5000"))
+)
@@ -0,0 +1,121 @@
+"""
+query_watchdog.py - Dừng statement chạy quá lâu hoặc khi client đã ngắt kết nối
+- QueryWatchdog: một thread duy nhất giữ heap deadline, tới hạn thì KILL QUERY
+- QueryControl: token cancel gắn với một request, biết connection id đang chạy statement
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Optional
+
+
+class WatchHandle:
+    """
+    Một statement đang được theo dõi; cancel() khi statement xong, trước khi trả connection về pool
+    cancel() chờ KILL đang gửi (nếu có) xong -> KILL không bao giờ trúng statement của request khác
+    """
+
+    def __init__(self, thread_id: int, deadline: float):
+        self.thread_id = thread_id
+        self.deadline = deadline
+        self.cancelled = False
+        self.fired = False
+        self.lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancelled = True
+
+
+class QueryWatchdog:
+    """
+    Theo dõi deadline của các statement đang chạy
+    Không tạo Timer thread cho mỗi statement: một thread daemon ngủ tới deadline gần nhất
+    """
+
+    def __init__(self, kill_fn: Callable[[int], bool]):
+        self.kill_fn = kill_fn
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.kills = 0
+
+    def watch(self, thread_id: int, timeout: float) -> WatchHandle:
+        handle = WatchHandle(thread_id, time.monotonic() + timeout)
+        with self._cond:
+            heapq.heappush(self._heap, (handle.deadline, next(self._seq), handle))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="query-watchdog", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return handle
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                deadline, _, handle = self._heap[0]
+                if handle.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            # KILL ngoài lock của heap (admin connection có thể chậm), giữ lock của handle
+            with handle.lock:
+                if handle.cancelled:
+                    continue
+                handle.fired = True
+                self.kills += 1
+                try:
+                    self.kill_fn(handle.thread_id)
+                except Exception as e:
+                    print(f"Warning: watchdog could not kill query {handle.thread_id}: {e}")
+
+
+class QueryControl:
+    """
+    Token cancel của một request: executor ghi connection id khi bắt đầu chạy,
+    endpoint gọi cancel() khi client ngắt kết nối
+    """
+
+    def __init__(self):
+        self.thread_id: Optional[int] = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def attach(self, thread_id: int) -> bool:
+        """Executor gọi sau khi có connection; False nếu request đã bị cancel trước đó"""
+        with self._lock:
+            self.thread_id = thread_id
+            return not self.cancelled
+
+    def detach(self) -> None:
+        """Gọi trước khi trả connection về pool (chờ KILL đang gửi xong)"""
+        with self._lock:
+            self.thread_id = None
+
+    def cancel(self, kill_fn: Callable[[int], bool]) -> None:
+        with self._lock:
+            self.cancelled = True
+            if self.thread_id is not None:
+                kill_fn(self.thread_id)
+
+
+_watchdog = None
+_watchdog_lock = threading.Lock()
+
+
+def get_watchdog(kill_fn: Callable[[int], bool]) -> QueryWatchdog:
+    """Watchdog dùng chung toàn process (khởi tạo lazy)"""
+    global _watchdog
+    with _watchdog_lock:
+        if _watchdog is None:
+            _watchdog = QueryWatchdog(kill_fn)
+        return _watchdog
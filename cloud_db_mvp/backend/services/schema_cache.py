@@ -0,0 +1,217 @@
+"""
+schema_cache.py - Cache metadata schema (tables, columns, keys, unique constraints) theo database
+- Load một lần bằng vài query information_schema gộp cho cả database (không query theo từng table)
+- Dùng chung cho executor (warning INSERT), bulk ingest, schema browser
+- Invalidate khi executor chạy DDL, sau restore/import; TTL phòng khi tenant đổi schema từ client ngoài
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+_COLUMNS_SQL = """
+    SELECT TABLE_NAME, COLUMN_NAME, ORDINAL_POSITION, DATA_TYPE, COLUMN_TYPE,
+           IS_NULLABLE, COLUMN_DEFAULT, EXTRA, COLUMN_KEY
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+_TABLES_SQL = """
+    SELECT TABLE_NAME, TABLE_TYPE, ENGINE, TABLE_ROWS, DATA_LENGTH, INDEX_LENGTH
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+_INDEXES_SQL = """
+    SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME
+    FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+    ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+"""
+
+_FOREIGN_KEYS_SQL = """
+    SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+    ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+"""
+
+# Thống kê ước lượng, không phải cấu trúc schema
+_VOLATILE_KEYS = ("rows_estimate", "data_bytes", "index_bytes")
+
+
+def load_schema(conn) -> Dict[str, Any]:
+    """
+    Đọc toàn bộ schema của database hiện tại (DATABASE() của connection)
+    Returns: {"tables": {name: {...}}, "loaded_at": float, "version": str}
+    """
+    cur = conn.cursor()
+    try:
+        tables = {}
+        cur.execute(_TABLES_SQL)
+        for name, table_type, engine, table_rows, data_length, index_length in cur.fetchall():
+            tables[name] = {
+                "name": name,
+                "type": table_type,
+                "engine": engine,
+                "rows_estimate": int(table_rows) if table_rows is not None else None,
+                "data_bytes": int(data_length or 0),
+                "index_bytes": int(index_length or 0),
+                "columns": [],
+                "primary_key": [],
+                "unique_keys": {},
+                "indexes": {},
+                "foreign_keys": {},
+            }
+
+        cur.execute(_COLUMNS_SQL)
+        for table, column, _, data_type, column_type, is_nullable, default, extra, column_key in cur.fetchall():
+            if table not in tables:
+                continue
+            tables[table]["columns"].append({
+                "name": column,
+                "data_type": (data_type or "").lower(),
+                "column_type": column_type,
+                "nullable": is_nullable == "YES",
+                "default": default,
+                "extra": (extra or "").lower(),
+                "key": column_key or "",
+            })
+
+        cur.execute(_INDEXES_SQL)
+        for table, index_name, non_unique, _, column in cur.fetchall():
+            if table not in tables:
+                continue
+            info = tables[table]
+            index = info["indexes"].setdefault(index_name, {"columns": [], "unique": not int(non_unique)})
+            index["columns"].append(column)
+            if index_name == "PRIMARY":
+                info["primary_key"].append(column)
+            elif not int(non_unique):
+                info["unique_keys"].setdefault(index_name, []).append(column)
+
+        cur.execute(_FOREIGN_KEYS_SQL)
+        for table, constraint, column, ref_table, ref_column in cur.fetchall():
+            if table not in tables:
+                continue
+            fk = tables[table]["foreign_keys"].setdefault(
+                constraint, {"columns": [], "referenced_table": ref_table, "referenced_columns": []}
+            )
+            fk["columns"].append(column)
+            fk["referenced_columns"].append(ref_column)
+    finally:
+        cur.close()
+
+    # version: hash nội dung schema (bỏ số rows/dung lượng vì thay đổi liên tục) -> dùng làm ETag
+    digest = hashlib.sha1(json.dumps(
+        {name: {k: v for k, v in info.items() if k not in _VOLATILE_KEYS} for name, info in tables.items()},
+        sort_keys=True, default=str
+    ).encode("utf-8")).hexdigest()
+    return {"tables": tables, "loaded_at": time.time(), "version": digest}
+
+
+def find_table(schema: Dict[str, Any], table: str) -> Optional[Dict[str, Any]]:
+    """Tìm table theo tên (khớp chính xác trước, sau đó không phân biệt hoa thường)"""
+    tables = schema["tables"]
+    if table in tables:
+        return tables[table]
+    lowered = table.lower()
+    for name, info in tables.items():
+        if name.lower() == lowered:
+            return info
+    return None
+
+
+def serialize_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Schema cache -> JSON cho schema browser (tables sắp theo tên, indexes/foreign keys dạng list)"""
+    tables = []
+    for name in sorted(schema["tables"]):
+        info = schema["tables"][name]
+        tables.append({
+            "name": name,
+            "type": info["type"],
+            "engine": info["engine"],
+            "rows_estimate": info["rows_estimate"],
+            "data_bytes": info["data_bytes"],
+            "index_bytes": info["index_bytes"],
+            "columns": info["columns"],
+            "primary_key": info["primary_key"],
+            "indexes": [
+                {"name": index_name, "columns": index["columns"], "unique": index["unique"]}
+                for index_name, index in info["indexes"].items()
+            ],
+            "foreign_keys": [
+                {"name": fk_name, **fk} for fk_name, fk in info["foreign_keys"].items()
+            ],
+        })
+    return {
+        "version": schema["version"],
+        "loaded_at": datetime.fromtimestamp(schema["loaded_at"]).isoformat(),
+        "table_count": len(tables),
+        "tables": tables,
+    }
+
+
+class SchemaCache:
+    """Cache schema theo database_id (thread-safe), mỗi entry có TTL"""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+
+    def get(self, database_id: int, loader: Callable[[], Dict[str, Any]], refresh: bool = False) -> Dict[str, Any]:
+        """
+        Lấy schema từ cache; miss/hết TTL/refresh -> gọi loader() (chạy ngoài lock)
+        Kết quả load bị bỏ nếu database bị invalidate trong lúc đang load
+        """
+        with self._lock:
+            entry = self._entries.get(database_id)
+            if entry is not None and not refresh and time.time() - entry["loaded_at"] < self.ttl:
+                self._stats["hits"] += 1
+                return entry
+            self._stats["misses"] += 1
+            generation = self._generations.get(database_id, 0)
+
+        schema = loader()
+        with self._lock:
+            self._stats["loads"] += 1
+            if self._generations.get(database_id, 0) == generation:
+                self._entries[database_id] = schema
+        return schema
+
+    def peek(self, database_id: int) -> Optional[Dict[str, Any]]:
+        """Schema đang cache (không load, không kiểm tra TTL)"""
+        with self._lock:
+            return self._entries.get(database_id)
+
+    def invalidate(self, database_id: int) -> bool:
+        with self._lock:
+            self._generations[database_id] = self._generations.get(database_id, 0) + 1
+            removed = self._entries.pop(database_id, None) is not None
+            if removed:
+                self._stats["invalidations"] += 1
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["databases"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+# Cache dùng chung toàn process
+schema_cache = SchemaCache(ttl=float(os.getenv("SQL_SCHEMA_CACHE_TTL", "300")))
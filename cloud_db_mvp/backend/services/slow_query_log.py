@@ -0,0 +1,210 @@
+"""
+slow_query_log.py - Ghi slow query của SQL console vào bảng slow_queries (write-behind)
+- Executor chỉ đẩy query chạy quá ngưỡng vào buffer có giới hạn -> không thêm độ trễ vào request
+- Thread nền lấy EXPLAIN FORMAT=JSON trên connection tenant (mượn từ pool) rồi ghi theo lô vào metadata DB
+- rows_sent: số rows trả về cho client; rows_examined: ước lượng từ plan (cost guard hoặc EXPLAIN)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+import pymysql
+from database import SessionLocal
+from models import SlowQuery
+from services.query_cost_guard import estimate_rows_examined
+from services.sql_tokenizer import to_pyformat
+
+# Loại lệnh EXPLAIN được (EXPLAIN không thực thi lệnh ghi)
+EXPLAINABLE_TYPES = ("SELECT", "INSERT", "UPDATE", "DELETE")
+# Giới hạn kích thước lưu (cột TEXT của MySQL tối đa 64KB)
+MAX_QUERY_TEXT = 16384
+MAX_PLAN_TEXT = 65000
+
+
+class SlowQueryLog:
+    """Buffer slow query + thread nền EXPLAIN và ghi vào metadata DB"""
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        threshold_ms: float = 1000.0,
+        max_queued: int = 1000,
+        batch_size: int = 50,
+        explain_enabled: bool = True,
+        background: bool = True
+    ):
+        self.session_factory = session_factory
+        self.threshold_ms = threshold_ms  # <= 0: tắt
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.explain_enabled = explain_enabled
+        self.background = background  # False: chỉ ghi khi gọi process_pending() (tests)
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {"captured": 0, "dropped": 0, "written": 0, "explains": 0, "explain_errors": 0, "write_errors": 0}
+        # Cùng bộ đếm theo database -> API của tenant chỉ thấy số của database mình
+        self._db_stats: Dict[int, Dict[str, int]] = {}
+
+    def is_slow(self, elapsed_ms: float) -> bool:
+        return self.threshold_ms > 0 and elapsed_ms >= self.threshold_ms
+
+    def capture(
+        self,
+        target: Dict[str, Any],
+        connect: Callable[[Dict[str, Any]], Any],
+        query: str,
+        params: Optional[List[Any]],
+        query_type: str,
+        elapsed_ms: float,
+        rows_sent: Optional[int],
+        rows_examined: Optional[int] = None
+    ) -> bool:
+        """
+        Gọi trên request path: chỉ append vào buffer (đầy -> bỏ, đếm dropped)
+        connect: hàm mượn connection tenant cho EXPLAIN ở thread nền
+        """
+        if not self.is_slow(elapsed_ms):
+            return False
+        item = {
+            "target": target,
+            "connect": connect,
+            "query": query,
+            "params": list(params) if params is not None else None,
+            "query_type": query_type,
+            "duration_ms": round(elapsed_ms, 2),
+            "rows_sent": rows_sent,
+            "rows_examined": rows_examined,
+            "timestamp": datetime.now(),
+        }
+        database_id = target["database_id"]
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                self._increment("dropped", database_id)
+                return False
+            self._queue.append(item)
+            self._increment("captured", database_id)
+            if self._thread is None and self.background:
+                self._thread = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            try:
+                self.process_pending()
+            except Exception as e:
+                print(f"Warning: could not write slow queries: {e}")
+                time.sleep(1.0)
+
+    def process_pending(self) -> int:
+        """EXPLAIN + ghi các slow query đang chờ theo lô; Returns: số row đã ghi"""
+        written = 0
+        while True:
+            with self._cond:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                return written
+            for item in batch:
+                if self.explain_enabled and item["query_type"] in EXPLAINABLE_TYPES:
+                    self._explain(item)
+            written += self._write(batch)
+
+    def _explain(self, item: Dict[str, Any]) -> None:
+        """EXPLAIN FORMAT=JSON trên connection tenant; lỗi (cú pháp, table đã bị xóa...) -> bỏ qua plan"""
+        database_id = item["target"]["database_id"]
+        self._count("explains", database_id)
+        conn = None
+        try:
+            conn = item["connect"](item["target"])
+            cur = conn.cursor()
+            try:
+                if item["params"] is not None:
+                    cur.execute("EXPLAIN FORMAT=JSON " + to_pyformat(item["query"]), item["params"])
+                else:
+                    cur.execute("EXPLAIN FORMAT=JSON " + item["query"])
+                plan = json.loads(cur.fetchone()[0])
+            finally:
+                cur.close()
+            conn.close()
+            conn = None
+        except Exception as e:
+            self._count("explain_errors", database_id)
+            if conn is not None:
+                if isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+                    conn.invalidate()
+                else:
+                    conn.close()
+            return
+
+        if item["rows_examined"] is None:
+            item["rows_examined"] = estimate_rows_examined(plan)[0]
+        compact = json.dumps(plan, separators=(",", ":"))
+        item["explain_plan"] = compact if len(compact) <= MAX_PLAN_TEXT else None
+
+    def _write(self, batch: List[Dict[str, Any]]) -> int:
+        db = self.session_factory()
+        try:
+            for item in batch:
+                db.add(SlowQuery(
+                    database_id=item["target"]["database_id"],
+                    query_text=item["query"][:MAX_QUERY_TEXT],
+                    duration_ms=item["duration_ms"],
+                    rows_examined=item["rows_examined"],
+                    rows_sent=item["rows_sent"],
+                    explain_plan=item.get("explain_plan"),
+                    timestamp=item["timestamp"]
+                ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            for item in batch:
+                self._count("write_errors", item["target"]["database_id"])
+            raise
+        finally:
+            db.close()
+        for item in batch:
+            self._count("written", item["target"]["database_id"])
+        return len(batch)
+
+    def clear(self) -> None:
+        with self._cond:
+            self._queue.clear()
+
+    def _count(self, name: str, database_id: int) -> None:
+        with self._cond:
+            self._increment(name, database_id)
+
+    def _increment(self, name: str, database_id: int) -> None:
+        """(Giữ lock) Tăng bộ đếm toàn process và của database"""
+        self._stats[name] += 1
+        db_stats = self._db_stats.setdefault(database_id, dict.fromkeys(self._stats, 0))
+        db_stats[name] += 1
+
+    def stats(self, database_id: Optional[int] = None) -> Dict[str, Any]:
+        """Bộ đếm của một database, hoặc toàn process khi database_id là None"""
+        with self._cond:
+            if database_id is None:
+                stats = dict(self._stats)
+                stats["queued"] = len(self._queue)
+            else:
+                stats = dict(self._db_stats.get(database_id) or dict.fromkeys(self._stats, 0))
+                stats["queued"] = sum(1 for item in self._queue if item["target"]["database_id"] == database_id)
+        stats["threshold_ms"] = self.threshold_ms
+        return stats
+
+
+# Slow query log dùng chung toàn process
+slow_query_log = SlowQueryLog(
+    threshold_ms=float(os.getenv("SQL_SLOW_QUERY_MS", "1000")),
+    max_queued=int(os.getenv("SQL_SLOW_QUERY_MAX_QUEUED", "1000")),
+    explain_enabled=os.getenv("SQL_SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true", "yes")
+)
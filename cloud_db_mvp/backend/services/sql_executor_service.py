@@ -4,30 +4,155 @@ sql_executor_service.py - Service để execute SQL queries trên database
 - Execute non-SELECT queries (INSERT, UPDATE, DELETE, etc.)
 - Validate SQL queries
 - Limit query execution time và result size
+- Stream toàn bộ kết quả SELECT ra CSV / NDJSON
+- Cache kết quả SELECT, invalidate khi có lệnh ghi
+- Chạy batch/script nhiều statement trên một connection (tùy chọn trong một transaction)
+- Parameterized query ('?' + params) với prepared statement cache theo connection
+- Giới hạn thời gian chạy mỗi statement (MAX_EXECUTION_TIME / watchdog KILL QUERY)
+- Schema metadata cache dùng chung (invalidate khi chạy DDL)
+- Cost guard: EXPLAIN trước SELECT, cảnh báo / thêm LIMIT / từ chối theo ngưỡng của gói
+- Admission control: giới hạn số statement đồng thời theo database và toàn process (xếp hàng có timeout)
+- Ghi latency / rows của mỗi statement vào histogram theo fingerprint (services/query_stats.py)
+- Query chạy quá ngưỡng được ghi vào slow_queries kèm EXPLAIN (write-behind, services/slow_query_log.py)
+- Tùy chọn retry statement ghi khi deadlock / lock wait timeout (backoff có jitter + retry budget)
 """
 
 import os
-from typing import List, Dict, Optional, Any
+import io
+import csv
+import json
+import zlib
+from datetime import datetime, date, time as dt_time
+import pymysql
+from pymysql.constants import FIELD_TYPE
+from typing import List, Dict, Optional, Any, Tuple, Iterator
 from sqlalchemy.orm import Session
 from models import Database
 from services.mysql_service import MySQLService
+from services.query_result_cache import query_result_cache, is_cacheable, normalize_sql
+from services.sql_tokenizer import split_statements, find_placeholders, to_pyformat, insert_target
+from services.query_watchdog import QueryControl, get_watchdog
+from services.schema_cache import schema_cache, load_schema, find_table
+from services.query_cost_guard import query_cost_guard, QueryRejectedError
+from services.query_admission import AdmissionTicket, query_admission
+from services.query_stats import query_stats
+from services.slow_query_log import slow_query_log
+from services.query_retry import query_retry_policy, conflict_errno, RETRYABLE_TYPES, ER_LOCK_DEADLOCK
+from collections import OrderedDict
 import re
+import threading
+
+# MySQL error: "This command is not supported in the prepared statement protocol yet"
+ER_UNSUPPORTED_PS = 1295
+# MySQL error: "Unknown prepared statement handler" (statement đã mất phía server)
+ER_UNKNOWN_STMT_HANDLER = 1243
+# MySQL error: "Query execution was interrupted" (KILL QUERY)
+ER_QUERY_INTERRUPTED = 1317
+# MySQL error: "maximum statement execution time exceeded" (MAX_EXECUTION_TIME)
+ER_QUERY_TIMEOUT = 3024
+
+_SELECT_PREFIX_RE = re.compile(r"^SELECT\b", re.IGNORECASE)
+
+# Đếm số statement bị timeout / bị hủy theo database (toàn process)
+_interrupt_counts: Dict[int, Dict[str, int]] = {}
+_interrupt_lock = threading.Lock()
+
+
+class QueryTimeoutError(Exception):
+    """Statement chạy quá SQL_MAX_EXECUTION_TIME và đã bị MySQL dừng"""
+
+
+class QueryCancelledError(Exception):
+    """Statement bị hủy vì client đã ngắt kết nối"""
+
+
+class QueryConflictError(Exception):
+    """Statement ghi thất bại vì deadlock / lock wait timeout (sau các lần retry nếu có bật)"""
+
+    def __init__(self, message: str, retries: int = 0):
+        super().__init__(message)
+        self.retries = retries
+
+
+def _iso(val: Any) -> str:
+    return val.isoformat()
+
+
+def _bits_to_int(val: Any) -> int:
+    return int.from_bytes(val, "big") if isinstance(val, (bytes, bytearray)) else int(val)
+
 
 class SQLExecutorService:
+    EXPORT_FORMATS = ("csv", "ndjson")
+    RESULT_FORMATS = ("rows", "columnar")
+    # Các loại lệnh không thay đổi dữ liệu (không cần invalidate result cache)
+    READ_ONLY_TYPES = ("SELECT", "SHOW", "DESCRIBE", "EXPLAIN")
+    
+    # MySQL field type -> (tên kiểu trả cho client, converter; None = giữ nguyên giá trị)
+    _COLUMN_TYPES = {
+        FIELD_TYPE.TINY: ("int", None),
+        FIELD_TYPE.SHORT: ("int", None),
+        FIELD_TYPE.LONG: ("int", None),
+        FIELD_TYPE.LONGLONG: ("int", None),
+        FIELD_TYPE.INT24: ("int", None),
+        FIELD_TYPE.YEAR: ("int", None),
+        FIELD_TYPE.FLOAT: ("float", None),
+        FIELD_TYPE.DOUBLE: ("float", None),
+        FIELD_TYPE.DECIMAL: ("decimal", str),
+        FIELD_TYPE.NEWDECIMAL: ("decimal", str),
+        FIELD_TYPE.DATE: ("date", _iso),
+        FIELD_TYPE.DATETIME: ("datetime", _iso),
+        FIELD_TYPE.TIMESTAMP: ("datetime", _iso),
+        FIELD_TYPE.TIME: ("time", str),
+        FIELD_TYPE.BIT: ("int", _bits_to_int),
+        FIELD_TYPE.JSON: ("json", None),
+    }
+    
     def __init__(self):
         self.mysql_service = MySQLService()
         self.max_result_rows = int(os.getenv("SQL_MAX_RESULT_ROWS", "1000"))
-        self.max_execution_time = int(os.getenv("SQL_MAX_EXECUTION_TIME", "30"))  # seconds
+        self.max_result_bytes = int(os.getenv("SQL_MAX_RESULT_BYTES", str(5 * 1024 * 1024)))
+        self.fetch_chunk_rows = int(os.getenv("SQL_FETCH_CHUNK_ROWS", "200"))
+        self.max_execution_time = int(os.getenv("SQL_MAX_EXECUTION_TIME", "30"))  # seconds, 0 = không giới hạn
+        # Export stream toàn bộ kết quả (có thể rất lớn / client đọc chậm) -> giới hạn riêng, dài hơn
+        self.export_max_execution_time = int(os.getenv("SQL_EXPORT_MAX_EXECUTION_TIME", "600"))  # seconds, 0 = không giới hạn
+        self.cache_enabled = os.getenv("SQL_RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.max_batch_statements = int(os.getenv("SQL_MAX_BATCH_STATEMENTS", "500"))
+        # Số prepared statement giữ trên mỗi connection tenant (0 = tắt, bind phía client)
+        self.prepared_cache_size = int(os.getenv("SQL_PREPARED_CACHE_SIZE", "32"))
+        self.cost_guard_enabled = os.getenv("SQL_COST_GUARD_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.cost_guard = query_cost_guard
+        self.admission = query_admission
+        self.query_stats_enabled = os.getenv("SQL_QUERY_STATS_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.query_stats = query_stats
+        self.slow_query_log = slow_query_log
+        self.retry_policy = query_retry_policy
     
     def execute_query(
         self,
         db: Session,
         database_id: int,
         query: str,
-        user_id: int
+        user_id: int,
+        result_format: str = "rows",
+        use_cache: bool = True,
+        params: Optional[List[Any]] = None,
+        control: Optional[QueryControl] = None,
+        retry_conflicts: bool = False,
+        ticket: Optional[AdmissionTicket] = None
     ) -> Dict[str, Any]:
         """
         Execute SQL query trên database
+        params: giá trị cho các placeholder '?' trong query (bind an toàn, không nối chuỗi);
+        trên connection tenant được chạy bằng prepared statement cache theo connection
+        control: token cancel của request (client ngắt kết nối -> KILL QUERY)
+        Raise QueryTimeoutError nếu statement chạy quá max_execution_time
+        result_format: "rows" (list-of-lists string, mặc định) hoặc "columnar"
+        (mỗi cột một mảng giá trị đúng kiểu, thay "columns"/"rows" bằng "columns"/"data")
+        use_cache: False để bỏ qua result cache (luôn chạy query trên MySQL)
+        retry_conflicts: INSERT/UPDATE/DELETE bị deadlock (1213) / lock wait timeout (1205) được chạy lại
+        (backoff có jitter, giới hạn bởi retry budget của database)
+        ticket: slot admission đã được cấp trước (API chờ slot trong event loop); None -> chờ slot tại đây
         Returns: {
             "success": bool,
             "columns": List[str],
@@ -35,18 +160,21 @@ class SQLExecutorService:
             "row_count": int,
             "execution_time_ms": float,
             "message": str,
-            "affected_rows": int (for non-SELECT queries)
+            "affected_rows": int (for non-SELECT queries),
+            "truncated": bool (SELECT bị cắt theo giới hạn rows/bytes),
+            "estimated_total_rows": int (SELECT; ước lượng nếu bị cắt),
+            "timing": {"prepared", "prepared_cache_hit", "prepare_ms", "execute_ms"} (khi có params),
+            "cost_guard": {"action", "estimated_rows_examined", ...} (SELECT khi bật cost guard),
+            "retries": int (số lần chạy lại vì deadlock / lock wait timeout)
         }
+        Raise QueryRejectedError (ValueError) nếu cost guard ước lượng SELECT quá đắt cho gói của user
+        Raise QueryAdmissionError nếu database đang chạy quá nhiều query đồng thời (hàng đợi đầy / chờ quá lâu)
+        Raise QueryConflictError nếu statement vẫn bị deadlock / lock wait timeout (hết lượt retry hoặc không bật retry)
         """
-        database = db.query(Database).filter(Database.id == database_id).first()
-        if not database:
-            raise ValueError(f"Database {database_id} not found")
-        
-        if database.owner_id != user_id:
-            raise ValueError("Access denied")
+        if result_format not in self.RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format '{result_format}'. Use one of: {', '.join(self.RESULT_FORMATS)}")
         
-        if database.status != "ACTIVE":
-            raise ValueError(f"Database {database_id} is not ACTIVE")
+        target = self._get_target(db, database_id, user_id)
         
         # Validate query
         self._validate_query(query)
@@ -59,100 +187,150 @@ class SQLExecutorService:
         # Determine query type
         query_type = self._get_query_type(query)
         
-        physical_db_name = database.physical_db_name or f"db_{database.id}"
+        if params is not None:
+            placeholders = len(find_placeholders(query))
+            if placeholders != len(params):
+                raise ValueError(f"Query has {placeholders} placeholder(s) but {len(params)} parameter(s) were given")
         
-        # Lấy thông tin user của DB đó (không dùng root/admin để tránh hack quyền)
-        db_username = database.db_username or f"user_{database.id}"
-        db_password = database.db_password_hash or ""  # Password được lưu trong db_password_hash
+        # SELECT giống hệt gần đây -> trả từ cache, không chạm MySQL
+        cache_key = None
+        cache_generation = None
+        if query_type == "SELECT" and use_cache and self.cache_enabled and is_cacheable(query):
+            cache_key = query_result_cache.make_key(database_id, query, result_format, params)
+            cached = query_result_cache.get(cache_key)
+            if cached is not None:
+                return dict(cached, cached=True)
+            cache_generation = query_result_cache.generation(database_id)
         
-        if not db_password:
-            raise ValueError(f"Database user password not found. Please reset password first.")
+        cost_limits = None
+        if query_type == "SELECT" and self.cost_guard_enabled:
+            cost_limits = self.cost_guard.limits_for(db, user_id)[0]
+        
+        # Cache hit không cần slot; từ đây chiếm một slot của database tới khi xong
+        ticket = self._admit(database_id, ticket)
+        
+        retry_enabled = retry_conflicts and query_type in RETRYABLE_TYPES
+        if retry_enabled:
+            self.retry_policy.deposit(database_id)
+        retries = 0
         
         import time
-        import pymysql
-        from pymysql.constants import CLIENT
         start_time = time.time()
+        conn = None
+        watch = None
         
         try:
-            # Kết nối bằng user của DB đó (không dùng root/admin)
-            mysql_host = os.getenv('MYSQL_HOST', 'localhost')
-            mysql_port = int(os.getenv('MYSQL_PORT', 3306))
-            
-            conn = pymysql.connect(
-                host=mysql_host,
-                port=mysql_port,
-                user=db_username,
-                password=db_password,
-                database=physical_db_name,
-                client_flag=CLIENT.MULTI_STATEMENTS,
-                autocommit=False,  # Không autocommit để có thể rollback nếu cần
-                connect_timeout=10,
-                ssl={'check_hostname': False} if mysql_host != 'localhost' else None
-            )
-            cur = conn.cursor()
+            # Kết nối bằng user của DB đó (không dùng root/admin), lấy từ pool theo tenant
+            conn = self._connect(target)
+            guard = None
+            run_query = query
+            if cost_limits is not None:
+                # +1 row: vẫn nhận biết được kết quả bị cắt như khi không có LIMIT
+                guard = self.cost_guard.check(conn, database_id, query, params, cost_limits, self.max_result_rows + 1)
+                run_query = guard.pop("query")
+            watch = self._begin_statement(conn, query_type, control)
+            if query_type == "SELECT":
+                # Unbuffered cursor: rows được đọc dần từ server thay vì load hết vào memory
+                cur = conn.cursor(pymysql.cursors.SSCursor)
+            else:
+                cur = conn.cursor()
             
             # Execute query
-            cur.execute(query)
-            
-            execution_time = (time.time() - start_time) * 1000  # Convert to ms
+            while True:
+                try:
+                    timing = self._execute(conn, cur, self._with_time_limit(run_query, query_type), params)
+                    break
+                except pymysql.err.OperationalError as e:
+                    # InnoDB đã rollback statement (deadlock: cả transaction) -> chạy lại trên cùng connection
+                    if not retry_enabled or (control is not None and control.cancelled) \
+                            or not self.retry_policy.allow_retry(database_id, e, retries + 1):
+                        raise
+                    conn.rollback()
+                    retries += 1
+                    time.sleep(self.retry_policy.backoff(retries))
+            if retry_enabled:
+                self.retry_policy.record_outcome(database_id, retries, succeeded=True)
             
             result = {
                 "success": True,
-                "execution_time_ms": round(execution_time, 2),
-                "query_type": query_type
+                "query_type": query_type,
+                "truncated": False,
+                "estimated_total_rows": None,
+                "cached": False,
+                "queue_wait_ms": round(ticket.wait_ms, 2),
+                "retries": retries
             }
+            if timing is not None:
+                result["timing"] = timing
+            if guard is not None:
+                result["cost_guard"] = guard
             
             if query_type == "SELECT":
-                # Fetch results
-                columns = [desc[0] for desc in cur.description] if cur.description else []
-                rows = cur.fetchall()
+                description = cur.description
+                columnar = result_format == "columnar"
+                rows_list, truncated = self._fetch_bounded(cur, as_text=not columnar)
+                self._end_statement(watch, control)
+                execution_time = (time.time() - start_time) * 1000  # Convert to ms
                 
-                # Limit result size
-                if len(rows) > self.max_result_rows:
-                    rows = rows[:self.max_result_rows]
-                    result["message"] = f"Results limited to {self.max_result_rows} rows. Total rows: {len(rows)}"
+                if truncated:
+                    # Còn rows chưa đọc trên server: đóng hẳn connection thay vì
+                    # đọc bỏ phần còn lại (cur.close() sẽ drain toàn bộ result)
+                    conn.invalidate()
+                    conn = None
+                    estimated_total = self._estimate_total_rows(target, query, len(rows_list), params)
+                    result["truncated"] = True
+                    result["estimated_total_rows"] = estimated_total
+                    result["message"] = (
+                        f"Results limited to {len(rows_list)} rows "
+                        f"(max {self.max_result_rows} rows / {self.max_result_bytes} bytes). "
+                        f"Estimated total rows: ~{estimated_total}."
+                    )
                 else:
-                    result["message"] = f"Query executed successfully. Returned {len(rows)} rows."
+                    result["estimated_total_rows"] = len(rows_list)
+                    result["message"] = f"Query executed successfully. Returned {len(rows_list)} rows."
+                if guard is not None and guard.get("warning"):
+                    result["message"] += f" Warning: {guard['warning']}"
                 
-                # Convert rows to list of lists
-                rows_list = []
-                for row in rows:
-                    rows_list.append([str(val) if val is not None else None for val in row])
-                
-                result["columns"] = columns
-                result["rows"] = rows_list
+                result["execution_time_ms"] = round(execution_time, 2)
+                if columnar:
+                    result["format"] = "columnar"
+                    result.update(self._encode_columnar(description, rows_list))
+                else:
+                    result["columns"] = [desc[0] for desc in description] if description else []
+                    result["rows"] = rows_list
                 result["row_count"] = len(rows_list)
-                result["affected_rows"] = cur.rowcount
+                result["affected_rows"] = len(rows_list)
+                
+                if cache_key is not None:
+                    query_result_cache.put(cache_key, dict(result), generation=cache_generation)
                 
             else:
                 # Non-SELECT query (INSERT, UPDATE, DELETE, etc.)
                 conn.commit()
+                self._end_statement(watch, control)
+                if self._is_ddl(query_type, query):
+                    self._invalidate_schema(database_id)
+                if query_type not in self.READ_ONLY_TYPES:
+                    # Dữ liệu/schema có thể đã đổi -> bỏ cache SELECT của database
+                    query_result_cache.invalidate_database(database_id)
+                result["execution_time_ms"] = round((time.time() - start_time) * 1000, 2)
                 affected_rows = cur.rowcount
                 result["columns"] = []
-                result["rows"] = []
+                if result_format == "columnar":
+                    result["format"] = "columnar"
+                    result["data"] = []
+                else:
+                    result["rows"] = []
                 result["row_count"] = 0
                 result["affected_rows"] = affected_rows
                 
                 # Thêm warning cho INSERT queries về duplicate data
                 if query_type == "INSERT":
-                    # Kiểm tra xem có UNIQUE constraint không bằng cách thử query information_schema
                     try:
-                        # Lấy tên table từ INSERT query
-                        import re
-                        insert_match = re.search(r'INSERT\s+INTO\s+`?(\w+)`?', query, re.IGNORECASE)
-                        if insert_match:
-                            table_name = insert_match.group(1)
-                            # Kiểm tra xem table có UNIQUE constraint không
-                            check_cur = conn.cursor()
-                            check_cur.execute("""
-                                SELECT COUNT(*) 
-                                FROM information_schema.TABLE_CONSTRAINTS 
-                                WHERE TABLE_SCHEMA = DATABASE() 
-                                AND TABLE_NAME = %s 
-                                AND CONSTRAINT_TYPE = 'UNIQUE'
-                            """, (table_name,))
-                            has_unique = check_cur.fetchone()[0] > 0
-                            check_cur.close()
+                        table_info = self._insert_target_schema(target, query, conn)
+                        if table_info is not None:
+                            # Kiểm tra xem table có UNIQUE constraint không (từ schema cache, không query thêm)
+                            has_unique = bool(table_info["unique_keys"])
                             
                             if not has_unique and affected_rows > 0:
                                 result["message"] = f"Query executed successfully. {affected_rows} row(s) inserted. ⚠️ Note: This table has no UNIQUE constraint, so duplicate data can be inserted."
@@ -166,14 +344,35 @@ class SQLExecutorService:
                 else:
                     result["message"] = f"Query executed successfully. {affected_rows} row(s) affected."
             
-            cur.close()
-            conn.close()
+            if conn is not None:
+                cur.close()
+                conn.close()
             
+            self._record_stats(database_id, query, query_type, result["execution_time_ms"],
+                               result["row_count"] if query_type == "SELECT" else result["affected_rows"])
+            self._capture_slow(target, query, params, query_type, result["execution_time_ms"], result["row_count"], guard)
             return result
             
         except Exception as e:
             execution_time = (time.time() - start_time) * 1000
             error_msg = str(e)
+            self._end_statement(watch, control)
+            self._release_after_error(conn, e)
+            # Statement lỗi sau khi chạy lâu (timeout, bị hủy...) vẫn là slow query
+            self._capture_slow(target, query, params, query_type, execution_time, None)
+            self._raise_if_interrupted(e, database_id, watch, control)
+            if isinstance(e, QueryRejectedError):
+                raise
+            errno = conflict_errno(e)
+            if errno is not None:
+                if retry_enabled:
+                    self.retry_policy.record_outcome(database_id, retries, succeeded=False)
+                reason = "Deadlock" if errno == ER_LOCK_DEADLOCK else "Lock wait timeout"
+                raise QueryConflictError(
+                    f"{reason} after {retries + 1} attempt(s): {error_msg}. "
+                    + ("Retry the statement later." if retry_enabled else "Set retry_on_conflict to retry automatically."),
+                    retries
+                )
             
             # Kiểm tra duplicate key error (MySQL error code 1062)
             if "Duplicate entry" in error_msg or "1062" in error_msg or "duplicate" in error_msg.lower():
@@ -188,6 +387,710 @@ class SQLExecutorService:
                 raise ValueError(f"Constraint violation: {error_msg}")
             
             raise Exception(f"SQL execution failed: {error_msg}")
+        finally:
+            ticket.release()
+    
+    def execute_batch(
+        self,
+        db: Session,
+        database_id: int,
+        user_id: int,
+        statements: Optional[List[str]] = None,
+        script: Optional[str] = None,
+        transaction: bool = False,
+        stop_on_error: bool = True,
+        control: Optional[QueryControl] = None,
+        ticket: Optional[AdmissionTicket] = None
+    ) -> Dict[str, Any]:
+        """
+        Chạy nhiều statement theo thứ tự trên cùng một connection
+        - statements: list statement; hoặc script: tách bằng sql_tokenizer (hỗ trợ DELIMITER)
+        - Mỗi statement được validate như execute_query trước khi chạy statement đầu tiên
+        - transaction=True: commit một lần cuối batch, lỗi -> rollback toàn bộ
+          (lưu ý DDL như CREATE/ALTER/DROP tự commit trong MySQL)
+        - transaction=False: commit sau từng statement; stop_on_error=False thì chạy tiếp khi lỗi
+        - Mỗi statement có giới hạn max_execution_time riêng; control cancel -> dừng cả batch
+        - SELECT bị cắt (rows/bytes) khi transaction=False: đóng hẳn connection thay vì đọc bỏ phần còn lại,
+          statement sau chạy trên connection mới (biến session / TEMPORARY table không còn);
+          transaction=True vẫn phải đọc bỏ để giữ transaction tới lúc commit
+        Returns: {"success", "transaction", "committed", "statement_count", "executed_count",
+                  "failed_index", "execution_time_ms", "results": [...]}
+        """
+        if statements is None and script is None:
+            raise ValueError("Either 'statements' or 'script' is required")
+        if statements is not None and script is not None:
+            raise ValueError("Provide either 'statements' or 'script', not both")
+        
+        target = self._get_target(db, database_id, user_id)
+        
+        if script is not None:
+            statements = split_statements(script)
+        else:
+            statements = [s.strip() for s in statements if s and s.strip()]
+        if not statements:
+            raise ValueError("Batch contains no statements")
+        if len(statements) > self.max_batch_statements:
+            raise ValueError(f"Batch too large: {len(statements)} statements (max {self.max_batch_statements})")
+        
+        # Validate toàn bộ trước khi chạy: một statement bị chặn thì không chạy gì cả
+        for index, statement in enumerate(statements):
+            try:
+                self._validate_query(statement)
+            except ValueError as e:
+                raise ValueError(f"Statement {index + 1}: {e}")
+        
+        cost_limits = None
+        if self.cost_guard_enabled and any(self._get_query_type(s) == "SELECT" for s in statements):
+            cost_limits = self.cost_guard.limits_for(db, user_id)[0]
+        
+        # Cả batch chạy trên một connection -> chiếm một slot của database
+        ticket = self._admit(database_id, ticket)
+        
+        import time
+        batch_start = time.time()
+        results = []
+        failed_index = None
+        committed = False
+        wrote = False
+        conn = None
+        
+        try:
+            for index, statement in enumerate(statements):
+                cancelled = control is not None and control.cancelled
+                if cancelled or (failed_index is not None and (transaction or stop_on_error)):
+                    results.append({"index": index, "query_type": self._get_query_type(statement),
+                                    "success": False, "skipped": True,
+                                    "message": "Skipped because an earlier statement failed"})
+                    continue
+                
+                if conn is None:
+                    # Lần đầu, hoặc SELECT trước bị cắt đã làm connection bị đóng hẳn
+                    conn = self._connect(target)
+                    if control is not None and not control.attach(conn.thread_id()):
+                        raise QueryCancelledError("Query was cancelled")
+                item = self._run_batch_statement(conn, database_id, index, statement, cost_limits,
+                                                 drain_truncated=transaction)
+                results.append(item)
+                self._capture_slow(target, statement, None, item["query_type"], item["execution_time_ms"],
+                                   item.get("row_count"), item.get("cost_guard"))
+                if item["truncated"] and not transaction:
+                    # Còn rows chưa đọc trên server: đóng hẳn connection (như execute_query)
+                    if control is not None:
+                        control.detach()
+                    conn.invalidate()
+                    conn = None
+                    continue
+                if not item["success"]:
+                    if failed_index is None:
+                        failed_index = index
+                    if transaction:
+                        conn.rollback()
+                    continue
+                if item["query_type"] not in self.READ_ONLY_TYPES:
+                    wrote = True
+                if self._is_ddl(item["query_type"], statement):
+                    self._invalidate_schema(database_id)
+                if not transaction:
+                    conn.commit()
+            
+            if transaction and failed_index is None:
+                conn.commit()
+                committed = True
+            elif not transaction:
+                committed = True
+            
+            if control is not None:
+                control.detach()
+            if conn is not None:
+                conn.close()
+                conn = None
+        except Exception as e:
+            if control is not None:
+                control.detach()
+            self._release_after_error(conn, e)
+            if isinstance(e, QueryCancelledError):
+                raise
+            raise Exception(f"SQL execution failed: {str(e)}")
+        finally:
+            ticket.release()
+            if wrote:
+                # Có lệnh ghi (kể cả đã rollback một phần) -> bỏ cache SELECT của database
+                query_result_cache.invalidate_database(database_id)
+        
+        return {
+            "success": failed_index is None,
+            "transaction": transaction,
+            "committed": committed,
+            "statement_count": len(statements),
+            "executed_count": sum(1 for item in results if not item.get("skipped")),
+            "failed_index": failed_index,
+            "execution_time_ms": round((time.time() - batch_start) * 1000, 2),
+            "results": results
+        }
+    
+    def _run_batch_statement(
+        self,
+        conn,
+        database_id: int,
+        index: int,
+        statement: str,
+        cost_limits: Optional[Tuple[int, int, int]] = None,
+        drain_truncated: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Chạy một statement của batch; lỗi SQL được trả trong kết quả thay vì raise
+        Lỗi mất kết nối (OperationalError/InterfaceError ngoài lỗi SQL) vẫn raise để dừng batch
+        cost_limits: ngưỡng cost guard cho SELECT (bị từ chối -> lỗi của statement)
+        drain_truncated: False -> SELECT bị cắt không đọc bỏ rows còn lại, caller phải invalidate() connection
+        """
+        import time
+        query_type = self._get_query_type(statement)
+        item = {"index": index, "query_type": query_type, "success": True, "skipped": False, "truncated": False}
+        start_time = time.time()
+        cur = None
+        watch = self._begin_statement(conn, query_type, None)
+        try:
+            if query_type == "SELECT":
+                run_statement = statement
+                if cost_limits is not None:
+                    guard = self.cost_guard.check(conn, database_id, statement, None, cost_limits, self.max_result_rows + 1)
+                    run_statement = guard.pop("query")
+                    item["cost_guard"] = guard
+                cur = conn.cursor(pymysql.cursors.SSCursor)
+                cur.execute(self._with_time_limit(run_statement, query_type))
+                rows_list, truncated = self._fetch_bounded(cur)
+                item["columns"] = [desc[0] for desc in cur.description] if cur.description else []
+                item["rows"] = rows_list
+                item["row_count"] = len(rows_list)
+                item["affected_rows"] = len(rows_list)
+                item["truncated"] = truncated
+                item["message"] = f"Returned {len(rows_list)} rows" + (" (truncated)" if truncated else "")
+            else:
+                cur = conn.cursor()
+                cur.execute(statement)
+                item["columns"] = []
+                item["rows"] = []
+                item["row_count"] = 0
+                item["affected_rows"] = cur.rowcount
+                item["truncated"] = False
+                item["message"] = f"{cur.rowcount} row(s) affected."
+            # Với SSCursor, close() đọc bỏ phần rows còn lại để connection dùng tiếp được
+            if drain_truncated or not item["truncated"]:
+                cur.close()
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            if not conn.open:
+                raise
+            item.update(success=False, error=self._batch_error(e, database_id, watch))
+        except pymysql.err.MySQLError as e:
+            item.update(success=False, error=self._batch_error(e, database_id, watch))
+        except QueryRejectedError as e:
+            item.update(success=False, error=str(e))
+        finally:
+            self._end_statement(watch, None)
+        item["execution_time_ms"] = round((time.time() - start_time) * 1000, 2)
+        if item["success"]:
+            self._record_stats(database_id, statement, query_type, item["execution_time_ms"], item["affected_rows"])
+        return item
+    
+    def export_query(
+        self,
+        db: Session,
+        database_id: int,
+        query: str,
+        user_id: int,
+        export_format: str = "csv",
+        compress: bool = False,
+        ticket: Optional[AdmissionTicket] = None
+    ) -> Iterator[bytes]:
+        """
+        Chạy SELECT và stream toàn bộ kết quả dưới dạng CSV hoặc NDJSON
+        - Unbuffered cursor + fetch theo chunk -> memory không phụ thuộc kích thước kết quả
+        - Query được execute ngay (lỗi SQL/kết nối raise trước khi bắt đầu stream)
+        - Generator chỉ đọc chunk tiếp theo khi client đã nhận chunk trước (backpressure)
+        - Giữ slot admission tới khi stream xong (ticket: slot đã cấp trước; None -> chờ slot tại đây)
+        - Giới hạn export_max_execution_time: hint MAX_EXECUTION_TIME + watchdog KILL QUERY theo thời gian
+          thực của cả stream (client đọc chậm / query tự đặt hint lớn hơn cũng bị dừng)
+        Raise QueryTimeoutError nếu query bị dừng vì quá giới hạn trước khi bắt đầu stream
+        """
+        if export_format not in self.EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format '{export_format}'. Use one of: {', '.join(self.EXPORT_FORMATS)}")
+        
+        target = self._get_target(db, database_id, user_id)
+        self._validate_query(query)
+        query = query.strip()
+        if not query:
+            raise ValueError("Query cannot be empty")
+        if self._get_query_type(query) != "SELECT":
+            raise ValueError("Only SELECT queries can be exported")
+        
+        ticket = self._admit(database_id, ticket)
+        conn = None
+        watch = None
+        try:
+            conn = self._connect(target)
+            if self.export_max_execution_time > 0:
+                watch = get_watchdog(self.mysql_service.kill_query).watch(conn.thread_id(), self.export_max_execution_time)
+            cur = conn.cursor(pymysql.cursors.SSCursor)
+            cur.execute(self._with_time_limit(query, "SELECT", self.export_max_execution_time))
+        except Exception as e:
+            self._end_statement(watch, None)
+            self._release_after_error(conn, e)
+            ticket.release()
+            self._raise_export_timeout(e, database_id, watch)
+            raise Exception(f"SQL execution failed: {str(e)}")
+        
+        columns = [desc[0] for desc in cur.description] if cur.description else []
+        return self._stream_export(conn, cur, columns, export_format, compress, database_id, watch, ticket)
+    
+    def _stream_export(self, conn, cur, columns: List[str], export_format: str, compress: bool,
+                       database_id: Optional[int] = None, watch=None,
+                       ticket: Optional[AdmissionTicket] = None) -> Iterator[bytes]:
+        """Generator encode rows theo chunk; đóng connection khi client ngắt giữa chừng"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31 -> gzip
+        finished = False
+        try:
+            if export_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                encode_rows = lambda rows: writer.writerows(
+                    [["" if val is None else self._export_text(val) for val in row] for row in rows]
+                )
+            else:
+                buffer = io.StringIO()
+                encode_rows = lambda rows: buffer.write("".join(
+                    json.dumps(dict(zip(columns, row)), default=self._export_text, ensure_ascii=False) + "\n"
+                    for row in rows
+                ))
+            
+            while True:
+                rows = cur.fetchmany(self.fetch_chunk_rows)
+                if rows:
+                    encode_rows(rows)
+                data = buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                if compressor is not None:
+                    data = compressor.compress(data)
+                    if not rows:
+                        data += compressor.flush()
+                if data:
+                    yield data
+                if not rows:
+                    break
+            finished = True
+        except pymysql.err.MySQLError as e:
+            self._raise_export_timeout(e, database_id, watch)
+            raise
+        finally:
+            self._end_statement(watch, None)
+            if finished:
+                cur.close()
+                conn.close()
+            else:
+                # Client ngắt kết nối hoặc lỗi giữa chừng: còn rows chưa đọc trên server,
+                # đóng hẳn connection thay vì drain phần còn lại
+                conn.invalidate()
+            if ticket is not None:
+                ticket.release()
+    
+    def _raise_export_timeout(self, error: Exception, database_id: int, watch) -> None:
+        """Export bị dừng vì quá export_max_execution_time (hint hoặc watchdog) -> QueryTimeoutError"""
+        errno = error.args[0] if isinstance(error, pymysql.err.MySQLError) and error.args else None
+        if errno == ER_QUERY_TIMEOUT or (errno == ER_QUERY_INTERRUPTED and watch is not None and watch.fired):
+            self._count_interrupt(database_id, "timeouts")
+            raise QueryTimeoutError(
+                f"Export exceeded the maximum execution time of {self.export_max_execution_time}s and was stopped"
+            )
+    
+    @staticmethod
+    def _export_text(val: Any) -> str:
+        """Convert giá trị MySQL sang text cho export (bytes -> utf-8 nếu được, không thì hex)"""
+        if isinstance(val, (bytes, bytearray)):
+            return SQLExecutorService._text_or_hex(val)
+        if isinstance(val, (datetime, date, dt_time)):
+            return val.isoformat()
+        return str(val)
+    
+    def _get_target(self, db: Session, database_id: int, user_id: int) -> Dict[str, Any]:
+        """
+        Kiểm tra quyền truy cập database và lấy thông tin kết nối
+        Dùng user riêng của database (không dùng root/admin để tránh hack quyền)
+        """
+        database = db.query(Database).filter(Database.id == database_id).first()
+        if not database:
+            raise ValueError(f"Database {database_id} not found")
+        
+        if database.owner_id != user_id:
+            raise ValueError("Access denied")
+        
+        if database.status != "ACTIVE":
+            raise ValueError(f"Database {database_id} is not ACTIVE")
+        
+        db_password = database.db_password_hash or ""  # Password được lưu trong db_password_hash
+        if not db_password:
+            raise ValueError(f"Database user password not found. Please reset password first.")
+        
+        return {
+            "database_id": database.id,
+            "physical_db_name": database.physical_db_name or f"db_{database.id}",
+            "db_username": database.db_username or f"user_{database.id}",
+            "db_password": db_password
+        }
+    
+    def _admit(self, database_id: int, ticket: Optional[AdmissionTicket]) -> AdmissionTicket:
+        """Slot admission đã cấp ở tầng async (main.py) hoặc chờ slot ngay trên thread hiện tại"""
+        return ticket if ticket is not None else self.admission.acquire(database_id)
+    
+    def _connect(self, target: Dict[str, Any]):
+        """Mượn connection tenant từ pool (conn.close() trả về pool)"""
+        return self.mysql_service.connect_tenant(
+            target["database_id"],
+            target["db_username"],
+            target["db_password"],
+            target["physical_db_name"]
+        )
+    
+    def _with_time_limit(self, query: str, query_type: str, seconds: Optional[int] = None) -> str:
+        """SELECT: thêm optimizer hint MAX_EXECUTION_TIME để MySQL tự dừng khi quá giới hạn (mặc định max_execution_time)"""
+        seconds = self.max_execution_time if seconds is None else seconds
+        if query_type != "SELECT" or seconds <= 0 or "MAX_EXECUTION_TIME" in query.upper():
+            return query
+        return _SELECT_PREFIX_RE.sub(f"SELECT /*+ MAX_EXECUTION_TIME({seconds * 1000}) */", query, count=1)
+    
+    def _begin_statement(self, conn, query_type: str, control: Optional[QueryControl]):
+        """
+        Gắn connection vào control (cancel khi client ngắt) và bật watchdog cho statement không phải SELECT
+        (MAX_EXECUTION_TIME chỉ áp dụng cho SELECT). Returns: WatchHandle hoặc None
+        """
+        if control is not None and not control.attach(conn.thread_id()):
+            raise QueryCancelledError("Query was cancelled")
+        if query_type == "SELECT" or self.max_execution_time <= 0:
+            return None
+        return get_watchdog(self.mysql_service.kill_query).watch(conn.thread_id(), self.max_execution_time)
+    
+    @staticmethod
+    def _end_statement(watch, control: Optional[QueryControl]) -> None:
+        """Gọi trước khi trả connection về pool: không còn KILL nào có thể nhắm vào connection này"""
+        if watch is not None:
+            watch.cancel()
+        if control is not None:
+            control.detach()
+    
+    def _raise_if_interrupted(self, error: Exception, database_id: int, watch, control: Optional[QueryControl]) -> None:
+        """Lỗi do timeout / cancel -> QueryTimeoutError / QueryCancelledError (đếm theo database)"""
+        if isinstance(error, QueryCancelledError):
+            self._count_interrupt(database_id, "cancelled")
+            raise error
+        errno = error.args[0] if isinstance(error, pymysql.err.MySQLError) and error.args else None
+        if errno == ER_QUERY_TIMEOUT or (errno == ER_QUERY_INTERRUPTED and watch is not None and watch.fired):
+            self._count_interrupt(database_id, "timeouts")
+            raise QueryTimeoutError(f"Query exceeded the maximum execution time of {self.max_execution_time}s and was stopped")
+        if errno == ER_QUERY_INTERRUPTED and control is not None and control.cancelled:
+            self._count_interrupt(database_id, "cancelled")
+            raise QueryCancelledError("Query was cancelled because the client disconnected")
+    
+    def _batch_error(self, error: Exception, database_id: int, watch) -> str:
+        """Message lỗi của statement trong batch (timeout được đếm như execute_query)"""
+        try:
+            self._raise_if_interrupted(error, database_id, watch, None)
+        except QueryTimeoutError as e:
+            return str(e)
+        return str(error)
+    
+    @staticmethod
+    def _count_interrupt(database_id: int, kind: str) -> None:
+        with _interrupt_lock:
+            counts = _interrupt_counts.setdefault(database_id, {"timeouts": 0, "cancelled": 0})
+            counts[kind] += 1
+    
+    def _record_stats(self, database_id: int, query: str, query_type: str, elapsed_ms: float, rows: int) -> None:
+        """Đưa statement đã chạy xong vào thống kê theo fingerprint (chỉ append hàng đợi)"""
+        if self.query_stats_enabled:
+            self.query_stats.record(database_id, query, query_type, elapsed_ms, rows)
+    
+    def _capture_slow(self, target: Dict[str, Any], query: str, params: Optional[List[Any]], query_type: str,
+                      elapsed_ms: float, rows_sent: Optional[int], guard: Optional[Dict[str, Any]] = None) -> None:
+        """Statement chạy quá ngưỡng -> buffer slow query log (EXPLAIN và ghi DB ở thread nền)"""
+        if self.slow_query_log.is_slow(elapsed_ms):
+            rows_examined = guard.get("estimated_rows_examined") if guard else None
+            self.slow_query_log.capture(target, self._connect, query, params, query_type,
+                                        elapsed_ms, rows_sent, rows_examined)
+    
+    def retry_stats(self, database_id: int) -> Dict[str, Any]:
+        """Số retry vì deadlock / lock wait timeout, thành công sau retry, hết budget... của database"""
+        return self.retry_policy.stats(database_id)
+    
+    def interrupt_stats(self, database_id: int) -> Dict[str, int]:
+        """Số statement bị timeout / bị hủy (client ngắt kết nối) của database"""
+        with _interrupt_lock:
+            return dict(_interrupt_counts.get(database_id, {"timeouts": 0, "cancelled": 0}))
+    
+    def _execute(self, conn, cur, query: str, params: Optional[List[Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Chạy query trên cursor; params=None -> SQL thô như trước
+        Có params: PREPARE một lần cho mỗi statement (đã normalize) trên connection,
+        các lần sau chỉ SET biến + EXECUTE (server không parse lại query)
+        PyMySQL không có binary protocol nên dùng PREPARE/EXECUTE ở mức SQL
+        Returns: timing {"prepared", "prepared_cache_hit", "prepare_ms", "execute_ms"} hoặc None
+        """
+        if params is None:
+            cur.execute(query)
+            return None
+        
+        import time
+        timing = {"prepared": False, "prepared_cache_hit": False, "prepare_ms": 0.0, "execute_ms": 0.0}
+        statement = query.strip().rstrip(";").rstrip()
+        name = None
+        if self.prepared_cache_size > 0:
+            start = time.time()
+            name, hit = self._prepare(conn, cur, statement)
+            timing["prepare_ms"] = round((time.time() - start) * 1000, 2)
+            timing["prepared_cache_hit"] = hit
+        
+        start = time.time()
+        if name is not None:
+            try:
+                self._execute_prepared(cur, name, params)
+            except pymysql.err.MySQLError as e:
+                if not (e.args and e.args[0] == ER_UNKNOWN_STMT_HANDLER):
+                    raise
+                # Server không còn statement (reset / DEALLOCATE ngoài executor): bỏ cache, PREPARE lại một lần
+                self._forget_prepared(conn, statement)
+                name, _ = self._prepare(conn, cur, statement)
+                if name is not None:
+                    self._execute_prepared(cur, name, params)
+        if name is None:
+            # Statement không prepare được (hoặc cache tắt): PyMySQL escape từng giá trị
+            cur.execute(to_pyformat(statement), params)
+        else:
+            timing["prepared"] = True
+        timing["execute_ms"] = round((time.time() - start) * 1000, 2)
+        return timing
+    
+    @staticmethod
+    def _execute_prepared(cur, name: str, params: List[Any]) -> None:
+        """SET biến @_pN rồi EXECUTE statement đã PREPARE"""
+        if params:
+            variables = [f"@_p{i}" for i in range(len(params))]
+            cur.execute("SET " + ", ".join(f"{var} = %s" for var in variables), params)
+            cur.execute(f"EXECUTE {name} USING {', '.join(variables)}")
+        else:
+            cur.execute(f"EXECUTE {name}")
+    
+    @staticmethod
+    def _forget_prepared(conn, statement: str) -> None:
+        """Bỏ statement khỏi cache của connection (không DEALLOCATE: server đã không còn)"""
+        cache = getattr(getattr(conn, "raw", conn), "_prepared_statements", None)
+        if cache is not None:
+            cache.pop(normalize_sql(statement), None)
+    
+    def _prepare(self, conn, cur, statement: str) -> Tuple[Optional[str], bool]:
+        """
+        Lấy prepared statement đã cache trên connection hoặc PREPARE mới (LRU, DEALLOCATE khi bị đẩy ra)
+        Cache gắn với connection vật lý nên tự mất khi connection bị đóng/invalidate;
+        reset session lúc trả về pool (COM_RESET_CONNECTION) xóa cả cache lẫn statement phía server
+        Returns: (tên statement hoặc None nếu MySQL không hỗ trợ prepare lệnh này, cache hit)
+        """
+        raw = getattr(conn, "raw", conn)
+        cache = getattr(raw, "_prepared_statements", None)
+        if cache is None:
+            cache = raw._prepared_statements = OrderedDict()
+            raw._prepared_seq = 0
+        
+        key = normalize_sql(statement)
+        name = cache.get(key)
+        if name is not None:
+            cache.move_to_end(key)
+            return name, True
+        
+        raw._prepared_seq += 1
+        name = f"_stmt{raw._prepared_seq}"
+        try:
+            cur.execute(f"PREPARE {name} FROM %s", (statement,))
+        except pymysql.err.MySQLError as e:
+            if e.args and e.args[0] == ER_UNSUPPORTED_PS:
+                return None, False
+            raise
+        cache[key] = name
+        while len(cache) > self.prepared_cache_size:
+            _, old_name = cache.popitem(last=False)
+            cur.execute(f"DEALLOCATE PREPARE {old_name}")
+        return name, False
+    
+    def _fetch_bounded(self, cur, as_text: bool = True) -> Tuple[List[Any], bool]:
+        """
+        Đọc rows theo chunk từ unbuffered cursor, dừng khi chạm giới hạn rows hoặc bytes
+        as_text=True: convert mỗi giá trị sang string (format "rows" cũ)
+        as_text=False: giữ nguyên tuple gốc (format "columnar" tự encode theo kiểu cột)
+        Returns: (rows, truncated)
+        """
+        rows_list = []
+        total_bytes = 0
+        while True:
+            chunk = cur.fetchmany(self.fetch_chunk_rows)
+            if not chunk:
+                return rows_list, False
+            for row in chunk:
+                if len(rows_list) >= self.max_result_rows or total_bytes >= self.max_result_bytes:
+                    return rows_list, True
+                if as_text:
+                    converted = [str(val) if val is not None else None for val in row]
+                    total_bytes += sum(len(val) for val in converted if val is not None)
+                    rows_list.append(converted)
+                else:
+                    total_bytes += sum(len(val) if isinstance(val, (str, bytes, bytearray)) else 8 for val in row)
+                    rows_list.append(row)
+    
+    def _encode_columnar(self, description, rows: List[tuple]) -> Dict[str, Any]:
+        """
+        Encode result theo cột: mỗi cột một mảng giá trị giữ đúng kiểu
+        - int/float giữ nguyên (không str() từng ô)
+        - decimal -> string (giữ độ chính xác), date/datetime -> ISO 8601
+        - chọn converter một lần cho mỗi cột dựa trên MySQL field type
+        """
+        columns = []
+        converters = []
+        for desc in description or []:
+            col_type, converter = self._COLUMN_TYPES.get(desc[1], ("string", self._text_or_hex))
+            columns.append({"name": desc[0], "type": col_type})
+            converters.append(converter)
+        
+        data = []
+        if rows:
+            for values, converter in zip(zip(*rows), converters):
+                if converter is None:
+                    data.append(list(values))
+                else:
+                    data.append([converter(val) if val is not None else None for val in values])
+        else:
+            data = [[] for _ in columns]
+        return {"columns": columns, "data": data}
+    
+    @staticmethod
+    def _text_or_hex(val: Any) -> Any:
+        if isinstance(val, (bytes, bytearray)):
+            try:
+                return bytes(val).decode("utf-8")
+            except UnicodeDecodeError:
+                return bytes(val).hex()
+        return val
+    
+    def _estimate_total_rows(self, target: Dict[str, Any], query: str, fetched_rows: int,
+                             params: Optional[List[Any]] = None) -> int:
+        """
+        Ước lượng tổng số rows của SELECT bị cắt bằng EXPLAIN (không chạy lại query)
+        Dùng rows * filtered của bảng đầu tiên trong plan; lỗi thì trả về số rows đã đọc
+        """
+        conn = None
+        try:
+            conn = self._connect(target)
+            cur = conn.cursor(pymysql.cursors.DictCursor)
+            if params:
+                cur.execute(f"EXPLAIN {to_pyformat(query.rstrip(';'))}", params)
+            else:
+                cur.execute(f"EXPLAIN {query.rstrip(';')}")
+            plan = cur.fetchall()
+            cur.close()
+            conn.close()
+        except Exception:
+            if conn is not None:
+                conn.invalidate()
+            return fetched_rows
+        
+        for step in plan:
+            rows = step.get("rows")
+            if rows is None:
+                continue
+            filtered = float(step.get("filtered") or 100.0)
+            return max(fetched_rows, int(int(rows) * filtered / 100.0))
+        return fetched_rows
+    
+    def invalidate_connections(self, database_id: int) -> int:
+        """
+        Bỏ các connection đã cache của database
+        Gọi khi credentials thay đổi (reset password) hoặc database bị xóa
+        """
+        return self.mysql_service.tenant_pools.invalidate(database_id)
+    
+    def invalidate_cache(self, database_id: int) -> int:
+        """
+        Bỏ cache SELECT, schema metadata và plan cache của database
+        (gọi sau restore/import hoặc thay đổi ngoài executor)
+        """
+        self._invalidate_schema(database_id)
+        return query_result_cache.invalidate_database(database_id)
+    
+    def _invalidate_schema(self, database_id: int) -> None:
+        """Schema đổi -> bỏ schema metadata và plan đã EXPLAIN của database"""
+        schema_cache.invalidate(database_id)
+        self.cost_guard.invalidate(database_id)
+    
+    def get_schema(self, db: Session, database_id: int, user_id: int, refresh: bool = False) -> Dict[str, Any]:
+        """Schema metadata của database (tables, columns, keys) từ cache dùng chung"""
+        target = self._get_target(db, database_id, user_id)
+        return self._schema(target, refresh=refresh)
+    
+    def _schema(self, target: Dict[str, Any], conn=None, refresh: bool = False) -> Dict[str, Any]:
+        """Schema từ cache; miss -> load trên conn (nếu có) hoặc một connection tenant mượn từ pool"""
+        def loader():
+            if conn is not None:
+                return load_schema(conn)
+            own = self._connect(target)
+            try:
+                schema = load_schema(own)
+            except Exception as e:
+                self._release_after_error(own, e)
+                raise
+            own.close()
+            return schema
+        return schema_cache.get(target["database_id"], loader, refresh=refresh)
+    
+    def _table_schema(self, target: Dict[str, Any], table: str, conn=None) -> Optional[Dict[str, Any]]:
+        """
+        Metadata của một table; không có trong cache thì load lại một lần
+        (table có thể vừa được tạo từ client ngoài executor)
+        """
+        info = find_table(self._schema(target, conn), table)
+        if info is None:
+            info = find_table(self._schema(target, conn, refresh=True), table)
+        return info
+    
+    def _insert_target_schema(self, target: Dict[str, Any], query: str, conn) -> Optional[Dict[str, Any]]:
+        """
+        Metadata table đích của INSERT từ schema cache (không load lại schema)
+        Table ở database khác / không nhận diện được / chưa có trong cache -> None (bỏ cảnh báo duplicate)
+        """
+        parsed = insert_target(query)
+        if parsed is None:
+            return None
+        database_name, table = parsed
+        if database_name is not None and database_name.lower() != target["physical_db_name"].lower():
+            return None
+        return find_table(self._schema(target, conn), table)
+    
+    @staticmethod
+    def _is_ddl(query_type: str, query: str) -> bool:
+        """Lệnh thay đổi schema -> phải invalidate schema cache"""
+        return query_type in ("CREATE", "ALTER", "DROP") or query.lstrip()[:6].upper() == "RENAME"
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Thống kê result cache (hits, misses, hit rate, ...)"""
+        return query_result_cache.stats()
+    
+    def connection_stats(self) -> Dict[str, Any]:
+        """Thống kê pool connection tenant (hit rate, số connection đang mở, ...)"""
+        return self.mysql_service.tenant_pools.stats()
+    
+    def _release_after_error(self, conn, error: Exception) -> None:
+        """Trả connection về pool sau lỗi; connection hỏng thì đóng hẳn"""
+        if conn is None:
+            return
+        if isinstance(error, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+            conn.invalidate()
+        else:
+            # close() rollback transaction dở dang trước khi trả về pool
+            conn.close()
     
     def _validate_query(self, query: str) -> None:
         """Validate SQL query"""
@@ -212,9 +1115,12 @@ class SQLExecutorService:
                 raise ValueError(f"Operation '{keyword}' is not allowed for security reasons")
         
         # Check for multiple statements (prevent SQL injection)
-        if ';' in query and query.count(';') > 1:
-            # Allow single statement ending with semicolon
-            statements = [s.strip() for s in query.split(';') if s.strip()]
+        # Dùng tokenizer để ';' trong chuỗi/comment không bị tính là statement mới
+        if ';' in query:
+            try:
+                statements = split_statements(query)
+            except ValueError:
+                statements = [query]  # Chuỗi chưa đóng: để MySQL báo lỗi cú pháp
             if len(statements) > 1:
                 raise ValueError("Multiple statements are not allowed. Please execute one query at a time.")
     
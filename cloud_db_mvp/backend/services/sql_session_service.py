@@ -0,0 +1,311 @@
+"""
+sql_session_service.py - Phiên SQL tương tác (dùng cho WebSocket) gắn với một connection tenant
+- Một connection mượn từ pool tenant cho cả phiên: không handshake lại mỗi lệnh
+- BEGIN / START TRANSACTION ... COMMIT / ROLLBACK qua nhiều message
+- Ngoài transaction: mỗi statement tự commit như SQL console
+- SELECT qua cost guard (EXPLAIN) như /query: ngưỡng theo gói của user, lấy lúc mở phiên
+- Kết quả SELECT được trả theo từng chunk ngay khi fetch (generator)
+- Result bị cắt (max_rows) / client ngắt giữa chừng: không đọc bỏ phần còn lại trên server
+  (ngoài transaction: đổi connection; trong transaction: KILL QUERY rồi mới close cursor)
+- Giới hạn số phiên mở trên mỗi database; phiên idle bị đóng (rollback transaction dở dang)
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+import pymysql
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from services.query_admission import AdmissionTicket
+from services.sql_executor_service import SQLExecutorService
+from services.query_result_cache import query_result_cache
+
+_BEGIN_RE = re.compile(r"^(?:BEGIN(?:\s+WORK)?|START\s+TRANSACTION(?:\s+.*)?)\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+_COMMIT_RE = re.compile(r"^COMMIT(?:\s+WORK)?\s*;?\s*$", re.IGNORECASE)
+_ROLLBACK_RE = re.compile(r"^ROLLBACK(?:\s+WORK)?\s*;?\s*$", re.IGNORECASE)
+_AUTOCOMMIT_RE = re.compile(r"^SET\s+(?:@@(?:SESSION\.)?|SESSION\s+)?AUTOCOMMIT\b", re.IGNORECASE)
+
+# MySQL error: deadlock -> server đã rollback cả transaction
+ER_LOCK_DEADLOCK = 1213
+
+# Phiên đang mở theo database (toàn process)
+_sessions: Dict[str, "SQLSession"] = {}
+_sessions_lock = threading.Lock()
+
+
+class SQLSession:
+    """Một phiên SQL: connection tenant + trạng thái transaction"""
+
+    def __init__(self, executor: SQLExecutorService, target: Dict[str, Any], max_rows: int, chunk_rows: int,
+                 cost_limits: Optional[Tuple[int, int, int]] = None):
+        self.id = uuid.uuid4().hex
+        self.executor = executor
+        self.target = target
+        self.database_id = target["database_id"]
+        self.max_rows = max_rows
+        self.chunk_rows = chunk_rows
+        # (warn, limit, reject) của cost guard; None -> không kiểm tra
+        self.cost_limits = cost_limits
+        self.conn = executor._connect(target)
+        self.in_transaction = False
+        self.broken = False
+        self.closed = False
+        self.statement_count = 0
+        self.opened_at = time.time()
+        # Có lệnh ghi chưa commit -> invalidate result cache khi commit
+        self._dirty = False
+
+    def run(self, query: str, params: Optional[List[Any]] = None,
+            ticket: Optional[AdmissionTicket] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Chạy một statement, yield các message:
+        {"type": "columns"} -> {"type": "rows"} (mỗi chunk) -> {"type": "done"}
+        Lỗi raise ra ngoài (ValueError, pymysql.err.MySQLError, QueryTimeoutError, ...)
+        ticket: slot admission đã được cấp trước (WebSocket chờ slot trong event loop); None -> chờ slot tại đây
+        """
+        if self.closed:
+            raise ValueError("Session is closed")
+        self.executor._validate_query(query)
+        query = query.strip()
+        if not query:
+            raise ValueError("Query cannot be empty")
+        if _AUTOCOMMIT_RE.match(query):
+            raise ValueError("Changing autocommit is not allowed; use BEGIN / COMMIT / ROLLBACK")
+
+        ticket = self.executor._admit(self.database_id, ticket)
+        start_time = time.time()
+        self.statement_count += 1
+        try:
+            if _BEGIN_RE.match(query):
+                if self.in_transaction:
+                    raise ValueError("A transaction is already open; COMMIT or ROLLBACK it first")
+                # Gửi nguyên văn: giữ READ ONLY / READ WRITE / WITH CONSISTENT SNAPSHOT
+                # (MySQL tự commit phần trước đó khi bắt đầu transaction mới)
+                cur = self.conn.cursor()
+                try:
+                    cur.execute(query.rstrip().rstrip(";"))
+                finally:
+                    cur.close()
+                self.in_transaction = True
+                yield self._done("BEGIN", start_time, message="Transaction started")
+                return
+            if _COMMIT_RE.match(query):
+                self.conn.commit()
+                self.in_transaction = False
+                self._flush_writes()
+                yield self._done("COMMIT", start_time, message="Transaction committed")
+                return
+            if _ROLLBACK_RE.match(query):
+                self.conn.rollback()
+                self.in_transaction = False
+                self._dirty = False
+                yield self._done("ROLLBACK", start_time, message="Transaction rolled back")
+                return
+            yield from self._run_statement(query, params, start_time)
+        except pymysql.err.MySQLError as e:
+            errno = e.args[0] if e.args else None
+            if errno == ER_LOCK_DEADLOCK and self.in_transaction:
+                # InnoDB đã rollback transaction của phiên
+                self.in_transaction = False
+                self._dirty = False
+            if isinstance(e, (pymysql.err.OperationalError, pymysql.err.InterfaceError)) and not self.conn.open:
+                self.broken = True
+            raise
+        finally:
+            ticket.release()
+
+    def _run_statement(self, query: str, params: Optional[List[Any]], start_time: float) -> Iterator[Dict[str, Any]]:
+        executor = self.executor
+        query_type = executor._get_query_type(query)
+        read_only = query_type in executor.READ_ONLY_TYPES
+        guard = None
+        run_query = query
+        if query_type == "SELECT" and self.cost_limits is not None:
+            # Quét quá lớn -> QueryRejectedError (ValueError) như /query; +1 row để vẫn nhận biết bị cắt
+            guard = executor.cost_guard.check(self.conn, self.database_id, query, params, self.cost_limits,
+                                              self.max_rows + 1)
+            run_query = guard.pop("query")
+        watch = executor._begin_statement(self.conn, query_type, None)
+        # Unbuffered cursor cho lệnh trả rows: chunk được gửi đi ngay khi đọc từ server
+        cur = self.conn.cursor(pymysql.cursors.SSCursor) if read_only else self.conn.cursor()
+        # Server còn rows chưa gửi hết cho cursor này
+        pending = False
+        try:
+            try:
+                timing = executor._execute(self.conn, cur, executor._with_time_limit(run_query, query_type), params)
+            except Exception as e:
+                executor._raise_if_interrupted(e, self.database_id, watch, None)
+                raise
+
+            row_count = 0
+            truncated = False
+            if cur.description:
+                pending = True
+                yield {"type": "columns", "columns": [desc[0] for desc in cur.description]}
+                while not truncated:
+                    chunk = cur.fetchmany(self.chunk_rows)
+                    if not chunk:
+                        pending = False
+                        break
+                    if row_count + len(chunk) > self.max_rows:
+                        chunk = chunk[:self.max_rows - row_count]
+                        truncated = True
+                    if chunk:
+                        row_count += len(chunk)
+                        yield {"type": "rows", "rows": [[str(val) if val is not None else None for val in row] for row in chunk]}
+            affected_rows = row_count if cur.description else cur.rowcount
+        finally:
+            executor._end_statement(watch, None)
+            if pending:
+                self._abandon_result(cur)
+            else:
+                cur.close()
+
+        message = None
+        if not read_only:
+            self._dirty = True
+            if executor._is_ddl(query_type, query):
+                executor._invalidate_schema(self.database_id)
+                if self.in_transaction:
+                    # DDL tự commit transaction đang mở trong MySQL
+                    self.in_transaction = False
+                    message = "DDL statement implicitly committed the open transaction"
+        if not self.in_transaction and not self.broken:
+            # Kể cả SELECT: kết thúc snapshot REPEATABLE READ để lệnh sau thấy dữ liệu mới
+            self.conn.commit()
+            self._flush_writes()
+
+        done = self._done(query_type, start_time, row_count=row_count, affected_rows=affected_rows,
+                          truncated=truncated, message=message)
+        executor._record_stats(self.database_id, query, query_type, done["execution_time_ms"], affected_rows)
+        executor._capture_slow(self.target, query, params, query_type, done["execution_time_ms"], row_count)
+        if timing is not None:
+            done["timing"] = timing
+        if guard is not None:
+            done["cost_guard"] = guard
+        yield done
+
+    def _abandon_result(self, cur) -> None:
+        """
+        Bỏ result chưa đọc hết (truncated / client ngắt giữa chừng) mà không chờ server gửi nốt
+        (SSCursor.close() đọc bỏ mọi row còn lại: có thể tới MAX_EXECUTION_TIME, giữ thread + slot admission)
+        - Ngoài transaction: đóng hẳn connection rồi mượn connection mới (như execute_query / batch)
+        - Trong transaction phải giữ connection: KILL QUERY để server dừng gửi rồi mới close cursor
+        """
+        if not self.in_transaction:
+            self.conn.invalidate()
+            self.broken = True
+            try:
+                self.conn = self.executor._connect(self.target)
+            except Exception as e:
+                # Không mượn được connection mới: phiên hỏng, WebSocket sẽ đóng sau message này
+                print(f"Warning: could not reconnect SQL session {self.id}: {e}")
+                return
+            self.broken = False
+            return
+        self.executor.mysql_service.kill_query(self.conn.thread_id())
+        try:
+            cur.close()
+        except pymysql.err.MySQLError:
+            # Lỗi 1317 (query bị interrupt) khi đọc nốt: connection vẫn dùng được, transaction còn nguyên
+            if not self.conn.open:
+                self.broken = True
+
+    def _flush_writes(self) -> None:
+        if self._dirty:
+            query_result_cache.invalidate_database(self.database_id)
+            self._dirty = False
+
+    def _done(self, query_type: str, start_time: float, row_count: int = 0, affected_rows: int = 0,
+              truncated: bool = False, message: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "type": "done",
+            "query_type": query_type,
+            "row_count": row_count,
+            "affected_rows": affected_rows,
+            "truncated": truncated,
+            "execution_time_ms": round((time.time() - start_time) * 1000, 2),
+            "in_transaction": self.in_transaction,
+            "message": message,
+        }
+
+    def close(self) -> bool:
+        """
+        Đóng phiên: rollback transaction dở dang rồi trả connection về pool (connection hỏng thì đóng hẳn)
+        Returns: True nếu có transaction bị rollback
+        """
+        if self.closed:
+            return False
+        self.closed = True
+        rolled_back = self.in_transaction
+        if self.broken:
+            self.conn.invalidate()
+            return rolled_back
+        try:
+            self.conn.rollback()
+        except Exception as e:
+            self.executor._release_after_error(self.conn, e)
+            return rolled_back
+        self.conn.close()
+        self.in_transaction = False
+        return rolled_back
+
+
+class SQLSessionService:
+    def __init__(self):
+        self.executor = SQLExecutorService()
+        self.max_sessions_per_db = int(os.getenv("SQL_SESSION_MAX_PER_DB", "4"))
+        # Idle ngoài transaction / trong transaction (giữ lock trên server -> ngắn hơn)
+        self.idle_timeout = float(os.getenv("SQL_SESSION_IDLE_TIMEOUT", "300"))
+        self.transaction_idle_timeout = float(os.getenv("SQL_SESSION_TXN_IDLE_TIMEOUT", "60"))
+        self.max_rows = int(os.getenv("SQL_SESSION_MAX_ROWS", "100000"))
+        self.chunk_rows = int(os.getenv("SQL_SESSION_CHUNK_ROWS", "500"))
+
+    def open(self, db: Session, database_id: int, user_id: int) -> SQLSession:
+        """Mở phiên mới (kiểm tra quyền, giới hạn số phiên của database)"""
+        target = self.executor._get_target(db, database_id, user_id)
+        cost_limits = None
+        if self.executor.cost_guard_enabled:
+            cost_limits = self.executor.cost_guard.limits_for(db, user_id)[0]
+        with _sessions_lock:
+            open_count = sum(1 for s in _sessions.values() if s.database_id == database_id)
+            if open_count >= self.max_sessions_per_db:
+                raise ValueError(f"Too many open SQL sessions for database {database_id} (max {self.max_sessions_per_db})")
+            # Giữ chỗ trước khi connect để hai request đồng thời không vượt giới hạn
+            placeholder = uuid.uuid4().hex
+            _sessions[placeholder] = _Reservation(database_id)
+        try:
+            session = SQLSession(self.executor, target, self.max_rows, self.chunk_rows, cost_limits)
+        except BaseException:
+            with _sessions_lock:
+                del _sessions[placeholder]
+            raise
+        # Đổi chỗ giữ thành phiên thật trong cùng một lần giữ lock: số phiên đếm được không lúc nào hụt
+        with _sessions_lock:
+            del _sessions[placeholder]
+            _sessions[session.id] = session
+        return session
+
+    def idle_timeout_for(self, session: SQLSession) -> float:
+        return self.transaction_idle_timeout if session.in_transaction else self.idle_timeout
+
+    def close(self, session: Optional[SQLSession]) -> bool:
+        if session is None:
+            return False
+        with _sessions_lock:
+            _sessions.pop(session.id, None)
+        return session.close()
+
+    @staticmethod
+    def active_sessions(database_id: int) -> int:
+        with _sessions_lock:
+            return sum(1 for s in _sessions.values() if s.database_id == database_id)
+
+
+class _Reservation:
+    """Chỗ giữ trong _sessions khi phiên đang connect"""
+
+    def __init__(self, database_id: int):
+        self.database_id = database_id
@@ -0,0 +1,206 @@
+"""
+sql_tokenizer.py - Tách SQL script thành từng statement
+- Bỏ qua ';' nằm trong chuỗi ('...', "..."), identifier (`...`) và comment (--, #, /* */)
+- Hỗ trợ lệnh DELIMITER của mysql client (script có stored procedure / trigger)
+- Tìm placeholder '?' của parameterized query (bỏ qua '?' trong chuỗi/comment)
+- Lấy table đích của INSERT (tên `quoted`, db.table, modifier LOW_PRIORITY / IGNORE...)
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+_DELIMITER_RE = re.compile(r"DELIMITER[ \t]+(\S+)[ \t]*(?:\r?\n|$)", re.IGNORECASE)
+# Comment ở đầu statement (giữ lại /*! ... */ vì MySQL vẫn thực thi phần này)
+_LEADING_COMMENT_RE = re.compile(r"--(?:[ \t][^\n]*)?(?:\n|$)|#[^\n]*(?:\n|$)|/\*(?!!).*?\*/", re.DOTALL)
+_WORD_RE = re.compile(r"[A-Za-z0-9_$]+")
+# INSERT [LOW_PRIORITY | DELAYED | HIGH_PRIORITY] [IGNORE] [INTO] tbl_name
+_INSERT_MODIFIERS = {"LOW_PRIORITY", "DELAYED", "HIGH_PRIORITY", "IGNORE"}
+# Từ khóa có thể đứng ngay sau INSERT [INTO] khi không có tên table hợp lệ
+_INSERT_CLAUSES = {"INTO", "VALUES", "VALUE", "SET", "SELECT", "PARTITION", "TABLE", "WITH"}
+
+
+def split_statements(script: str) -> List[str]:
+    """
+    Tách script thành list statement (đã strip, không gồm delimiter)
+    Comment đầu statement bị bỏ; statement chỉ có comment/khoảng trắng bị bỏ qua
+    Raise ValueError nếu chuỗi/comment chưa đóng
+    """
+    statements = []
+    delimiter = ";"
+    start = 0
+    i = 0
+    n = len(script)
+    at_line_start = True
+
+    while i < n:
+        ch = script[i]
+
+        # DELIMITER chỉ có nghĩa ở đầu dòng, ngoài statement đang dở
+        if at_line_start and not script[start:i].strip():
+            match = _DELIMITER_RE.match(script, i)
+            if match:
+                delimiter = match.group(1)
+                i = start = match.end()
+                continue
+
+        if ch in ("'", '"', "`"):
+            i = _skip_quoted(script, i)
+            at_line_start = False
+            continue
+        if ch == "#" or (script.startswith("--", i) and (i + 2 == n or script[i + 2] in " \t\r\n")):
+            end = script.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if script.startswith("/*", i):
+            end = script.find("*/", i + 2)
+            if end == -1:
+                raise ValueError("Unterminated comment in SQL script")
+            i = end + 2
+            continue
+        if script.startswith(delimiter, i):
+            _append(statements, script[start:i])
+            i = start = i + len(delimiter)
+            at_line_start = False
+            continue
+
+        at_line_start = ch == "\n"
+        i += 1
+
+    _append(statements, script[start:])
+    return statements
+
+
+def find_placeholders(query: str) -> List[int]:
+    """Vị trí các placeholder '?' nằm ngoài chuỗi, identifier và comment"""
+    positions = []
+    i = 0
+    n = len(query)
+    while i < n:
+        ch = query[i]
+        if ch in ("'", '"', "`"):
+            i = _skip_quoted(query, i)
+            continue
+        if ch == "#" or (query.startswith("--", i) and (i + 2 == n or query[i + 2] in " \t\r\n")):
+            end = query.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            if end == -1:
+                raise ValueError("Unterminated comment in SQL query")
+            i = end + 2
+            continue
+        if ch == "?":
+            positions.append(i)
+        i += 1
+    return positions
+
+
+def to_pyformat(query: str) -> str:
+    """Đổi placeholder '?' sang '%s' của PyMySQL (escape '%' có sẵn thành '%%')"""
+    positions = set(find_placeholders(query))
+    return "".join("%s" if i in positions else ("%%" if ch == "%" else ch) for i, ch in enumerate(query))
+
+
+def insert_target(statement: str) -> Optional[Tuple[Optional[str], str]]:
+    """
+    Table đích của INSERT: (database hoặc None, table), identifier `...` đã bỏ quote
+    Không phải INSERT / không nhận diện được tên table -> None
+    """
+    try:
+        tokens = _tokens(statement, 8)
+    except ValueError:
+        return None
+    words = iter(tokens)
+    token = next(words, None)
+    if token is None or token[:2] != ("word", "INSERT"):
+        return None
+    token = next(words, None)
+    while token is not None and token[0] == "word" and token[1] in _INSERT_MODIFIERS:
+        token = next(words, None)
+    if token is not None and token[:2] == ("word", "INTO"):
+        token = next(words, None)
+    if token is None or token[0] not in ("word", "quoted") or (token[0] == "word" and token[1] in _INSERT_CLAUSES):
+        return None
+    name = token[2]
+    token = next(words, None)
+    if token is not None and token[0] == ".":
+        table = next(words, None)
+        if table is None or table[0] not in ("word", "quoted"):
+            return None
+        return name, table[2]
+    return None, name
+
+
+def _tokens(statement: str, limit: int) -> List[Tuple[str, str, str]]:
+    """
+    limit token đầu tiên (bỏ comment / khoảng trắng): ("word", CHỮ HOA, nguyên văn), ("quoted", tên, tên)
+    cho `identifier`, (ký tự, ký tự, ký tự) cho dấu câu; chuỗi '...' / "..." -> ("string", "", "")
+    """
+    tokens = []
+    i = 0
+    n = len(statement)
+    while i < n and len(tokens) < limit:
+        ch = statement[i]
+        if ch.isspace():
+            i += 1
+        elif ch == "#" or (statement.startswith("--", i) and (i + 2 == n or statement[i + 2] in " \t\r\n")):
+            end = statement.find("\n", i)
+            i = n if end == -1 else end
+        elif statement.startswith("/*", i):
+            end = statement.find("*/", i + 2)
+            if end == -1:
+                raise ValueError("Unterminated comment in SQL query")
+            i = end + 2
+        elif ch in ("'", '"', "`"):
+            end = _skip_quoted(statement, i)
+            if ch == "`":
+                name = statement[i + 1:end - 1].replace("``", "`")
+                tokens.append(("quoted", name, name))
+            else:
+                tokens.append(("string", "", ""))
+            i = end
+        else:
+            match = _WORD_RE.match(statement, i)
+            if match:
+                tokens.append(("word", match.group().upper(), match.group()))
+                i = match.end()
+            else:
+                tokens.append((ch, ch, ch))
+                i += 1
+    return tokens
+
+
+def _skip_quoted(script: str, i: int) -> int:
+    """Trả về vị trí ngay sau chuỗi/identifier bắt đầu tại i (hỗ trợ '' và \\' escape)"""
+    quote = script[i]
+    i += 1
+    n = len(script)
+    while i < n:
+        ch = script[i]
+        if ch == "\\" and quote != "`":
+            i += 2
+            continue
+        if ch == quote:
+            if i + 1 < n and script[i + 1] == quote:
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    raise ValueError("Unterminated quoted string in SQL script")
+
+
+def _append(statements: List[str], text: str) -> None:
+    statement = strip_leading_comments(text)
+    if statement:
+        statements.append(statement)
+
+
+def strip_leading_comments(statement: str) -> str:
+    """Bỏ comment/khoảng trắng đầu statement (để nhận diện loại lệnh); statement chỉ có comment -> ''"""
+    while True:
+        statement = statement.lstrip()
+        match = _LEADING_COMMENT_RE.match(statement)
+        if not match:
+            return statement.rstrip()
+        statement = statement[match.end():]
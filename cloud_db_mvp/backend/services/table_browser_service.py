@@ -0,0 +1,225 @@
+"""
+table_browser_service.py - Duyệt dữ liệu table theo trang bằng keyset (seek) pagination
+- Phân trang theo primary key (hoặc unique index NOT NULL), không dùng OFFSET
+  -> trang thứ N tốn như trang đầu: MySQL seek thẳng vào index
+- Cursor opaque (base64 JSON) chứa giá trị key của row cuối trang trước
+- Filter bằng (=) theo cột, sort theo cột có index
+- Metadata table lấy từ schema cache dùng chung với executor
+"""
+
+import os
+import json
+import base64
+import hashlib
+import re
+import time
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import List, Dict, Optional, Any, Tuple
+from sqlalchemy.orm import Session
+from services.query_admission import AdmissionTicket
+from services.sql_executor_service import SQLExecutorService
+
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z0-9_$]{1,64}$")
+
+
+class TableBrowserService:
+    def __init__(self):
+        self.executor = SQLExecutorService()
+        self.default_page_rows = int(os.getenv("SQL_BROWSE_PAGE_ROWS", "100"))
+        self.max_page_rows = int(os.getenv("SQL_BROWSE_MAX_PAGE_ROWS", "1000"))
+
+    def browse(
+        self,
+        db: Session,
+        database_id: int,
+        user_id: int,
+        table: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        sort: Optional[str] = None,
+        order: str = "asc",
+        filters: Optional[Dict[str, Any]] = None,
+        ticket: Optional[AdmissionTicket] = None
+    ) -> Dict[str, Any]:
+        """
+        Lấy một trang rows của table
+        - sort: cột có index (NOT NULL); mặc định sort theo key
+        - filters: {cột: giá trị} so sánh bằng (None -> IS NULL)
+        - cursor: next_cursor của trang trước (phải cùng sort/order/filters)
+        - ticket: slot admission đã được cấp trước; None -> chờ slot tại đây
+        Returns: {"columns", "rows", "next_cursor", "has_more", "key", ...}
+        """
+        if not _IDENTIFIER_RE.match(table or ""):
+            raise ValueError(f"Invalid table name '{table}'")
+        limit = limit or self.default_page_rows
+        if limit < 1 or limit > self.max_page_rows:
+            raise ValueError(f"limit must be between 1 and {self.max_page_rows}")
+        order = (order or "asc").lower()
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        filters = filters or {}
+
+        target = self.executor._get_target(db, database_id, user_id)
+        ticket = self.executor._admit(database_id, ticket)
+        start_time = time.time()
+        conn = None
+        try:
+            conn = self.executor._connect(target)
+            info = self.executor._table_schema(target, table, conn)
+            if info is None:
+                raise ValueError(f"Table '{table}' not found")
+            table = info["name"]
+
+            columns = {col["name"]: col for col in info["columns"]}
+            for col in filters:
+                if col not in columns:
+                    raise ValueError(f"Unknown filter column '{col}'")
+            key = self._pick_key(info, columns)
+            order_columns = self._order_columns(info, columns, key, sort)
+            fingerprint = self._cursor_fingerprint(table, order_columns, order, filters)
+            after = self._decode_cursor(cursor, fingerprint, len(order_columns)) if cursor else None
+
+            sql, args = self._build_query(table, order_columns, order, filters, after, limit + 1)
+            cur = conn.cursor()
+            cur.execute(self.executor._with_time_limit(sql, "SELECT"), args)
+            column_names = [desc[0] for desc in cur.description]
+            rows = list(cur.fetchall())
+            cur.close()
+            conn.close()
+            conn = None
+        except Exception as e:
+            self.executor._release_after_error(conn, e)
+            if isinstance(e, ValueError):
+                raise
+            raise Exception(f"Table browse failed: {str(e)}")
+        finally:
+            ticket.release()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more:
+            positions = [column_names.index(col) for col in order_columns]
+            next_cursor = self._encode_cursor(fingerprint, [rows[-1][pos] for pos in positions])
+
+        return {
+            "table": table,
+            "columns": column_names,
+            "rows": [[str(val) if val is not None else None for val in row] for row in rows],
+            "row_count": len(rows),
+            "key": key,
+            "order_by": order_columns,
+            "order": order,
+            "limit": limit,
+            "has_more": has_more,
+            "next_cursor": next_cursor,
+            "execution_time_ms": round((time.time() - start_time) * 1000, 2)
+        }
+
+    @staticmethod
+    def _pick_key(info: Dict[str, Any], columns: Dict[str, Dict[str, Any]]) -> List[str]:
+        """Primary key, nếu không có thì unique index đầu tiên mà mọi cột NOT NULL"""
+        if info["primary_key"]:
+            return list(info["primary_key"])
+        for index_columns in info["unique_keys"].values():
+            if all(not columns[col]["nullable"] for col in index_columns):
+                return list(index_columns)
+        raise ValueError(
+            f"Table '{info['name']}' has no primary key or NOT NULL unique index; keyset pagination is not possible"
+        )
+
+    @staticmethod
+    def _order_columns(info: Dict[str, Any], columns: Dict[str, Dict[str, Any]], key: List[str], sort: Optional[str]) -> List[str]:
+        """
+        Cột ORDER BY: sort (nếu có) + key làm tie-breaker -> thứ tự toàn phần, seek được
+        Phải có index mà thứ tự của nó chính là thứ tự ORDER BY: [sort], [sort] + cột PK, hoặc đúng danh sách order
+        (InnoDB tự nối cột PK vào cuối secondary index) -> MySQL đọc theo index, không filesort cả table
+        Index (sort, cột khác) không được: trong cùng giá trị sort, index không xếp theo key
+        """
+        if not sort or sort == key[0]:
+            return key
+        if sort not in columns:
+            raise ValueError(f"Unknown sort column '{sort}'")
+        order_columns = [sort] + [col for col in key if col != sort]
+        primary_key = list(info["primary_key"])
+        for index in info["indexes"].values():
+            index_columns = list(index["columns"])
+            implicit = index_columns + [col for col in primary_key if col not in index_columns]
+            if implicit[:len(order_columns)] == order_columns:
+                break
+        else:
+            raise ValueError(f"Sort column '{sort}' is not indexed")
+        if columns[sort]["nullable"]:
+            raise ValueError(f"Sort column '{sort}' is nullable; only NOT NULL indexed columns can be sorted")
+        return order_columns
+
+    @staticmethod
+    def _build_query(
+        table: str,
+        order_columns: List[str],
+        order: str,
+        filters: Dict[str, Any],
+        after: Optional[List[Any]],
+        fetch_rows: int
+    ) -> Tuple[str, List[Any]]:
+        """
+        SELECT ... WHERE filters AND (seek) ORDER BY ... LIMIT n
+        Seek viết dạng a > x OR (a = x AND b > y) thay vì row constructor để optimizer dùng range trên index
+        """
+        conditions = []
+        args: List[Any] = []
+        for col, value in filters.items():
+            if value is None:
+                conditions.append(f"`{col}` IS NULL")
+            else:
+                conditions.append(f"`{col}` = %s")
+                args.append(value)
+
+        if after is not None:
+            op = ">" if order == "asc" else "<"
+            branches = []
+            for i, col in enumerate(order_columns):
+                parts = [f"`{prev}` = %s" for prev in order_columns[:i]] + [f"`{col}` {op} %s"]
+                args.extend(after[:i + 1])
+                branches.append("(" + " AND ".join(parts) + ")")
+            conditions.append("(" + " OR ".join(branches) + ")")
+
+        sql = f"SELECT * FROM `{table}`"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        direction = "ASC" if order == "asc" else "DESC"
+        sql += " ORDER BY " + ", ".join(f"`{col}` {direction}" for col in order_columns)
+        sql += f" LIMIT {int(fetch_rows)}"
+        return sql, args
+
+    @staticmethod
+    def _cursor_fingerprint(table: str, order_columns: List[str], order: str, filters: Dict[str, Any]) -> str:
+        """Cursor chỉ hợp lệ với đúng table/sort/order/filters đã tạo ra nó"""
+        payload = json.dumps([table, order_columns, order, sorted(filters.items())], default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _encode_cursor(fingerprint: str, values: List[Any]) -> str:
+        encoded = []
+        for val in values:
+            if isinstance(val, (bytes, bytearray)):
+                encoded.append({"hex": bytes(val).hex()})
+            elif isinstance(val, (datetime, date, dt_time, Decimal)):
+                encoded.append(str(val))
+            else:
+                encoded.append(val)
+        raw = json.dumps({"f": fingerprint, "v": encoded}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str, fingerprint: str, size: int) -> List[Any]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            payload = json.loads(raw)
+            values = [bytes.fromhex(val["hex"]) if isinstance(val, dict) else val for val in payload["v"]]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("Invalid cursor")
+        if payload.get("f") != fingerprint or len(values) != size:
+            raise ValueError("Cursor does not match this table, sort or filters")
+        return values
@@ -11,6 +11,9 @@ from pathlib import Path
 backend_dir = Path(__file__).parent.parent
 sys.path.insert(0, str(backend_dir))
 
+# Không chạy collector metrics nền trong tests (cần MySQL thật)
+os.environ.setdefault("METRICS_COLLECTOR_ENABLED", "false")
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from fastapi.testclient import TestClient
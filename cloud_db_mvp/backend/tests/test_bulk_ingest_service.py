@@ -0,0 +1,154 @@
+"""
+test_bulk_ingest_service.py - Tests cho BulkIngestService
+"""
+
+import pytest
+import sys
+import pymysql
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.bulk_ingest_service import BulkIngestService
+from services.schema_cache import schema_cache
+from sqlalchemy.orm import Session
+
+# information_schema của table `orders` giả lập
+ORDER_TABLES = [("orders", "BASE TABLE", "InnoDB", 0, 16384, 0)]
+ORDER_COLUMNS = [
+    ("orders", "id", 1, "int", "int", "NO", None, "auto_increment", "PRI"),
+    ("orders", "customer", 2, "varchar", "varchar(64)", "NO", None, "", ""),
+    ("orders", "amount", 3, "decimal", "decimal(10,2)", "YES", None, "", ""),
+    ("orders", "total", 4, "decimal", "decimal(10,2)", "YES", None, "STORED GENERATED", ""),
+]
+
+
+class IngestCursor:
+    """Cursor giả lập: trả schema table và ghi lại các chunk executemany"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, args=None):
+        if "information_schema.TABLES" in query:
+            self.result = ORDER_TABLES
+        elif "information_schema.COLUMNS" in query:
+            self.result = ORDER_COLUMNS
+        else:
+            self.result = []
+
+    def fetchall(self):
+        return self.result
+
+    def executemany(self, query, rows):
+        if self.conn.fail_on_chunk == len(self.conn.chunks):
+            raise pymysql.err.DataError(1366, "Incorrect decimal value")
+        self.conn.query = query
+        self.conn.chunks.append(rows)
+
+    def close(self):
+        pass
+
+
+class IngestConnection:
+    """Connection giả lập ghi lại commit/rollback"""
+
+    def __init__(self, fail_on_chunk=None):
+        self.fail_on_chunk = fail_on_chunk
+        self.chunks = []
+        self.events = []
+        self.released = None
+
+    def cursor(self):
+        return IngestCursor(self)
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def close(self):
+        self.released = "pool"
+
+    def invalidate(self):
+        self.released = "discarded"
+
+
+class TestBulkIngestService:
+    """Tests cho BulkIngestService"""
+
+    def _service(self, monkeypatch, conn):
+        service = BulkIngestService()
+        schema_cache.clear()
+        monkeypatch.setattr(service.executor, "_connect", lambda target: conn)
+        return service
+
+    def test_parse_json_objects(self):
+        """JSON list object -> columns theo object đầu tiên"""
+        columns, rows = BulkIngestService().parse_payload(
+            b'[{"customer": "a", "amount": 1}, {"amount": 2, "customer": "b"}]', "application/json"
+        )
+
+        assert columns == ["customer", "amount"]
+        assert rows == [["a", 1], ["b", 2]]
+
+    def test_parse_json_rejects_mismatched_rows(self):
+        """Object thiếu cột -> ValueError"""
+        with pytest.raises(ValueError, match="Row 2"):
+            BulkIngestService().parse_payload(b'[{"a": 1}, {"b": 2}]', "application/json")
+
+    def test_parse_csv(self):
+        """CSV: dòng đầu là header"""
+        columns, rows = BulkIngestService().parse_payload(b"customer,amount\r\na,1.5\r\n\"b,c\",\r\n", "text/csv; charset=utf-8")
+
+        assert columns == ["customer", "amount"]
+        assert rows == [["a", "1.5"], ["b,c", ""]]
+
+    def test_ingest_in_chunks(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Rows được ghi theo chunk, commit sau mỗi chunk, "" của cột số -> NULL khi nạp CSV"""
+        conn = IngestConnection()
+        service = self._service(monkeypatch, conn)
+
+        result = service.ingest(
+            test_db, test_database.id, test_user.id, "orders",
+            ["customer", "amount"], [["a", "1"], ["b", ""], ["", "3"]],
+            chunk_size=2, from_csv=True
+        )
+
+        assert result["rows_inserted"] == 3
+        assert result["chunks"] == 2
+        assert conn.chunks == [[["a", "1"], ["b", None]], [["", "3"]]]
+        assert conn.query == "INSERT INTO `orders` (`customer`, `amount`) VALUES (%s, %s)"
+        assert conn.events == ["commit", "commit"]
+        assert conn.released == "pool"
+
+    def test_ingest_atomic_rolls_back(self, monkeypatch, test_db: Session, test_database, test_user):
+        """atomic=True: chunk lỗi -> rollback toàn bộ, rows_inserted = 0"""
+        conn = IngestConnection(fail_on_chunk=1)
+        service = self._service(monkeypatch, conn)
+
+        result = service.ingest(
+            test_db, test_database.id, test_user.id, "orders",
+            ["customer"], [["a"], ["b"], ["c"]], chunk_size=2, atomic=True
+        )
+
+        assert result["success"] is False
+        assert result["failed_chunk"] == 1
+        assert result["rows_inserted"] == 0
+        assert conn.events == ["rollback"]
+
+    def test_ingest_validates_columns(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Cột không tồn tại, generated column, thiếu cột NOT NULL -> ValueError"""
+        service = self._service(monkeypatch, IngestConnection())
+
+        with pytest.raises(ValueError, match="Unknown column"):
+            service.ingest(test_db, test_database.id, test_user.id, "orders", ["customer", "nope"], [["a", 1]])
+        with pytest.raises(ValueError, match="generated"):
+            service.ingest(test_db, test_database.id, test_user.id, "orders", ["customer", "total"], [["a", 1]])
+        with pytest.raises(ValueError, match="Missing required column.*customer"):
+            service.ingest(test_db, test_database.id, test_user.id, "orders", ["amount"], [[1]])
+        with pytest.raises(ValueError, match="not found"):
+            service.ingest(test_db, test_database.id, test_user.id, "missing", ["a"], [[1]])
@@ -0,0 +1,209 @@
+"""
+test_fleet_sampler.py - Tests cho lấy mẫu metrics theo lô (FleetSampler)
+"""
+
+import pytest
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy.orm import Session
+from models import Database, PerformanceMetric, MetricCounter, MetricRollup
+from services.fleet_sampler import FleetSampler, counter_rates
+from services.monitoring_service import MonitoringService
+
+PROCESSLIST = {"db_1": 3, "db_2": 1, "test_db_physical": 2, "other": 9}
+STORAGE = {"db_1": 12.5, "db_3": 0.75, "test_db_physical": 4.25, "other": 100.0}
+# user MySQL của database -> (COUNT_STAR, SUM_TIMER_WAIT picoseconds, rows)
+COUNTERS = {"user_1": (500, 2_000_000_000, 800), "test_user": (1000, 65_000_000_000_000, 2000)}
+ACCOUNTS = {"db_1": "user_1", "db_2": "user_2", "db_3": "user_3"}
+
+
+class FakeMySQL:
+    """MySQLService giả lập: trả kết quả GROUP BY theo các schema trong IN (...)"""
+
+    def __init__(self, fail=False, counters_fail=False):
+        self.fail = fail
+        self.counters_fail = counters_fail
+        self.executed = []
+        self.closed = 0
+
+    def connect(self):
+        mysql = self
+
+        class Cursor:
+            def execute(self, query, args=None):
+                if mysql.fail:
+                    raise Exception("Can't connect to MySQL server")
+                mysql.executed.append((query, args))
+                self.query, self.args = query, args or ()
+                if mysql.counters_fail and "events_statements" in query:
+                    raise Exception("SELECT command denied to user for table "
+                                    "'events_statements_summary_by_account_by_event_name'")
+
+            def fetchone(self):
+                return (151,)
+
+            def fetchall(self):
+                if "events_statements" in self.query:
+                    return [(user, *COUNTERS[user]) for user in self.args if user in COUNTERS]
+                source = PROCESSLIST if "PROCESSLIST" in self.query else STORAGE
+                return [(schema, source[schema]) for schema in self.args if schema in source]
+
+            def close(self):
+                pass
+
+        class Connection:
+            def cursor(self):
+                return Cursor()
+
+            def close(self):
+                mysql.closed += 1
+
+        return Connection()
+
+
+class TestFleetSampler:
+    """Tests cho FleetSampler"""
+
+    def test_sample_fans_out_grouped_results(self):
+        mysql = FakeMySQL()
+        result = FleetSampler(mysql_service=mysql).sample(["db_1", "db_2", "db_3"], ACCOUNTS)
+
+        assert result["schemas"] == {
+            "db_1": {"connections": 3, "storage_mb": 12.5,
+                     "counters": {"statements": 500, "timer_wait_us": 2000, "rows": 800}},
+            "db_2": {"connections": 1, "storage_mb": 0.0,
+                     "counters": {"statements": 0, "timer_wait_us": 0, "rows": 0}},
+            "db_3": {"connections": 0, "storage_mb": 0.75,
+                     "counters": {"statements": 0, "timer_wait_us": 0, "rows": 0}},
+        }
+        assert result["host"]["max_connections"] == 151
+        assert result["round_trips"] == 4
+        assert len(mysql.executed) == 4
+        assert mysql.closed == 1
+
+    def test_missing_counter_access_keeps_other_metrics(self):
+        result = FleetSampler(mysql_service=FakeMySQL(counters_fail=True)).sample(["db_1"], ACCOUNTS)
+
+        assert result["schemas"]["db_1"]["connections"] == 3
+        assert result["schemas"]["db_1"]["counters"] is None
+        # Query counter bị từ chối vẫn là một round-trip tới server
+        assert result["round_trips"] == 1 + 3
+
+    def test_counters_keyed_by_tenant_account(self):
+        """Chỉ statement SQL của user database; PREPARE / DEALLOCATE / SET của executor không tính"""
+        mysql = FakeMySQL()
+        result = FleetSampler(mysql_service=mysql).sample(["db_1"], ACCOUNTS)
+
+        query, args = mysql.executed[-1]
+        assert "events_statements_summary_by_account_by_event_name" in query
+        assert "WHERE USER IN (%s)" in query and "GROUP BY USER" in query
+        assert args == ("user_1", "statement/sql/%", "statement/sql/prepare_sql",
+                        "statement/sql/dealloc_sql", "statement/sql/set_option")
+        assert result["schemas"]["db_1"]["counters"]["statements"] == 500
+
+    def test_schema_without_account_has_no_counters(self):
+        mysql = FakeMySQL()
+        result = FleetSampler(mysql_service=mysql).sample(["db_1"])
+
+        assert result["schemas"]["db_1"]["counters"] is None
+        assert result["round_trips"] == 1 + 2
+
+    def test_schemas_are_chunked(self):
+        """Round-trip tăng theo số lô, không theo số schema"""
+        mysql = FakeMySQL()
+        schemas = [f"db_{i}" for i in range(1, 8)]
+
+        result = FleetSampler(mysql_service=mysql, chunk_size=3).sample(schemas, {s: f"user_{s[3:]}" for s in schemas})
+
+        assert result["round_trips"] == 1 + 3 * 3
+        assert result["round_trips"] == len(mysql.executed)
+        # Query counter: user của lô + pattern statement SQL + 3 loại statement của executor
+        assert [len(args) for query, args in mysql.executed if args] == [3, 3, 7, 3, 3, 7, 1, 1, 5]
+        assert result["schemas"]["db_1"]["connections"] == 3
+
+    def test_counter_rates(self):
+        previous = {"statements": 1000, "timer_wait_us": 50_000, "rows": 4000}
+        current = {"statements": 1600, "timer_wait_us": 80_000, "rows": 5000}
+
+        assert counter_rates(previous, current, 60.0) == {"qps": 10.0, "avg_response_ms": 0.05, "rows_per_second": 16.67}
+        # Không có statement mới: response time 0, không chia cho 0
+        assert counter_rates(current, current, 60.0) == {"qps": 0.0, "avg_response_ms": 0.0, "rows_per_second": 0.0}
+
+    def test_counter_reset_gives_no_rate(self):
+        """MySQL restart / TRUNCATE bảng summary: counter giảm -> không ra tốc độ âm"""
+        previous = {"statements": 1000, "timer_wait_us": 50_000, "rows": 4000}
+        current = {"statements": 20, "timer_wait_us": 100, "rows": 30}
+
+        assert counter_rates(previous, current, 60.0) is None
+        assert counter_rates(previous, previous, 0.0) is None
+
+
+class TestCollectFleetMetrics:
+    """Tests cho MonitoringService.collect_fleet_metrics"""
+
+    def _service(self, mysql) -> MonitoringService:
+        service = MonitoringService()
+        service.fleet_sampler = FleetSampler(mysql_service=mysql)
+        return service
+
+    def test_stores_metrics_for_every_active_database(self, test_db: Session, test_database, test_user):
+        test_db.add(Database(id=2, name="second", owner_id=test_user.id, status="ACTIVE", physical_db_name="db_2",
+                             db_username="user_2"))
+        test_db.add(Database(id=3, name="gone", owner_id=test_user.id, status="DELETED", physical_db_name="db_3"))
+        test_db.commit()
+        mysql = FakeMySQL()
+
+        result = self._service(mysql).collect_fleet_metrics(test_db, [test_database.id, 2, 3])
+
+        assert result == {"databases": 2, "round_trips": 4, "counter_resets": 0}
+        rows = {(m.database_id, m.metric_type): float(m.value) for m in test_db.query(PerformanceMetric).all()}
+        assert rows[(test_database.id, "CONNECTIONS")] == 2.0
+        assert rows[(test_database.id, "MEMORY")] == 4.25
+        assert rows[(2, "CONNECTIONS")] == 1.0
+        assert (3, "CONNECTIONS") not in rows
+        # Lần lấy mẫu đầu: chỉ lưu counter, chưa có QPS
+        assert len(rows) == 4
+        # Mỗi mẫu được cộng vào rollup 1m / 1h / 1d
+        assert test_db.query(MetricRollup).count() == 4 * 3
+        assert test_db.query(MetricCounter).get(test_database.id).statements == 1000
+
+    def test_rates_from_consecutive_samples(self, test_db: Session, test_database):
+        """QPS / response time / throughput theo schema từ hai snapshot counter"""
+        test_db.add(MetricCounter(database_id=test_database.id, statements=400, timer_wait_us=5_000_000, rows=800,
+                                  sampled_at=datetime.now() - timedelta(seconds=60)))
+        test_db.commit()
+
+        self._service(FakeMySQL()).collect_fleet_metrics(test_db, [test_database.id])
+
+        rows = {m.metric_type: float(m.value) for m in test_db.query(PerformanceMetric).all()}
+        assert rows["QUERIES"] == pytest.approx(10.0, abs=0.05)
+        assert rows["RESPONSE_TIME"] == 100.0
+        assert rows["THROUGHPUT"] == pytest.approx(20.0, abs=0.05)
+        counter = test_db.query(MetricCounter).get(test_database.id)
+        assert counter.statements == 1000
+        assert counter.timer_wait_us == 65_000_000
+
+    def test_counter_reset_skips_rates_and_rebases(self, test_db: Session, test_database):
+        test_db.add(MetricCounter(database_id=test_database.id, statements=99999, timer_wait_us=1, rows=1,
+                                  sampled_at=datetime.now() - timedelta(seconds=60)))
+        test_db.commit()
+
+        result = self._service(FakeMySQL()).collect_fleet_metrics(test_db, [test_database.id])
+
+        assert result["counter_resets"] == 1
+        types = {m.metric_type for m in test_db.query(PerformanceMetric).all()}
+        assert types == {"CONNECTIONS", "MEMORY"}
+        assert test_db.query(MetricCounter).get(test_database.id).statements == 1000
+
+    def test_collect_metrics_falls_back_to_zeros(self, test_db: Session, test_database):
+        result = self._service(FakeMySQL(fail=True)).collect_metrics(test_db, test_database.id)
+
+        assert result is False
+        values = [float(m.value) for m in test_db.query(PerformanceMetric).all()]
+        assert values == [0.0, 0.0, 0.0]
@@ -0,0 +1,87 @@
+"""
+test_metric_rollups.py - Tests cho rollup metrics 1m / 1h / 1d
+"""
+
+import pytest
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy.orm import Session
+from models import MetricRollup, PerformanceMetric
+from services import metric_rollups
+from services.monitoring_service import MonitoringService
+
+
+def _sample(database_id, metric_type, value, timestamp):
+    return {"database_id": database_id, "metric_type": metric_type, "value": value, "timestamp": timestamp}
+
+
+class TestMetricRollups:
+    """Tests cho services/metric_rollups.py"""
+
+    def test_resolution_for_timeframes(self):
+        """Timeframe ngắn đọc mẫu thô, dài hơn đọc độ phân giải thô nhất còn đủ điểm"""
+        assert metric_rollups.resolution_for(timedelta(hours=1)) is None
+        assert metric_rollups.resolution_for(timedelta(hours=6)) == "1m"
+        assert metric_rollups.resolution_for(timedelta(hours=24)) == "1h"
+        assert metric_rollups.resolution_for(timedelta(days=7)) == "1h"
+        assert metric_rollups.resolution_for(timedelta(days=30)) == "1d"
+
+    def test_apply_accumulates_into_every_resolution(self, test_db: Session, test_database):
+        t = datetime(2024, 5, 1, 10, 15, 20)
+        metric_rollups.apply(test_db, [_sample(test_database.id, "QUERIES", 10.0, t)])
+        test_db.commit()
+        # Lần ghi sau cộng dồn vào bucket đã có, không tạo dòng mới
+        metric_rollups.apply(test_db, [
+            _sample(test_database.id, "QUERIES", 30.0, t + timedelta(seconds=30)),
+            _sample(test_database.id, "QUERIES", 2.0, t + timedelta(minutes=5)),
+        ])
+        test_db.commit()
+
+        rows = {(r.resolution, r.bucket_start): r for r in test_db.query(MetricRollup).all()}
+        minute = rows[("1m", datetime(2024, 5, 1, 10, 15))]
+        assert (minute.count, minute.sum, minute.min, minute.max) == (2, 40.0, 10.0, 30.0)
+        assert rows[("1m", datetime(2024, 5, 1, 10, 20))].count == 1
+        hour = rows[("1h", datetime(2024, 5, 1, 10, 0))]
+        assert (hour.count, hour.sum, hour.min, hour.max) == (3, 42.0, 2.0, 30.0)
+        assert rows[("1d", datetime(2024, 5, 1))].count == 3
+        assert len(rows) == 4
+
+    def test_prune_uses_retention_per_resolution(self, test_db: Session, test_database, monkeypatch):
+        monkeypatch.setitem(metric_rollups.RETENTION, "1m", timedelta(hours=2))
+        now = datetime(2024, 5, 10, 12, 0)
+        old = now - timedelta(hours=3)
+        metric_rollups.apply(test_db, [
+            _sample(test_database.id, "CONNECTIONS", 1.0, old),
+            _sample(test_database.id, "CONNECTIONS", 2.0, now),
+        ])
+        test_db.commit()
+
+        deleted = metric_rollups.prune(test_db, now=now)
+
+        assert deleted == {"1m": 1, "1h": 0, "1d": 0}
+        assert test_db.query(MetricRollup).filter_by(resolution="1m").count() == 1
+        assert test_db.query(MetricRollup).filter_by(resolution="1h").count() == 2
+
+    def test_get_metrics_long_timeframe_reads_rollups(self, test_db: Session, test_database):
+        """24h đọc bucket 1h (avg / min / max), không đọc mẫu thô"""
+        now = datetime.now()
+        samples = [_sample(test_database.id, "CONNECTIONS", value, now) for value in (4.0, 8.0)]
+        # Mẫu thô không có rollup: không xuất hiện ở timeframe dài
+        test_db.add(PerformanceMetric(database_id=test_database.id, metric_type="QUERIES", value=5.0, timestamp=now))
+        metric_rollups.apply(test_db, samples)
+        test_db.commit()
+
+        result = MonitoringService().get_metrics(test_db, test_database.id, "24h")
+
+        assert result["resolution"] == "1h"
+        point = result["metrics"]["CONNECTIONS"][0]
+        assert point["value"] == 6.0
+        assert (point["min"], point["max"], point["count"]) == (4.0, 8.0, 2)
+        assert result["metrics"]["QUERIES"] == []
+        assert MonitoringService().get_metrics(test_db, test_database.id, "1h")["resolution"] == "raw"
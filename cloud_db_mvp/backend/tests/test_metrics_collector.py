@@ -0,0 +1,143 @@
+"""
+test_metrics_collector.py - Tests cho collector metrics nền
+"""
+
+import time
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import Database
+from services.metrics_collector import MetricsCollector
+
+
+class FakeMonitoring:
+    """MonitoringService giả lập: ghi lại database được collect, lô chứa database trong `failing` lỗi"""
+
+    def __init__(self, calls, failing=(), batches=None):
+        self.calls = calls
+        self.failing = failing
+        self.batches = batches if batches is not None else []
+
+    def collect_fleet_metrics(self, db, database_ids):
+        self.calls.extend(database_ids)
+        self.batches.append(list(database_ids))
+        if any(database_id in self.failing for database_id in database_ids):
+            raise Exception("MySQL unavailable")
+        return {"databases": len(database_ids), "round_trips": 3}
+
+
+@pytest.fixture
+def shared_session_factory():
+    """SQLite in-memory dùng chung một connection: thread nền của collector thấy cùng dữ liệu"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(Database(id=7, name="shared", owner_id=1, status="ACTIVE"))
+    db.commit()
+    db.close()
+    yield factory
+    Base.metadata.drop_all(bind=engine)
+
+
+class TestMetricsCollector:
+    """Tests cho MetricsCollector"""
+
+    def _collector(self, test_db: Session, calls, failing=(), interval=60.0) -> MetricsCollector:
+        return MetricsCollector(
+            session_factory=sessionmaker(bind=test_db.get_bind()),
+            interval=interval,
+            jitter=0.0,
+            service_factory=lambda: FakeMonitoring(calls, failing)
+        )
+
+    def test_cycle_samples_only_active_databases(self, test_db: Session, test_database, test_user):
+        deleted = Database(name="old", owner_id=test_user.id, status="DELETED")
+        test_db.add(deleted)
+        test_db.commit()
+        calls = []
+
+        result = self._collector(test_db, calls).run_cycle(lag_ms=12.5)
+
+        assert calls == [test_database.id]
+        assert result["databases"] == 1
+        assert result["errors"] == 0
+
+    def test_cycle_stats_track_timing_lag_and_errors(self, test_db: Session, test_database):
+        calls = []
+        collector = self._collector(test_db, calls, failing=(test_database.id,))
+
+        collector.run_cycle(lag_ms=40.0)
+        collector.run_cycle(lag_ms=10.0)
+
+        stats = collector.stats()
+        assert stats["cycles"] == 2
+        assert stats["errors"] == 2
+        assert stats["last_cycle_errors"] == 1
+        assert stats["last_lag_ms"] == 10.0
+        assert stats["max_lag_ms"] == 40.0
+        assert stats["last_cycle_ms"] is not None
+        assert stats["running"] is False
+
+    def test_cycle_samples_in_batches(self, test_db: Session, test_database, test_user):
+        """Mỗi lô một lượt lấy mẫu; lô lỗi không làm hỏng lô khác"""
+        for i in range(4):
+            test_db.add(Database(name=f"extra_{i}", owner_id=test_user.id, status="ACTIVE"))
+        test_db.commit()
+        calls, batches = [], []
+        collector = MetricsCollector(
+            session_factory=sessionmaker(bind=test_db.get_bind()), jitter=0.0, batch_size=2,
+            service_factory=lambda: FakeMonitoring(calls, failing=(test_database.id,), batches=batches)
+        )
+
+        result = collector.run_cycle()
+
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert result["errors"] == 2
+        assert result["round_trips"] == 6
+        assert collector.stats()["last_cycle_round_trips"] == 6
+
+    def test_request_sample_wakes_background_thread(self, shared_session_factory):
+        """Database mới: được lấy mẫu ngay, không chờ tới chu kỳ sau"""
+        calls = []
+        collector = MetricsCollector(session_factory=shared_session_factory, interval=3600.0, jitter=0.0,
+                                     service_factory=lambda: FakeMonitoring(calls))
+        # Chu kỳ đầu tiên nằm xa trong tương lai
+        collector._initial_delay = lambda: 3600.0
+        collector.start()
+        try:
+            collector.request_sample(7)
+            deadline = time.monotonic() + 2.0
+            while not calls and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            collector.stop()
+
+        assert calls == [7]
+        assert collector.stats()["on_demand_samples"] == 1
+        assert collector.stats()["cycles"] == 0
+        assert collector.running is False
+
+    def test_background_thread_runs_cycles(self, shared_session_factory):
+        calls = []
+        collector = MetricsCollector(session_factory=shared_session_factory, interval=0.05, jitter=0.0,
+                                     service_factory=lambda: FakeMonitoring(calls))
+        collector.start()
+        try:
+            deadline = time.monotonic() + 2.0
+            while len(calls) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            collector.stop()
+
+        assert len(calls) >= 2
+        assert collector.stats()["cycles"] >= 2
@@ -0,0 +1,110 @@
+"""
+test_metrics_retention.py - Tests cho job dọn mẫu thô performance_metrics
+"""
+
+import pytest
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy.orm import Session, sessionmaker
+from models import PerformanceMetric
+from services.metrics_retention import (
+    MetricsRetentionJob, parse_retention_overrides, expired_partitions, missing_partitions, to_days
+)
+
+NOW = datetime(2024, 5, 10, 12, 0)
+
+
+class TestMetricsRetentionJob:
+    """Tests cho MetricsRetentionJob"""
+
+    def _job(self, test_db: Session, **kwargs) -> MetricsRetentionJob:
+        kwargs.setdefault("pause", 0)
+        return MetricsRetentionJob(session_factory=sessionmaker(bind=test_db.get_bind()), **kwargs)
+
+    def _add(self, test_db: Session, database_id, metric_type, count, age):
+        test_db.add_all([
+            PerformanceMetric(database_id=database_id, metric_type=metric_type, value=1.0, timestamp=NOW - age)
+            for _ in range(count)
+        ])
+        test_db.commit()
+
+    def test_parse_retention_overrides(self):
+        assert parse_retention_overrides("connections=24, QUERIES=72") == {"CONNECTIONS": 24.0, "QUERIES": 72.0}
+        assert parse_retention_overrides("") == {}
+        with pytest.raises(ValueError, match="Invalid metrics retention entry"):
+            parse_retention_overrides("QUERIES=forever")
+
+    def test_deletes_expired_rows_per_type_in_batches(self, test_db: Session, test_database):
+        """CONNECTIONS giữ 24h, type khác giữ mặc định 168h"""
+        self._add(test_db, test_database.id, "CONNECTIONS", 25, timedelta(hours=48))
+        self._add(test_db, test_database.id, "CONNECTIONS", 5, timedelta(hours=1))
+        self._add(test_db, test_database.id, "QUERIES", 5, timedelta(hours=48))
+        self._add(test_db, test_database.id, "QUERIES", 3, timedelta(days=10))
+        job = self._job(test_db, default_hours=168, overrides={"CONNECTIONS": 24}, batch_size=10)
+
+        report = job.run_once(now=NOW)
+
+        assert report["deleted"] == {"CONNECTIONS": 25, "QUERIES": 3}
+        assert report["rows_reclaimed"] == 28
+        assert report["batches"] == 4
+        assert report["finished"] is True
+        assert report["partitions_dropped"] == []
+        assert test_db.query(PerformanceMetric).count() == 10
+        assert job.stats()["total_rows_reclaimed"] == 28
+
+    def test_max_batches_leaves_rest_for_next_run(self, test_db: Session, test_database):
+        self._add(test_db, test_database.id, "MEMORY", 12, timedelta(days=30))
+        job = self._job(test_db, batch_size=5, max_batches=2)
+
+        first = job.run_once(now=NOW)
+        second = job.run_once(now=NOW)
+
+        assert (first["rows_reclaimed"], first["finished"]) == (10, False)
+        assert (second["rows_reclaimed"], second["finished"]) == (2, True)
+        assert test_db.query(PerformanceMetric).count() == 0
+
+    def test_unknown_metric_type_uses_default_retention(self, test_db: Session, test_database):
+        self._add(test_db, test_database.id, "LEGACY_TOTAL_QUERIES", 2, timedelta(days=30))
+
+        report = self._job(test_db).run_once(now=NOW)
+
+        assert report["deleted"] == {"OTHER": 2}
+
+    def test_maybe_run_respects_interval(self, test_db: Session):
+        job = self._job(test_db, interval=3600)
+
+        assert job.maybe_run() is not None
+        assert job.maybe_run() is None
+
+
+class TestPartitions:
+    """Tests cho chọn partition cần drop / cần tạo (MySQL RANGE (TO_DAYS(timestamp)))"""
+
+    def test_to_days_matches_mysql(self):
+        # Ví dụ trong tài liệu MySQL: TO_DAYS('2007-10-07') = 733321
+        assert to_days(date(2007, 10, 7)) == 733321
+
+    def test_expired_partitions(self):
+        partitions = [
+            ("p20240501", str(to_days(date(2024, 5, 2)))),
+            ("p20240502", str(to_days(date(2024, 5, 3)))),
+            ("p20240503", str(to_days(date(2024, 5, 4)))),
+            ("pmax", "MAXVALUE"),
+        ]
+
+        # Dòng của ngày 03/05 có thể còn mới hơn cutoff -> giữ lại
+        assert expired_partitions(partitions, datetime(2024, 5, 3, 8, 0)) == ["p20240501", "p20240502"]
+
+    def test_missing_partitions_only_above_existing_bounds(self):
+        partitions = [("p20240510", str(to_days(date(2024, 5, 11)))), ("pmax", "MAXVALUE")]
+
+        missing = missing_partitions(partitions, date(2024, 5, 10), days_ahead=2)
+
+        assert missing == [("p20240511", to_days(date(2024, 5, 12))), ("p20240512", to_days(date(2024, 5, 13)))]
+        assert len(missing_partitions([("pmax", "MAXVALUE")], date(2024, 5, 10), days_ahead=2)) == 3
@@ -47,6 +47,12 @@ class TestMonitoringAPI:
         assert response.status_code == 404
         assert "not found" in response.json()["detail"].lower()
     
+    def test_collector_stats_not_exposed_to_tenants(self, authenticated_client: TestClient):
+        """Số liệu collector là của cả fleet -> không có endpoint cho tenant"""
+        response = authenticated_client.get("/monitoring/collector")
+        
+        assert response.status_code == 404
+    
     def test_get_realtime_metrics_success(self, authenticated_client: TestClient, test_database):
         """Test lấy real-time metrics"""
         response = authenticated_client.get(f"/db/{test_database.id}/metrics/realtime")
@@ -0,0 +1,279 @@
+"""
+test_mysql_service.py - Tests cho MySQLConnectionPool
+"""
+
+import pytest
+import sys
+import threading
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services import mysql_service
+from services.mysql_service import (
+    COM_RESET_CONNECTION, MySQLConnectionPool, PoolTimeoutError, TenantPoolRegistry, _reset_session
+)
+
+
+class FakeConnection:
+    """Connection giả lập cho pool tests (không cần MySQL)"""
+
+    def __init__(self):
+        self.open = True
+        self.pings = 0
+        self.fail_ping = False
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.fail_ping:
+            raise Exception("MySQL server has gone away")
+
+    def close(self):
+        self.open = False
+
+
+class TestMySQLConnectionPool:
+    """Tests cho MySQLConnectionPool"""
+
+    def test_checkin_reuses_connection(self):
+        """Connection trả về pool được dùng lại"""
+        created = []
+        pool = MySQLConnectionPool(lambda: created.append(FakeConnection()) or created[-1], max_size=2)
+
+        conn = pool.checkout()
+        raw = conn.raw
+        conn.close()
+        conn.close()  # close lần 2 không làm hỏng pool
+
+        conn2 = pool.checkout()
+        assert conn2.raw is raw
+        assert len(created) == 1
+        stats = pool.stats()
+        assert stats["checkouts"] == 2
+        assert stats["created"] == 1
+        assert stats["in_use"] == 1
+
+    def test_checkout_timeout_when_exhausted(self):
+        """Pool đầy -> chờ rồi raise PoolTimeoutError"""
+        pool = MySQLConnectionPool(FakeConnection, max_size=1, wait_timeout=0.05)
+        conn = pool.checkout()
+
+        with pytest.raises(PoolTimeoutError):
+            pool.checkout()
+        assert pool.stats()["timeouts"] == 1
+        conn.close()
+
+    def test_waiter_gets_released_connection(self):
+        """Thread đang chờ nhận được connection khi có người trả về"""
+        pool = MySQLConnectionPool(FakeConnection, max_size=1, wait_timeout=2)
+        conn = pool.checkout()
+        result = {}
+
+        def worker():
+            result["conn"] = pool.checkout()
+
+        t = threading.Thread(target=worker)
+        t.start()
+        conn.close()
+        t.join(2)
+
+        assert result["conn"].raw is conn.raw
+        assert pool.stats()["waits"] == 1
+
+    def test_failed_pre_ping_replaces_connection(self):
+        """Connection idle ping lỗi thì bị bỏ và tạo connection mới"""
+        pool = MySQLConnectionPool(FakeConnection, max_size=1, pre_ping_after=0)
+        conn = pool.checkout()
+        stale = conn.raw
+        stale.fail_ping = True
+        conn.close()
+
+        conn2 = pool.checkout()
+        assert conn2.raw is not stale
+        assert stale.open is False
+        stats = pool.stats()
+        assert stats["ping_failures"] == 1
+        assert stats["size"] == 1
+
+    def test_max_lifetime_recycles_connection(self):
+        """Connection quá max_lifetime bị đóng khi checkout"""
+        pool = MySQLConnectionPool(FakeConnection, max_size=1, max_lifetime=0)
+        conn = pool.checkout()
+        old = conn.raw
+        conn.close()
+
+        conn2 = pool.checkout()
+        assert conn2.raw is not old
+        assert pool.stats()["recycled"] == 1
+
+    def test_connect_failure_releases_slot(self):
+        """Lỗi khi mở connection không chiếm slot của pool"""
+        def broken():
+            raise ConnectionRefusedError("refused")
+
+        pool = MySQLConnectionPool(broken, max_size=1, wait_timeout=0.05)
+        for _ in range(3):
+            with pytest.raises(ConnectionRefusedError):
+                pool.checkout()
+        assert pool.stats()["size"] == 0
+
+
+class FakeSessionConnection(FakeConnection):
+    """Connection giả lập ghi lại lệnh protocol / query gửi lên server"""
+
+    def __init__(self, charset="utf8mb4", collation=None, autocommit=True, db=None):
+        super().__init__()
+        self.charset, self.collation, self.autocommit_mode, self.db = charset, collation, autocommit, db
+        self.sent = []
+
+    def select_db(self, db):
+        self.sent.append(("select_db", db))
+
+    def _execute_command(self, command, sql):
+        self.sent.append((command, sql))
+
+    def _read_ok_packet(self):
+        pass
+
+    def query(self, sql):
+        self.sent.append(("query", sql))
+
+
+class TestResetSession:
+    """Tests cho reset session khi trả connection về pool"""
+
+    def test_reset_connection_then_restores_charset_and_autocommit(self):
+        raw = FakeSessionConnection(collation="utf8mb4_unicode_ci", autocommit=False)
+
+        _reset_session(raw)
+
+        assert raw.sent == [
+            (COM_RESET_CONNECTION, b""),
+            ("query", "SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci, autocommit=0"),
+        ]
+
+    def test_tenant_connection_reselects_its_database(self, monkeypatch):
+        """SET / @vars / TEMPORARY / LOCK TABLES / USE của request trước không sang request sau"""
+        monkeypatch.setattr(mysql_service, "_tenant_pools", None)
+        service = mysql_service.MySQLService()
+        monkeypatch.setattr(
+            service, "_open_tenant_connection",
+            lambda username, password, database_name: FakeSessionConnection(autocommit=False, db=database_name)
+        )
+
+        conn = service.connect_tenant(1, "u1", "p1", "db_1")
+        raw = conn.raw
+        conn.close()
+
+        assert raw.sent == [
+            (COM_RESET_CONNECTION, b""),
+            ("query", "SET NAMES utf8mb4, autocommit=0"),
+            ("select_db", "db_1"),
+        ]
+        mysql_service._tenant_pools.clear()
+
+    def test_admin_pool_resets_on_checkin(self, monkeypatch):
+        """Admin connection (provision / restore / sampler dùng chung) không mang session state sang lần mượn sau"""
+        monkeypatch.setattr(mysql_service, "_admin_pool", None)
+        service = mysql_service.MySQLService()
+        monkeypatch.setattr(service, "_open_connection", FakeSessionConnection)
+
+        conn = service.connect()
+        raw = conn.raw
+        conn.close()
+
+        assert raw.sent == [(COM_RESET_CONNECTION, b""), ("query", "SET NAMES utf8mb4, autocommit=1")]
+        assert service.pool.checkout().raw is raw
+        mysql_service._admin_pool.dispose()
+
+    def test_failed_reset_discards_connection(self):
+        def broken_reset(raw):
+            raise Exception("Lost connection to MySQL server during query")
+
+        pool = MySQLConnectionPool(FakeConnection, max_size=1, reset_fn=broken_reset)
+        conn = pool.checkout()
+        raw = conn.raw
+        conn.close()
+
+        assert raw.open is False
+        assert pool.stats()["size"] == 0
+
+
+class TestTenantPoolRegistry:
+    """Tests cho TenantPoolRegistry (pool connection theo tenant)"""
+
+    def _registry(self, **kwargs):
+        opened = []
+
+        def connect(username, password, database_name):
+            conn = FakeConnection()
+            conn.credentials = (username, password, database_name)
+            opened.append(conn)
+            return conn
+
+        return TenantPoolRegistry(connect, **kwargs), opened
+
+    def test_reuses_connection_per_tenant(self):
+        """Cùng database + credentials dùng lại connection, hit rate tăng"""
+        registry, opened = self._registry()
+
+        conn = registry.checkout(1, "u1", "p1", "db1")
+        conn.close()
+        conn = registry.checkout(1, "u1", "p1", "db1")
+        conn.close()
+
+        assert len(opened) == 1
+        stats = registry.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_new_password_uses_new_pool(self):
+        """Đổi password -> key mới, không dùng lại connection cũ"""
+        registry, opened = self._registry()
+
+        registry.checkout(1, "u1", "old", "db1").close()
+        conn = registry.checkout(1, "u1", "new", "db1")
+
+        assert conn.raw.credentials == ("u1", "new", "db1")
+        assert len(opened) == 2
+
+    def test_invalidate_closes_connections(self):
+        """invalidate() đóng connection idle và connection đang mượn khi trả về"""
+        registry, opened = self._registry()
+
+        registry.checkout(1, "u1", "p1", "db1").close()
+        in_use = registry.checkout(1, "u1", "p1", "db1")
+        in_use_2 = registry.checkout(1, "u1", "p1", "db1")
+        in_use.close()
+
+        assert registry.invalidate(1) == 1
+        assert all(not c.open for c in opened if c is not in_use_2.raw)
+        in_use_2.close()
+        assert not in_use_2.raw.open
+        assert registry.stats()["pools"] == 0
+
+    def test_lru_cap_evicts_idle_connections(self):
+        """Vượt giới hạn tổng connection -> đóng connection idle của tenant ít dùng nhất"""
+        registry, opened = self._registry(max_total=2)
+
+        registry.checkout(1, "u1", "p1", "db1").close()
+        registry.checkout(2, "u2", "p2", "db2").close()
+        registry.checkout(3, "u3", "p3", "db3").close()
+
+        assert not opened[0].open
+        assert opened[1].open and opened[2].open
+        stats = registry.stats()
+        assert stats["open_connections"] == 2
+        assert stats["lru_evictions"] == 1
+
+    def test_lru_cap_rejects_when_all_busy(self):
+        """Tất cả connection đang bận -> không mở thêm connection vượt giới hạn"""
+        registry, opened = self._registry(max_total=1)
+
+        busy = registry.checkout(1, "u1", "p1", "db1")
+        with pytest.raises(PoolTimeoutError):
+            registry.checkout(2, "u2", "p2", "db2")
+        busy.close()
@@ -0,0 +1,140 @@
+"""
+test_query_admission.py - Tests cho QueryAdmission (giới hạn query đồng thời theo database)
+"""
+
+import asyncio
+import pytest
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.query_admission import QueryAdmission, QueryAdmissionError
+
+
+def acquire_in_thread(admission, database_id, results, timeout=2.0):
+    """Chạy acquire trong thread riêng, ghi lại thứ tự được nhận"""
+    def run():
+        try:
+            results.append((database_id, admission.acquire(database_id, timeout=timeout)))
+        except QueryAdmissionError as e:
+            results.append((database_id, e))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(admission, depth):
+    deadline = time.time() + 2
+    while admission.stats()["queue_depth"] < depth and time.time() < deadline:
+        time.sleep(0.005)
+
+
+class TestQueryAdmission:
+    """Tests cho QueryAdmission"""
+
+    def test_per_database_limit_queues_and_hands_off(self):
+        """Quá slot của database -> chờ; release trao slot cho request đang chờ"""
+        admission = QueryAdmission(per_database=1, global_limit=4)
+        first = admission.acquire(1)
+        results = []
+        thread = acquire_in_thread(admission, 1, results)
+        wait_for_queue(admission, 1)
+        assert admission.stats(1)["queue_depth"] == 1
+
+        first.release()
+        thread.join()
+
+        ticket = results[0][1]
+        assert ticket.wait_ms > 0
+        assert admission.stats(1)["running"] == 1
+        ticket.release()
+        assert admission.stats(1)["running"] == 0
+        assert admission.stats(1)["admitted"] == 2
+
+    def test_other_database_not_blocked_by_busy_tenant(self):
+        """Slot toàn cục trống được trao cho database khác, không cho tenant đã hết slot"""
+        admission = QueryAdmission(per_database=1, global_limit=2)
+        busy = admission.acquire(1)
+        other = admission.acquire(2)
+        results = []
+        threads = [acquire_in_thread(admission, 1, results)]
+        wait_for_queue(admission, 1)
+        threads.append(acquire_in_thread(admission, 3, results))
+        wait_for_queue(admission, 2)
+
+        # database 2 xong: database 1 vẫn hết slot -> database 3 được nhận dù đến sau
+        other.release()
+        deadline = time.time() + 2
+        while not results and time.time() < deadline:
+            time.sleep(0.005)
+        assert results[0][0] == 3
+
+        busy.release()
+        for thread in threads:
+            thread.join()
+        assert [database_id for database_id, _ in results] == [3, 1]
+
+    def test_queue_full_rejected_with_retry_after(self):
+        admission = QueryAdmission(per_database=1, global_limit=4, queue_per_database=0)
+        admission.acquire(1)
+        with pytest.raises(QueryAdmissionError) as exc:
+            admission.acquire(1)
+        assert exc.value.retry_after >= 1
+        assert admission.stats(1)["rejected"] == 1
+
+    def test_queue_timeout(self):
+        """Chờ quá timeout -> lỗi, rời hàng đợi"""
+        admission = QueryAdmission(per_database=1, global_limit=4)
+        admission.acquire(1)
+        with pytest.raises(QueryAdmissionError, match="Timed out"):
+            admission.acquire(1, timeout=0.05)
+        stats = admission.stats(1)
+        assert stats["timeouts"] == 1
+        assert stats["queue_depth"] == 0
+
+    def test_release_is_idempotent(self):
+        admission = QueryAdmission(per_database=2, global_limit=2)
+        ticket = admission.acquire(1)
+        ticket.release()
+        ticket.release()
+        assert admission.stats()["running"] == 0
+
+    def test_async_waiter_does_not_hold_a_thread(self):
+        """acquire_async xếp hàng trong event loop; release từ thread khác đánh thức waiter"""
+        admission = QueryAdmission(per_database=1, global_limit=4)
+        busy = admission.acquire(1)
+
+        async def main():
+            waiting = asyncio.ensure_future(admission.acquire_async(1, timeout=2))
+            await asyncio.sleep(0.01)
+            assert admission.stats(1)["queue_depth"] == 1
+            # Statement đang chạy xong trên thread của threadpool
+            threading.Thread(target=busy.release).start()
+            return await waiting
+
+        ticket = asyncio.run(main())
+        assert admission.stats(1)["running"] == 1
+        ticket.release()
+        assert admission.stats(1)["admitted"] == 2
+
+    def test_async_timeout_and_cancel_leave_queue(self):
+        admission = QueryAdmission(per_database=1, global_limit=4)
+        admission.acquire(1)
+
+        async def main():
+            with pytest.raises(QueryAdmissionError, match="Timed out"):
+                await admission.acquire_async(1, timeout=0.02)
+            waiting = asyncio.ensure_future(admission.acquire_async(1, timeout=2))
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+
+        asyncio.run(main())
+        stats = admission.stats(1)
+        assert (stats["timeouts"], stats["queue_depth"], stats["running"]) == (1, 0, 1)
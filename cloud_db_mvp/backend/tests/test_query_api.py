@@ -0,0 +1,88 @@
+"""
+test_query_api.py - Tests cho các endpoint chạy SQL của tenant (admission, export, stats)
+"""
+
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from fastapi.testclient import TestClient
+import main
+from services.query_admission import QueryAdmission
+from services.query_cost_guard import query_cost_guard
+from services.slow_query_log import slow_query_log
+from services.sql_executor_service import SQLExecutorService
+
+
+class TestQueryAdmissionAPI:
+    """Request chờ slot admission trong event loop trước khi chạy trong threadpool"""
+
+    @pytest.fixture
+    def admission(self, monkeypatch):
+        admission = QueryAdmission(per_database=1, global_limit=4, queue_per_database=0)
+        monkeypatch.setattr(main, "query_admission", admission)
+        return admission
+
+    def test_query_gets_ticket_and_releases_it(self, client: TestClient, test_database, admission, monkeypatch):
+        seen = {}
+
+        def fake_execute(self, **kwargs):
+            seen["ticket"] = kwargs["ticket"]
+            seen["running"] = admission.stats(test_database.id)["running"]
+            return {"success": True, "query_type": "SELECT", "columns": [], "rows": [], "row_count": 0,
+                    "execution_time_ms": 1.0, "message": "ok", "affected_rows": 0}
+        monkeypatch.setattr(SQLExecutorService, "execute_query", fake_execute)
+
+        response = client.post(f"/db/{test_database.id}/query", json={"query": "SELECT 1"})
+
+        assert response.status_code == 200
+        assert seen["ticket"].database_id == test_database.id
+        assert seen["running"] == 1
+        assert admission.stats(test_database.id)["running"] == 0
+
+    @pytest.mark.parametrize("method, path, kwargs", [
+        ("post", "/query", {"json": {"query": "SELECT 1"}}),
+        ("post", "/query/batch", {"json": {"statements": ["SELECT 1"]}}),
+        ("post", "/query/export", {"json": {"query": "SELECT 1"}}),
+        ("get", "/tables/users/rows", {}),
+        ("post", "/tables/users/ingest", {"json": [{"id": 1}]}),
+    ])
+    def test_busy_database_rejected_before_threadpool(self, client: TestClient, test_database, admission,
+                                                      method, path, kwargs):
+        busy = admission.acquire(test_database.id)
+
+        response = getattr(client, method)(f"/db/{test_database.id}{path}", **kwargs)
+
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
+        busy.release()
+
+    def test_other_users_database_cannot_take_slots(self, client: TestClient, admission):
+        response = client.post("/db/99999/query", json={"query": "SELECT 1"})
+
+        assert response.status_code == 404
+        assert admission.stats()["admitted"] == 0
+
+
+class TestQueryStatsAPI:
+    def test_stats_only_cover_own_database(self, client: TestClient, test_database, monkeypatch):
+        """Bộ đếm của database khác (cost guard, slow query log, admission) không lộ ra"""
+        other = test_database.id + 1000
+        monkeypatch.setattr(query_cost_guard, "_stats", dict(query_cost_guard._stats))
+        monkeypatch.setattr(query_cost_guard, "_db_stats", {})
+        query_cost_guard._count("rejected", other)
+        monkeypatch.setattr(slow_query_log, "_stats", dict(slow_query_log._stats))
+        monkeypatch.setattr(slow_query_log, "_db_stats", {})
+        slow_query_log._count("dropped", other)
+
+        response = client.get(f"/db/{test_database.id}/query/stats")
+
+        assert response.status_code == 200
+        body = response.json()
+        assert body["cost_guard"]["rejected"] == 0
+        assert body["slow_query_log"]["dropped"] == 0
+        assert "admission_global" not in body
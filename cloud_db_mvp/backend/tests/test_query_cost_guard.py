@@ -0,0 +1,153 @@
+"""
+test_query_cost_guard.py - Tests cho QueryCostGuard (EXPLAIN cost guard)
+"""
+
+import pytest
+import sys
+import json
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.query_cost_guard import (
+    QueryCostGuard, QueryRejectedError, estimate_rows_examined, has_top_level_limit, FALLBACK_LIMITS
+)
+from models import Subscription, PricingPlan
+from sqlalchemy.orm import Session
+
+LIMITS = (1_000, 10_000, 100_000)
+
+
+def join_plan(outer_rows, inner_rows_per_scan):
+    """Plan JSON giả lập: orders (full scan) join items theo index"""
+    return {
+        "query_block": {
+            "cost_info": {"query_cost": "123.45"},
+            "nested_loop": [
+                {"table": {"table_name": "orders", "access_type": "ALL",
+                           "rows_examined_per_scan": outer_rows, "rows_produced_per_join": outer_rows}},
+                {"table": {"table_name": "items", "access_type": "ref",
+                           "rows_examined_per_scan": inner_rows_per_scan,
+                           "rows_produced_per_join": outer_rows * inner_rows_per_scan}},
+            ],
+        }
+    }
+
+
+class ExplainCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, args=None):
+        self.conn.explains.append((query, args))
+
+    def fetchone(self):
+        return (json.dumps(self.conn.plan),)
+
+    def close(self):
+        pass
+
+
+class ExplainConnection:
+    def __init__(self, plan):
+        self.plan = plan
+        self.explains = []
+        self.open = True
+
+    def cursor(self):
+        return ExplainCursor(self)
+
+
+class TestQueryCostGuard:
+    """Tests cho QueryCostGuard"""
+
+    def test_estimate_rows_examined_nested_loop(self):
+        """Table trong join được scan (rows của table trước) lần"""
+        rows, full_scans = estimate_rows_examined(join_plan(100, 5))
+        assert rows == 100 + 100 * 5
+        assert full_scans == ["orders"]
+
+    def test_has_top_level_limit(self):
+        assert has_top_level_limit("select * from t limit ?")
+        assert not has_top_level_limit("select * from (select * from t limit ?) x")
+
+    def test_small_query_passes_and_plan_is_cached(self):
+        """Query cùng fingerprint (khác literal) dùng lại plan, không EXPLAIN lại"""
+        guard = QueryCostGuard()
+        conn = ExplainConnection(join_plan(10, 2))
+
+        first = guard.check(conn, 1, "SELECT * FROM orders WHERE id = 1", None, LIMITS, 1001)
+        second = guard.check(conn, 1, "SELECT * FROM orders WHERE id = 2", None, LIMITS, 1001)
+
+        assert first["action"] == "none"
+        assert first["plan_cached"] is False
+        assert second["plan_cached"] is True
+        assert second["query"] == "SELECT * FROM orders WHERE id = 2"
+        assert len(conn.explains) == 1
+        assert conn.explains[0][0].startswith("EXPLAIN FORMAT=JSON ")
+
+    def test_warn_limit_and_reject(self):
+        guard = QueryCostGuard()
+
+        warned = guard.check(ExplainConnection(join_plan(2_000, 1)), 1, "SELECT * FROM a", None, LIMITS, 1001)
+        assert warned["action"] == "warn"
+
+        limited = guard.check(ExplainConnection(join_plan(20_000, 1)), 1, "SELECT * FROM b -- all", None, LIMITS, 1001)
+        assert limited["action"] == "limit"
+        assert limited["query"] == "SELECT * FROM b -- all\nLIMIT 1001"
+
+        # Đã có LIMIT ở ngoài cùng -> chỉ cảnh báo, không thêm LIMIT
+        kept = guard.check(ExplainConnection(join_plan(20_000, 1)), 1, "SELECT * FROM c LIMIT 5", None, LIMITS, 1001)
+        assert kept["action"] == "warn"
+        assert kept["query"] == "SELECT * FROM c LIMIT 5"
+
+        with pytest.raises(QueryRejectedError):
+            guard.check(ExplainConnection(join_plan(1_000, 1_000)), 1, "SELECT * FROM d", None, LIMITS, 1001)
+        assert guard.stats()["rejected"] == 1
+
+    def test_explain_error_does_not_block(self):
+        """EXPLAIN lỗi -> bỏ qua guard, query thật sẽ báo lỗi"""
+        guard = QueryCostGuard()
+        conn = ExplainConnection(None)
+        conn.cursor = lambda: type("Bad", (ExplainCursor,), {"fetchone": lambda self: ("not json",)})(conn)
+        result = guard.check(conn, 1, "SELECT broken", None, LIMITS, 1001)
+        assert result["action"] == "none"
+        assert result["estimated_rows_examined"] is None
+
+    def test_invalidate_drops_database_plans(self):
+        guard = QueryCostGuard()
+        guard.check(ExplainConnection(join_plan(1, 1)), 1, "SELECT 1 FROM t", None, LIMITS, 1001)
+        guard.check(ExplainConnection(join_plan(1, 1)), 2, "SELECT 1 FROM t", None, LIMITS, 1001)
+        assert guard.invalidate(1) == 1
+        assert guard.stats()["cached_plans"] == 1
+
+    def test_stats_per_database(self):
+        """Tenant chỉ thấy bộ đếm / plan cache của database mình; không truyền database_id -> toàn process"""
+        guard = QueryCostGuard()
+        guard.check(ExplainConnection(join_plan(1, 1)), 1, "SELECT 1 FROM t", None, LIMITS, 1001)
+        guard.check(ExplainConnection(join_plan(1, 1)), 1, "SELECT 1 FROM t", None, LIMITS, 1001)
+        with pytest.raises(QueryRejectedError):
+            guard.check(ExplainConnection(join_plan(1_000, 1_000)), 2, "SELECT * FROM d", None, LIMITS, 1001)
+
+        assert guard.stats(1) == {"explains": 1, "plan_hits": 1, "warned": 0, "limited": 0, "rejected": 0,
+                                  "explain_errors": 0, "cached_plans": 1}
+        assert guard.stats(2)["rejected"] == 1
+        assert guard.stats(3)["explains"] == 0
+        assert guard.stats()["explains"] == 2
+
+    def test_limits_follow_active_plan(self, test_db: Session, test_user):
+        guard = QueryCostGuard()
+        assert guard.limits_for(test_db, test_user.id) == (FALLBACK_LIMITS, None)
+
+        plan = PricingPlan(name="Gói Pro", storage_mb=500, users_allowed=5, price_monthly_cents=99000)
+        test_db.add(plan)
+        test_db.commit()
+        test_db.add(Subscription(user_id=test_user.id, plan_id=plan.id, status="ACTIVE"))
+        test_db.commit()
+
+        guard.clear()
+        limits, plan_name = guard.limits_for(test_db, test_user.id)
+        assert plan_name == "Gói Pro"
+        assert limits == guard.plan_limits["Gói Pro"]
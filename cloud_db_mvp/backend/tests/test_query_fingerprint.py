@@ -0,0 +1,38 @@
+"""
+test_query_fingerprint.py - Tests cho query fingerprint
+"""
+
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.query_fingerprint import fingerprint, fingerprint_id
+
+
+class TestQueryFingerprint:
+    """Tests cho fingerprint()"""
+
+    def test_literals_replaced(self):
+        """String, số, hex và placeholder đều thành ?"""
+        assert fingerprint("SELECT * FROM t WHERE id = 5 AND name = 'o''x' AND h = 0xFF AND p = ?") == \
+            "select * from t where id = ? and name = ? and h = ? and p = ?"
+
+    def test_comments_whitespace_and_case(self):
+        """Comment, khoảng trắng, hoa thường không tạo fingerprint mới; `identifier` giữ nguyên"""
+        a = fingerprint("SELECT  *\nFROM `Orders` -- note\nWHERE id=1;")
+        b = fingerprint("select * /* hint */ from `Orders` where id=42")
+        assert a == b == "select * from `Orders` where id=?"
+
+    def test_lists_collapsed(self):
+        """IN list và multi-row VALUES có độ dài khác nhau vẫn cùng fingerprint"""
+        assert fingerprint("SELECT 1 FROM t WHERE id IN (1, 2, 3)") == fingerprint("select 1 from t where id in (7)")
+        assert fingerprint("INSERT INTO t (a, b) VALUES (1, 'x'), (2, 'y')") == "insert into t (a, b) values (?, ?)"
+
+    def test_identifier_digits_kept(self):
+        assert fingerprint("SELECT col1 FROM t2 WHERE c = -1.5e3") == "select col1 from t2 where c = ?"
+        assert fingerprint_id("SELECT 1") == fingerprint_id("select 2")
+        assert fingerprint_id("SELECT 1 FROM a") != fingerprint_id("SELECT 1 FROM b")
@@ -0,0 +1,319 @@
+"""
+test_query_job_service.py - Tests cho QueryJobService
+"""
+
+import pytest
+import sys
+import json
+from datetime import datetime, timedelta
+import pymysql
+from decimal import Decimal
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services import query_job_service
+from services.query_admission import QueryAdmission
+from services.query_job_service import QueryJobService, QueryJobLimitError
+from models import QueryJob
+from sqlalchemy.orm import Session, sessionmaker
+
+
+class JobCursor:
+    """Unbuffered cursor giả lập"""
+
+    def __init__(self, rows, error=None):
+        self._rows = list(rows)
+        self.error = error
+        self.description = [("id", None), ("price", None)]
+
+    def execute(self, query):
+        if self.error:
+            raise self.error
+
+    def fetchmany(self, size):
+        chunk, self._rows = self._rows[:size], self._rows[size:]
+        return chunk
+
+    def close(self):
+        pass
+
+
+class JobConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.released = None
+
+    def thread_id(self):
+        return 42
+
+    def cursor(self, cursor_class=None):
+        return self._cursor
+
+    def close(self):
+        self.released = "pool"
+
+    def invalidate(self):
+        self.released = "discarded"
+
+
+class NoopPool:
+    """Worker pool giả lập: giữ job lại, không chạy"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+class TestQueryJobService:
+    """Tests cho QueryJobService"""
+
+    def _service(self, monkeypatch, test_db: Session, tmp_path, conn=None):
+        service = QueryJobService(session_factory=sessionmaker(bind=test_db.get_bind()))
+        service.job_dir = tmp_path
+        if conn is not None:
+            monkeypatch.setattr(service.executor, "_connect", lambda target: conn)
+        return service
+
+    def _create_job(self, test_db: Session, test_database, test_user):
+        job = QueryJob(database_id=test_database.id, user_id=test_user.id, query_text="SELECT id, price FROM t")
+        test_db.add(job)
+        test_db.commit()
+        return job
+
+    def test_run_job_spools_results(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Job chạy xong: rows được ghi ra NDJSON, đọc lại theo trang bằng next_offset"""
+        conn = JobConnection(JobCursor([(i, Decimal("1.50")) for i in range(5)]))
+        service = self._service(monkeypatch, test_db, tmp_path, conn)
+        service.executor.fetch_chunk_rows = 2
+        job = self._create_job(test_db, test_database, test_user)
+
+        service._run_job(job.id, {}, job.query_text)
+        test_db.refresh(job)
+
+        assert job.status == "COMPLETED"
+        assert job.row_count == 5
+        assert job.mysql_thread_id == 42
+        assert conn.released == "pool"
+        page = service.read_results(job, 0, 3)
+        assert page["columns"] == ["id", "price"]
+        assert page["rows"] == [[0, "1.50"], [1, "1.50"], [2, "1.50"]]
+        assert page["complete"] is False
+        page = service.read_results(job, page["next_offset"], 3)
+        assert [row[0] for row in page["rows"]] == [3, 4]
+        assert page["complete"] is True
+
+    def test_job_takes_admission_slot_of_database(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Database hết slot quá lâu -> job FAILED, không mở connection"""
+        conn = JobConnection(JobCursor([(1, None)]))
+        service = self._service(monkeypatch, test_db, tmp_path, conn)
+        service.executor.admission = QueryAdmission(per_database=1, global_limit=4)
+        service.admission_timeout = 0.01
+        busy = service.executor.admission.acquire(test_database.id)
+        job = self._create_job(test_db, test_database, test_user)
+
+        service._run_job(job.id, {}, job.query_text)
+        test_db.refresh(job)
+
+        assert job.status == "FAILED"
+        assert "waiting for a query slot" in job.error_message
+        assert conn.released is None
+        busy.release()
+        service._run_job(self._create_job(test_db, test_database, test_user).id, {}, job.query_text)
+        assert service.executor.admission.stats(test_database.id)["running"] == 0
+
+    def test_stream_results_after_completion(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Stream: dòng đầu là columns, sau đó từng row"""
+        service = self._service(monkeypatch, test_db, tmp_path, JobConnection(JobCursor([(1, None)])))
+        job = self._create_job(test_db, test_database, test_user)
+        service._run_job(job.id, {}, job.query_text)
+        test_db.refresh(job)
+
+        lines = b"".join(service.stream_results(job)).decode("utf-8").splitlines()
+
+        assert [json.loads(line) for line in lines] == [{"columns": ["id", "price"]}, [1, None]]
+
+    def test_killed_query_marks_cancelled(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Lỗi 1317 (KILL QUERY) -> CANCELLED, connection bị đóng hẳn"""
+        error = pymysql.err.OperationalError(1317, "Query execution was interrupted")
+        conn = JobConnection(JobCursor([], error=error))
+        service = self._service(monkeypatch, test_db, tmp_path, conn)
+        job = self._create_job(test_db, test_database, test_user)
+
+        service._run_job(job.id, {}, job.query_text)
+        test_db.refresh(job)
+
+        assert job.status == "CANCELLED"
+        assert conn.released == "discarded"
+
+    def test_cancel_job_of_other_worker_only_marks_cancelled(self, monkeypatch, test_db: Session, test_database,
+                                                             test_user, tmp_path):
+        """Job không có trong process này: chỉ ghi CANCELLED, không KILL theo thread id đã lưu
+        (job có thể vừa xong, connection đã được pool đưa cho request khác)"""
+        service = self._service(monkeypatch, test_db, tmp_path)
+        killed = []
+        monkeypatch.setattr(service.mysql_service, "kill_query", lambda thread_id: killed.append(thread_id))
+        job = self._create_job(test_db, test_database, test_user)
+        job.status = "RUNNING"
+        job.mysql_thread_id = 77
+        test_db.commit()
+
+        result = service.cancel(test_db, job.id, test_user.id)
+
+        assert result.status == "CANCELLED"
+        assert killed == []
+
+    def test_owning_worker_kills_its_connection_on_cancel(self, monkeypatch, test_db: Session, test_database,
+                                                          test_user, tmp_path):
+        """Worker đang chạy job thấy CANCELLED trong DB -> KILL connection của mình; đã trả connection thì thôi"""
+        service = self._service(monkeypatch, test_db, tmp_path)
+        killed = []
+        monkeypatch.setattr(service.mysql_service, "kill_query", lambda thread_id: killed.append(thread_id))
+        running = self._create_job(test_db, test_database, test_user)
+        released = self._create_job(test_db, test_database, test_user)
+        untouched = self._create_job(test_db, test_database, test_user)
+        running.status = released.status = "CANCELLED"
+        untouched.status = "RUNNING"
+        test_db.commit()
+        states = {job.id: query_job_service._JobState(test_user.id) for job in (running, released, untouched)}
+        states[running.id].thread_id = 42
+        states[untouched.id].thread_id = 43
+        monkeypatch.setattr(query_job_service, "_jobs", states)
+
+        assert service.poll_cancellations() == 2
+
+        assert killed == [42]
+        assert states[running.id].cancel_requested.is_set()
+        assert states[released.id].cancel_requested.is_set()
+        assert not states[untouched.id].cancel_requested.is_set()
+
+    def test_finished_worker_releases_connection_before_kill(self, monkeypatch, test_db: Session, test_database,
+                                                             test_user, tmp_path):
+        """Sau khi job xong không còn thread id để KILL (connection đã về pool)"""
+        conn = JobConnection(JobCursor([(1, None)]))
+        service = self._service(monkeypatch, test_db, tmp_path, conn)
+        states = {}
+        monkeypatch.setattr(query_job_service, "_jobs", states)
+        original_finish = service._finish_if_active
+        seen = {}
+
+        def finish(db, job_id, status, error=None):
+            seen["thread_id"] = states[job_id].thread_id
+            seen["released"] = conn.released
+            return original_finish(db, job_id, status, error)
+        monkeypatch.setattr(service, "_finish_if_active", finish)
+        job = self._create_job(test_db, test_database, test_user)
+
+        service._run_job(job.id, {}, job.query_text)
+
+        assert seen == {"thread_id": None, "released": "pool"}
+
+    def test_worker_does_not_overwrite_cancel_from_other_worker(self, monkeypatch, test_db: Session, test_database,
+                                                                test_user, tmp_path):
+        """Cancel ghi vào DB giữa lúc spool: worker dừng và giữ CANCELLED thay vì COMPLETED"""
+        job = self._create_job(test_db, test_database, test_user)
+        other = sessionmaker(bind=test_db.get_bind())()
+
+        class CancellingCursor(JobCursor):
+            def fetchmany(self, size):
+                other.query(QueryJob).filter(QueryJob.id == job.id).update({QueryJob.status: "CANCELLED"})
+                other.commit()
+                return super().fetchmany(size)
+
+        conn = JobConnection(CancellingCursor([(i, None) for i in range(10)]))
+        service = self._service(monkeypatch, test_db, tmp_path, conn)
+        service.executor.fetch_chunk_rows = 2
+        service.progress_interval = 0
+
+        service._run_job(job.id, {}, job.query_text)
+        test_db.refresh(job)
+        other.close()
+
+        assert job.status == "CANCELLED"
+        assert conn.released == "discarded"
+
+    def test_job_cancelled_before_start_is_not_run(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        def connect(target):
+            raise AssertionError("Job đã CANCELLED không được kết nối MySQL")
+
+        service = self._service(monkeypatch, test_db, tmp_path)
+        monkeypatch.setattr(service.executor, "_connect", connect)
+        job = self._create_job(test_db, test_database, test_user)
+        job.status = "CANCELLED"
+        test_db.commit()
+
+        service._run_job(job.id, {}, job.query_text)
+        test_db.refresh(job)
+
+        assert job.status == "CANCELLED"
+
+    def test_failed_query_records_error(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Lỗi SQL khác -> FAILED kèm error_message"""
+        error = pymysql.err.ProgrammingError(1146, "Table 't' doesn't exist")
+        service = self._service(monkeypatch, test_db, tmp_path, JobConnection(JobCursor([], error=error)))
+        job = self._create_job(test_db, test_database, test_user)
+
+        service._run_job(job.id, {}, job.query_text)
+        test_db.refresh(job)
+
+        assert job.status == "FAILED"
+        assert "doesn't exist" in job.error_message
+
+    def test_per_tenant_limit(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Vượt số job đồng thời của tenant -> QueryJobLimitError"""
+        service = self._service(monkeypatch, test_db, tmp_path)
+        service.max_jobs_per_tenant = 1
+        pool = NoopPool()
+        monkeypatch.setattr(service, "_pool", lambda: pool)
+        monkeypatch.setattr(query_job_service, "_jobs", {})
+
+        service.submit(test_db, test_database.id, test_user.id, "SELECT 1")
+        with pytest.raises(QueryJobLimitError):
+            service.submit(test_db, test_database.id, test_user.id, "SELECT 2")
+        assert len(pool.submitted) == 1
+
+    def test_submit_rejects_non_select(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Chỉ SELECT được chạy dưới dạng job"""
+        service = self._service(monkeypatch, test_db, tmp_path)
+
+        with pytest.raises(ValueError, match="Only SELECT"):
+            service.submit(test_db, test_database.id, test_user.id, "DELETE FROM t")
+
+    def test_fail_orphaned_jobs_keeps_live_workers(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        """Startup chỉ đánh FAILED job có heartbeat quá hạn; job của worker khác còn heartbeat giữ nguyên"""
+        service = self._service(monkeypatch, test_db, tmp_path)
+        monkeypatch.setattr(query_job_service, "_jobs", {})
+        live = self._create_job(test_db, test_database, test_user)
+        live.status, live.worker_id, live.heartbeat_at = "RUNNING", "host-b:12:abcd", datetime.now()
+        dead = self._create_job(test_db, test_database, test_user)
+        dead.status, dead.worker_id, dead.heartbeat_at = "RUNNING", "host-a:7:ef01", datetime.now() - timedelta(minutes=5)
+        legacy = self._create_job(test_db, test_database, test_user)
+        test_db.commit()
+
+        assert service.fail_orphaned_jobs() == 2
+        test_db.refresh(live)
+        test_db.refresh(dead)
+        test_db.refresh(legacy)
+
+        assert live.status == "RUNNING"
+        assert dead.status == "FAILED"
+        assert "host-a:7:ef01" in dead.error_message
+        assert legacy.status == "FAILED"
+
+    def test_heartbeat_updates_jobs_of_this_process(self, monkeypatch, test_db: Session, test_database, test_user, tmp_path):
+        service = self._service(monkeypatch, test_db, tmp_path)
+        job = self._create_job(test_db, test_database, test_user)
+        other = self._create_job(test_db, test_database, test_user)
+        monkeypatch.setattr(query_job_service, "_jobs", {job.id: query_job_service._JobState(test_user.id)})
+
+        assert service.heartbeat() == 1
+        test_db.refresh(job)
+        test_db.refresh(other)
+
+        assert job.worker_id == query_job_service.WORKER_ID
+        assert job.heartbeat_at is not None
+        assert other.heartbeat_at is None
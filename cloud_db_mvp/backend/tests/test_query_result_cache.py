@@ -0,0 +1,99 @@
+"""
+test_query_result_cache.py - Tests cho QueryResultCache
+"""
+
+import pytest
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.query_result_cache import QueryResultCache, normalize_sql, is_cacheable
+
+
+def make_result(rows):
+    return {"success": True, "columns": ["v"], "rows": rows, "row_count": len(rows)}
+
+
+class TestQueryResultCache:
+    """Tests cho QueryResultCache"""
+
+    def test_normalize_sql_collapses_whitespace(self):
+        """Whitespace/';' cuối không tạo key mới, nội dung trong quote giữ nguyên"""
+        assert normalize_sql("SELECT *\n  FROM  users ;") == "SELECT * FROM users"
+        assert normalize_sql("SELECT 'a  b'") == "SELECT 'a  b'"
+
+    def test_is_cacheable(self):
+        """Query có hàm non-deterministic hoặc lock không được cache"""
+        assert is_cacheable("SELECT user, name FROM accounts")
+        assert not is_cacheable("SELECT NOW()")
+        assert not is_cacheable("SELECT * FROM t WHERE d > CURRENT_DATE")
+        assert not is_cacheable("SELECT * FROM t FOR UPDATE")
+        assert not is_cacheable("SELECT @counter")
+
+    def test_hit_after_put(self):
+        """Cùng query (khác whitespace) -> hit"""
+        cache = QueryResultCache()
+        cache.put(cache.make_key(1, "SELECT * FROM t"), make_result([["1"]]))
+
+        assert cache.get(cache.make_key(1, "SELECT *  FROM t;")) == make_result([["1"]])
+        assert cache.get(cache.make_key(1, "SELECT * FROM t", "columnar")) is None
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_ttl_expiry(self):
+        """Entry hết TTL -> miss"""
+        cache = QueryResultCache(ttl=0.01)
+        key = cache.make_key(1, "SELECT 1")
+        cache.put(key, make_result([]))
+        time.sleep(0.02)
+
+        assert cache.get(key) is None
+        assert cache.stats()["expired"] == 1
+
+    def test_lru_eviction(self):
+        """Vượt max_entries -> bỏ entry ít dùng nhất"""
+        cache = QueryResultCache(max_entries=2)
+        keys = [cache.make_key(1, f"SELECT {i}") for i in range(3)]
+        cache.put(keys[0], make_result([]))
+        cache.put(keys[1], make_result([]))
+        cache.get(keys[0])
+        cache.put(keys[2], make_result([]))
+
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_byte_limit_skips_large_result(self):
+        """Result lớn hơn max_bytes không được lưu"""
+        cache = QueryResultCache(max_bytes=1024)
+        key = cache.make_key(1, "SELECT big FROM t")
+
+        assert cache.put(key, make_result([["x" * 2048]])) is False
+        assert cache.get(key) is None
+
+    def test_invalidate_database(self):
+        """Lệnh ghi trên database 1 chỉ xóa cache của database 1"""
+        cache = QueryResultCache()
+        key1 = cache.make_key(1, "SELECT 1")
+        key2 = cache.make_key(2, "SELECT 1")
+        cache.put(key1, make_result([]))
+        cache.put(key2, make_result([]))
+
+        assert cache.invalidate_database(1) == 1
+        assert cache.get(key1) is None
+        assert cache.get(key2) is not None
+
+    def test_put_skipped_after_concurrent_write(self):
+        """SELECT chạy trước lệnh ghi không được lưu kết quả cũ vào cache"""
+        cache = QueryResultCache()
+        key = cache.make_key(1, "SELECT * FROM t")
+        generation = cache.generation(1)
+        cache.invalidate_database(1)
+
+        assert cache.put(key, make_result([]), generation=generation) is False
+        assert cache.get(key) is None
@@ -0,0 +1,133 @@
+"""
+test_query_retry.py - Tests cho retry deadlock / lock wait timeout
+"""
+
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import pymysql
+from sqlalchemy.orm import Session
+from services.query_retry import RetryPolicy
+from services.sql_executor_service import SQLExecutorService, QueryConflictError
+from tests.test_sql_executor_service import BatchConnection, ScriptedCursor
+
+DEADLOCK = pymysql.err.OperationalError(1213, "Deadlock found when trying to get lock; try restarting transaction")
+LOCK_TIMEOUT = pymysql.err.OperationalError(1205, "Lock wait timeout exceeded; try restarting transaction")
+
+
+class ConflictConnection(BatchConnection):
+    """Connection giả lập: statement ghi gặp lỗi lock trong `failures` lần chạy đầu"""
+
+    def __init__(self, failures, error=DEADLOCK):
+        super().__init__()
+        self.failures = failures
+        self.error = error
+
+    def cursor(self, cursor_class=None):
+        conn = self
+
+        class ConflictCursor(ScriptedCursor):
+            def execute(self, statement):
+                conn.executed.append(statement)
+                if conn.failures > 0:
+                    conn.failures -= 1
+                    raise conn.error
+
+        return ConflictCursor(self)
+
+
+class TestRetryPolicy:
+    """Tests cho RetryPolicy"""
+
+    def test_only_lock_conflicts_are_retried(self):
+        policy = RetryPolicy()
+        assert policy.allow_retry(1, DEADLOCK, 1) is True
+        assert policy.allow_retry(1, LOCK_TIMEOUT, 1) is True
+        assert policy.allow_retry(1, pymysql.err.OperationalError(2013, "Lost connection"), 1) is False
+        assert policy.stats(1)["deadlock_retries"] == 1
+        assert policy.stats(1)["lock_timeout_retries"] == 1
+
+    def test_max_attempts(self):
+        policy = RetryPolicy(max_attempts=3)
+        assert policy.allow_retry(1, DEADLOCK, 2) is True
+        assert policy.allow_retry(1, DEADLOCK, 3) is False
+
+    def test_budget_limits_retries_per_database(self):
+        """Hết token -> không retry; mỗi statement nạp thêm budget_ratio token"""
+        policy = RetryPolicy(budget_max=2, budget_ratio=0.5)
+        assert policy.allow_retry(1, DEADLOCK, 1) is True
+        assert policy.allow_retry(1, DEADLOCK, 1) is True
+        assert policy.allow_retry(1, DEADLOCK, 1) is False
+        assert policy.stats(1)["budget_exhausted"] == 1
+        # Database khác có budget riêng
+        assert policy.allow_retry(2, DEADLOCK, 1) is True
+
+        policy.deposit(1)
+        policy.deposit(1)
+        assert policy.allow_retry(1, DEADLOCK, 1) is True
+
+    def test_backoff_is_jittered_and_capped(self):
+        policy = RetryPolicy(base_delay=0.1, max_delay=0.3)
+        for attempt in range(1, 6):
+            delay = policy.backoff(attempt)
+            assert 0 <= delay <= min(0.3, 0.1 * 2 ** (attempt - 1))
+
+
+class TestExecutorRetry:
+    """Tests cho retry_conflicts của execute_query"""
+
+    def _executor(self, monkeypatch, conn):
+        executor = SQLExecutorService()
+        executor.cost_guard_enabled = False
+        executor.max_execution_time = 0
+        executor.retry_policy = RetryPolicy(base_delay=0.001, max_delay=0.001)
+        monkeypatch.setattr(executor, "_connect", lambda target: conn)
+        return executor
+
+    def test_deadlock_is_retried_when_enabled(self, monkeypatch, test_db: Session, test_database, test_user):
+        conn = ConflictConnection(failures=1)
+        executor = self._executor(monkeypatch, conn)
+
+        result = executor.execute_query(test_db, test_database.id, "UPDATE t SET v = v + 1", test_user.id,
+                                        retry_conflicts=True)
+
+        assert result["success"] is True
+        assert result["retries"] == 1
+        assert conn.executed == ["UPDATE t SET v = v + 1"] * 2
+        assert conn.events == ["rollback", "commit"]
+        assert executor.retry_stats(test_database.id)["succeeded_after_retry"] == 1
+
+    def test_conflict_without_retry_is_reported(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Không bật retry: lỗi lock trả QueryConflictError (409) thay vì lỗi chung"""
+        conn = ConflictConnection(failures=1, error=LOCK_TIMEOUT)
+        executor = self._executor(monkeypatch, conn)
+
+        with pytest.raises(QueryConflictError, match="Lock wait timeout after 1 attempt"):
+            executor.execute_query(test_db, test_database.id, "DELETE FROM t", test_user.id)
+        assert len(conn.executed) == 1
+
+    def test_gives_up_after_max_attempts(self, monkeypatch, test_db: Session, test_database, test_user):
+        conn = ConflictConnection(failures=10)
+        executor = self._executor(monkeypatch, conn)
+
+        with pytest.raises(QueryConflictError) as exc_info:
+            executor.execute_query(test_db, test_database.id, "UPDATE t SET v = 1", test_user.id,
+                                   retry_conflicts=True)
+
+        assert exc_info.value.retries == 2
+        assert len(conn.executed) == 3
+        assert executor.retry_stats(test_database.id)["gave_up"] == 1
+
+    def test_ddl_is_not_retried(self, monkeypatch, test_db: Session, test_database, test_user):
+        conn = ConflictConnection(failures=1)
+        executor = self._executor(monkeypatch, conn)
+
+        with pytest.raises(QueryConflictError):
+            executor.execute_query(test_db, test_database.id, "ALTER TABLE t ADD COLUMN w INT", test_user.id,
+                                   retry_conflicts=True)
+        assert len(conn.executed) == 1
@@ -0,0 +1,151 @@
+"""
+test_query_stats.py - Tests cho histogram latency theo fingerprint query
+"""
+
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi.testclient import TestClient
+from models import QueryStat
+from services.query_stats import QueryStatsCollector, LatencyHistogram, LATENCY_BUCKETS_MS, query_stats
+from services.sql_executor_service import SQLExecutorService
+from tests.test_sql_executor_service import BatchConnection
+
+
+class TestLatencyHistogram:
+    """Tests cho LatencyHistogram"""
+
+    def test_bucket_boundaries(self):
+        """Giá trị bằng cận trên thuộc bucket đó; > bucket cuối vào bucket tràn"""
+        hist = LatencyHistogram()
+        hist.add(1, 0)
+        hist.add(1.5, 0)
+        hist.add(60000, 0)
+
+        assert hist.counts[0] == 1
+        assert hist.counts[1] == 1
+        assert hist.counts[len(LATENCY_BUCKETS_MS)] == 1
+        assert hist.calls == 3
+        assert hist.max_ms == 60000
+
+    def test_percentiles_interpolate_within_bucket(self):
+        """p50 rơi giữa bucket (10, 25], p99 không vượt max thực tế"""
+        hist = LatencyHistogram()
+        for _ in range(100):
+            hist.add(20, 1)
+
+        assert hist.percentile(0.50) == pytest.approx(17.5)
+        assert hist.percentile(0.99) == 20
+        assert hist.rows == 100
+
+    def test_empty_histogram_has_no_percentiles(self):
+        assert LatencyHistogram().percentile(0.95) is None
+
+
+class TestQueryStatsCollector:
+    """Tests cho QueryStatsCollector"""
+
+    def _collector(self, test_db: Session) -> QueryStatsCollector:
+        # flush_interval=0: không chạy thread nền, test gọi flush trực tiếp
+        return QueryStatsCollector(session_factory=sessionmaker(bind=test_db.get_bind()), flush_interval=0)
+
+    def test_queries_differing_only_in_literals_share_fingerprint(self, test_db: Session, test_database):
+        """Hai query chỉ khác literal được gộp vào cùng một fingerprint"""
+        collector = self._collector(test_db)
+        collector.record(test_database.id, "SELECT * FROM users WHERE id = 1", "SELECT", 3.0, 1)
+        collector.record(test_database.id, "select * from users where id = 42", "SELECT", 7.0, 1)
+        collector.record(test_database.id, "DELETE FROM users WHERE id = 3", "DELETE", 2.0, 1)
+
+        result = collector.snapshot(test_db, test_database.id, sort="calls")
+
+        assert result["total_fingerprints"] == 2
+        top = result["fingerprints"][0]
+        assert top["fingerprint"] == "select * from users where id = ?"
+        assert top["calls"] == 2
+        assert top["total_time_ms"] == 10.0
+        assert top["rows_total"] == 2
+        assert result["unflushed_calls"] == 3
+
+    def test_flush_accumulates_deltas_into_rows(self, test_db: Session, test_database):
+        """Mỗi lần flush cộng thêm phần mới vào row đã có, không ghi đè"""
+        collector = self._collector(test_db)
+        collector.record(test_database.id, "SELECT 1", "SELECT", 4.0, 1)
+        assert collector.flush() == 1
+        collector.record(test_database.id, "SELECT 2", "SELECT", 400.0, 1)
+        assert collector.flush() == 1
+
+        rows = test_db.query(QueryStat).filter(QueryStat.database_id == test_database.id).all()
+        assert len(rows) == 1
+        assert rows[0].calls == 2
+        assert rows[0].max_time_ms == 400.0
+
+        result = collector.snapshot(test_db, test_database.id)
+        assert result["unflushed_calls"] == 0
+        assert result["fingerprints"][0]["calls"] == 2
+        assert sum(result["fingerprints"][0]["histogram"]) == 2
+
+    def test_flush_skips_unknown_database(self, test_db: Session):
+        """Database không còn trong metadata -> bỏ mẫu thay vì lỗi foreign key"""
+        collector = self._collector(test_db)
+        collector.record(99999, "SELECT 1", "SELECT", 1.0, 1)
+
+        assert collector.flush() == 0
+        assert test_db.query(QueryStat).count() == 0
+
+    def test_full_queue_drops_samples(self, test_db: Session, test_database):
+        collector = QueryStatsCollector(session_factory=sessionmaker(bind=test_db.get_bind()),
+                                        flush_interval=0, max_queued=2)
+        for _ in range(3):
+            collector.record(test_database.id, "SELECT 1", "SELECT", 1.0, 1)
+
+        assert collector.stats()["dropped"] == 1
+        assert collector.snapshot(test_db, test_database.id)["fingerprints"][0]["calls"] == 2
+
+    def test_snapshot_rejects_unknown_sort(self, test_db: Session, test_database):
+        with pytest.raises(ValueError, match="Unsupported sort"):
+            self._collector(test_db).snapshot(test_db, test_database.id, sort="name")
+
+    def test_executor_batch_records_statements(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Statement chạy thành công trong batch được đưa vào collector"""
+        collector = self._collector(test_db)
+        executor = SQLExecutorService()
+        executor.cost_guard_enabled = False
+        executor.query_stats = collector
+        monkeypatch.setattr(executor, "_connect", lambda target: BatchConnection())
+
+        executor.execute_batch(
+            test_db, test_database.id, test_user.id,
+            statements=["INSERT INTO t VALUES (1)", "INSERT fail", "INSERT INTO t VALUES (2)"],
+            stop_on_error=False
+        )
+
+        result = collector.snapshot(test_db, test_database.id)
+        assert [item["fingerprint"] for item in result["fingerprints"]] == ["insert into t values (?)"]
+        assert result["fingerprints"][0]["calls"] == 2
+
+
+class TestQueryStatsAPI:
+    """Tests cho GET /db/{db_id}/query-stats"""
+
+    def test_get_query_stats(self, client: TestClient, test_database):
+        query_stats.clear()
+        query_stats.record(test_database.id, "SELECT * FROM t WHERE a = 'x'", "SELECT", 12.5, 3)
+
+        response = client.get(f"/db/{test_database.id}/query-stats")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["buckets_ms"] == list(LATENCY_BUCKETS_MS)
+        assert data["fingerprints"][0]["fingerprint"] == "select * from t where a = ?"
+        assert data["fingerprints"][0]["p95_ms"] is not None
+        query_stats.clear()
+
+    def test_get_query_stats_not_found(self, client: TestClient):
+        response = client.get("/db/99999/query-stats")
+        assert response.status_code == 404
@@ -0,0 +1,77 @@
+"""
+test_query_watchdog.py - Tests cho QueryWatchdog và QueryControl
+"""
+
+import pytest
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.query_watchdog import QueryWatchdog, QueryControl
+
+
+class TestQueryWatchdog:
+    """Tests cho QueryWatchdog"""
+
+    def test_kills_statement_after_deadline(self):
+        """Quá deadline -> KILL QUERY đúng connection id"""
+        killed = []
+        watchdog = QueryWatchdog(lambda thread_id: killed.append(thread_id) or True)
+
+        handle = watchdog.watch(11, 0.05)
+        for _ in range(100):
+            if killed:
+                break
+            time.sleep(0.01)
+
+        assert killed == [11]
+        assert handle.fired is True
+
+    def test_cancelled_watch_never_kills(self):
+        """Statement xong trước deadline -> không KILL"""
+        killed = []
+        watchdog = QueryWatchdog(lambda thread_id: killed.append(thread_id) or True)
+
+        handle = watchdog.watch(12, 0.05)
+        handle.cancel()
+        watchdog.watch(13, 0.01)
+        time.sleep(0.15)
+
+        assert killed == [13]
+        assert handle.fired is False
+
+
+class TestQueryControl:
+    """Tests cho QueryControl (cancel khi client ngắt kết nối)"""
+
+    def test_cancel_kills_attached_connection(self):
+        killed = []
+        control = QueryControl()
+
+        assert control.attach(21) is True
+        control.cancel(killed.append)
+
+        assert killed == [21]
+
+    def test_cancel_before_attach(self):
+        """Cancel trước khi có connection -> attach() báo đã cancel, không KILL gì"""
+        killed = []
+        control = QueryControl()
+        control.cancel(killed.append)
+
+        assert control.attach(22) is False
+        assert killed == []
+
+    def test_detached_connection_not_killed(self):
+        """Connection đã trả về pool thì không bị KILL nữa"""
+        killed = []
+        control = QueryControl()
+        control.attach(23)
+        control.detach()
+        control.cancel(killed.append)
+
+        assert killed == []
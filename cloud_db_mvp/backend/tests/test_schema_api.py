@@ -0,0 +1,52 @@
+"""
+test_schema_api.py - Tests cho schema browser endpoint
+"""
+
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from fastapi.testclient import TestClient
+from services.schema_cache import schema_cache, load_schema
+from tests.test_schema_cache import SchemaConnection
+
+
+class TestSchemaAPI:
+    """Tests cho GET /db/{db_id}/schema"""
+
+    @pytest.fixture(autouse=True)
+    def cached_schema(self, test_database):
+        """Schema đã có trong cache -> endpoint không cần MySQL"""
+        schema_cache.invalidate(test_database.id)
+        schema_cache.get(test_database.id, lambda: load_schema(SchemaConnection()))
+        yield
+        schema_cache.invalidate(test_database.id)
+
+    def test_get_schema_with_etag(self, client: TestClient, test_database):
+        """Trả tables/columns/indexes kèm ETag theo version"""
+        response = client.get(f"/db/{test_database.id}/schema")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["table_count"] == 2
+        assert [t["name"] for t in data["tables"]] == ["orders", "users"]
+        users = data["tables"][1]
+        assert {"name": "uq_email", "columns": ["email"], "unique": True} in users["indexes"]
+        assert response.headers["etag"] == f'"{data["version"]}"'
+
+    def test_get_schema_not_modified(self, client: TestClient, test_database):
+        """If-None-Match khớp version -> 304 không body"""
+        etag = client.get(f"/db/{test_database.id}/schema").headers["etag"]
+
+        response = client.get(f"/db/{test_database.id}/schema", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_get_schema_database_not_found(self, client: TestClient):
+        response = client.get("/db/99999/schema")
+        assert response.status_code == 404
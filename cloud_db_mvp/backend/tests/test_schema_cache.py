@@ -0,0 +1,115 @@
+"""
+test_schema_cache.py - Tests cho SchemaCache và load_schema
+"""
+
+import pytest
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.schema_cache import SchemaCache, load_schema, find_table
+
+# Kết quả information_schema giả lập theo từng query
+SCHEMA_ROWS = {
+    "information_schema.TABLES": [("users", "BASE TABLE", "InnoDB", 10, 16384, 16384), ("orders", "BASE TABLE", "InnoDB", 5, 16384, 0)],
+    "information_schema.COLUMNS": [
+        ("orders", "id", 1, "INT", "int", "NO", None, "auto_increment", "PRI"),
+        ("orders", "user_id", 2, "int", "int", "NO", None, "", "MUL"),
+        ("users", "id", 1, "int", "int", "NO", None, "auto_increment", "PRI"),
+        ("users", "email", 2, "varchar", "varchar(255)", "YES", None, "", "UNI"),
+    ],
+    "information_schema.STATISTICS": [
+        ("orders", "PRIMARY", 0, 1, "id"),
+        ("orders", "idx_user", 1, 1, "user_id"),
+        ("users", "PRIMARY", 0, 1, "id"),
+        ("users", "uq_email", 0, 1, "email"),
+    ],
+    "information_schema.KEY_COLUMN_USAGE": [("orders", "fk_user", "user_id", "users", "id")],
+}
+
+
+class SchemaCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, args=None):
+        self.conn.queries += 1
+        self.result = next(rows for key, rows in SCHEMA_ROWS.items() if key in query)
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class SchemaConnection:
+    def __init__(self):
+        self.queries = 0
+
+    def cursor(self):
+        return SchemaCursor(self)
+
+
+class TestSchemaCache:
+    """Tests cho SchemaCache"""
+
+    def test_load_schema_bulk_queries(self):
+        """Cả database load bằng 4 query cố định, không phụ thuộc số table"""
+        conn = SchemaConnection()
+        schema = load_schema(conn)
+
+        assert conn.queries == 4
+        users = schema["tables"]["users"]
+        assert users["primary_key"] == ["id"]
+        assert users["unique_keys"] == {"uq_email": ["email"]}
+        orders = schema["tables"]["orders"]
+        assert orders["unique_keys"] == {}
+        assert orders["indexes"]["idx_user"] == {"columns": ["user_id"], "unique": False}
+        assert orders["foreign_keys"]["fk_user"]["referenced_table"] == "users"
+        assert orders["columns"][0]["data_type"] == "int"
+
+    def test_version_ignores_row_estimates(self):
+        """version (ETag) không đổi khi chỉ TABLE_ROWS thay đổi"""
+        first = load_schema(SchemaConnection())
+        SCHEMA_ROWS["information_schema.TABLES"][0] = ("users", "BASE TABLE", "InnoDB", 999, 65536, 16384)
+        try:
+            second = load_schema(SchemaConnection())
+        finally:
+            SCHEMA_ROWS["information_schema.TABLES"][0] = ("users", "BASE TABLE", "InnoDB", 10, 16384, 16384)
+        assert first["version"] == second["version"]
+
+    def test_find_table_case_insensitive(self):
+        schema = load_schema(SchemaConnection())
+        assert find_table(schema, "Users")["name"] == "users"
+        assert find_table(schema, "missing") is None
+
+    def test_get_caches_until_ttl(self):
+        """Lần hai lấy từ cache; hết TTL thì load lại"""
+        cache = SchemaCache(ttl=60)
+        loads = []
+        loader = lambda: loads.append(1) or {"tables": {}, "loaded_at": time.time(), "version": "v"}
+
+        cache.get(1, loader)
+        cache.get(1, loader)
+        assert len(loads) == 1
+        assert cache.stats()["hits"] == 1
+
+        cache.ttl = 0
+        cache.get(1, loader)
+        assert len(loads) == 2
+
+    def test_invalidate_during_load_discards_result(self):
+        """Database bị invalidate (DDL) trong lúc đang load -> kết quả cũ không được cache"""
+        cache = SchemaCache(ttl=60)
+
+        def loader():
+            cache.invalidate(1)
+            return {"tables": {}, "loaded_at": time.time(), "version": "stale"}
+
+        assert cache.get(1, loader)["version"] == "stale"
+        assert cache.peek(1) is None
@@ -0,0 +1,148 @@
+"""
+test_slow_query_log.py - Tests cho slow query log (write-behind + EXPLAIN ở thread nền)
+"""
+
+import json
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+import pymysql
+from sqlalchemy.orm import Session, sessionmaker
+from models import SlowQuery
+from services.slow_query_log import SlowQueryLog
+from services.monitoring_service import MonitoringService
+from services.sql_executor_service import SQLExecutorService
+from tests.test_sql_executor_service import FakeConnection, BatchConnection
+
+PLAN = {
+    "query_block": {
+        "select_id": 1,
+        "table": {"table_name": "orders", "access_type": "ALL", "rows_examined_per_scan": 5000, "rows_produced_per_join": 5000}
+    }
+}
+
+
+class ExplainConnection(FakeConnection):
+    """Connection giả lập trả plan EXPLAIN FORMAT=JSON (hoặc lỗi SQL)"""
+
+    def __init__(self, fail=False):
+        super().__init__()
+        self.fail = fail
+        self.executed = []
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def execute(self, query, args=None):
+                conn.executed.append((query, args))
+                if conn.fail:
+                    raise pymysql.err.ProgrammingError(1146, "Table 'db_1.orders' doesn't exist")
+
+            def fetchone(self):
+                return (json.dumps(PLAN),)
+
+            def close(self):
+                pass
+
+        return Cursor()
+
+
+class TestSlowQueryLog:
+    """Tests cho SlowQueryLog"""
+
+    def _log(self, test_db: Session, **kwargs) -> SlowQueryLog:
+        # background=False: không chạy thread nền, test gọi process_pending trực tiếp
+        return SlowQueryLog(session_factory=sessionmaker(bind=test_db.get_bind()), background=False, **kwargs)
+
+    def _target(self, test_database):
+        return {"database_id": test_database.id, "physical_db_name": "db_1", "db_username": "u", "db_password": "p"}
+
+    def test_fast_query_is_not_captured(self, test_db: Session, test_database):
+        log = self._log(test_db, threshold_ms=1000)
+        captured = log.capture(self._target(test_database), lambda target: ExplainConnection(),
+                               "SELECT 1", None, "SELECT", 12.0, 1)
+
+        assert captured is False
+        assert log.stats()["queued"] == 0
+
+    def test_capture_writes_row_with_plan(self, test_db: Session, test_database):
+        """Plan được lấy khi ghi; rows_examined ước lượng từ plan khi chưa có"""
+        conn = ExplainConnection()
+        log = self._log(test_db, threshold_ms=1000)
+        log.capture(self._target(test_database), lambda target: conn,
+                    "SELECT * FROM orders WHERE note = ?", ["x"], "SELECT", 2500.0, 20)
+        assert test_db.query(SlowQuery).count() == 0
+
+        assert log.process_pending() == 1
+
+        row = test_db.query(SlowQuery).one()
+        assert float(row.duration_ms) == 2500.0
+        assert row.rows_sent == 20
+        assert row.rows_examined == 5000
+        assert json.loads(row.explain_plan) == PLAN
+        assert conn.executed == [("EXPLAIN FORMAT=JSON SELECT * FROM orders WHERE note = %s", ["x"])]
+        assert conn.released == "pool"
+
+    def test_explain_failure_still_records_query(self, test_db: Session, test_database):
+        conn = ExplainConnection(fail=True)
+        log = self._log(test_db, threshold_ms=1000)
+        log.capture(self._target(test_database), lambda target: conn,
+                    "DELETE FROM orders", None, "DELETE", 1500.0, 0, rows_examined=None)
+
+        log.process_pending()
+
+        row = test_db.query(SlowQuery).one()
+        assert row.explain_plan is None
+        assert row.rows_examined is None
+        assert conn.released == "pool"
+        assert log.stats()["explain_errors"] == 1
+
+    def test_ddl_is_not_explained(self, test_db: Session, test_database):
+        def connect(target):
+            raise AssertionError("DDL không cần EXPLAIN")
+
+        log = self._log(test_db, threshold_ms=1000)
+        log.capture(self._target(test_database), connect, "ALTER TABLE t ADD COLUMN c INT", None, "ALTER", 5000.0, 0)
+
+        assert log.process_pending() == 1
+
+    def test_full_buffer_drops_capture(self, test_db: Session, test_database):
+        log = self._log(test_db, threshold_ms=1, max_queued=1)
+        connect = lambda target: ExplainConnection()
+        assert log.capture(self._target(test_database), connect, "SELECT 1", None, "SELECT", 5.0, 1) is True
+        assert log.capture(self._target(test_database), connect, "SELECT 2", None, "SELECT", 5.0, 1) is False
+        assert log.stats()["dropped"] == 1
+        assert log.stats(test_database.id)["dropped"] == 1
+        assert log.stats(test_database.id)["queued"] == 1
+        assert log.stats(test_database.id + 1) == {"captured": 0, "dropped": 0, "written": 0, "explains": 0,
+                                                   "explain_errors": 0, "write_errors": 0, "queued": 0,
+                                                   "threshold_ms": 1}
+
+    def test_executor_batch_captures_slow_statements(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Executor chỉ đẩy vào buffer; row xuất hiện sau khi thread nền (process_pending) ghi"""
+        log = self._log(test_db, threshold_ms=0.000001, explain_enabled=False)
+        executor = SQLExecutorService()
+        executor.cost_guard_enabled = False
+        executor.slow_query_log = log
+        monkeypatch.setattr(executor, "_connect", lambda target: BatchConnection())
+
+        executor.execute_batch(test_db, test_database.id, test_user.id, statements=["UPDATE t SET v = 1"])
+        assert test_db.query(SlowQuery).count() == 0
+
+        log.process_pending()
+        assert test_db.query(SlowQuery).one().query_text == "UPDATE t SET v = 1"
+
+    def test_get_slow_queries_returns_plan(self, test_db: Session, test_database):
+        test_db.add(SlowQuery(database_id=test_database.id, query_text="SELECT * FROM orders",
+                              duration_ms=3000, rows_sent=1, explain_plan=json.dumps(PLAN)))
+        test_db.commit()
+
+        result = MonitoringService().get_slow_queries(test_db, test_database.id)
+
+        assert result[0]["explain_plan"] == PLAN
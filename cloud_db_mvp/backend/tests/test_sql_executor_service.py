@@ -0,0 +1,572 @@
+"""
+test_sql_executor_service.py - Tests cho SQLExecutorService
+"""
+
+import pytest
+import sys
+import pymysql
+import gzip
+import json
+import time
+from unittest.mock import patch
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from pymysql.constants import FIELD_TYPE
+from services.sql_executor_service import SQLExecutorService, QueryTimeoutError
+from services.schema_cache import schema_cache
+from services.query_admission import QueryAdmission
+from services.mysql_service import COM_RESET_CONNECTION, MySQLConnectionPool, _reset_session
+from models import Database
+from sqlalchemy.orm import Session
+
+
+class FakeCursor:
+    """Cursor giả lập trả rows theo chunk (không cần MySQL)"""
+
+    def __init__(self, rows):
+        self._rows = list(rows)
+        self.fetched = 0
+
+    def fetchmany(self, size):
+        chunk = self._rows[self.fetched:self.fetched + size]
+        self.fetched += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Pooled connection giả lập: ghi nhận close() (trả pool) hay invalidate() (đóng hẳn)"""
+
+    def __init__(self):
+        self.released = None
+
+    def close(self):
+        self.released = "pool"
+
+    def invalidate(self):
+        self.released = "discarded"
+
+
+class ScriptedCursor(FakeCursor):
+    """Cursor giả lập cho batch: statement chứa 'fail' raise lỗi SQL"""
+
+    def __init__(self, conn):
+        super().__init__([(1,)])
+        self.conn = conn
+        self.description = [("v", FIELD_TYPE.LONG)]
+        self.rowcount = 1
+
+    def execute(self, statement):
+        self.conn.executed.append(statement)
+        if "fail" in statement:
+            raise pymysql.err.ProgrammingError(1064, "You have an error in your SQL syntax")
+
+
+class BatchConnection(FakeConnection):
+    """Connection giả lập ghi lại commit/rollback của batch"""
+
+    def __init__(self):
+        super().__init__()
+        self.open = True
+        self.executed = []
+        self.events = []
+
+    def cursor(self, cursor_class=None):
+        return ScriptedCursor(self)
+
+    def thread_id(self):
+        return 7
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+
+class FakeWatchdog:
+    """QueryWatchdog giả lập: ghi lại statement được canh giờ"""
+
+    class Handle:
+        def __init__(self, thread_id, timeout):
+            self.thread_id, self.timeout = thread_id, timeout
+            self.fired = False
+            self.cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    def __init__(self):
+        self.handles = []
+
+    def watch(self, thread_id, timeout):
+        self.handles.append(self.Handle(thread_id, timeout))
+        return self.handles[-1]
+
+
+class RecordingCursor:
+    """Cursor giả lập ghi lại các lệnh SQL + params đã gửi"""
+
+    def __init__(self, unsupported=False):
+        self.calls = []
+        self.unsupported = unsupported
+
+    def execute(self, query, args=None):
+        self.calls.append((query, args))
+        if self.unsupported and query.startswith("PREPARE"):
+            raise pymysql.err.ProgrammingError(1295, "This command is not supported in the prepared statement protocol yet")
+
+
+class PreparingConnection:
+    """Raw connection giả lập giữ prepared statement phía server; COM_RESET_CONNECTION xóa hết"""
+
+    def __init__(self):
+        self.open = True
+        self.charset, self.collation, self.autocommit_mode, self.db = "utf8mb4", None, True, "db_1"
+        self.server_statements = set()
+        self.calls = []
+
+    def cursor(self):
+        conn = self
+
+        class Cursor(RecordingCursor):
+            def execute(self, query, args=None):
+                conn.calls.append((query, args))
+                name = query.split()[1]
+                if query.startswith("PREPARE"):
+                    conn.server_statements.add(name)
+                elif query.startswith("DEALLOCATE"):
+                    conn.server_statements.discard(query.split()[2])
+                elif query.startswith("EXECUTE") and name not in conn.server_statements:
+                    raise pymysql.err.InternalError(1243, f"Unknown prepared statement handler ({name}) given to EXECUTE")
+
+        return Cursor()
+
+    def _execute_command(self, command, sql):
+        if command == COM_RESET_CONNECTION:
+            self.server_statements.clear()
+
+    def _read_ok_packet(self):
+        pass
+
+    def query(self, sql):
+        pass
+
+    def select_db(self, db):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+class TestSQLExecutorService:
+    """Tests cho SQLExecutorService"""
+
+    def test_fetch_bounded_returns_all_rows_under_limit(self):
+        """Result nhỏ hơn giới hạn -> đọc hết, không truncated"""
+        executor = SQLExecutorService()
+        executor.fetch_chunk_rows = 2
+
+        rows, truncated = executor._fetch_bounded(FakeCursor([(1, "a"), (2, None), (3, "c")]))
+
+        assert truncated is False
+        assert rows == [["1", "a"], ["2", None], ["3", "c"]]
+
+    def test_fetch_bounded_stops_at_row_limit(self):
+        """Dừng đọc khi đủ max_result_rows, không đọc hết table"""
+        executor = SQLExecutorService()
+        executor.max_result_rows = 5
+        executor.fetch_chunk_rows = 2
+        cursor = FakeCursor([(i,) for i in range(1000)])
+
+        rows, truncated = executor._fetch_bounded(cursor)
+
+        assert truncated is True
+        assert len(rows) == 5
+        assert cursor.fetched <= 6
+
+    def test_fetch_bounded_stops_at_byte_limit(self):
+        """Dừng đọc khi vượt max_result_bytes"""
+        executor = SQLExecutorService()
+        executor.max_result_bytes = 25
+        executor.fetch_chunk_rows = 10
+        cursor = FakeCursor([("x" * 10,) for _ in range(100)])
+
+        rows, truncated = executor._fetch_bounded(cursor)
+
+        assert truncated is True
+        assert len(rows) == 3
+
+    def test_execute_query_database_not_found(self, test_db: Session, test_user):
+        """Execute query với database không tồn tại"""
+        executor = SQLExecutorService()
+
+        with pytest.raises(ValueError, match="Database .* not found"):
+            executor.execute_query(test_db, 99999, "SELECT 1", test_user.id)
+
+    def test_execute_query_rejects_dangerous_statement(self, test_db: Session, test_database, test_user):
+        """Các lệnh nguy hiểm bị chặn trước khi kết nối MySQL"""
+        executor = SQLExecutorService()
+
+        with pytest.raises(ValueError, match="not allowed"):
+            executor.execute_query(test_db, test_database.id, "DROP DATABASE test_db_physical", test_user.id)
+
+    def test_stream_export_csv_gzip(self):
+        """Export CSV có gzip: giải nén ra đúng header + rows, connection trả về pool"""
+        executor = SQLExecutorService()
+        executor.fetch_chunk_rows = 2
+        conn = FakeConnection()
+        rows = [(1, "a,b", None), (2, "c", date(2024, 1, 2)), (3, "d", Decimal("1.50"))]
+
+        chunks = list(executor._stream_export(conn, FakeCursor(rows), ["id", "name", "extra"], "csv", True))
+        text = gzip.decompress(b"".join(chunks)).decode("utf-8")
+
+        assert text.splitlines() == ["id,name,extra", '1,"a,b",', "2,c,2024-01-02", "3,d,1.50"]
+        assert conn.released == "pool"
+
+    def test_stream_export_ndjson(self):
+        """Export NDJSON: mỗi dòng là một JSON object"""
+        executor = SQLExecutorService()
+        conn = FakeConnection()
+
+        chunks = list(executor._stream_export(conn, FakeCursor([(1, b"\xff")]), ["id", "data"], "ndjson", False))
+        lines = b"".join(chunks).decode("utf-8").splitlines()
+
+        assert [json.loads(line) for line in lines] == [{"id": 1, "data": "ff"}]
+
+    def test_stream_export_client_disconnect_discards_connection(self):
+        """Client ngắt giữa chừng -> connection bị đóng hẳn (không drain result)"""
+        executor = SQLExecutorService()
+        executor.fetch_chunk_rows = 1
+        conn = FakeConnection()
+
+        stream = executor._stream_export(conn, FakeCursor([(i,) for i in range(10)]), ["id"], "csv", False)
+        next(stream)
+        stream.close()
+
+        assert conn.released == "discarded"
+
+    def test_export_holds_admission_slot_and_time_limit(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Export giữ slot admission tới khi stream xong, chạy với giới hạn thời gian riêng + watchdog"""
+        executor = SQLExecutorService()
+        executor.admission = QueryAdmission(per_database=1, global_limit=4)
+        executor.export_max_execution_time = 600
+        conn = BatchConnection()
+        monkeypatch.setattr(executor, "_connect", lambda target: conn)
+        watchdog = FakeWatchdog()
+        monkeypatch.setattr("services.sql_executor_service.get_watchdog", lambda kill_fn: watchdog)
+
+        stream = executor.export_query(test_db, test_database.id, "SELECT v FROM t", test_user.id)
+
+        assert conn.executed == ["SELECT /*+ MAX_EXECUTION_TIME(600000) */ v FROM t"]
+        assert [(h.thread_id, h.timeout) for h in watchdog.handles] == [(7, 600)]
+        assert executor.admission.stats(test_database.id)["running"] == 1
+        assert b"".join(stream).decode("utf-8").splitlines() == ["v", "1"]
+        assert executor.admission.stats(test_database.id)["running"] == 0
+        assert conn.released == "pool"
+        assert watchdog.handles[0].cancelled is True
+
+    def test_export_query_rejects_non_select(self, test_db: Session, test_database, test_user):
+        """Chỉ cho phép export SELECT"""
+        executor = SQLExecutorService()
+
+        with pytest.raises(ValueError, match="Only SELECT"):
+            executor.export_query(test_db, test_database.id, "DELETE FROM users", test_user.id)
+
+    def test_encode_columnar_preserves_types(self):
+        """Format columnar: mảng theo cột, int giữ nguyên, decimal/date giữ độ chính xác"""
+        executor = SQLExecutorService()
+        description = [
+            ("id", FIELD_TYPE.LONGLONG),
+            ("price", FIELD_TYPE.NEWDECIMAL),
+            ("created_at", FIELD_TYPE.DATETIME),
+            ("name", FIELD_TYPE.VAR_STRING),
+        ]
+        rows = [
+            (1, Decimal("10.50"), datetime(2024, 1, 2, 3, 4, 5), "a"),
+            (2, None, None, b"\xff"),
+        ]
+
+        encoded = executor._encode_columnar(description, rows)
+
+        assert encoded["columns"] == [
+            {"name": "id", "type": "int"},
+            {"name": "price", "type": "decimal"},
+            {"name": "created_at", "type": "datetime"},
+            {"name": "name", "type": "string"},
+        ]
+        assert encoded["data"] == [
+            [1, 2],
+            ["10.50", None],
+            ["2024-01-02T03:04:05", None],
+            ["a", "ff"],
+        ]
+
+    def test_encode_columnar_empty_result(self):
+        """Result rỗng vẫn trả đủ mảng cho từng cột"""
+        executor = SQLExecutorService()
+
+        encoded = executor._encode_columnar([("id", FIELD_TYPE.LONG)], [])
+
+        assert encoded["data"] == [[]]
+
+    def test_execute_query_rejects_unknown_format(self, test_db: Session, test_database, test_user):
+        """Format kết quả không hỗ trợ -> ValueError"""
+        executor = SQLExecutorService()
+
+        with pytest.raises(ValueError, match="Unsupported result format"):
+            executor.execute_query(test_db, test_database.id, "SELECT 1", test_user.id, result_format="xml")
+
+    def _batch_executor(self, monkeypatch, conn):
+        executor = SQLExecutorService()
+        # ScriptedCursor không trả plan EXPLAIN; cost guard có test riêng
+        executor.cost_guard_enabled = False
+        monkeypatch.setattr(executor, "_connect", lambda target: conn)
+        return executor
+
+    def test_execute_batch_script_single_connection(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Script được tách và chạy tuần tự trên một connection, commit sau từng statement"""
+        conn = BatchConnection()
+        executor = self._batch_executor(monkeypatch, conn)
+
+        result = executor.execute_batch(
+            test_db, test_database.id, test_user.id,
+            script="INSERT INTO t VALUES ('a;b'); SELECT v FROM t;"
+        )
+
+        assert result["success"] is True
+        assert conn.executed == [
+            "INSERT INTO t VALUES ('a;b')",
+            f"SELECT /*+ MAX_EXECUTION_TIME({executor.max_execution_time * 1000}) */ v FROM t"
+        ]
+        assert conn.events == ["commit", "commit"]
+        assert result["results"][1]["rows"] == [["1"]]
+        assert conn.released == "pool"
+
+    def test_execute_batch_transaction_rolls_back_on_error(self, monkeypatch, test_db: Session, test_database, test_user):
+        """transaction=True: lỗi -> rollback, các statement sau bị skip"""
+        conn = BatchConnection()
+        executor = self._batch_executor(monkeypatch, conn)
+
+        result = executor.execute_batch(
+            test_db, test_database.id, test_user.id,
+            statements=["INSERT INTO t VALUES (1)", "INSERT fail", "INSERT INTO t VALUES (2)"],
+            transaction=True
+        )
+
+        assert result["success"] is False
+        assert result["committed"] is False
+        assert result["failed_index"] == 1
+        assert conn.events == ["rollback"]
+        assert result["results"][2]["skipped"] is True
+        assert result["executed_count"] == 2
+
+    def test_execute_batch_continue_on_error(self, monkeypatch, test_db: Session, test_database, test_user):
+        """stop_on_error=False: statement lỗi không chặn các statement sau"""
+        conn = BatchConnection()
+        executor = self._batch_executor(monkeypatch, conn)
+
+        result = executor.execute_batch(
+            test_db, test_database.id, test_user.id,
+            statements=["UPDATE fail", "UPDATE t SET v = 1"],
+            stop_on_error=False
+        )
+
+        assert result["failed_index"] == 0
+        assert result["results"][1]["success"] is True
+        assert "syntax" in result["results"][0]["error"]
+
+    def test_execute_batch_truncated_select_discards_connection(self, monkeypatch, test_db: Session, test_database, test_user):
+        """SELECT bị cắt: không đọc bỏ rows còn lại, connection bị đóng hẳn; statement sau chạy trên connection mới"""
+        connections = [BatchConnection(), BatchConnection()]
+        pool = iter(connections)
+        executor = self._batch_executor(monkeypatch, None)
+        monkeypatch.setattr(executor, "_connect", lambda target: next(pool))
+        executor.max_result_rows = 0
+
+        result = executor.execute_batch(
+            test_db, test_database.id, test_user.id,
+            statements=["SELECT v FROM big", "UPDATE t SET v = 1"]
+        )
+
+        assert result["success"] is True
+        assert result["results"][0]["truncated"] is True
+        assert connections[0].released == "discarded"
+        assert connections[1].executed == ["UPDATE t SET v = 1"]
+        assert connections[1].released == "pool"
+
+    def test_insert_target_schema_never_forces_reload(self, monkeypatch):
+        """Table đích INSERT lấy từ schema cache; không nhận diện được / database khác -> bỏ qua, không refresh"""
+        executor = SQLExecutorService()
+        calls = []
+        schema = {"tables": {"my-table": {"name": "my-table", "unique_keys": []}}}
+        monkeypatch.setattr(executor, "_schema", lambda target, conn=None, refresh=False: calls.append(refresh) or schema)
+        target = {"physical_db_name": "shop"}
+
+        assert executor._insert_target_schema(target, "INSERT IGNORE INTO shop.`my-table` VALUES (1)", None)["name"] == "my-table"
+        assert executor._insert_target_schema(target, "INSERT INTO other.`my-table` VALUES (1)", None) is None
+        assert executor._insert_target_schema(target, "INSERT INTO missing VALUES (1)", None) is None
+        assert calls == [False, False]
+
+    def test_execute_batch_validates_every_statement(self, test_db: Session, test_database, test_user):
+        """Một statement bị chặn -> không chạy statement nào"""
+        executor = SQLExecutorService()
+
+        with pytest.raises(ValueError, match="Statement 2: .*not allowed"):
+            executor.execute_batch(
+                test_db, test_database.id, test_user.id,
+                statements=["SELECT 1", "DROP DATABASE other"]
+            )
+
+    def test_validate_query_allows_semicolon_in_string(self):
+        """';' nằm trong chuỗi không bị coi là nhiều statement"""
+        executor = SQLExecutorService()
+        executor._validate_query("SELECT 'a;b;c';")
+
+        with pytest.raises(ValueError, match="Multiple statements"):
+            executor._validate_query("SELECT 1; SELECT 2")
+
+    def test_execute_with_params_reuses_prepared_statement(self):
+        """Lần đầu PREPARE, lần sau cùng statement (khác whitespace) chỉ SET + EXECUTE"""
+        executor = SQLExecutorService()
+        conn = FakeConnection()
+        cur = RecordingCursor()
+
+        first = executor._execute(conn, cur, "SELECT * FROM t WHERE id = ? AND name = ?", [1, "a'b"])
+        second = executor._execute(conn, cur, "SELECT *  FROM t WHERE id = ? AND name = ?;", [2, "c"])
+
+        assert first["prepared"] is True and first["prepared_cache_hit"] is False
+        assert second["prepared_cache_hit"] is True
+        assert cur.calls == [
+            ("PREPARE _stmt1 FROM %s", ("SELECT * FROM t WHERE id = ? AND name = ?",)),
+            ("SET @_p0 = %s, @_p1 = %s", [1, "a'b"]),
+            ("EXECUTE _stmt1 USING @_p0, @_p1", None),
+            ("SET @_p0 = %s, @_p1 = %s", [2, "c"]),
+            ("EXECUTE _stmt1 USING @_p0, @_p1", None),
+        ]
+
+    def test_prepared_cache_evicts_and_deallocates(self):
+        """Vượt prepared_cache_size -> DEALLOCATE statement ít dùng nhất"""
+        executor = SQLExecutorService()
+        executor.prepared_cache_size = 1
+        conn = FakeConnection()
+        cur = RecordingCursor()
+
+        executor._execute(conn, cur, "SELECT ?", [1])
+        executor._execute(conn, cur, "SELECT ? + 1", [1])
+
+        assert ("DEALLOCATE PREPARE _stmt1", None) in cur.calls
+
+    def test_prepared_statement_survives_pool_checkin(self):
+        """Reset khi trả về pool xóa statement phía server -> lần mượn sau PREPARE lại, không EXECUTE tên cũ"""
+        executor = SQLExecutorService()
+        pool = MySQLConnectionPool(PreparingConnection, max_size=1, reset_fn=_reset_session)
+        query = "SELECT * FROM t WHERE id = ?"
+
+        conn = pool.checkout()
+        executor._execute(conn, conn.cursor(), query, [1])
+        conn.close()
+        conn = pool.checkout()
+        timing = executor._execute(conn, conn.cursor(), query, [2])
+
+        assert timing["prepared"] is True and timing["prepared_cache_hit"] is False
+        assert [call[0] for call in conn.raw.calls] == [
+            "PREPARE _stmt1 FROM %s", "SET @_p0 = %s", "EXECUTE _stmt1 USING @_p0",
+            "PREPARE _stmt1 FROM %s", "SET @_p0 = %s", "EXECUTE _stmt1 USING @_p0",
+        ]
+        conn.close()
+
+    def test_unknown_prepared_statement_is_prepared_again(self):
+        """Cache còn tên nhưng server đã mất statement (1243) -> PREPARE lại một lần rồi chạy tiếp"""
+        executor = SQLExecutorService()
+        raw = PreparingConnection()
+        executor._execute(raw, raw.cursor(), "SELECT ?", [1])
+        raw.server_statements.clear()
+
+        timing = executor._execute(raw, raw.cursor(), "SELECT ?", [2])
+
+        assert timing["prepared"] is True
+        assert [call[0] for call in raw.calls[3:]] == [
+            "SET @_p0 = %s", "EXECUTE _stmt1 USING @_p0",
+            "PREPARE _stmt2 FROM %s", "SET @_p0 = %s", "EXECUTE _stmt2 USING @_p0",
+        ]
+
+    def test_unsupported_prepare_falls_back_to_client_binding(self):
+        """Lệnh MySQL không prepare được -> PyMySQL escape params phía client"""
+        executor = SQLExecutorService()
+        cur = RecordingCursor(unsupported=True)
+
+        timing = executor._execute(FakeConnection(), cur, "SELECT '%', ?", ["x"])
+
+        assert timing["prepared"] is False
+        assert cur.calls[-1] == ("SELECT '%%', %s", ["x"])
+
+    def test_execute_query_param_count_mismatch(self, test_db: Session, test_database, test_user):
+        """Số params khác số placeholder -> ValueError"""
+        executor = SQLExecutorService()
+
+        with pytest.raises(ValueError, match="2 placeholder"):
+            executor.execute_query(test_db, test_database.id, "SELECT ?, ?", test_user.id, params=[1])
+
+    def test_select_gets_max_execution_time_hint(self):
+        """SELECT được thêm hint MAX_EXECUTION_TIME (ms), lệnh khác giữ nguyên"""
+        executor = SQLExecutorService()
+        executor.max_execution_time = 5
+
+        assert executor._with_time_limit("select * from t", "SELECT") == "SELECT /*+ MAX_EXECUTION_TIME(5000) */ * from t"
+        assert executor._with_time_limit("UPDATE t SET a = 1", "UPDATE") == "UPDATE t SET a = 1"
+        executor.max_execution_time = 0
+        assert executor._with_time_limit("SELECT 1", "SELECT") == "SELECT 1"
+
+    def test_timeout_error_is_distinct_and_counted(self):
+        """Lỗi 3024 -> QueryTimeoutError, đếm theo database"""
+        executor = SQLExecutorService()
+        error = pymysql.err.InternalError(3024, "Query execution was interrupted, maximum statement execution time exceeded")
+        before = executor.interrupt_stats(987)["timeouts"]
+
+        with pytest.raises(QueryTimeoutError):
+            executor._raise_if_interrupted(error, 987, None, None)
+        assert executor.interrupt_stats(987)["timeouts"] == before + 1
+        # Lỗi SQL thường không bị coi là timeout
+        executor._raise_if_interrupted(pymysql.err.ProgrammingError(1064, "syntax"), 987, None, None)
+
+    def test_ddl_invalidates_schema_cache(self, monkeypatch, test_db: Session, test_database, test_user):
+        """DDL trong batch -> bỏ schema cache của database; DML không đụng tới"""
+        conn = BatchConnection()
+        executor = self._batch_executor(monkeypatch, conn)
+        schema_cache.get(test_database.id, lambda: {"tables": {}, "loaded_at": time.time(), "version": "v1"})
+
+        executor.execute_batch(test_db, test_database.id, test_user.id, statements=["UPDATE t SET v = 1"])
+        assert schema_cache.peek(test_database.id) is not None
+
+        executor.execute_batch(test_db, test_database.id, test_user.id, statements=["ALTER TABLE t ADD COLUMN w INT"])
+        assert schema_cache.peek(test_database.id) is None
+
+    def test_table_schema_reloads_once_for_unknown_table(self):
+        """Table chưa có trong cache (tạo ngoài executor) -> load lại một lần"""
+        executor = SQLExecutorService()
+        schema_cache.invalidate(99)
+        loads = []
+
+        def fake_load(conn):
+            loads.append(conn)
+            tables = {"t": {"name": "t"}} if len(loads) > 1 else {}
+            return {"tables": tables, "loaded_at": time.time(), "version": str(len(loads))}
+
+        target = {"database_id": 99}
+        with patch("services.sql_executor_service.load_schema", fake_load):
+            assert executor._table_schema(target, "T", conn="conn") == {"name": "t"}
+            assert executor._table_schema(target, "t", conn="conn") == {"name": "t"}
+        assert len(loads) == 2
+        schema_cache.invalidate(99)
@@ -0,0 +1,284 @@
+"""
+test_sql_session_service.py - Tests cho phiên SQL (SQLSessionService + WebSocket endpoint)
+"""
+
+import pytest
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from fastapi.testclient import TestClient
+from services.query_cost_guard import QueryRejectedError
+from services.sql_session_service import SQLSessionService
+from sqlalchemy.orm import Session
+
+
+class SessionCursor:
+    """Cursor giả lập: SELECT trả 3 rows, lệnh khác affected 1 row"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self.rowcount = 0
+        self.rows = []
+
+    def execute(self, query, args=None):
+        self.conn.executed.append(query)
+        if "SELECT" in query:
+            self.description = [("v",)]
+            self.rows = [(1,), (2,), (3,)]
+        else:
+            self.rowcount = 1
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        # SSCursor.close() thật đọc bỏ mọi row còn lại
+        self.conn.drained += len(self.rows)
+        self.rows = []
+
+
+class SessionConnection:
+    """Connection giả lập ghi lại begin/commit/rollback"""
+
+    def __init__(self):
+        self.executed = []
+        self.events = []
+        self.open = True
+        self.released = None
+        self.drained = 0
+
+    def cursor(self, cursor_class=None):
+        return SessionCursor(self)
+
+    def thread_id(self):
+        return 7
+
+    def begin(self):
+        self.events.append("begin")
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def close(self):
+        self.released = "pool"
+
+    def invalidate(self):
+        self.released = "discarded"
+
+
+def run(session, query):
+    return list(session.run(query))
+
+
+class TestSQLSessionService:
+    """Tests cho SQLSessionService"""
+
+    def _service(self, monkeypatch, conn):
+        service = SQLSessionService()
+        service.chunk_rows = 2
+        service.executor.cost_guard_enabled = False
+        monkeypatch.setattr(service.executor, "_connect", lambda target: conn)
+        return service
+
+    def test_select_goes_through_cost_guard(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Như /query: SELECT quét quá lớn bị từ chối, quá ngưỡng limit thì chạy query đã thêm LIMIT"""
+        conn = SessionConnection()
+        service = self._service(monkeypatch, conn)
+        service.executor.cost_guard_enabled = True
+        checks = []
+
+        def check(conn, database_id, query, params, limits, row_cap):
+            checks.append((database_id, query, row_cap))
+            if "big" in query:
+                raise QueryRejectedError("Query rejected: estimated 10000000 rows examined")
+            return {"query": query + "\nLIMIT 4", "action": "limit", "estimated_rows_examined": 600_000}
+        monkeypatch.setattr(service.executor.cost_guard, "check", check)
+        session = service.open(test_db, test_database.id, test_user.id)
+
+        with pytest.raises(ValueError, match="rejected"):
+            run(session, "SELECT * FROM big")
+        done = run(session, "SELECT v FROM t")[-1]
+        run(session, "INSERT INTO t VALUES (1)")
+
+        assert checks == [(test_database.id, "SELECT * FROM big", service.max_rows + 1),
+                          (test_database.id, "SELECT v FROM t", service.max_rows + 1)]
+        assert done["cost_guard"]["action"] == "limit"
+        assert conn.executed[0].endswith(" v FROM t\nLIMIT 4")
+        service.close(session)
+
+    def test_truncated_select_swaps_connection(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Ngoài transaction: result bị cắt -> đóng hẳn connection, mượn connection mới (không đọc bỏ rows)"""
+        first, second = SessionConnection(), SessionConnection()
+        service = self._service(monkeypatch, first)
+        service.max_rows = 2
+        session = service.open(test_db, test_database.id, test_user.id)
+        monkeypatch.setattr(service.executor, "_connect", lambda target: second)
+
+        done = run(session, "SELECT v FROM t")[-1]
+
+        assert done["truncated"] is True and done["row_count"] == 2
+        assert first.released == "discarded" and first.drained == 0
+        assert session.conn is second and session.broken is False
+        assert run(session, "SELECT v FROM t")[-1]["row_count"] == 2
+        service.close(session)
+
+    def test_client_disconnect_mid_stream_swaps_connection(self, monkeypatch, test_db: Session, test_database, test_user):
+        first, second = SessionConnection(), SessionConnection()
+        service = self._service(monkeypatch, first)
+        session = service.open(test_db, test_database.id, test_user.id)
+        monkeypatch.setattr(service.executor, "_connect", lambda target: second)
+
+        results = session.run("SELECT v FROM t")
+        assert next(results)["type"] == "columns"
+        assert next(results)["type"] == "rows"
+        results.close()
+
+        assert first.released == "discarded" and first.drained == 0
+        assert session.conn is second
+        service.close(session)
+
+    def test_truncated_select_in_transaction_kills_query(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Trong transaction giữ connection: KILL QUERY trước rồi mới close cursor"""
+        conn = SessionConnection()
+        service = self._service(monkeypatch, conn)
+        service.max_rows = 2
+        killed = []
+        monkeypatch.setattr(service.executor.mysql_service, "kill_query",
+                            lambda thread_id: killed.append((thread_id, conn.drained)) or True)
+        session = service.open(test_db, test_database.id, test_user.id)
+
+        run(session, "BEGIN")
+        done = run(session, "SELECT v FROM t")[-1]
+
+        assert done["truncated"] is True and done["in_transaction"] is True
+        assert killed == [(7, 0)]
+        assert session.conn is conn and conn.released is None
+        service.close(session)
+
+    def test_select_streams_chunks_and_autocommits(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Ngoài transaction: rows trả theo chunk, mỗi statement commit ngay"""
+        conn = SessionConnection()
+        service = self._service(monkeypatch, conn)
+        session = service.open(test_db, test_database.id, test_user.id)
+
+        messages = run(session, "SELECT v FROM t")
+        assert [m["type"] for m in messages] == ["columns", "rows", "rows", "done"]
+        assert messages[1]["rows"] == [["1"], ["2"]]
+        assert messages[-1]["row_count"] == 3
+
+        done = run(session, "INSERT INTO t VALUES (4)")[-1]
+        assert done["affected_rows"] == 1
+        assert conn.events == ["commit", "commit"]
+        service.close(session)
+
+    def test_transaction_spans_messages(self, monkeypatch, test_db: Session, test_database, test_user):
+        """BEGIN ... ROLLBACK: lệnh ghi ở giữa không được commit"""
+        conn = SessionConnection()
+        service = self._service(monkeypatch, conn)
+        session = service.open(test_db, test_database.id, test_user.id)
+
+        assert run(session, "BEGIN")[-1]["in_transaction"] is True
+        run(session, "UPDATE t SET v = 1")
+        with pytest.raises(ValueError, match="already open"):
+            run(session, "START TRANSACTION")
+        assert run(session, "ROLLBACK")[-1]["in_transaction"] is False
+
+        assert conn.executed == ["BEGIN", "UPDATE t SET v = 1"]
+        assert conn.events == ["rollback"]
+        service.close(session)
+
+    def test_begin_modifiers_sent_as_written(self, monkeypatch, test_db: Session, test_database, test_user):
+        """START TRANSACTION READ ONLY / WITH CONSISTENT SNAPSHOT không bị đổi thành BEGIN trơn"""
+        conn = SessionConnection()
+        service = self._service(monkeypatch, conn)
+        session = service.open(test_db, test_database.id, test_user.id)
+
+        done = run(session, "start transaction read only, with consistent snapshot;")[-1]
+
+        assert done["in_transaction"] is True
+        assert conn.executed == ["start transaction read only, with consistent snapshot"]
+        assert conn.events == []
+        service.close(session)
+
+    def test_close_rolls_back_open_transaction(self, monkeypatch, test_db: Session, test_database, test_user):
+        conn = SessionConnection()
+        service = self._service(monkeypatch, conn)
+        session = service.open(test_db, test_database.id, test_user.id)
+        run(session, "BEGIN")
+        run(session, "DELETE FROM t")
+
+        assert service.close(session) is True
+        assert conn.events[-1] == "rollback"
+        assert conn.released == "pool"
+        assert service.active_sessions(test_database.id) == 0
+
+    def test_session_limit_per_database(self, monkeypatch, test_db: Session, test_database, test_user):
+        service = self._service(monkeypatch, SessionConnection())
+        service.max_sessions_per_db = 1
+        session = service.open(test_db, test_database.id, test_user.id)
+        with pytest.raises(ValueError, match="Too many open SQL sessions"):
+            service.open(test_db, test_database.id, test_user.id)
+        service.close(session)
+
+    def test_failed_connect_frees_reserved_slot(self, monkeypatch, test_db: Session, test_database, test_user):
+        service = SQLSessionService()
+        service.max_sessions_per_db = 1
+
+        def refuse(target):
+            raise ConnectionRefusedError("refused")
+        monkeypatch.setattr(service.executor, "_connect", refuse)
+        with pytest.raises(ConnectionRefusedError):
+            service.open(test_db, test_database.id, test_user.id)
+        assert service.active_sessions(test_database.id) == 0
+
+        monkeypatch.setattr(service.executor, "_connect", lambda target: SessionConnection())
+        session = service.open(test_db, test_database.id, test_user.id)
+        assert service.active_sessions(test_database.id) == 1
+        service.close(session)
+
+    def test_autocommit_change_rejected(self, monkeypatch, test_db: Session, test_database, test_user):
+        service = self._service(monkeypatch, SessionConnection())
+        session = service.open(test_db, test_database.id, test_user.id)
+        with pytest.raises(ValueError, match="autocommit"):
+            run(session, "SET autocommit = 1")
+        service.close(session)
+
+    def test_websocket_session(self, monkeypatch, client: TestClient, test_database, test_user):
+        """WebSocket: ready -> columns/rows/done cho từng query, đóng socket trả connection về pool"""
+        from main import app
+        from auth import get_current_user_ws
+        from services.sql_executor_service import SQLExecutorService
+        conn = SessionConnection()
+        monkeypatch.setattr(SQLExecutorService, "_connect", lambda self, target: conn)
+        monkeypatch.setenv("SQL_COST_GUARD_ENABLED", "false")
+        app.dependency_overrides[get_current_user_ws] = lambda: test_user
+
+        with client.websocket_connect(f"/db/{test_database.id}/session?token=test") as ws:
+            assert ws.receive_json()["type"] == "ready"
+            ws.send_json({"id": 1, "query": "SELECT v FROM t"})
+            types = []
+            while True:
+                message = ws.receive_json()
+                assert message["id"] == 1
+                types.append(message["type"])
+                if message["type"] == "done":
+                    break
+            assert types[0] == "columns"
+            ws.send_json({"id": 2, "query": "DROP DATABASE x"})
+            assert ws.receive_json()["type"] == "error"
+
+        # Server dọn phiên sau khi nhận disconnect (bất đồng bộ)
+        deadline = time.time() + 2
+        while conn.released is None and time.time() < deadline:
+            time.sleep(0.01)
+        assert conn.released == "pool"
@@ -0,0 +1,70 @@
+"""
+test_sql_tokenizer.py - Tests cho split_statements, insert_target
+"""
+
+import pytest
+import sys
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.sql_tokenizer import split_statements, insert_target
+
+
+class TestSplitStatements:
+    """Tests cho split_statements"""
+
+    def test_ignores_semicolons_in_strings_and_comments(self):
+        """';' trong chuỗi, identifier, comment không tách statement"""
+        script = "SELECT 'a;b', `c;d`; -- note; here\nINSERT INTO t VALUES ('it''s;', \"x\\\";\"); /* e; */"
+
+        assert split_statements(script) == [
+            "SELECT 'a;b', `c;d`",
+            "INSERT INTO t VALUES ('it''s;', \"x\\\";\")",
+        ]
+
+    def test_strips_leading_comments_and_empty_statements(self):
+        """Comment đầu statement bị bỏ, statement rỗng bị bỏ qua"""
+        script = "-- create table\n/* v1 */ CREATE TABLE t (id INT);;\n# only comment\n;"
+
+        assert split_statements(script) == ["CREATE TABLE t (id INT)"]
+
+    def test_delimiter_command(self):
+        """DELIMITER cho phép body procedure chứa ';'"""
+        script = (
+            "DELIMITER //\n"
+            "CREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END //\n"
+            "DELIMITER ;\n"
+            "CALL p();"
+        )
+
+        assert split_statements(script) == [
+            "CREATE PROCEDURE p() BEGIN SELECT 1; SELECT 2; END",
+            "CALL p()",
+        ]
+
+    def test_unterminated_string(self):
+        """Chuỗi chưa đóng -> ValueError"""
+        with pytest.raises(ValueError, match="Unterminated"):
+            split_statements("SELECT 'abc; SELECT 1")
+
+
+class TestInsertTarget:
+    """Tests cho insert_target (table đích của INSERT)"""
+
+    @pytest.mark.parametrize("query, expected", [
+        ("INSERT INTO users VALUES (1)", (None, "users")),
+        ("insert low_priority ignore into `my-table` (a) values (1)", (None, "my-table")),
+        ("INSERT IGNORE shop.orders SELECT * FROM tmp", ("shop", "orders")),
+        ("INSERT INTO `a``b` . `c` SET x = 1", ("a`b", "c")),
+        ("/* batch */ INSERT -- note\n INTO t2 (a) VALUES (1)", (None, "t2")),
+        ("INSERT INTO t WITH c AS (SELECT 1) SELECT * FROM c", (None, "t")),
+    ])
+    def test_resolves_target(self, query, expected):
+        assert insert_target(query) == expected
+
+    @pytest.mark.parametrize("query", ["SELECT 1", "INSERT INTO VALUES (1)", "INSERT INTO 'x' VALUES (1)", "INSERT INTO `t"])
+    def test_unresolvable(self, query):
+        assert insert_target(query) is None
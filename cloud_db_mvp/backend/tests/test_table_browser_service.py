@@ -0,0 +1,176 @@
+"""
+test_table_browser_service.py - Tests cho TableBrowserService (keyset pagination)
+"""
+
+import pytest
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to path
+backend_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.table_browser_service import TableBrowserService
+from services.schema_cache import schema_cache
+from sqlalchemy.orm import Session
+
+
+def column(name, nullable=False):
+    return {"name": name, "data_type": "int", "column_type": "int", "nullable": nullable,
+            "default": None, "extra": "", "key": ""}
+
+
+# Schema giả lập: events(id PK, created_at indexed NOT NULL, note không index), logs không có key
+SCHEMA = {
+    "tables": {
+        "events": {
+            "name": "events", "type": "BASE TABLE", "engine": "InnoDB", "rows_estimate": 0,
+            "data_bytes": 0, "index_bytes": 0,
+            "columns": [column("id"), column("created_at"), column("note", nullable=True)],
+            "primary_key": ["id"], "unique_keys": {},
+            "indexes": {"PRIMARY": {"columns": ["id"], "unique": True},
+                        "idx_created": {"columns": ["created_at"], "unique": False}},
+            "foreign_keys": {},
+        },
+        "logs": {
+            "name": "logs", "type": "BASE TABLE", "engine": "InnoDB", "rows_estimate": 0,
+            "data_bytes": 0, "index_bytes": 0,
+            "columns": [column("msg", nullable=True)],
+            "primary_key": [], "unique_keys": {}, "indexes": {}, "foreign_keys": {},
+        },
+    },
+    "loaded_at": 0, "version": "v1",
+}
+
+
+class BrowseCursor:
+    """Cursor giả lập: ghi lại SQL + args, trả rows cố định"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = [("id",), ("created_at",), ("note",)]
+
+    def execute(self, query, args=None):
+        self.conn.calls.append((query, args))
+
+    def fetchall(self):
+        return self.conn.rows
+
+    def close(self):
+        pass
+
+
+class BrowseConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+        self.released = None
+
+    def cursor(self):
+        return BrowseCursor(self)
+
+    def close(self):
+        self.released = "pool"
+
+    def invalidate(self):
+        self.released = "discarded"
+
+
+class TestTableBrowserService:
+    """Tests cho TableBrowserService"""
+
+    @pytest.fixture(autouse=True)
+    def cached_schema(self, test_database):
+        schema_cache.invalidate(test_database.id)
+        schema_cache.get(test_database.id, lambda: dict(SCHEMA, loaded_at=time.time()))
+        yield
+        schema_cache.invalidate(test_database.id)
+
+    def _service(self, monkeypatch, conn):
+        service = TableBrowserService()
+        monkeypatch.setattr(service.executor, "_connect", lambda target: conn)
+        return service
+
+    def test_pages_by_primary_key(self, monkeypatch, test_db: Session, test_database, test_user):
+        """Trang đầu không OFFSET; trang sau seek theo id của row cuối"""
+        conn = BrowseConnection([(1, 10, "a"), (2, 20, None), (3, 30, "c")])
+        service = self._service(monkeypatch, conn)
+
+        page = service.browse(test_db, test_database.id, test_user.id, "events", limit=2)
+
+        assert page["has_more"] is True
+        assert page["rows"] == [["1", "10", "a"], ["2", "20", None]]
+        assert "OFFSET" not in conn.calls[0][0]
+        assert conn.calls[0][0].endswith("FROM `events` ORDER BY `id` ASC LIMIT 3")
+        assert conn.released == "pool"
+
+        conn.rows = [(3, 30, "c")]
+        page = service.browse(test_db, test_database.id, test_user.id, "events", limit=2, cursor=page["next_cursor"])
+
+        sql, args = conn.calls[1]
+        assert "WHERE ((`id` > %s)) ORDER BY `id` ASC" in sql
+        assert args == [2]
+        assert page["has_more"] is False
+        assert page["next_cursor"] is None
+
+    def test_sort_on_indexed_column_uses_key_tiebreaker(self, monkeypatch, test_db: Session, test_database, test_user):
+        """sort + filter: ORDER BY created_at, id và seek dạng OR mở rộng"""
+        conn = BrowseConnection([(5, 10, "x"), (6, 10, "x")])
+        service = self._service(monkeypatch, conn)
+
+        page = service.browse(test_db, test_database.id, test_user.id, "events", limit=1,
+                              sort="created_at", order="desc", filters={"note": "x"})
+        assert page["order_by"] == ["created_at", "id"]
+
+        service.browse(test_db, test_database.id, test_user.id, "events", limit=1, cursor=page["next_cursor"],
+                       sort="created_at", order="desc", filters={"note": "x"})
+        sql, args = conn.calls[1]
+        assert "WHERE `note` = %s AND ((`created_at` < %s) OR (`created_at` = %s AND `id` < %s))" in sql
+        assert "ORDER BY `created_at` DESC, `id` DESC" in sql
+        assert args == ["x", 10, 10, 5]
+
+    def test_rejects_unindexed_sort_and_mismatched_cursor(self, monkeypatch, test_db: Session, test_database, test_user):
+        conn = BrowseConnection([(1, 10, "a"), (2, 20, "b")])
+        service = self._service(monkeypatch, conn)
+
+        with pytest.raises(ValueError, match="not indexed"):
+            service.browse(test_db, test_database.id, test_user.id, "events", sort="note")
+
+        page = service.browse(test_db, test_database.id, test_user.id, "events", limit=1)
+        with pytest.raises(ValueError, match="does not match"):
+            service.browse(test_db, test_database.id, test_user.id, "events", limit=1,
+                           cursor=page["next_cursor"], sort="created_at")
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            service.browse(test_db, test_database.id, test_user.id, "events", cursor="not-a-cursor")
+
+    def test_sort_index_must_cover_order_columns(self):
+        """Index (sort, cột khác) không cho thứ tự theo key -> không nhận; [sort] / [sort]+PK / đúng order thì nhận"""
+        columns = {"id": column("id"), "code": column("code"), "created_at": column("created_at"),
+                   "note": column("note")}
+        info = {"name": "t", "primary_key": ["id"], "indexes": {
+            "PRIMARY": {"columns": ["id"], "unique": True},
+            "idx_created_note": {"columns": ["created_at", "note"], "unique": False},
+        }}
+        with pytest.raises(ValueError, match="not indexed"):
+            TableBrowserService._order_columns(info, columns, ["id"], "created_at")
+
+        info["indexes"]["idx_created_id"] = {"columns": ["created_at", "id"], "unique": False}
+        assert TableBrowserService._order_columns(info, columns, ["id"], "created_at") == ["created_at", "id"]
+        info["indexes"]["idx_note"] = {"columns": ["note"], "unique": False}
+        assert TableBrowserService._order_columns(info, columns, ["id"], "note") == ["note", "id"]
+
+        # Key là unique index (không có PK): index phải chứa đủ cột key theo đúng thứ tự
+        info = {"name": "t", "primary_key": [], "indexes": {
+            "uq_code": {"columns": ["code"], "unique": True},
+            "idx_created": {"columns": ["created_at"], "unique": False},
+        }}
+        with pytest.raises(ValueError, match="not indexed"):
+            TableBrowserService._order_columns(info, columns, ["code"], "created_at")
+        info["indexes"]["idx_created_code"] = {"columns": ["created_at", "code"], "unique": False}
+        assert TableBrowserService._order_columns(info, columns, ["code"], "created_at") == ["created_at", "code"]
+
+    def test_table_without_key_rejected(self, monkeypatch, test_db: Session, test_database, test_user):
+        service = self._service(monkeypatch, BrowseConnection([]))
+        with pytest.raises(ValueError, match="keyset pagination"):
+            service.browse(test_db, test_database.id, test_user.id, "logs")